@@ -11,8 +11,9 @@ import customtkinter as ctk
 from io import BytesIO
 import hashlib
 import json
+import logging
 from pathlib import Path
-from typing import Dict, Literal, Optional, List, Any, Callable
+from typing import Dict, Literal, Optional, List, Any, Callable, TYPE_CHECKING
 import traceback # 追加
 
 import keyring
@@ -25,54 +26,107 @@ except Exception:  # pragma: no cover - non-Windows
 import keyboard # 追加
 import ctypes
 import sys
-from PIL import Image, ImageGrab
-from google.api_core import exceptions
-from pystray import Icon, Menu, MenuItem
-from google.generativeai import types
-import google.generativeai as genai
 
-from common_models import BaseAgent, LlmAgent, Prompt, PromptParameters, create_image_part # create_image_partをインポート
+from common_models import BaseAgent, LlmAgent, Prompt, PromptParameters, configure_genai, is_api_call_error, load_genai_async
 from config_manager import load_config, save_config
+from history_store import HistoryStore, text_key
 from constants import API_SERVICE_ID, APP_NAME, COMPLETION_SOUND_FILE, ICON_FILE
-from matrix_batch_processor import MatrixBatchProcessorWindow
 from ui_components import ActionSelectorWindow, NotificationPopup, SettingsWindow, ResizableInputDialog
 from i18n import tr
+from request_trace import Span
+from prompt_runner import model_pricing
+import input_prep
+import local_api
+import loop_monitor
+import memory_accounting
+import profiler
+import startup_profile
+
+# 重いモジュール（Gemini SDK / PIL / pystray / マトリクス画面）は使う箇所で import する
+if TYPE_CHECKING:
+    from PIL import Image
+    from matrix_batch_processor import MatrixBatchProcessorWindow
+
+logger = logging.getLogger(__name__)
+
+# --- Clipboard change fingerprints ---
+# 監視ループで毎回 PNG エンコードしないための安価な指紋。
+_QUICK_FP_TEXT_EDGE = 4096
+
+
+def _clipboard_sequence_number() -> Optional[int]:
+    """Windows のクリップボード更新カウンタを返す（他OSでは None）。"""
+    if sys.platform != "win32":
+        return None
+    try:
+        return int(ctypes.windll.user32.GetClipboardSequenceNumber())
+    except Exception:
+        return None
+
+
+def _image_quick_fingerprint(image: "Image.Image") -> str:
+    """全ピクセル行の生データのハッシュ。PNG エンコードは行わない。
+
+    ``tobytes()`` はバッファ全体をコピーするので、コストは画像サイズに比例する
+    （それでも PNG エンコードより一桁速い）。一部の行だけをサンプリングすると
+    小さな変更を見落とすため、全行を対象にする。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    width, height = image.size
+    h.update(f"{image.mode}:{width}x{height}".encode("ascii"))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def _text_quick_fingerprint(text: str) -> str:
+    """長さと先頭/末尾の断片だけを使うテキスト指紋。"""
+    edge = _QUICK_FP_TEXT_EDGE
+    sample = text if len(text) <= edge * 2 else text[:edge] + text[-edge:]
+    return f"{len(text)}:" + hashlib.blake2b(sample.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
 
 class ClipboardToolAgent(BaseAgent):
-    def __init__(self, name: str = "ClipboardToolAgent", description: str = "クリップボード操作とLLM処理を行うエージェント"):
+    def __init__(self, name: str = "ClipboardToolAgent", description: str = "クリップボード操作とLLM処理を行うエージェント", config=None):
         super().__init__(name, description)
-        self.config = load_config()
+        # app.py がロケール設定のために読み込んだ設定があればそれを使う（二重読み込みしない）
+        self.config = config or load_config()
         if not self.config:
             sys.exit(1)
-        
-        # API価格情報を読み込む
-        self.api_price_info = self._load_api_price_info()
 
-        self.api_key = self._get_api_key()
-        # genai.configure を使用してAPIキーを設定
-        if self.api_key:
-            genai.configure(api_key=self.api_key)
+        # 互いに独立した初期化は並行して行う。トレイ表示に必要なのは設定とワーカーループだけで、
+        # APIキー（keyring は Linux で数百 ms かかることがある）・価格表・履歴・ホットキーは
+        # 裏で進め、値が必要になった時点で完了を待つ。
+        self._startup = startup_profile.StartupTasks()
+        self._api_key_override = False
+        self._api_price_info_value: Optional[Dict] = None
+        self._history_store_value: Optional[HistoryStore] = None
+        self.max_history_size = self.config.max_history_size
+        self._startup.add("api_key", self._load_api_key)
+        self._startup.add("api_price", self._load_api_price_info)
+        self._startup.add("history", lambda: HistoryStore(max_entries=self.max_history_size))
 
         self.task_queue = queue.Queue()
         self.loop = None
         self.worker_thread = threading.Thread(target=self._async_worker, daemon=True)
         self._worker_running = True
         self._loop_ready_event = threading.Event()
+        # ワーカーループの遅延監視（ループを作ったワーカースレッド側で開始する）
+        self._loop_monitor: Optional[loop_monitor.LoopMonitor] = None
         self.worker_thread.start()
-        self._loop_ready_event.wait(timeout=5)
-        if not self._loop_ready_event.is_set():
-            sys.exit(1)
 
         self.app: Optional[ctk.CTk] = None
-        self.matrix_batch_processor_window: Optional[MatrixBatchProcessorWindow] = None
+        self.matrix_batch_processor_window: Optional["MatrixBatchProcessorWindow"] = None
         self._current_notification_popup_window: Optional[NotificationPopup] = None
         self._current_action_selector_window: Optional[ActionSelectorWindow] = None
         self._settings_window: Optional[SettingsWindow] = None
 
-        self.clipboard_history = []
-        self.max_history_size = self.config.max_history_size
         self._clipboard_monitor_thread: Optional[threading.Thread] = None
         self._clipboard_monitor_running = False
+        # UI スレッドの停止検知と CPU プロファイル（set_ui_elements で作る）
+        self._stall_watchdog: Optional[profiler.StallWatchdog] = None
+        self._profiler: Optional[profiler.Profiler] = None
+        self._memory_monitor: Optional[memory_accounting.MemoryMonitor] = None
+        self._local_api: Optional[local_api.LocalApiServer] = None
         self._on_history_updated_callback: Optional[Callable[[List[str]], None]] = None
 
         # Initialize hotkey-related attributes before registering
@@ -91,7 +145,47 @@ class ClipboardToolAgent(BaseAgent):
         self._win_hotkey_user32 = None
         self._win_hotkey_id_map: Dict[int, Callable] = {}
         self._win_hotkey_registrations: List[tuple] = []
-        self._register_hotkey()
+        self._startup.add("hotkeys", self._register_hotkey)
+
+        # ワーカーループの起動はここまでの処理と並行して進んでいる
+        self._loop_ready_event.wait(timeout=5)
+        if not self._loop_ready_event.is_set():
+            sys.exit(1)
+
+    @property
+    def history_store(self) -> HistoryStore:
+        # 履歴はディスク上のストアに保持し、ペイロードは選択時にのみ読み込む
+        if self._history_store_value is None:
+            self._history_store_value = self._startup.result("history")
+        return self._history_store_value
+
+    @property
+    def api_key(self) -> Optional[str]:
+        if not self._api_key_override:
+            try:
+                return self._startup.result("api_key")
+            except Exception:
+                return None
+        return self._api_key_value
+
+    @api_key.setter
+    def api_key(self, value: Optional[str]) -> None:
+        # 設定画面で変更された値は keyring の読み込み結果より優先する
+        self._api_key_value = value
+        self._api_key_override = True
+
+    @property
+    def api_price_info(self) -> Dict:
+        if self._api_price_info_value is None:
+            self._api_price_info_value = self._startup.result("api_price")
+        return self._api_price_info_value
+
+    def _load_api_key(self) -> Optional[str]:
+        api_key = self._get_api_key()
+        # APIキーは SDK を初めて使うときに genai.configure で適用される
+        if not self._api_key_override:
+            configure_genai(api_key)
+        return api_key
 
     def _load_api_price_info(self) -> Dict:
         """api_price.jsonファイルを読み込む"""
@@ -109,57 +203,7 @@ class ClipboardToolAgent(BaseAgent):
 
     def _get_model_pricing(self, model_name: str, input_token_count: int = 0) -> tuple:
         """モデル名と入力トークン数に基づいて価格情報を取得する"""
-        if not self.api_price_info:
-            return 0.0, 0.0
-            
-        # モデル名の完全一致を試す
-        model_info = self.api_price_info.get(model_name)
-        if model_info:
-            # 階層情報がある場合
-            if "tiers" in model_info:
-                # トークン数に応じた価格を取得
-                for tier in sorted(model_info["tiers"], key=lambda x: x.get("threshold_tokens", 0), reverse=True):
-                    if input_token_count <= tier.get("threshold_tokens", 0) or tier.get("threshold_tokens", 0) == -1:
-                        return (
-                            tier.get("input_cost_per_thousand_tokens", 0.0),
-                            tier.get("output_cost_per_thousand_tokens", 0.0)
-                        )
-                # デフォルト価格を使用
-                default = model_info.get("default", {})
-                return (
-                    default.get("input_cost_per_thousand_tokens", 0.0),
-                    default.get("output_cost_per_thousand_tokens", 0.0)
-                )
-            # 階層情報がない場合（フラットな構造）
-            elif "input_cost_per_thousand_tokens" in model_info:
-                return (
-                    model_info.get("input_cost_per_thousand_tokens", 0.0),
-                    model_info.get("output_cost_per_thousand_tokens", 0.0)
-                )
-        
-        # 部分一致で検索
-        for key, model_info in self.api_price_info.items():
-            if key in model_name:
-                if "tiers" in model_info:
-                    for tier in sorted(model_info["tiers"], key=lambda x: x.get("threshold_tokens", 0), reverse=True):
-                        if input_token_count <= tier.get("threshold_tokens", 0) or tier.get("threshold_tokens", 0) == -1:
-                            return (
-                                tier.get("input_cost_per_thousand_tokens", 0.0),
-                                tier.get("output_cost_per_thousand_tokens", 0.0)
-                            )
-                    default = model_info.get("default", {})
-                    return (
-                        default.get("input_cost_per_thousand_tokens", 0.0),
-                        default.get("output_cost_per_thousand_tokens", 0.0)
-                    )
-                elif "input_cost_per_thousand_tokens" in model_info:
-                    return (
-                        model_info.get("input_cost_per_thousand_tokens", 0.0),
-                        model_info.get("output_cost_per_thousand_tokens", 0.0)
-                    )
-        
-        # 見つからない場合はデフォルト値
-        return 0.0, 0.0
+        return model_pricing(self.api_price_info, model_name, input_token_count)
 
     def _register_hotkey(self):
         """
@@ -495,6 +539,22 @@ class ClipboardToolAgent(BaseAgent):
         if on_history_updated_callback:
             self._on_history_updated_callback = on_history_updated_callback
         self._start_clipboard_monitor()
+        if self._stall_watchdog is None:
+            self._stall_watchdog = profiler.StallWatchdog(app)
+            self._stall_watchdog.start()
+            self._profiler = profiler.Profiler(app, lambda: self.loop)
+            if profiler.profile_from_startup():
+                self._profiler.start()
+        if self._memory_monitor is None:
+            memory_accounting.set_budgets(getattr(self.config, 'memory_budgets_mb', None))
+            self._memory_monitor = memory_accounting.MemoryMonitor()
+            self._memory_monitor.start()
+            # 画像前処理のプロセス数（プールは最初の大きな画像で起動する）
+            input_prep.configure(getattr(self.config, 'prep_workers', None))
+        if self._local_api is None:
+            # 二重起動の引き継ぎ先にもなるので常に待ち受ける（API 本体は設定で有効化）
+            self._local_api = local_api.LocalApiServer(self, enabled=getattr(self.config, 'local_api_enabled', False))
+            threading.Thread(target=self._local_api.start, name="local-api-start", daemon=True).start()
 
         # 追加指示用の直近結果・設定の初期化
         if not hasattr(self, 'last_result_text'):
@@ -536,6 +596,7 @@ class ClipboardToolAgent(BaseAgent):
         # マトリクスに含めるフラグが立っているプロンプトのみをデフォルトで表示する
         # すべてのプロンプトをコピーして使用すると行列UIでの編集が設定ファイルに影響しない
         filtered_prompts = {pid: prompt for pid, prompt in self.config.prompts.items() if getattr(prompt, "include_in_matrix", False)}
+        from matrix_batch_processor import MatrixBatchProcessorWindow
         self.matrix_batch_processor_window = MatrixBatchProcessorWindow(
             prompts=filtered_prompts,
             on_processing_completed=self._on_batch_processing_completed,
@@ -576,6 +637,8 @@ class ClipboardToolAgent(BaseAgent):
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
         self.loop.set_debug(False) # 内部ログを抑制するためデバッグモードを無効化
+        self._loop_monitor = loop_monitor.LoopMonitor(self.loop)
+        self._loop_monitor.start()
         self._loop_ready_event.set()
 
         def _run_task_from_queue():
@@ -584,19 +647,27 @@ class ClipboardToolAgent(BaseAgent):
                 if task_info is None:
                     self.loop.call_soon_threadsafe(self.loop.stop)
                     return
+                span = task_info.pop("_span", None)
 
                 async def _process_task_internal():
+                    if span is not None:
+                        span.mark("started")
                     try:
-                        await self.run_async(**task_info)
+                        await self.run_async(**task_info, span=span)
                     except Exception as e:
+                        if span is not None:
+                            span.fail(e)
                         error_message = tr("notify.agent_run_error", details=str(e))
                         if self.app:
                             self.app.after(0, lambda msg=error_message: self._show_notification_ui(tr("common.error"), msg, "error"))
                     finally:
+                        if span is not None:
+                            span.end()
                         self.task_queue.task_done()
                 
                 try:
-                    self.loop.create_task(_process_task_internal())
+                    name = loop_monitor.task_name("hotkey", span.job_id if span is not None else task_info.get("prompt_id"))
+                    self.loop.create_task(_process_task_internal(), name=name)
                 except Exception as e:
                     error_message = tr("notify.task_create_unexpected", details=str(e))
                     if self.app:
@@ -642,6 +713,7 @@ class ClipboardToolAgent(BaseAgent):
     async def _process_clipboard_content(self, file_paths: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         contents = []
         if file_paths:
+            genai = await load_genai_async()
             # genai.Client を使用せず、genai.upload_file を直接使用
             for file_path in file_paths:
                 try:
@@ -657,6 +729,7 @@ class ClipboardToolAgent(BaseAgent):
                     raise RuntimeError(error_message)
             return contents
         else:
+            from PIL import Image, ImageGrab
             max_retries = 3
             for i in range(max_retries):
                 try:
@@ -680,7 +753,7 @@ class ClipboardToolAgent(BaseAgent):
             self._show_notification_ui(tr("notify.clipboard_error"), tr("notify.clipboard_get_failed"), "error")
             raise RuntimeError(tr("notify.clipboard_get_failed"))
 
-    async def run_async(self, prompt_id: Optional[str] = None, file_paths: Optional[List[str]] = None, system_prompt: Optional[str] = None, model: Optional[str] = None, temperature: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, max_output_tokens: Optional[int] = None, stop_sequences: Optional[List[str]] = None, refine_instruction: Optional[str] = None) -> str:
+    async def run_async(self, prompt_id: Optional[str] = None, file_paths: Optional[List[str]] = None, system_prompt: Optional[str] = None, model: Optional[str] = None, temperature: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, max_output_tokens: Optional[int] = None, stop_sequences: Optional[List[str]] = None, refine_instruction: Optional[str] = None, span: Optional[Span] = None) -> str:
         if not self.app:
             raise RuntimeError("UI application not initialized.")
 
@@ -740,10 +813,14 @@ class ClipboardToolAgent(BaseAgent):
                         pass
                 else:
                     processed_contents = await self._process_clipboard_content(file_paths)
+                    if file_paths and span is not None:
+                        span.mark("upload_done")
+                # 手入力のプロンプトには画像の方針がない（原寸の PNG で送る）
+                image_policy = prompt_config.image_policy if prompt_id else None
                 for content_info in processed_contents:
                     if content_info["type"] == "image":
-                        image_part = create_image_part(content_info["data"]) # 共通関数を呼び出し
-                        contents_to_send.append(image_part)
+                        # 変換はループの外（プロセスプール）で
+                        contents_to_send.append(await input_prep.image_part(content_info, image_policy, final_model_name, span))
                     elif content_info["type"] == "file":
                         contents_to_send.append(content_info["file_ref"])
                     else: # テキストの場合
@@ -767,6 +844,8 @@ class ClipboardToolAgent(BaseAgent):
             except Exception:
                 tools_list = None
 
+            genai = await load_genai_async()
+            types = genai.types
             model_instance = genai.GenerativeModel(final_model_name, system_instruction=final_system_prompt)
 
             # GenerationConfig を構築（安全設定はデフォルト、ツールは有効なら付与）
@@ -797,9 +876,11 @@ class ClipboardToolAgent(BaseAgent):
                     contents=contents_to_send,
                 )
                 input_token_count = count_tokens_response.total_tokens
-                print(f"DEBUG: Input token count: {input_token_count}")
+                logger.debug("Input token count: %d", input_token_count)
             except Exception as e:
-                print(f"WARNING: Failed to count input tokens: {e}")
+                logger.warning("Failed to count input tokens: %s", e)
+            if span is not None:
+                span.set(model=final_model_name, input_tokens=input_token_count)
 
             full_response_text = ""
             # 生成（Web検索ツールがエラーならフォールバック）
@@ -815,6 +896,8 @@ class ClipboardToolAgent(BaseAgent):
             except Exception as e:
                 # google_search キーで失敗した可能性。fallback: google_search_retrieval
                 if tools_list:
+                    if span is not None:
+                        span.set(retries=1)
                     try:
                         alt_tools = [{"google_search_retrieval": {}}]
                         alt_config = types.GenerationConfig(
@@ -828,6 +911,8 @@ class ClipboardToolAgent(BaseAgent):
                         responses = _gen(True, alt_config)
                     except Exception:
                         # 最終フォールバック: ツールなし
+                        if span is not None:
+                            span.set(retries=2)
                         responses = _gen(True, types.GenerationConfig(
                             temperature=generate_content_config.temperature,
                             top_p=generate_content_config.top_p,
@@ -848,6 +933,8 @@ class ClipboardToolAgent(BaseAgent):
                     pass
 
                 if text:
+                    if span is not None and not full_response_text:
+                        span.mark("first_token")
                     full_response_text += text
                     # クロージャ内で chunk.text を再度評価しないよう text を閉じ込める
                     self.app.after(0, lambda c=text: self._update_notification_message(c))
@@ -862,11 +949,15 @@ class ClipboardToolAgent(BaseAgent):
                     self.app.after(0, lambda: self._show_notification_ui(tr("safety.response_blocked_title"), full_response_text, level="error"))
                     break  # Stop processing further chunks
 
+            if span is not None:
+                span.mark("completed")
             output_token_count = (await asyncio.to_thread(
                 model_instance.count_tokens,
                 contents=[full_response_text],
             )).total_tokens
-            print(f"DEBUG: Output token count: {output_token_count}")
+            logger.debug("Output token count: %d", output_token_count)
+            if span is not None:
+                span.set(output_tokens=output_token_count)
 
             # 価格情報を取得（推定コストの表示用）
             input_cost_per_thousand_tokens, output_cost_per_thousand_tokens = self._get_model_pricing(final_model_name, input_token_count)
@@ -896,6 +987,8 @@ class ClipboardToolAgent(BaseAgent):
                     enable_web=bool(tools_list)
                 )
                 self._copy_to_clipboard_and_notify(full_response_text, final_prompt_config, cost_message)
+                if span is not None:
+                    span.mark("ui_applied")
                 # 直近結果を保持（追加指示用）
                 self.last_result_text = full_response_text
                 self.last_prompt_config = final_prompt_config
@@ -912,11 +1005,11 @@ class ClipboardToolAgent(BaseAgent):
 
             return full_response_text
 
-        except exceptions.GoogleAPICallError as e:
-            error_message = tr("notify.api_error_message", code=e.code, message=e.message)
-            self._show_notification_ui(tr("notify.api_error_title"), error_message, level="error")
-            raise RuntimeError(error_message)
         except Exception as e:
+            if is_api_call_error(e):
+                error_message = tr("notify.api_error_message", code=e.code, message=e.message)
+                self._show_notification_ui(tr("notify.api_error_title"), error_message, level="error")
+                raise RuntimeError(error_message)
             error_message = tr("notify.unexpected_error", details=str(e))
             if "finish_reason: SAFETY" in str(e) or (hasattr(e, '__cause__') and e.__cause__ and "finish_reason: SAFETY" in str(e.__cause__)):
                 error_message = tr("safety.request_blocked_message")
@@ -962,6 +1055,8 @@ class ClipboardToolAgent(BaseAgent):
 
     def _run_process_in_thread(self, **kwargs):
         try:
+            # キューに入った時点からトレースを始める（待ち時間も計測する）
+            kwargs["_span"] = Span("clipboard", prompt_id=kwargs.get("prompt_id"), refine=bool(kwargs.get("refine_instruction")), files=len(kwargs.get("file_paths") or []))
             self.task_queue.put(kwargs)
         except Exception as e:
             self._show_notification_ui(tr("common.error"), tr("notify.task_enqueue_failed", details=str(e)), level="error")
@@ -1128,6 +1223,18 @@ class ClipboardToolAgent(BaseAgent):
         #     self._show_notification_ui("ファイル添付", "ファイルが選択されませんでした。", level="info", duration_ms=2000)
 
     def quit_app(self, icon=None, item=None):
+        if self._stall_watchdog is not None:
+            self._stall_watchdog.stop()
+        if self._memory_monitor is not None:
+            self._memory_monitor.stop()
+        if self._loop_monitor is not None:
+            self._loop_monitor.stop()
+        if self._local_api is not None:
+            self._local_api.stop()
+        input_prep.shutdown()
+        # プロファイル中ならワーカーループを止める前に書き出す
+        if self._profiler is not None and self._profiler.running:
+            self._profiler.stop(timeout=2.0, background=False)
         # Unregister Windows hotkeys (if any) and stop the listener thread
         try:
             self._unregister_hotkeys_windows()
@@ -1180,11 +1287,32 @@ class ClipboardToolAgent(BaseAgent):
                     pass
 
     def _clipboard_monitor(self):
-        """テキストだけでなく、画像やファイルの履歴も収集する。"""
+        """テキストだけでなく、画像やファイルの履歴も収集する。
+
+        変更検出は二段階で行う。Windows ではクリップボードのシーケンス番号が
+        変わらない限り読みに行かず、変わった場合は常に内容を処理する。
+        シーケンス番号がない環境では安価な指紋（画像は全行の生ピクセルのハッシュ、
+        テキストは長さと先頭/末尾の断片と本文比較）で比較し、変化があった場合に
+        だけ PNG エンコードや全文ハッシュを行う。
+        """
+        # 監視スレッド側で読み込む（起動時のメインスレッドでは PIL を import しない）
+        from PIL import Image, ImageGrab
         last_signature: Optional[str] = None
+        last_sequence: Optional[int] = None
+        last_quick: Optional[str] = None
+        last_text: Optional[str] = None
 
         while self._clipboard_monitor_running:
             try:
+                # 0) Windows ではシーケンス番号が変わらない限りクリップボードを読まない
+                sequence = _clipboard_sequence_number()
+                if sequence is not None and sequence == last_sequence:
+                    time.sleep(0.5)
+                    continue
+                last_sequence = sequence
+                # シーケンス番号が変わったなら指紋での省略はしない（最終的な重複は署名で判定）
+                changed = sequence is not None
+
                 items_to_add = None
                 signature = None
 
@@ -1196,29 +1324,28 @@ class ClipboardToolAgent(BaseAgent):
 
                 if isinstance(clip_obj, Image.Image):
                     image = clip_obj
+                    quick = "img:" + _image_quick_fingerprint(image)
+                    if not changed and quick == last_quick:
+                        time.sleep(0.5)
+                        continue
+                    last_quick = quick
+                    last_text = None
                     if image.mode != 'RGB':
                         image = image.convert('RGB')
-                    # Convert image to bytes and compress to reduce memory footprint. Use zlib
-                    # to compress the raw PNG bytes before Base64 encoding. This makes
-                    # history storage more compact for large images.
+                    # PNG は既に圧縮済みなので、そのまま Base64 化して保持する
                     with BytesIO() as buffer:
                         image.save(buffer, format='PNG')
                         image_bytes = buffer.getvalue()
-                    try:
-                        import zlib
-                        compressed = zlib.compress(image_bytes)
-                        encoded = base64.b64encode(compressed).decode('utf-8')
-                        items_to_add = [{"type": "image_compressed", "data": encoded}]
-                    except Exception:
-                        # Fallback to storing uncompressed Base64 if compression fails
-                        encoded = base64.b64encode(image_bytes).decode('utf-8')
-                        items_to_add = [{"type": "image", "data": encoded}]
+                    encoded = base64.b64encode(image_bytes).decode('utf-8')
+                    items_to_add = [{"type": "image", "data": encoded}]
                     signature = "img:" + hashlib.sha1(image_bytes).hexdigest()
                 elif isinstance(clip_obj, list):
                     file_paths = [p for p in clip_obj if isinstance(p, str)]
                     if file_paths:
                         items_to_add = [{"type": "file", "data": p} for p in file_paths]
                         signature = "files:" + "|".join(file_paths)
+                        last_quick = signature
+                        last_text = None
 
                 # 2) テキストのチェック（上で何も取得できなかった場合）
                 if items_to_add is None:
@@ -1227,26 +1354,57 @@ class ClipboardToolAgent(BaseAgent):
                     except Exception:
                         text_content = ""
                     if text_content:
+                        quick = "text:" + _text_quick_fingerprint(text_content)
+                        # 断片が一致しても中央部だけ変わっている可能性があるので、
+                        # 前回の本文と比較する（先頭から差分が出た時点で打ち切られる）
+                        if not changed and quick == last_quick and text_content == last_text:
+                            time.sleep(0.5)
+                            continue
+                        last_quick = quick
+                        last_text = text_content
                         items_to_add = [{"type": "text", "data": text_content}]
-                        signature = "text:" + hashlib.sha1(text_content.encode('utf-8')).hexdigest()
+                        signature = text_key(text_content)
 
                 # 3) 新規内容のみ履歴に追加
                 if items_to_add and signature != last_signature:
+                    # 単一項目（テキスト/画像）の署名は履歴ストアのキーとしてそのまま使える
+                    item_key = signature if len(items_to_add) == 1 and not signature.startswith("files:") else None
                     for it in items_to_add:
-                        self._add_to_history(it)
+                        self._add_to_history(it, key=item_key)
                     last_signature = signature
 
                 time.sleep(0.5)
             except Exception:
                 time.sleep(1)
 
-    def _add_to_history(self, content: Any):
-        """履歴にテキスト/画像/ファイル項目を追加。既存重複は先頭へ移動。"""
+    @property
+    def clipboard_history(self) -> List[Dict[str, Any]]:
+        """履歴のメタデータ一覧（新しい順）。ペイロードは load_history_item で取得する。"""
+        return self.history_store.entries()
+
+    def load_history_item(self, meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """履歴メタデータから {"type", "data"} 形式の項目を読み込む。"""
+        try:
+            return self.history_store.load(meta)
+        except Exception as e:
+            print(f"ERROR: load_history_item - {e}")
+            return None
+
+    def set_max_history_size(self, size: int):
+        self.max_history_size = size
+        self.history_store.set_max_entries(size)
+        if self._on_history_updated_callback:
+            self._on_history_updated_callback(self.clipboard_history)
+
+    def _add_to_history(self, content: Any, key: Optional[str] = None):
+        """履歴にテキスト/画像/ファイル項目を追加。既存重複は先頭へ移動。
+
+        key には監視スレッドの署名を渡せる。ストアはキーで索引されているため、
+        重複検出・先頭への移動・古い項目の削除はいずれも O(1)。
+        """
         # 正規化と空チェック
         if isinstance(content, str):
-            normalized = content.strip()
-            if not normalized:
-                return
+            normalized = {"type": "text", "data": content.strip()}
         elif isinstance(content, dict):
             # type/data がなければ無視
             if "type" not in content or "data" not in content:
@@ -1255,25 +1413,18 @@ class ClipboardToolAgent(BaseAgent):
         else:
             return
 
-        # 既存重複を削除（等価比較）
-        existing_index = None
-        for idx, item in enumerate(self.clipboard_history):
-            try:
-                if item == normalized:
-                    existing_index = idx
-                    break
-            except Exception:
-                continue
-        if existing_index is not None:
-            self.clipboard_history.pop(existing_index)
-
-        self.clipboard_history.insert(0, normalized)
-        if len(self.clipboard_history) > self.max_history_size:
-            self.clipboard_history = self.clipboard_history[:self.max_history_size]
+        try:
+            if self.history_store.add(normalized, key=key) is None:
+                return
+        except Exception as e:
+            print(f"ERROR: _add_to_history - {e}")
+            return
         if self._on_history_updated_callback:
             self.app.after(0, lambda: self._on_history_updated_callback(self.clipboard_history))
 
     def create_tray_icon(self):
+        from PIL import Image
+        from pystray import Icon, MenuItem
         image = Image.open(ICON_FILE)
         menu = (
             MenuItem(tr('tray.list'), self._show_action_selector_gui, default=True),
@@ -1281,11 +1432,53 @@ class ClipboardToolAgent(BaseAgent):
             # MenuItem('追加指示…', self.handle_refine),
             MenuItem(tr('tray.manager'), self._show_main_window),
             MenuItem(tr('tray.settings'), self.show_settings_window),
+            MenuItem(lambda item: tr('tray.profile_stop') if self._profiler is not None and self._profiler.running else tr('tray.profile_start'), self.toggle_profiling),
+            MenuItem(tr('tray.memory_report'), self.write_memory_report),
             MenuItem(tr('tray.quit'), self.quit_app)
         )
         self.tray_icon = Icon(APP_NAME, image, APP_NAME, menu)
         return self.tray_icon
 
+    def toggle_profiling(self, icon=None, item=None):
+        """トレイメニューから CPU プロファイルを開始/停止する。停止時は保存先を通知する。"""
+        if self._profiler is None:
+            return
+        if not self._profiler.running:
+            self._profiler.start()
+        else:
+            def _on_saved(paths):
+                where = str(paths[0].parent) if paths else "-"
+                if self.app:
+                    self.app.after(0, lambda: self._show_notification_ui(tr("notify.profile_saved_title"), tr("notify.profile_saved_fmt", path=where), level="info", duration_ms=5000))
+
+            self._profiler.stop(on_saved=_on_saved)
+        # メニューの表示（開始/停止）を切り替える
+        try:
+            if icon is not None:
+                icon.update_menu()
+        except Exception:
+            pass
+
+    def write_memory_report(self, icon=None, item=None):
+        """トレイメニューからメモリ使用量レポート（GEM_CLIP_TRACEMALLOC=1 なら tracemalloc の差分付き）を書き出し、保存先を通知する。"""
+        def _work():
+            try:
+                path = memory_accounting.write_report()
+            except Exception as e:
+                print(f"ERROR: write_memory_report - {e}")
+                return
+            if self.app:
+                self.app.after(0, lambda: self._show_notification_ui(tr("notify.memory_report_title"), tr("notify.memory_report_fmt", path=str(path)), level="info", duration_ms=5000))
+
+        # スナップショットの比較は重いので UI/トレイのスレッドで行わない
+        threading.Thread(target=_work, name="memory-report", daemon=True).start()
+
     def run(self):
         self.icon = self.create_tray_icon()
-        self.icon.run()
+        self.icon.run(setup=self._on_tray_ready)
+
+    def _on_tray_ready(self, icon):
+        # pystray の既定の setup と同じくアイコンを表示し、起動時間の内訳を記録する
+        icon.visible = True
+        startup_profile.mark("tray_visible")
+        startup_profile.report()
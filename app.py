@@ -12,10 +12,12 @@ import styles
 from ui_components import PromptEditorDialog
 from config_manager import save_config, load_config
 from common_models import Prompt
+import startup_profile
 
 class ClipboardToolApp:
     def __init__(self):
         # Load locale and theme from config before building UI
+        _cfg = None
         try:
             from config_manager import load_config as _lc
             _cfg = _lc()
@@ -32,9 +34,11 @@ class ClipboardToolApp:
                     ctk.set_appearance_mode("System")
         except Exception:
             ctk.set_appearance_mode("System")
+        startup_profile.mark("config_locale")
 
         self.app = ctk.CTk()
         self.app.withdraw()
+        startup_profile.mark("tk_root")
         # ウィンドウタイトルを設定（i18n）
         self.app.title(tr("app.title"))
 
@@ -60,9 +64,11 @@ class ClipboardToolApp:
         # --- UI Elements ---
         # タイトルラベルは不要になったので削除し、ウィンドウタイトルに設定した
 
-        self.agent = ClipboardToolAgent()
+        # 読み込み済みの設定を渡し、設定ファイルを二度読まない
+        self.agent = ClipboardToolAgent(config=_cfg)
         # Pass the app instance to the agent, no history callback needed
         self.agent.set_ui_elements(self.app)
+        startup_profile.mark("agent_init")
 
         # --- Matrix summary settings section (compact, no scroll) ---
         self.matrix_section = ctk.CTkScrollableFrame(self.app, label_text=tr("matrix.section.title"), fg_color=styles.HISTORY_ITEM_FG_COLOR, height=100)
@@ -128,6 +134,7 @@ class ClipboardToolApp:
         self._row_drop_indicator_widget: Optional[tk.Frame] = None  # ドロップ位置の境界線（水平・オーバーレイ）
 
         self._create_prompt_list_frame() # フレーム作成は初期化後に行う
+        startup_profile.mark("main_window")
 
     def _set_window_icon(self) -> None:
         """Set window/taskbar icon to icon.ico where supported.
@@ -625,7 +632,11 @@ class ClipboardToolApp:
         tray_thread = threading.Thread(target=self.agent.run, daemon=True)
         tray_thread.start()
 
-        if not self.agent.api_key:
-            self.app.after(1000, self.agent.show_settings_window)
+        # APIキーは裏で keyring から読み込み中なので、確認はメインループ開始後に行う
+        self.app.after(1000, self._prompt_api_key_if_missing)
 
         self.app.mainloop()
+
+    def _prompt_api_key_if_missing(self):
+        if not self.agent.api_key:
+            self.agent.show_settings_window()
@@ -0,0 +1,619 @@
+"""
+bench_offline.py
+==================
+
+Offline throughput benchmarks, run against :mod:`fake_genai` so no API quota
+is used.
+
+Scenarios (each runs in its own process, with a throwaway data directory):
+
+- ``matrix``: run all N×M cells of a matrix window
+- ``flow``: a flow of S steps on each of N rows
+- ``summary``: a summary tree over an N×M result grid (row summaries, then
+  column summaries, then the matrix summary)
+- ``clipboard_idle``: CPU used by the clipboard monitor while nothing changes
+- ``grid_rebuild``: time to rebuild a large grid (``_update_ui``)
+- ``history``: inserts into a full :class:`history_store.HistoryStore`
+  (``--history-size`` entries kept, ``--history-inserts`` adds, every fourth
+  one a duplicate that moves to the front), then reopening it from disk
+- ``image_prep``: image part preparation (:mod:`input_prep`) of N generated
+  screenshots with 0 (in-process), 1, 2, 4, … worker processes, to show how
+  it scales with core count. ``--prep-policy`` encodes them with an image
+  policy; bytes and estimated image tokens per image are reported
+
+Request timings come from the trace spans (:mod:`request_trace`). While the
+Tk scenarios run, a heartbeat on the Tk loop also measures how late the UI
+thread was.
+
+Results are written as JSON, so runs can be compared across commits::
+
+    python bench_offline.py --out bench.json
+    python bench_offline.py --scenario matrix --rows 50 --cols 6 --profile '{"ttft_ms": 800}'
+    python bench_offline.py --compare base.json --out head.json --threshold 0.15
+
+``--cassette`` runs the scenarios against a :mod:`genai_cassette` file
+instead of the fake backend: ``--cassette-mode record`` captures real
+traffic once (this uses quota), and later runs replay it offline.
+
+With ``--compare``, the exit status is 1 when any metric regressed by more
+than the threshold. Metrics ending in ``_per_s`` are better when higher;
+every other timing or CPU metric is better when lower.
+
+The matrix, flow, summary and grid scenarios need a display (Tk). The
+clipboard scenario needs clipboard access. The image scenario needs Pillow.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+SCENARIOS = ("matrix", "flow", "summary", "clipboard_idle", "grid_rebuild", "history", "image_prep")
+RESULT_PREFIX = "BENCH_RESULT "
+SCHEMA_VERSION = 1
+DEFAULT_TIMEOUT_S = 600.0
+SAMPLE_TEXT = "Gem Clip offline benchmark input. " * 8
+
+
+# ----------------------------------------------------------------------
+# Measurement helpers
+# ----------------------------------------------------------------------
+def _percentiles(values: List[float], prefix: str) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    return {
+        f"{prefix}_p50_ms": round(pick(0.50), 2),
+        f"{prefix}_p95_ms": round(pick(0.95), 2),
+        f"{prefix}_max_ms": round(values[-1], 2),
+    }
+
+
+class _SpanCollector(logging.Handler):
+    """Keeps the payload of every trace span emitted in this process."""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.spans: List[Dict[str, Any]] = []
+        self._spans_lock = threading.Lock()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if isinstance(record.args, dict):
+            with self._spans_lock:
+                self.spans.append(dict(record.args))
+
+    def install(self) -> "_SpanCollector":
+        from request_trace import TRACE_LOGGER_NAME
+
+        trace_logger = logging.getLogger(TRACE_LOGGER_NAME)
+        trace_logger.setLevel(logging.INFO)
+        trace_logger.propagate = False
+        trace_logger.addHandler(self)
+        return self
+
+    def summary(self, kind: Optional[str] = None) -> Dict[str, Any]:
+        with self._spans_lock:
+            spans = [s for s in self.spans if kind is None or s.get("kind") == kind]
+        result: Dict[str, Any] = {
+            "requests": len(spans),
+            "errors": sum(1 for s in spans if s.get("status") == "error"),
+        }
+        result.update(_percentiles([s["total_ms"] for s in spans if "total_ms" in s], "span_total"))
+        result.update(_percentiles([s["queue_wait_ms"] for s in spans if "queue_wait_ms" in s], "queue_wait"))
+        result.update(_percentiles([s["first_token_ms"] for s in spans if "first_token_ms" in s], "first_token"))
+        result.update(_percentiles([s["ui_apply_ms"] for s in spans if "ui_apply_ms" in s], "ui_apply"))
+        return result
+
+
+class _UiLagProbe:
+    """Heartbeat on the Tk loop; records how late each beat ran."""
+
+    def __init__(self, root: Any, interval_ms: int = 16):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.lags: List[float] = []
+        self._expected = 0.0
+        self._job: Optional[str] = None
+
+    def start(self) -> None:
+        self._expected = time.perf_counter() + self.interval_ms / 1000
+        self._job = self.root.after(self.interval_ms, self._beat)
+
+    def _beat(self) -> None:
+        now = time.perf_counter()
+        self.lags.append(max(0.0, (now - self._expected) * 1000))
+        self._expected = now + self.interval_ms / 1000
+        self._job = self.root.after(self.interval_ms, self._beat)
+
+    def stop(self) -> Dict[str, float]:
+        if self._job is not None:
+            self.root.after_cancel(self._job)
+            self._job = None
+        return _percentiles(self.lags, "ui_lag")
+
+
+class _TkHarness:
+    """A hidden root, a worker event loop and a matrix window filled with text inputs."""
+
+    def __init__(self, rows: int, cols: int):
+        import customtkinter as ctk
+
+        from common_models import AppConfig, Prompt
+        from i18n import set_locale
+        from matrix_batch_processor import MatrixBatchProcessorWindow
+
+        set_locale("en")
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="bench-worker-loop", daemon=True).start()
+        self.root = ctk.CTk()
+        self.root.withdraw()
+        models = ("gemini-2.5-flash-lite", "gemini-2.5-flash")
+        prompts = {
+            f"bench{c + 1}": Prompt(name=f"Bench {c + 1}", model=models[c % len(models)], system_prompt=f"Step {c + 1}: rewrite the input.", include_in_matrix=True)
+            for c in range(cols)
+        }
+        self.agent = _BenchAgent(AppConfig(prompts=prompts))
+        self.window = MatrixBatchProcessorWindow(
+            prompts=prompts,
+            on_processing_completed=lambda *a, **k: None,
+            llm_agent_factory=lambda *a, **k: None,
+            notification_callback=lambda *a, **k: None,
+            worker_loop=self.loop,
+            parent_app=self.root,
+            agent=self.agent,
+        )
+        self.window.input_data = [{"type": "text", "data": f"{r + 1}: {SAMPLE_TEXT}"} for r in range(rows)]
+        self.window._ensure_grid_state()
+        self.window._update_ui()
+        self.pump(lambda: True)
+
+    def pump(self, until: Callable[[], bool], timeout: float = DEFAULT_TIMEOUT_S) -> None:
+        deadline = time.perf_counter() + timeout
+        while True:
+            self.root.update()
+            if until():
+                return
+            if time.perf_counter() > deadline:
+                raise TimeoutError("benchmark scenario did not finish in time")
+            time.sleep(0.002)
+
+    def check_all(self) -> None:
+        cells = self.window._cells
+        for r in range(cells.rows):
+            for c in range(cells.cols):
+                cells.set_checked(r, c, True)
+
+    def close(self) -> None:
+        w = self.window
+        w._is_closing = True
+        try:
+            w._session_store.close()
+            w._cells.close()
+            w.destroy()
+            self.root.destroy()
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class _BenchAgent:
+    """The only thing the matrix window needs from the agent is its config."""
+
+    def __init__(self, config: Any):
+        self.config = config
+
+
+# ----------------------------------------------------------------------
+# Scenarios (run inside the child process)
+# ----------------------------------------------------------------------
+def _scenario_matrix(params: Dict[str, Any]) -> Dict[str, Any]:
+    collector = _SpanCollector().install()
+    h = _TkHarness(params["rows"], params["cols"])
+    try:
+        h.check_all()
+        probe = _UiLagProbe(h.root)
+        probe.start()
+        started = time.perf_counter()
+        h.window._run_batch_processing()
+        total = h.window.total_tasks
+        h.pump(lambda: h.window.completed_tasks >= total)
+        wall = time.perf_counter() - started
+        result = {"cells": total, "wall_s": round(wall, 3), "cells_per_s": round(total / wall, 2) if wall else 0.0}
+        result.update(probe.stop())
+        result.update(collector.summary("matrix_cell"))
+        return result
+    finally:
+        h.close()
+
+
+def _scenario_flow(params: Dict[str, Any]) -> Dict[str, Any]:
+    collector = _SpanCollector().install()
+    steps = params["flow_steps"]
+    h = _TkHarness(params["rows"], steps)
+    try:
+        w = h.window
+        plans = {r: list(range(steps)) for r in range(params["rows"])}
+        # _run_flow_processing から確認ダイアログと進捗ダイアログを除いたもの
+        w.total_tasks = sum(len(cols) for cols in plans.values())
+        w.completed_tasks = 0
+        w._flow_cancel_requested = False
+        probe = _UiLagProbe(h.root)
+        probe.start()
+        started = time.perf_counter()
+        fut = asyncio.run_coroutine_threadsafe(w._execute_flow_tasks(plans), h.loop)
+        h.pump(lambda: fut.done() and w.completed_tasks >= w.total_tasks)
+        fut.result()
+        wall = time.perf_counter() - started
+        result = {"rows": params["rows"], "steps": w.total_tasks, "wall_s": round(wall, 3), "steps_per_s": round(w.total_tasks / wall, 2) if wall else 0.0}
+        result.update(probe.stop())
+        result.update(collector.summary("matrix_flow_step"))
+        return result
+    finally:
+        h.close()
+
+
+async def _summary_tree(window: Any, rows: int, cols: int) -> int:
+    cells = window._cells
+    row_jobs = [window._summarize_content_with_llm([cells.full(r, c) for c in range(cols)], f"row {r + 1}", r_idx=r) for r in range(rows)]
+    row_out = await asyncio.gather(*row_jobs)
+    col_jobs = [window._summarize_content_with_llm([cells.full(r, c) for r in range(rows)], f"column {c + 1}", c_idx=c) for c in range(cols)]
+    col_out = await asyncio.gather(*col_jobs)
+    await window._summarize_content_with_llm(list(row_out) + list(col_out), "matrix")
+    return rows + cols + 1
+
+
+def _scenario_summary(params: Dict[str, Any]) -> Dict[str, Any]:
+    collector = _SpanCollector().install()
+    rows, cols = params["rows"], params["cols"]
+    h = _TkHarness(rows, cols)
+    try:
+        filler = "Result text for the summary benchmark. " * 20
+        for r in range(rows):
+            for c in range(cols):
+                h.window._cells.set_result(r, c, f"R{r + 1}C{c + 1} {filler}")
+        probe = _UiLagProbe(h.root)
+        probe.start()
+        started = time.perf_counter()
+        fut = asyncio.run_coroutine_threadsafe(_summary_tree(h.window, rows, cols), h.loop)
+        h.pump(fut.done)
+        calls = fut.result()
+        wall = time.perf_counter() - started
+        result = {"summaries": calls, "wall_s": round(wall, 3), "summaries_per_s": round(calls / wall, 2) if wall else 0.0}
+        result.update(probe.stop())
+        result.update(collector.summary("summary"))
+        return result
+    finally:
+        h.close()
+
+
+def _scenario_clipboard_idle(params: Dict[str, Any]) -> Dict[str, Any]:
+    from agent import ClipboardToolAgent
+
+    # 監視ループだけを動かす（トレイや Tk は作らない）
+    added: List[Any] = []
+    monitor = ClipboardToolAgent.__new__(ClipboardToolAgent)
+    monitor._clipboard_monitor_running = True
+    monitor._add_to_history = lambda content, key=None: added.append(key)
+    thread = threading.Thread(target=monitor._clipboard_monitor, name="bench-clipboard-monitor", daemon=True)
+    thread.start()
+    # 初回の読み取り（現在の内容の取り込み）が済んでから測る
+    time.sleep(1.5)
+    seconds = params["idle_seconds"]
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    time.sleep(seconds)
+    cpu = time.process_time() - cpu0
+    wall = time.perf_counter() - wall0
+    monitor._clipboard_monitor_running = False
+    thread.join(timeout=2.0)
+    return {
+        "idle_s": round(wall, 2),
+        "cpu_s": round(cpu, 4),
+        "cpu_percent": round(cpu / wall * 100, 3) if wall else 0.0,
+        "items_seen": len(added),
+    }
+
+
+def _scenario_grid_rebuild(params: Dict[str, Any]) -> Dict[str, Any]:
+    rows, cols, repeats = params["grid_rows"], params["grid_cols"], params["repeats"]
+    h = _TkHarness(rows, cols)
+    try:
+        times = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            h.window._update_ui()
+            h.root.update_idletasks()
+            times.append((time.perf_counter() - started) * 1000)
+        result = {"rows": rows, "cols": cols, "repeats": repeats, "widgets": h.window._count_widgets()}
+        result.update(_percentiles(times, "rebuild"))
+        return result
+    finally:
+        h.close()
+
+
+def _scenario_history(params: Dict[str, Any]) -> Dict[str, Any]:
+    from history_store import HistoryStore, text_key
+
+    size, inserts = params["history_size"], params["history_inserts"]
+    with tempfile.TemporaryDirectory(prefix="gem_clip_bench_hist_") as tmp:
+        store = HistoryStore(Path(tmp), max_entries=size)
+        for i in range(size):
+            store.add({"type": "text", "data": f"{i} {SAMPLE_TEXT}"})
+        times = []
+        started = time.perf_counter()
+        for i in range(inserts):
+            # 4件に1件は既存項目の再コピー（先頭への移動）
+            text = f"{size - 1 - i % size if i % 4 == 0 else size + i} {SAMPLE_TEXT}"
+            t0 = time.perf_counter()
+            store.add({"type": "text", "data": text}, key=text_key(text))
+            times.append((time.perf_counter() - t0) * 1000)
+        wall = time.perf_counter() - started
+        started = time.perf_counter()
+        reopened = HistoryStore(Path(tmp), max_entries=size)
+        load_ms = (time.perf_counter() - started) * 1000
+    result = {
+        "history_size": size,
+        "inserts": inserts,
+        "insert_wall_s": round(wall, 3),
+        "inserts_per_s": round(inserts / wall, 1) if wall else 0.0,
+        "reload_ms": round(load_ms, 1),
+        "entries_after_reload": len(reopened),
+    }
+    result.update(_percentiles(times, "insert"))
+    return result
+
+
+def _bench_images(directory: Path, count: int, size: str) -> List[Dict[str, Any]]:
+    from PIL import Image, ImageDraw
+
+    width, height = (int(v) for v in size.lower().split("x"))
+    items = []
+    for i in range(count):
+        # 画面写しに近いもの：グラデーションの背景に文字とノイズの帯
+        im = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        draw = ImageDraw.Draw(im)
+        for y in range(20, height - 20, 40):
+            draw.text((20 + i % 7, y), f"{i}:{y} {SAMPLE_TEXT}", fill=(20, 20, 20))
+        band = Image.effect_noise((width, max(1, height // 8)), 32 + i % 16).convert("RGB")
+        im.paste(band, (0, (i * 37) % max(1, height - band.height)))
+        path = directory / f"bench_{i:04d}.png"
+        im.save(path, format="PNG")
+        items.append({"type": "image_file", "data": str(path)})
+    return items
+
+
+def _scenario_image_prep(params: Dict[str, Any]) -> Dict[str, Any]:
+    import input_prep
+
+    counts = [int(v) for v in str(params["prep_workers"]).split(",") if v.strip()]
+    model = "gemini-2.5-flash"
+    spec = input_prep.encode_spec(json.loads(params["prep_policy"]) if params.get("prep_policy") else None, model)
+    result: Dict[str, Any] = {"images": params["prep_images"], "size": params["prep_size"], "policy": spec, "cpu_count": os.cpu_count()}
+    with tempfile.TemporaryDirectory(prefix="gem_clip_bench_img_") as tmp:
+        items = _bench_images(Path(tmp), params["prep_images"] + 1, params["prep_size"])
+        warmup, items = items[0], items[1:]
+        result["input_mb"] = round(sum(os.path.getsize(it["data"]) for it in items) / input_prep.memory_accounting.MiB, 1)
+        baseline = None
+        for workers in counts:
+            preparer = input_prep.InputPreparer(workers)
+
+            async def _run() -> Any:
+                # プロセスの起動は測らない
+                await preparer.prepare(warmup, spec)
+                started = time.perf_counter()
+                out = await asyncio.gather(*(preparer.prepare(item, spec) for item in items))
+                return time.perf_counter() - started, out
+
+            try:
+                wall, prepared = asyncio.run(_run())
+            finally:
+                preparer.close()
+            rate = len(items) / wall if wall else 0.0
+            baseline = baseline or rate
+            result[f"w{workers}_wall_s"] = round(wall, 3)
+            result[f"w{workers}_images_per_s"] = round(rate, 2)
+            result[f"w{workers}_speedup"] = round(rate / baseline, 2) if baseline else 0.0
+        sizes = [p[2] for p in prepared if p[2]]
+        result["output_kb_per_image"] = round(sum(len(p[0]) for p in prepared) / len(prepared) / 1024, 1)
+        result["image_tokens_per_image"] = round(sum(input_prep.image_tokens(*s, input_prep.tile_size(model)) for s in sizes) / max(1, len(sizes)))
+        result["output_size"] = "x".join(str(v) for v in sizes[0]) if sizes else None
+    return result
+
+
+_RUNNERS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "matrix": _scenario_matrix,
+    "flow": _scenario_flow,
+    "summary": _scenario_summary,
+    "clipboard_idle": _scenario_clipboard_idle,
+    "grid_rebuild": _scenario_grid_rebuild,
+    "history": _scenario_history,
+    "image_prep": _scenario_image_prep,
+}
+
+
+def _child_main(name: str, params: Dict[str, Any]) -> int:
+    import fake_genai
+
+    data = _RUNNERS[name](params)
+    data["fake_backend"] = fake_genai.stats()
+    print(RESULT_PREFIX + json.dumps(data), flush=True)
+    return 0
+
+
+# ----------------------------------------------------------------------
+# Runner
+# ----------------------------------------------------------------------
+def _run_scenario(name: str, params: Dict[str, Any], profile: Dict[str, Any], timeout: float,
+                  cassette: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    root = Path(__file__).resolve().parent
+    with tempfile.TemporaryDirectory(prefix="gem_clip_bench_") as data_dir:
+        env = dict(os.environ)
+        if cassette is None:
+            env["GEM_CLIP_FAKE_GENAI"] = json.dumps(profile)
+        else:
+            env["GEM_CLIP_CASSETTE"] = cassette["path"]
+            env["GEM_CLIP_CASSETTE_MODE"] = cassette["mode"]
+            env["GEM_CLIP_CASSETTE_TIME_SCALE"] = str(cassette["time_scale"])
+        # 設定・セッション・ログは使い捨てのディレクトリへ（実ユーザーのデータに触れない）
+        for var in ("APPDATA", "XDG_CONFIG_HOME", "HOME", "USERPROFILE"):
+            env[var] = data_dir
+        cmd = [sys.executable, str(root / "bench_offline.py"), "--child", name, "--params", json.dumps(params)]
+        try:
+            proc = subprocess.run(cmd, cwd=root, env=env, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {"error": f"timed out after {timeout:.0f} s"}
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    tail = (proc.stderr or proc.stdout)[-1500:].strip()
+    return {"error": f"exit {proc.returncode}: {tail}"}
+
+
+def _default_prep_workers() -> str:
+    counts, n = [0], 1
+    while n <= (os.cpu_count() or 1):
+        counts.append(n)
+        n *= 2
+    return ",".join(str(c) for c in counts)
+
+
+def _git_revision(root: Path) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, capture_output=True, text=True, timeout=30).stdout.strip())
+        return {"commit": commit or None, "dirty": dirty}
+    except Exception:
+        return {"commit": None, "dirty": None}
+
+
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_s")
+
+
+def _is_compared(metric: str) -> bool:
+    return metric.endswith(("_ms", "_s", "_per_s", "cpu_percent")) and metric != "idle_s"
+
+
+def compare(base: Dict[str, Any], head: Dict[str, Any], threshold: float, out: Any = None) -> List[str]:
+    """Print metric deltas between two result files; return the regressed ``scenario.metric`` names."""
+    regressions = []
+    for name, head_metrics in head.get("scenarios", {}).items():
+        base_metrics = base.get("scenarios", {}).get(name)
+        if not base_metrics or "error" in base_metrics or "error" in head_metrics:
+            continue
+        for metric, new in head_metrics.items():
+            old = base_metrics.get(metric)
+            if not _is_compared(metric) or not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or old <= 0:
+                continue
+            change = (new - old) / old
+            worse = -change if _higher_is_better(metric) else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{name}.{metric}")
+            print(f"{name}.{metric}: {old} -> {new} ({change:+.1%}){flag}", file=out)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline gem_clip benchmarks against a fake Gemini backend.")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run (repeatable; default: all)")
+    parser.add_argument("--rows", type=int, default=20, help="input rows for matrix, flow and summary")
+    parser.add_argument("--cols", type=int, default=5, help="prompt columns for matrix and summary")
+    parser.add_argument("--flow-steps", type=int, default=3)
+    parser.add_argument("--grid-rows", type=int, default=2000)
+    parser.add_argument("--grid-cols", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5, help="grid rebuilds to time")
+    parser.add_argument("--idle-seconds", type=float, default=10.0)
+    parser.add_argument("--history-size", type=int, default=10000, help="entries kept by the history store")
+    parser.add_argument("--history-inserts", type=int, default=12000, help="adds to time in the history scenario")
+    parser.add_argument("--prep-images", type=int, default=64, help="generated images for image_prep")
+    parser.add_argument("--prep-size", default="2560x1440", help="their size, WIDTHxHEIGHT")
+    parser.add_argument("--prep-policy", default=None, help='image policy for image_prep as JSON, e.g. \'{"max_edge": 2048, "format": "jpeg"}\'')
+    parser.add_argument("--prep-workers", default=None, help="worker counts to compare, e.g. 0,1,2,4 (default: 0 and powers of two up to the CPU count)")
+    parser.add_argument("--profile", default=None, help="fake backend settings as JSON or a JSON file (see fake_genai.FakeProfile)")
+    parser.add_argument("--cassette", default=None, help="record to / replay from this cassette instead of the fake backend")
+    parser.add_argument("--cassette-mode", choices=("record", "replay"), default="replay")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="replay timing multiplier (0 = no delays)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT_S, help="per scenario, seconds")
+    parser.add_argument("--out", default=None, help="write the results JSON here (default: stdout)")
+    parser.add_argument("--compare", default=None, help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="relative change that counts as a regression")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--params", default="{}", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return _child_main(args.child, json.loads(args.params))
+
+    from fake_genai import FakeProfile
+
+    overrides: Dict[str, Any] = {}
+    if args.profile:
+        text = args.profile.strip()
+        overrides = json.loads(text if text.startswith("{") else Path(text).read_text(encoding="utf-8"))
+    profile = FakeProfile.from_dict(overrides).to_dict()
+    params = {
+        "rows": args.rows, "cols": args.cols, "flow_steps": args.flow_steps,
+        "grid_rows": args.grid_rows, "grid_cols": args.grid_cols, "repeats": args.repeats,
+        "idle_seconds": args.idle_seconds,
+        "history_size": args.history_size, "history_inserts": args.history_inserts,
+        "prep_images": args.prep_images, "prep_size": args.prep_size, "prep_policy": args.prep_policy,
+        "prep_workers": args.prep_workers or _default_prep_workers(),
+    }
+    root = Path(__file__).resolve().parent
+    report: Dict[str, Any] = {
+        "schema": SCHEMA_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        **_git_revision(root),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "profile": profile,
+        "scenarios": {},
+    }
+    cassette = None
+    if args.cassette:
+        cassette = {"path": str(Path(args.cassette).resolve()), "mode": args.cassette_mode, "time_scale": args.time_scale}
+        report["cassette"] = cassette
+        report["profile"] = None
+    failed = False
+    for name in args.scenario or SCENARIOS:
+        print(f"running {name} ...", file=sys.stderr)
+        data = _run_scenario(name, params, profile, args.timeout, cassette)
+        report["scenarios"][name] = data
+        if "error" in data:
+            failed = True
+            print(f"ERROR: {name} - {data['error']}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.compare:
+        base = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        # 比較表は stdout の JSON と混ざらないよう stderr へ
+        regressions = compare(base, report, args.threshold, out=sys.stderr)
+        if regressions:
+            print(f"FAIL: {len(regressions)} metric(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 2 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+cli.py
+========
+
+Command line front end for batch work without the GUI::
+
+    python main.py run --prompt check --input "テキスト"      # or --file PATH, or stdin
+    python main.py matrix --inputs docs.jsonl --set review --output results.csv
+
+Neither command creates a Tk root or a tray icon. The configuration is read
+from the same file as the app (notices go to stderr instead of message
+boxes) and the API key comes from ``GEMINI_API_KEY`` or the keyring entry
+written by the settings window.
+
+``run`` streams the response to stdout (or ``--output``). ``matrix`` runs
+every input × prompt with ``--concurrency`` requests in flight. Without
+``--output`` each result is written to stdout as a JSON line as soon as it
+completes. With ``--output`` nothing goes to stdout; the whole table is
+exported there (.csv, .xlsx or .jsonl, same layout as the matrix window's
+export) at the end. ``--max-requests`` and ``--max-cost``
+stop starting new requests once reached; requests already in flight still
+finish. Progress and a timing summary go to stderr.
+
+Exit status is 0 on success, 1 when any request failed and 2 for usage
+errors. Requests are traced to ``trace.jsonl`` like the GUI paths (source
+``cli``).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = ("run", "matrix")
+API_KEY_ENV = "GEMINI_API_KEY"
+
+
+def _error(message: str) -> None:
+    print(f"ERROR: {message}", file=sys.stderr)
+
+
+def _error_text(e: Exception) -> str:
+    # KeyError は str() だとメッセージがクォートされるので、元の文字列を使う
+    return str(e.args[0]) if isinstance(e, KeyError) and e.args else str(e)
+
+
+def _positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not an integer: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {number}")
+    return number
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="main.py", description="Run Gem Clip prompts without the GUI.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log INFO messages to stderr")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run one prompt on one input")
+    run.add_argument("--prompt", required=True, help="prompt id (from the config, or from --set)")
+    run.add_argument("--set", dest="prompt_set", help="look the prompt up in this prompt set")
+    src = run.add_mutually_exclusive_group()
+    src.add_argument("--input", help="input text (default: read stdin)")
+    src.add_argument("--file", type=Path, help="input file (image, PDF, text, ...)")
+    run.add_argument("--output", type=Path, help="write the response here instead of stdout")
+
+    matrix = sub.add_parser("matrix", help="run prompts on every input of a file or directory")
+    matrix.add_argument("--inputs", type=Path, required=True, help="CSV/JSONL file or directory of files")
+    matrix.add_argument("--text-column", help="CSV column that holds the input text")
+    matrix.add_argument("--recursive", action="store_true", help="include subdirectories of --inputs")
+    matrix.add_argument("--set", dest="prompt_set", help="prompt set name (prompt_set/<name>.json)")
+    matrix.add_argument("--prompt", dest="prompt_ids", action="append", default=[],
+                        help="prompt id from the config (repeatable; default: prompts marked for the matrix)")
+    matrix.add_argument("--output", type=Path, help="export the results (.csv, .xlsx or .jsonl) instead of JSON lines on stdout")
+    matrix.add_argument("--concurrency", type=_positive_int, default=5, help="requests in flight (default: 5)")
+    matrix.add_argument("--prep-workers", type=int, help="image preparation processes (default: prep_workers in the config; 0 = none)")
+    matrix.add_argument("--max-requests", type=int, help="start at most this many requests")
+    matrix.add_argument("--max-cost", type=float, help="stop starting requests once the estimated cost (USD) reaches this")
+    matrix.add_argument("-q", "--quiet", action="store_true", help="no per-cell progress on stderr")
+    return parser
+
+
+def _load_config():
+    from config_manager import load_config
+    from i18n import set_locale
+
+    config = load_config(interactive=False)
+    if config is not None:
+        set_locale(getattr(config, "language", "auto"))
+    return config
+
+
+def _configure_api_key() -> bool:
+    from common_models import configure_genai
+    from constants import API_SERVICE_ID
+
+    api_key = os.environ.get(API_KEY_ENV)
+    if not api_key:
+        try:
+            import keyring
+            api_key = keyring.get_password(API_SERVICE_ID, "api_key")
+        except Exception as e:
+            logger.info("could not read the API key from the keyring: %s", e)
+    if api_key:
+        configure_genai(api_key)
+        return True
+    # オフライン実装やカセット再生ならキーは要らない
+    return bool(os.environ.get("GEM_CLIP_FAKE_GENAI") or os.environ.get("GEM_CLIP_CASSETTE"))
+
+
+# ----------------------------------------------------------------------
+# run
+# ----------------------------------------------------------------------
+def _run_input(args: argparse.Namespace) -> Dict[str, Any]:
+    from matrix_import import item_for_path
+
+    if args.input is not None:
+        return {"type": "text", "data": args.input}
+    if args.file is not None:
+        if not args.file.is_file():
+            raise FileNotFoundError(f"no such file: {args.file}")
+        item = item_for_path(args.file)
+        if item is not None:
+            return item
+        # 未知の拡張子はテキストとして読む
+        return {"type": "text", "data": args.file.read_text(encoding="utf-8", errors="replace")}
+    return {"type": "text", "data": sys.stdin.read()}
+
+
+async def _run(args: argparse.Namespace, prompt: Any) -> int:
+    from prompt_runner import contents_for_item, stream_prompt
+    from request_trace import Span
+
+    try:
+        item = _run_input(args)
+    except OSError as e:
+        _error(str(e))
+        return 2
+    if not str(item.get("data") or "").strip():
+        _error("the input is empty")
+        return 2
+    span = Span("cli_run", prompt_id=args.prompt, model=prompt.model, input_type=item.get("type"))
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    ends_with_newline = True
+    try:
+        span.mark("started")
+        contents = await contents_for_item(item, span, prompt)
+        async for text in stream_prompt(prompt, contents, span):
+            out.write(text)
+            out.flush()
+            ends_with_newline = text.endswith("\n")
+        if not ends_with_newline:
+            out.write("\n")
+    except Exception as e:
+        span.fail(e)
+        _error(str(e))
+        return 1
+    finally:
+        span.end()
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+# ----------------------------------------------------------------------
+# matrix
+# ----------------------------------------------------------------------
+def _matrix_prompts(args: argparse.Namespace, config: Any) -> List[Tuple[str, Any]]:
+    from prompt_runner import load_prompt_set
+
+    if args.prompt_set:
+        prompts = load_prompt_set(args.prompt_set)
+        ids = args.prompt_ids or list(prompts)
+    else:
+        prompts = dict(config.prompts)
+        ids = args.prompt_ids or [pid for pid, p in prompts.items() if getattr(p, "include_in_matrix", False)]
+    missing = [pid for pid in ids if pid not in prompts]
+    if missing:
+        raise KeyError(f"no such prompt: {', '.join(missing)}")
+    return [(pid, prompts[pid]) for pid in ids]
+
+
+def _export(path: Path, items: List[Dict[str, Any]], prompts: List[Tuple[str, Any]], store: Any) -> None:
+    from i18n import tr
+    from matrix_export import MatrixExportSource, export_matrix
+
+    source = MatrixExportSource(
+        items, store, [(pid, p.name) for pid, p in prompts],
+        [tr("matrix.export.header_input"), tr("matrix.export.header_prompt_name"), tr("matrix.export.header_system_prompt")],
+    )
+    export_matrix(path, source)
+
+
+async def _matrix(args: argparse.Namespace, items: List[Dict[str, Any]], prompts: List[Tuple[str, Any]]) -> int:
+    from matrix_cell_store import MatrixCellStore
+    from prompt_runner import Budget, Job, load_price_info, run_matrix
+
+    budget = None
+    if args.max_requests is not None or args.max_cost is not None:
+        budget = Budget(args.max_requests, args.max_cost, load_price_info())
+    job = Job("cli_matrix", prompt_set=args.prompt_set)
+    store = MatrixCellStore(len(items), len(prompts)) if args.output else None
+    started = time.perf_counter()
+    task = asyncio.create_task(run_matrix(job, items, prompts, concurrency=args.concurrency,
+                                          span_kind="cli_matrix_cell", budget=budget))
+    done = skipped = 0
+    try:
+        async for event in job.follow():
+            if event.get("type") != "cell":
+                continue
+            done += 1
+            r, c = event["row"], event["col"]
+            if event.get("skipped"):
+                skipped += 1
+            elif store is not None and "text" in event:
+                store.set_result(r, c, event["text"])
+            if store is None:
+                print(json.dumps({"row": r + 1, "col": c + 1, **{k: v for k, v in event.items() if k not in ("type", "row", "col")}},
+                                 ensure_ascii=False), flush=True)
+            if not args.quiet:
+                state = "skipped" if event.get("skipped") else ("error: " + event["error"] if "error" in event else "ok")
+                print(f"[{done}/{job.total}] row {r + 1} {event['prompt_id']}: {state}", file=sys.stderr, flush=True)
+        await task
+        elapsed = time.perf_counter() - started
+        if store is not None:
+            await asyncio.to_thread(_export, args.output, items, prompts, store)
+    finally:
+        if not task.done():
+            task.cancel()
+        if store is not None:
+            store.close()
+    summary = f"{job.completed} ok, {job.failed} failed, {skipped} skipped in {elapsed:.1f}s"
+    if job.completed:
+        summary += f" ({job.completed / elapsed:.2f} req/s)"
+    if budget is not None:
+        summary += f", estimated cost ${budget.cost:.6f}"
+    print(summary, file=sys.stderr)
+    return 1 if job.failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _build_parser().parse_args(argv)
+    from logging_conf import setup_logging, stop_logging
+    import input_prep
+
+    setup_logging(logging.INFO if args.verbose else logging.WARNING)
+    try:
+        config = _load_config()
+        if config is None:
+            return 1
+        workers = getattr(args, "prep_workers", None)
+        input_prep.configure(workers if workers is not None else getattr(config, "prep_workers", None))
+        if not _configure_api_key():
+            _error(f"no API key: set {API_KEY_ENV} or save one in the settings window")
+            return 1
+        if args.command == "run":
+            try:
+                prompts = _matrix_prompts(argparse.Namespace(prompt_set=args.prompt_set, prompt_ids=[args.prompt]), config)
+            except (KeyError, FileNotFoundError) as e:
+                _error(_error_text(e))
+                return 2
+            return asyncio.run(_run(args, prompts[0][1]))
+
+        from matrix_import import iter_import_items
+        try:
+            prompts = _matrix_prompts(args, config)
+            items = list(iter_import_items(args.inputs, args.text_column, args.recursive))
+        except (KeyError, FileNotFoundError, ValueError) as e:
+            _error(_error_text(e))
+            return 2
+        if not prompts:
+            _error("no prompts selected: use --set or --prompt")
+            return 2
+        if not items:
+            _error(f"no inputs in {args.inputs}")
+            return 2
+        return asyncio.run(_matrix(args, items, prompts))
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        input_prep.shutdown()
+        stop_logging()
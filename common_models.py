@@ -1,20 +1,81 @@
 from typing import List, Dict, Any, Optional, Literal, AsyncIterator
 from pydantic import BaseModel, Field, ConfigDict
-import google.generativeai as genai
-from google.generativeai import types
-from google.api_core import exceptions
+import asyncio
 import base64
+import logging
+import os
+import sys
+import threading
 from io import BytesIO
-from PIL import Image
 
-def create_image_part(image_data_base64: str | bytes) -> Dict[str, Any]:
+logger = logging.getLogger(__name__)
+
+# google.generativeai は import だけで1秒前後かかるため、初回利用時に読み込む。
+# APIキーは configure_genai() で預かり、読み込んだ時点で適用する。
+_genai_module = None
+_genai_api_key: Optional[str] = None
+_genai_lock = threading.Lock()
+
+
+def load_genai():
+    """Return the ``google.generativeai`` module, importing and configuring it on first use."""
+    global _genai_module
+    if _genai_module is not None:
+        return _genai_module
+    with _genai_lock:
+        if _genai_module is None:
+            # GEM_CLIP_CASSETTE があれば記録/再生を挟む（genai_cassette.py 参照）
+            import genai_cassette
+            genai = genai_cassette.from_env(_import_genai_backend) or _import_genai_backend()
+            if _genai_api_key:
+                genai.configure(api_key=_genai_api_key)
+            _genai_module = genai
+    return _genai_module
+
+
+def is_api_call_error(e: BaseException) -> bool:
+    """True if *e* is a ``google.api_core`` API error (has ``code`` and ``message``).
+
+    Does not import the SDK: if ``google.api_core`` was never loaded (fake or
+    cassette backend), nothing can have raised one.
+    """
+    api_exceptions = sys.modules.get("google.api_core.exceptions")
+    return api_exceptions is not None and isinstance(e, api_exceptions.GoogleAPICallError)
+
+
+async def load_genai_async():
+    """:func:`load_genai` for coroutines: the first (slow) import runs off the event loop."""
+    if _genai_module is not None:
+        return _genai_module
+    return await asyncio.to_thread(load_genai)
+
+
+def _import_genai_backend():
+    if os.environ.get("GEM_CLIP_FAKE_GENAI"):
+        # ベンチマーク用のオフライン実装（fake_genai.py 参照）
+        import fake_genai
+        return fake_genai.install_from_env()
+    import google.generativeai as genai
+    return genai
+
+
+def configure_genai(api_key: Optional[str]) -> None:
+    """Set the API key now if the SDK is loaded, otherwise when it is first loaded."""
+    global _genai_api_key
+    with _genai_lock:
+        _genai_api_key = api_key
+        if _genai_module is not None and api_key:
+            _genai_module.configure(api_key=api_key)
+
+
+def create_image_part(image_data_base64: str | bytes, policy: Optional[Any] = None, model: Optional[str] = None) -> Dict[str, Any]:
     """
     Base64エンコードされた画像データ（またはバイト列）から、
     Gemini API 用の画像パートを生成する。
 
     - 入力が base64 文字列の場合: デコードしてバイト列へ。
     - zlib 圧縮が施されている場合: 可能なら解凍。
-    - PIL で一度読み込み、PNG として正規化してから `inline_data` に格納。
+    - PIL で一度読み込み、PNG（*policy* があればその形式・サイズ）に正規化してから `inline_data` に格納。
     """
     # 1) bytes へ正規化
     raw: bytes
@@ -23,35 +84,16 @@ def create_image_part(image_data_base64: str | bytes) -> Dict[str, Any]:
     else:
         raw = base64.b64decode(image_data_base64)
 
-    # 2) 必要なら zlib 解凍（履歴で圧縮されている場合のフォールバック）
-    try:
-        # 典型的な zlib ヘッダ（0x78, 0x9C/0xDA 等）を簡易判定
-        if len(raw) > 2 and raw[0] == 0x78 and raw[1] in (0x01, 0x5E, 0x9C, 0xDA):
-            import zlib
-            raw = zlib.decompress(raw)
-    except Exception:
-        # 解凍に失敗した場合は元のバイト列をそのまま使用
-        pass
+    # 2) zlib 解凍（必要なら）と PNG への正規化（input_prep.py と共通）
+    from input_prep import encode_image, encode_spec
 
-    # 3) PIL で読み込んで PNG 化（壊れたデータや非PNGでも正規化）
-    try:
-        with Image.open(BytesIO(raw)) as im:
-            if im.mode != 'RGB':
-                im = im.convert('RGB')
-            buf = BytesIO()
-            # optimize=True でサイズを抑えつつ互換性維持
-            im.save(buf, format='PNG', optimize=True)
-            png_bytes = buf.getvalue()
-    except Exception:
-        # 画像として読み込めない場合は、最終手段としてそのまま送る
-        # （API 側で拒否される可能性はあるが、以前の挙動に近い）
-        png_bytes = raw
-
-    return {"inline_data": {"mime_type": "image/png", "data": png_bytes}}
+    data, mime_type, _ = encode_image(raw, encode_spec(policy, model))
+    return {"inline_data": {"mime_type": mime_type, "data": data}}
 
 class Event(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
-    content: Optional[types.GenerateContentResponse] = None
+    # google.generativeai.types.GenerateContentResponse（SDK を import しないよう Any にしている）
+    content: Optional[Any] = None
     is_final: bool = False
 
     def is_final_response(self) -> bool:
@@ -90,6 +132,7 @@ class LlmAgent(BaseAgent):
         if not self.prompt_config:
             raise ValueError("LlmAgentがprompt_configで初期化されていません。")
 
+        genai = await load_genai_async()
         model = genai.GenerativeModel(self.model)
         generation_config = genai.types.GenerationConfig(
             temperature=self.temperature
@@ -99,19 +142,18 @@ class LlmAgent(BaseAgent):
         contents = f"{self.instruction}\n\n---\n\n{content}"
         
         try:
-            print(f"DEBUG: LlmAgent '{self.name}' - LLMストリーミングリクエスト送信中。モデル: {self.model}, 温度: {self.temperature}, コンテンツ先頭: {contents[:100]}...")
+            logger.debug("LlmAgent '%s' - LLMストリーミングリクエスト送信中。モデル: %s, 温度: %s, コンテンツ長: %d", self.name, self.model, self.temperature, len(contents))
             response_stream = await model.generate_content_async(contents, generation_config=generation_config, stream=True)
             
             async for chunk in response_stream:
                 if chunk.parts: # chunk.textではなくchunk.partsを使用
-                    print(f"DEBUG: LlmAgent '{self.name}' - LLMストリーミングチャンク受信。")
                     yield Event(content=chunk)
             yield Event(is_final=True) # ストリームの最後にis_final=TrueのEventを送信
-        except exceptions.GoogleAPICallError as e:
-            print(f"ERROR: LlmAgent '{self.name}' - APIエラーが発生しました (コード: {e.code}): {e.message}")
-            raise RuntimeError(f"APIエラーが発生しました (コード: {e.code}): {e.message}")
         except Exception as e:
-            print(f"ERROR: LlmAgent '{self.name}' - LLM呼び出し中に予期せぬエラーが発生しました: {e}")
+            if is_api_call_error(e):
+                logger.error("LlmAgent '%s' - APIエラーが発生しました (コード: %s): %s", self.name, e.code, e.message)
+                raise RuntimeError(f"APIエラーが発生しました (コード: {e.code}): {e.message}")
+            logger.error("LlmAgent '%s' - LLM呼び出し中に予期せぬエラーが発生しました: %s", self.name, e)
             raise RuntimeError(f"LLM呼び出し中に予期せぬエラーが発生しました: {e}")
 
     async def run_live(self, content: Any) -> Any:
@@ -125,6 +167,19 @@ class PromptParameters(BaseModel):
     max_output_tokens: Optional[int] = None
     stop_sequences: Optional[List[str]] = None
 
+class ImagePolicy(BaseModel):
+    """How images are encoded before they are sent with a prompt (see input_prep.py).
+
+    A prompt without a policy sends images at full size as lossless PNG.
+    """
+    # 長辺の上限（px）。None なら縮小しない
+    max_edge: Optional[int] = Field(default=None, ge=64)
+    format: Literal["png", "jpeg", "webp"] = "png"
+    # JPEG/WebP の画質（PNG では無視）
+    quality: int = Field(default=85, ge=1, le=100)
+    # モデルのタイル（768px）の数が減るなら少しだけ縮める
+    tile_aware: bool = True
+
 class Prompt(BaseModel):
     name: str
     model: Literal["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.5-flash-lite"] = "gemini-2.5-flash-lite"
@@ -132,6 +187,7 @@ class Prompt(BaseModel):
     thinking_level: Literal["Fast", "Balanced", "High Quality", "Unlimited"] = "Balanced"
     enable_web: bool = False
     parameters: PromptParameters = Field(default_factory=PromptParameters)
+    image_policy: Optional[ImagePolicy] = None
 
     # マトリクスプロンプトにデフォルトで含めるかどうかを示すフラグ
     include_in_matrix: bool = False
@@ -152,7 +208,7 @@ class AppConfig(BaseModel):
         hotkey_matrix: Optional hotkey for opening the matrix processor.
         hotkey: Deprecated single global hotkey (v2 and earlier). Kept for migration.
     """
-    version: int = 7
+    version: int = 10
     prompts: Dict[str, Prompt]
     max_history_size: int = 20
     api_key: Optional[str] = None
@@ -172,3 +228,9 @@ class AppConfig(BaseModel):
     language: Optional[str] = "auto"
     # Theme mode (v7): 'system' | 'light' | 'dark'
     theme_mode: Optional[Literal['system','light','dark']] = 'system'
+    # Memory budgets in MiB per subsystem (v8): e.g. {"matrix": 256}; 0 = unlimited
+    memory_budgets_mb: Dict[str, int] = Field(default_factory=dict)
+    # Local HTTP/Unix-socket API for scripts and editors (v9); see local_api.py
+    local_api_enabled: bool = False
+    # Image preparation processes (v10); None = CPU count - 1, 0 = no pool. See input_prep.py
+    prep_workers: Optional[int] = None
@@ -46,6 +46,14 @@ def _write_json(path: Path, data: dict) -> bool:
         print(f"ERROR: Failed to write JSON to {path}: {e}")
         return False
 
+def _notify(title: str, message: str, interactive: bool, error: bool = False) -> None:
+    """Show *message* in a message box, or on stderr when running without a UI."""
+    if interactive:
+        (messagebox.showerror if error else messagebox.showinfo)(title, message)
+    else:
+        import sys
+        print(f"{'ERROR' if error else 'INFO'}: {message}", file=sys.stderr)
+
 def _migrate_v1_to_v2(data: dict) -> dict:
     """Migrate a v1 configuration dictionary to the v2 format.
 
@@ -116,7 +124,28 @@ def _migrate_v6_to_v7(data: dict) -> dict:
     data["version"] = 7
     return data
 
-def load_config() -> Optional[AppConfig]:
+def _migrate_v7_to_v8(data: dict) -> dict:
+    """Migrate v7 to v8 by adding per-subsystem memory budgets."""
+    data = data.copy()
+    data.setdefault("memory_budgets_mb", {})
+    data["version"] = 8
+    return data
+
+def _migrate_v8_to_v9(data: dict) -> dict:
+    """Migrate v8 to v9 by adding the local API switch."""
+    data = data.copy()
+    data.setdefault("local_api_enabled", False)
+    data["version"] = 9
+    return data
+
+def _migrate_v9_to_v10(data: dict) -> dict:
+    """Migrate v9 to v10 by adding the image preparation process count."""
+    data = data.copy()
+    data.setdefault("prep_workers", None)
+    data["version"] = 10
+    return data
+
+def load_config(interactive: bool = True) -> Optional[AppConfig]:
     """Load the application configuration with automatic migration support.
 
     This function attempts to read the configuration from the user-specific
@@ -125,10 +154,14 @@ def load_config() -> Optional[AppConfig]:
     directory, the old file is migrated to the new location and upgraded to
     the latest version.
 
+    Args:
+        interactive: Report migrations and errors in a message box. Command
+            line callers pass ``False`` to get them on stderr instead, so no
+            Tk root is created.
+
     Returns:
         An instance of ``AppConfig`` if loading and validation succeed,
-        otherwise ``None``. Errors are displayed to the user via a
-        message box.
+        otherwise ``None``.
     """
     # Determine paths
     new_config_path: Path = paths.get_config_file_path()
@@ -174,7 +207,7 @@ def load_config() -> Optional[AppConfig]:
                 if data is not None:
                     # Write to new location with minimal changes (structural migration happens later)
                     if _write_json(new_config_path, data):
-                        messagebox.showinfo(APP_NAME, f"旧アプリ名の設定を移行しました: {legacy_base / CONFIG_FILE} → {new_config_path}")
+                        _notify(APP_NAME, f"旧アプリ名の設定を移行しました: {legacy_base / CONFIG_FILE} → {new_config_path}", interactive)
         except Exception:
             # Non-fatal: continue with other migration paths
             pass
@@ -189,19 +222,20 @@ def load_config() -> Optional[AppConfig]:
             # Write migrated data to new location
             if _write_json(new_config_path, data):
                 # Optionally keep a backup of the old file. We leave it in place for now.
-                messagebox.showinfo(APP_NAME, f"旧設定ファイル {old_config_path} を {new_config_path} に移行しました。")
+                _notify(APP_NAME, f"旧設定ファイル {old_config_path} を {new_config_path} に移行しました。", interactive)
         else:
             # If reading fails, create a default config in new location
             create_default_config()
     # If new config still does not exist, create a default one
     if not new_config_path.exists():
         create_default_config()
-        messagebox.showinfo(APP_NAME, f"{new_config_path.name} を作成しました。プロンプトやホットキーを編集してください。")
+        _notify(APP_NAME, f"{new_config_path.name} を作成しました。プロンプトやホットキーを編集してください。", interactive)
     # Read the configuration
     try:
         data = _read_json(new_config_path)
         if data is None:
             raise ValueError("設定ファイルが空、または読み込みに失敗しました。")
+        original = dict(data)
         # Handle migration if needed
         ver = data.get("version", 1)
         if ver < 2:
@@ -222,12 +256,23 @@ def load_config() -> Optional[AppConfig]:
         if ver < 7:
             data = _migrate_v6_to_v7(data)
             ver = 7
+        if ver < 8:
+            data = _migrate_v7_to_v8(data)
+            ver = 8
+        if ver < 9:
+            data = _migrate_v8_to_v9(data)
+            ver = 9
+        if ver < 10:
+            data = _migrate_v9_to_v10(data)
+            ver = 10
         if data.get("version") != ver:
             data["version"] = ver
-        _write_json(new_config_path, data)
+        # Only rewrite the file when a migration actually changed it
+        if data != original:
+            _write_json(new_config_path, data)
         return AppConfig(**data)
     except Exception as e:
-        messagebox.showerror("設定エラー", f"設定ファイルの読み込みに失敗しました: {e}")
+        _notify("設定エラー", f"設定ファイルの読み込みに失敗しました: {e}", interactive, error=True)
         return None
 
 def save_config(config: AppConfig):
@@ -246,7 +291,7 @@ def save_config(config: AppConfig):
 def create_default_config():
     """Create a default configuration file in the user-specific configuration directory."""
     default_config = {
-        "version": 7,
+        "version": 10,
         "prompts": {
             "check": {
                 "name": "誤字脱字を修正",
@@ -273,6 +318,8 @@ def create_default_config():
                     "テキストの構造やレイアウトも可能な限り保持してください。"
                 ),
                 "parameters": {"temperature": 0.1},
+                # 文字が読める範囲で縮め、タイル数を抑える（原寸で送るなら削除）
+                "image_policy": {"max_edge": 3072, "format": "png", "tile_aware": True},
             },
         },
         "max_history_size": 20,
@@ -285,6 +332,9 @@ def create_default_config():
         "max_flow_steps": 5,
         "language": "auto",
         "theme_mode": "system",
+        "memory_budgets_mb": {},
+        "local_api_enabled": False,
+        "prep_workers": None,
     }
     config_path: Path = paths.get_config_file_path()
     _write_json(config_path, default_config)
@@ -0,0 +1,268 @@
+"""
+fake_genai.py
+==============
+
+Offline stand-in for ``google.generativeai`` used by benchmarks.
+
+It implements the parts of the SDK the app calls (``configure``,
+``GenerativeModel.generate_content`` with and without streaming,
+``count_tokens``, ``upload_file`` and ``types.GenerationConfig``). Responses
+have the same shape as the real ones: candidates with parts, prompt feedback
+and usage metadata.
+
+How a call behaves is set by a :class:`FakeProfile`:
+
+- latency: time to the first token, drawn from a ``fixed``, ``uniform``,
+  ``normal`` or ``lognormal`` distribution
+- streaming: number of chunks and the gap between them
+- token counts: output tokens per response; input tokens are estimated from
+  the prompt length
+- errors: injected exceptions, safety blocks and tool rejections (the tool
+  rejections exercise the app's fallback without tools)
+
+Set ``GEM_CLIP_FAKE_GENAI`` and :func:`common_models.load_genai` returns this
+module instead of the SDK. The value is ``1`` for the defaults, or profile
+fields as a JSON object or the path of a JSON file::
+
+    GEM_CLIP_FAKE_GENAI='{"ttft_ms": 400, "latency_dist": "lognormal", "error_rate": 0.05}'
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+FAKE_GENAI_ENV = "GEM_CLIP_FAKE_GENAI"
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+
+
+class FakeProfile:
+    """Latency, streaming, token and error settings of the fake backend."""
+
+    def __init__(self, ttft_ms: float = 300.0, latency_dist: str = "lognormal", latency_jitter: float = 0.3,
+                 chunks: int = 8, chunk_interval_ms: float = 40.0, output_tokens: int = 200,
+                 upload_ms: float = 150.0, error_rate: float = 0.0, block_rate: float = 0.0,
+                 tool_error_rate: float = 0.0, seed: Optional[int] = 0):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency_dist must be one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.ttft_ms = float(ttft_ms)
+        self.latency_dist = latency_dist
+        # uniform/normal では ttft_ms に対する割合、lognormal では sigma
+        self.latency_jitter = float(latency_jitter)
+        self.chunks = max(1, int(chunks))
+        self.chunk_interval_ms = float(chunk_interval_ms)
+        self.output_tokens = int(output_tokens)
+        self.upload_ms = float(upload_ms)
+        self.error_rate = float(error_rate)
+        self.block_rate = float(block_rate)
+        self.tool_error_rate = float(tool_error_rate)
+        self.seed = seed
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "FakeProfile":
+        return cls(**data)
+
+    @classmethod
+    def from_env(cls) -> "FakeProfile":
+        raw = (os.environ.get(FAKE_GENAI_ENV) or "").strip()
+        if raw in ("", "1", "true"):
+            return cls()
+        if raw.startswith("{"):
+            return cls.from_dict(json.loads(raw))
+        return cls.from_dict(json.loads(Path(raw).read_text(encoding="utf-8")))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+class _Backend:
+    """Shared random source and call counters (the SDK is thread-safe, so is this)."""
+
+    def __init__(self, profile: FakeProfile):
+        self.profile = profile
+        self._rng = random.Random(profile.seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def _random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def ttft_seconds(self) -> float:
+        p = self.profile
+        with self._lock:
+            if p.latency_dist == "fixed":
+                ms = p.ttft_ms
+            elif p.latency_dist == "uniform":
+                ms = self._rng.uniform(p.ttft_ms * (1 - p.latency_jitter), p.ttft_ms * (1 + p.latency_jitter))
+            elif p.latency_dist == "normal":
+                ms = self._rng.gauss(p.ttft_ms, p.ttft_ms * p.latency_jitter)
+            else:
+                # mu=0 なので中央値が ttft_ms になる（裾の長い実測に近い）
+                ms = p.ttft_ms * self._rng.lognormvariate(0.0, p.latency_jitter)
+        return max(0.0, ms) / 1000
+
+    def roll(self, rate: float) -> bool:
+        return rate > 0 and self._random() < rate
+
+    def count_call(self, failed: bool = False) -> None:
+        with self._lock:
+            self.calls += 1
+            if failed:
+                self.errors += 1
+
+
+_backend = _Backend(FakeProfile())
+
+
+def configure_fake(profile: FakeProfile) -> None:
+    """Replace the active profile (and reset the random source and counters)."""
+    global _backend
+    _backend = _Backend(profile)
+
+
+def stats() -> Dict[str, int]:
+    return {"calls": _backend.calls, "errors": _backend.errors}
+
+
+class FakeAPIError(RuntimeError):
+    pass
+
+
+# ----------------------------------------------------------------------
+# SDK surface
+# ----------------------------------------------------------------------
+class GenerationConfig:
+    def __init__(self, temperature=None, top_p=None, top_k=None, max_output_tokens=None, stop_sequences=None, tools=None, **kwargs):
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.max_output_tokens = max_output_tokens
+        self.stop_sequences = stop_sequences
+        self.tools = tools
+
+
+types = SimpleNamespace(GenerationConfig=GenerationConfig)
+
+
+class _Part:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Candidate:
+    def __init__(self, text: str, finish_reason: Optional[int]):
+        self.content = SimpleNamespace(parts=[_Part(text)] if text else [])
+        self.finish_reason = finish_reason
+
+
+class FakeResponse:
+    def __init__(self, text: str = "", finish_reason: Optional[int] = None, block_reason: Optional[str] = None,
+                 input_tokens: int = 0, output_tokens: int = 0):
+        self.candidates = [] if block_reason else [_Candidate(text, finish_reason)]
+        self.prompt_feedback = SimpleNamespace(block_reason=block_reason)
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=input_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=input_tokens + output_tokens,
+        )
+
+    @property
+    def text(self) -> str:
+        if not self.candidates:
+            raise ValueError("The response was blocked; no text is available.")
+        return "".join(p.text for p in self.candidates[0].content.parts)
+
+
+def _estimate_tokens(contents: Any) -> int:
+    """About 4 characters per token for text; a flat 258 per image or file (as the API counts images)."""
+    if isinstance(contents, str):
+        return max(1, len(contents) // 4)
+    if isinstance(contents, dict):
+        if "text" in contents:
+            return _estimate_tokens(contents["text"])
+        if "parts" in contents:
+            return _estimate_tokens(contents["parts"])
+        return 258
+    if isinstance(contents, (list, tuple)):
+        return sum(_estimate_tokens(c) for c in contents)
+    return 258
+
+
+def _has_tools(generation_config: Any, tools: Any) -> bool:
+    return bool(tools or getattr(generation_config, "tools", None))
+
+
+class GenerativeModel:
+    def __init__(self, model_name: str = "gemini-fake", system_instruction: Any = None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def count_tokens(self, contents: Any = None, **kwargs) -> SimpleNamespace:
+        return SimpleNamespace(total_tokens=_estimate_tokens(contents))
+
+    def generate_content(self, contents: Any = None, generation_config: Any = None, stream: bool = False, tools: Any = None, **kwargs):
+        backend = _backend
+        p = backend.profile
+        input_tokens = _estimate_tokens(contents)
+        if _has_tools(generation_config, tools) and backend.roll(p.tool_error_rate):
+            backend.count_call(failed=True)
+            raise FakeAPIError("400 Tool is not supported (injected)")
+        if backend.roll(p.error_rate):
+            time.sleep(backend.ttft_seconds())
+            backend.count_call(failed=True)
+            raise FakeAPIError("503 The service is currently unavailable (injected)")
+        blocked = backend.roll(p.block_rate)
+        backend.count_call()
+        if stream:
+            return self._stream(backend, input_tokens, blocked)
+        # 非ストリーミングは全チャンク分待ってからまとめて返す
+        time.sleep(backend.ttft_seconds() + (p.chunks - 1) * p.chunk_interval_ms / 1000)
+        if blocked:
+            return FakeResponse(block_reason="SAFETY", input_tokens=input_tokens)
+        return FakeResponse("".join(self._chunk_texts(p)), finish_reason=1, input_tokens=input_tokens, output_tokens=p.output_tokens)
+
+    def _chunk_texts(self, p: FakeProfile) -> List[str]:
+        # 1トークン ≒ 4文字として出力トークン数ぶんの本文を作り、チャンクに割る
+        body = (f"[{self.model_name}] " + "lorem ipsum dolor sit amet " * (p.output_tokens // 6 + 1))[: p.output_tokens * 4]
+        size = max(1, -(-len(body) // p.chunks))
+        return [body[i:i + size] for i in range(0, len(body), size)] or [""]
+
+    def _stream(self, backend: _Backend, input_tokens: int, blocked: bool) -> Iterator[FakeResponse]:
+        p = backend.profile
+        time.sleep(backend.ttft_seconds())
+        if blocked:
+            yield FakeResponse(block_reason="SAFETY", input_tokens=input_tokens)
+            return
+        texts = self._chunk_texts(p)
+        for i, text in enumerate(texts):
+            if i:
+                time.sleep(p.chunk_interval_ms / 1000)
+            last = i == len(texts) - 1
+            yield FakeResponse(text, finish_reason=1 if last else None, input_tokens=input_tokens,
+                               output_tokens=p.output_tokens if last else 0)
+
+
+def configure(api_key: Optional[str] = None, **kwargs) -> None:
+    pass
+
+
+def upload_file(path: Any = None, mime_type: Optional[str] = None, **kwargs) -> SimpleNamespace:
+    time.sleep(_backend.profile.upload_ms / 1000)
+    name = Path(str(path)).name
+    return SimpleNamespace(name=f"files/{name}", uri=f"fake://files/{name}", mime_type=mime_type, display_name=name)
+
+
+def install_from_env() -> Any:
+    """Apply the profile from ``GEM_CLIP_FAKE_GENAI`` and return this module."""
+    import sys
+
+    configure_fake(FakeProfile.from_env())
+    return sys.modules[__name__]
@@ -0,0 +1,357 @@
+"""
+genai_cassette.py
+===================
+
+Record/replay transport for the Gemini SDK.
+
+:func:`common_models.load_genai` returns a :class:`Cassette` instead of the
+SDK module when ``GEM_CLIP_CASSETTE`` names a cassette file. Every call site
+(hotkey requests, matrix cells, flows, summaries, file uploads, token counts)
+already goes through that module, so nothing else has to change.
+
+- ``GEM_CLIP_CASSETTE_MODE=record``: calls go to the real backend (the SDK,
+  or :mod:`fake_genai` if ``GEM_CLIP_FAKE_GENAI`` is set as well). Each
+  request/response pair is appended to the cassette with the offset of every
+  stream chunk, the finish/block reasons, usage metadata and any error.
+- ``GEM_CLIP_CASSETTE_MODE=replay`` (default): no network and no SDK import.
+  Responses are played back with their recorded timing, multiplied by
+  ``GEM_CLIP_CASSETTE_TIME_SCALE`` (``1`` = original, ``0.5`` = twice as
+  fast, ``0`` = no delays).
+
+Requests are matched on a hash of the model, system instruction, contents,
+generation parameters, tools and streaming flag. Images are hashed by their
+bytes and uploaded files by their content, so file URIs that differ between
+runs still match. A request recorded several times is replayed in recorded
+order, and the last recording repeats after that. A request that is not in
+the cassette raises :class:`CassetteMiss`.
+
+The cassette is a JSON Lines file: one header line, then one line per
+interaction.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_ENV = "GEM_CLIP_CASSETTE"
+MODE_ENV = "GEM_CLIP_CASSETTE_MODE"
+TIME_SCALE_ENV = "GEM_CLIP_CASSETTE_TIME_SCALE"
+MODES = ("record", "replay")
+FORMAT_VERSION = 1
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+class CassetteReplayError(RuntimeError):
+    """A recorded backend error, raised again on replay."""
+
+
+def _sha1(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def _enum_value(value: Any) -> Any:
+    """finish_reason/block_reason are proto enums in the SDK; keep them as ints (0 = unset)."""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _usage(resp: Any) -> Optional[Dict[str, int]]:
+    meta = getattr(resp, "usage_metadata", None)
+    if meta is None:
+        return None
+    fields = ("prompt_token_count", "candidates_token_count", "total_token_count")
+    return {f: int(getattr(meta, f, 0) or 0) for f in fields}
+
+
+def _chunk_record(resp: Any, t_ms: float) -> Dict[str, Any]:
+    try:
+        text = resp.text
+    except Exception:
+        # ブロックされた応答では text が例外になる
+        text = ""
+    candidates = getattr(resp, "candidates", None) or []
+    feedback = getattr(resp, "prompt_feedback", None)
+    return {
+        "t_ms": round(t_ms, 2),
+        "text": text or "",
+        "has_candidate": bool(candidates),
+        "finish_reason": _enum_value(getattr(candidates[0], "finish_reason", None)) if candidates else None,
+        "block_reason": _enum_value(getattr(feedback, "block_reason", None)) if feedback is not None else None,
+        "usage": _usage(resp),
+    }
+
+
+# ----------------------------------------------------------------------
+# Replayed response objects (same shape as the SDK's)
+# ----------------------------------------------------------------------
+class _ReplayCandidate:
+    def __init__(self, text: str, finish_reason: Any):
+        self.content = SimpleNamespace(parts=[SimpleNamespace(text=text)] if text else [])
+        self.finish_reason = finish_reason
+
+
+class ReplayResponse:
+    def __init__(self, chunk: Dict[str, Any]):
+        text = chunk.get("text") or ""
+        self.candidates = [_ReplayCandidate(text, chunk.get("finish_reason"))] if chunk.get("has_candidate", True) else []
+        self.prompt_feedback = SimpleNamespace(block_reason=chunk.get("block_reason") or None)
+        usage = chunk.get("usage") or {}
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=usage.get("prompt_token_count", 0),
+            candidates_token_count=usage.get("candidates_token_count", 0),
+            total_token_count=usage.get("total_token_count", 0),
+        )
+
+    @property
+    def text(self) -> str:
+        if not self.candidates:
+            raise ValueError("The response was blocked; no text is available.")
+        return "".join(p.text for p in self.candidates[0].content.parts)
+
+
+# ----------------------------------------------------------------------
+# Cassette
+# ----------------------------------------------------------------------
+class Cassette:
+    """Stands in for the ``google.generativeai`` module (``configure``, ``GenerativeModel``, ``upload_file``, ``types``)."""
+
+    def __init__(self, path: Path, mode: str = "replay", time_scale: float = 1.0,
+                 backend_loader: Optional[Callable[[], Any]] = None):
+        if mode not in MODES:
+            raise ValueError(f"{MODE_ENV} must be one of {', '.join(MODES)}")
+        self.path = Path(path)
+        self.mode = mode
+        self.time_scale = max(0.0, float(time_scale))
+        self._lock = threading.Lock()
+        # 実ファイル URI -> 内容ハッシュ（記録時と再生時で URI が違っても一致させる）
+        self._file_ids: Dict[str, str] = {}
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        if mode == "record":
+            if backend_loader is None:
+                raise ValueError("recording needs a backend")
+            self.backend = backend_loader()
+            self.types = self.backend.types
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if not self.path.exists() or self.path.stat().st_size == 0:
+                self._append({"cassette": FORMAT_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z")})
+        else:
+            self.backend = None
+            # 再生時は SDK を読み込まない（GenerationConfig は引数を保持するだけでよい）
+            from fake_genai import types as replay_types
+            self.types = replay_types
+            self._load()
+
+    # --- module surface ---
+    def configure(self, api_key: Optional[str] = None, **kwargs) -> None:
+        if self.backend is not None:
+            self.backend.configure(api_key=api_key, **kwargs)
+
+    def GenerativeModel(self, model_name: str = "", system_instruction: Any = None, **kwargs) -> "_CassetteModel":  # noqa: N802 - SDK name
+        return _CassetteModel(self, model_name, system_instruction, kwargs)
+
+    def upload_file(self, path: Any = None, mime_type: Optional[str] = None, **kwargs) -> Any:
+        file_id = _sha1(Path(path).read_bytes())
+        key = self._key({"kind": "upload", "file": file_id, "mime_type": mime_type})
+        if self.mode == "replay":
+            entry = self._next(key, f"upload of {Path(path).name}")
+            self._wait(entry.get("t_ms", 0.0))
+            uri = f"cassette://files/{file_id}"
+            self._file_ids[uri] = file_id
+            return SimpleNamespace(name=entry.get("name") or f"files/{file_id[:12]}", uri=uri, mime_type=mime_type, display_name=Path(path).name)
+        t0 = time.perf_counter()
+        result = self.backend.upload_file(path=path, mime_type=mime_type, **kwargs)
+        uri = getattr(result, "uri", None)
+        if uri:
+            self._file_ids[str(uri)] = file_id
+        self._record({"key": key, "kind": "upload", "name": getattr(result, "name", None), "t_ms": round((time.perf_counter() - t0) * 1000, 2)})
+        return result
+
+    # --- matching ---
+    def normalize(self, obj: Any) -> Any:
+        """JSON-able form of request contents, with bytes and file references replaced by content hashes."""
+        if obj is None or isinstance(obj, (str, int, float, bool)):
+            return obj
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            return {"sha1": _sha1(bytes(obj))}
+        if isinstance(obj, dict):
+            return {str(k): self.normalize(v) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))}
+        if isinstance(obj, (list, tuple)):
+            return [self.normalize(v) for v in obj]
+        uri = getattr(obj, "uri", None)
+        if uri:
+            return {"file": self._file_ids.get(str(uri), str(uri))}
+        return {"object": type(obj).__name__}
+
+    def _key(self, request: Dict[str, Any]) -> str:
+        return _sha1(json.dumps(self.normalize(request), sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+
+    def _next(self, key: str, what: str) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(f"{what} is not in cassette {self.path} (key {key[:12]})")
+            i = self._cursor.get(key, 0)
+            self._cursor[key] = i + 1
+            return entries[min(i, len(entries) - 1)]
+
+    def _wait(self, t_ms: float, since: Optional[float] = None) -> None:
+        """Sleep until *t_ms* (scaled) after *since* (default: now)."""
+        if self.time_scale <= 0:
+            return
+        start = time.perf_counter() if since is None else since
+        delay = start + t_ms * self.time_scale / 1000 - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    # --- storage ---
+    def _load(self) -> None:
+        if not self.path.exists():
+            raise FileNotFoundError(f"cassette not found: {self.path}")
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                if "key" in entry:
+                    self._entries.setdefault(entry["key"], []).append(entry)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        with open(self.path, "a", encoding="utf-8", newline="\n") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _record(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            try:
+                self._append(entry)
+            except Exception as e:
+                logger.error("genai_cassette - failed to write %s: %s", self.path, e)
+
+
+def _config_dict(config: Any) -> Any:
+    if config is None or isinstance(config, dict):
+        return config
+    fields = ("temperature", "top_p", "top_k", "max_output_tokens", "stop_sequences", "tools", "candidate_count", "response_mime_type")
+    return {f: getattr(config, f, None) for f in fields}
+
+
+class _CassetteModel:
+    def __init__(self, cassette: Cassette, model_name: str, system_instruction: Any, kwargs: Dict[str, Any]):
+        self.cassette = cassette
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self._real = None
+        if cassette.backend is not None:
+            self._real = cassette.backend.GenerativeModel(model_name, system_instruction=system_instruction, **kwargs)
+
+    def _request(self, kind: str, **fields: Any) -> Dict[str, Any]:
+        return {"kind": kind, "model": self.model_name, "system_instruction": self.system_instruction, **fields}
+
+    def count_tokens(self, contents: Any = None, **kwargs) -> Any:
+        cassette = self.cassette
+        key = cassette._key(self._request("count_tokens", contents=contents))
+        if cassette.mode == "replay":
+            entry = cassette._next(key, f"count_tokens on {self.model_name}")
+            return SimpleNamespace(total_tokens=entry.get("total_tokens", 0))
+        result = self._real.count_tokens(contents=contents, **kwargs)
+        cassette._record({"key": key, "kind": "count_tokens", "total_tokens": int(getattr(result, "total_tokens", 0) or 0)})
+        return result
+
+    def generate_content(self, contents: Any = None, generation_config: Any = None, stream: bool = False, tools: Any = None, **kwargs) -> Any:
+        cassette = self.cassette
+        request = self._request("generate", contents=contents, generation_config=_config_dict(generation_config), tools=tools, stream=bool(stream))
+        key = cassette._key(request)
+        if cassette.mode == "replay":
+            entry = cassette._next(key, f"generate_content on {self.model_name}")
+            return self._replay(entry, bool(stream))
+
+        call = {"contents": contents, "generation_config": generation_config, "stream": stream, **kwargs}
+        if tools is not None:
+            call["tools"] = tools
+        t0 = time.perf_counter()
+        entry: Dict[str, Any] = {"key": key, "kind": "generate", "model": self.model_name, "stream": bool(stream)}
+        try:
+            result = self._real.generate_content(**call)
+        except Exception as e:
+            entry.update(chunks=[], error=f"{type(e).__name__}: {e}", error_t_ms=round((time.perf_counter() - t0) * 1000, 2))
+            cassette._record(entry)
+            raise
+        if not stream:
+            entry["chunks"] = [_chunk_record(result, (time.perf_counter() - t0) * 1000)]
+            cassette._record(entry)
+            return result
+        return self._record_stream(result, entry, t0)
+
+    def _record_stream(self, responses: Any, entry: Dict[str, Any], t0: float) -> Iterator[Any]:
+        chunks: List[Dict[str, Any]] = []
+        entry["chunks"] = chunks
+        try:
+            for chunk in responses:
+                chunks.append(_chunk_record(chunk, (time.perf_counter() - t0) * 1000))
+                yield chunk
+        except Exception as e:
+            entry.update(error=f"{type(e).__name__}: {e}", error_t_ms=round((time.perf_counter() - t0) * 1000, 2))
+            raise
+        finally:
+            # 途中で読むのをやめた場合も、そこまでを記録する
+            self.cassette._record(entry)
+
+    def _replay(self, entry: Dict[str, Any], stream: bool) -> Any:
+        cassette = self.cassette
+        t0 = time.perf_counter()
+        chunks = entry.get("chunks") or []
+        if not stream:
+            if entry.get("error") and not chunks:
+                cassette._wait(entry.get("error_t_ms", 0.0), t0)
+                raise CassetteReplayError(entry["error"])
+            if not chunks:
+                return ReplayResponse({"text": ""})
+            cassette._wait(chunks[-1]["t_ms"], t0)
+            return ReplayResponse(chunks[-1])
+        if entry.get("error") and not chunks:
+            # 呼び出し自体が失敗していた（ストリーム開始前）
+            cassette._wait(entry.get("error_t_ms", 0.0), t0)
+            raise CassetteReplayError(entry["error"])
+        return self._replay_stream(entry, chunks, t0)
+
+    def _replay_stream(self, entry: Dict[str, Any], chunks: List[Dict[str, Any]], t0: float) -> Iterator[Any]:
+        for chunk in chunks:
+            self.cassette._wait(chunk["t_ms"], t0)
+            yield ReplayResponse(chunk)
+        if entry.get("error"):
+            self.cassette._wait(entry.get("error_t_ms", 0.0), t0)
+            raise CassetteReplayError(entry["error"])
+
+
+def from_env(backend_loader: Callable[[], Any]) -> Optional[Cassette]:
+    """The cassette configured by the environment, or None when ``GEM_CLIP_CASSETTE`` is not set."""
+    path = (os.environ.get(CASSETTE_ENV) or "").strip()
+    if not path:
+        return None
+    mode = (os.environ.get(MODE_ENV) or "replay").strip().lower()
+    try:
+        scale = float(os.environ.get(TIME_SCALE_ENV) or 1.0)
+    except ValueError:
+        scale = 1.0
+    cassette = Cassette(Path(path).expanduser(), mode=mode, time_scale=scale, backend_loader=backend_loader)
+    # stdout は CLI の JSON 出力に使うのでログへ
+    logger.info("Gemini calls use cassette %s (%s, time scale %g)", cassette.path, mode, cassette.time_scale)
+    return cassette
@@ -0,0 +1,188 @@
+"""
+history_search.py
+==================
+
+Incremental substring/prefix index over clipboard history entries.
+
+All searchable text is kept casefolded in one append-only haystack string.
+Each entry is a segment that starts with a ``\\x00`` separator. A query then
+becomes a handful of C-level ``str.rfind`` calls instead of a Python loop over
+every entry. Scanning from the end yields the newest matches first, so the
+search can stop as soon as *limit* hits are found. With 10k entries a
+substring query typically takes a few milliseconds or less.
+
+New segments are appended to a list and joined into the haystack on the next
+search, so adding an entry does not copy the whole haystack. Entries that are
+replaced or evicted become tombstones. The haystack is rebuilt once
+tombstones outnumber live segments.
+"""
+
+from __future__ import annotations
+
+import bisect
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+_SEP = "\x00"
+# 1エントリあたりの索引対象文字数の上限
+MAX_INDEXED_CHARS = 2048
+
+
+def searchable_text(meta: Dict[str, Any]) -> str:
+    """Return the text that should be indexed for a history metadata record."""
+    t = meta.get("type")
+    if t == "text":
+        text = meta.get("data")
+        if not isinstance(text, str):
+            text = str(meta.get("preview", ""))
+    elif t == "file":
+        path = str(meta.get("data", ""))
+        text = f"{Path(path).name} {path}"
+    else:
+        return ""
+    return text[:MAX_INDEXED_CHARS].replace(_SEP, " ").casefold()
+
+
+class HistorySearchIndex:
+    """Append-only substring index keyed by history entry key."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._haystack = ""
+        # まだ haystack に連結していない末尾のセグメント（検索時にまとめて join する）
+        self._pending: List[str] = []
+        self._size = 0
+        self._starts: List[int] = []
+        self._keys: List[Optional[str]] = []
+        self._segment_of: Dict[str, int] = {}
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._segment_of)
+
+    def memory_estimate(self) -> int:
+        """Rough size in bytes of the haystack and the segment tables."""
+        with self._lock:
+            return (sys.getsizeof(self._haystack) + sum(sys.getsizeof(p) for p in self._pending)
+                    + sys.getsizeof(self._starts) + sys.getsizeof(self._keys)
+                    + sys.getsizeof(self._segment_of) + 28 * len(self._starts))
+
+    def add(self, key: str, text: str) -> None:
+        """Index *text* for *key*, replacing any previous text for that key."""
+        with self._lock:
+            self._remove_locked(key)
+            self._segment_of[key] = len(self._keys)
+            seg = _SEP + text
+            self._starts.append(self._size)
+            self._keys.append(key)
+            self._pending.append(seg)
+            self._size += len(seg)
+            self._maybe_rebuild()
+
+    def add_many(self, items: Iterable[tuple]) -> None:
+        """Bulk-add ``(key, text)`` pairs (oldest first)."""
+        with self._lock:
+            for key, text in items:
+                self._remove_locked(key)
+                self._segment_of[key] = len(self._keys)
+                seg = _SEP + text
+                self._starts.append(self._size)
+                self._keys.append(key)
+                self._pending.append(seg)
+                self._size += len(seg)
+
+    def text_of(self, key: str) -> Optional[str]:
+        """Return the indexed (casefolded) text for *key*, or None."""
+        with self._lock:
+            seg = self._segment_of.get(key)
+            if seg is None:
+                return None
+            hay = self._flush_locked()
+            end = self._starts[seg + 1] if seg + 1 < len(self._starts) else len(hay)
+            return hay[self._starts[seg] + 1:end]
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._remove_locked(key)
+            self._maybe_rebuild()
+
+    def compact(self) -> None:
+        """Drop the text of removed entries now instead of waiting for enough of them to pile up."""
+        with self._lock:
+            if self._dead:
+                self._rebuild_locked()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._haystack = ""
+            self._pending = []
+            self._size = 0
+            self._starts = []
+            self._keys = []
+            self._segment_of = {}
+            self._dead = 0
+
+    def search(self, query: str, limit: int = 50, prefix: bool = False) -> List[str]:
+        """Return keys of entries matching *query*, newest first.
+
+        Whitespace-separated terms must all be present. The first term drives
+        the scan and the others are checked inside each candidate segment.
+        With ``prefix=True`` the first term must match at the start of the entry.
+        """
+        terms = query.casefold().split()
+        if not terms:
+            return []
+        first, rest = terms[0], terms[1:]
+        needle = _SEP + first if prefix else first
+        results: List[str] = []
+        with self._lock:
+            hay = self._flush_locked()
+            end = len(hay)
+            while len(results) < limit:
+                pos = hay.rfind(needle, 0, end)
+                if pos < 0:
+                    break
+                seg = bisect.bisect_right(self._starts, pos) - 1
+                seg_start = self._starts[seg]
+                # 同じセグメント内の他の一致は不要なので、セグメント先頭より前から続ける
+                end = seg_start
+                key = self._keys[seg]
+                if key is None:
+                    continue
+                if rest:
+                    seg_end = self._starts[seg + 1] if seg + 1 < len(self._starts) else len(hay)
+                    segment = hay[seg_start:seg_end]
+                    if not all(t in segment for t in rest):
+                        continue
+                results.append(key)
+        return results
+
+    def _flush_locked(self) -> str:
+        if self._pending:
+            self._haystack = "".join([self._haystack, *self._pending])
+            self._pending = []
+        return self._haystack
+
+    def _remove_locked(self, key: str) -> None:
+        seg = self._segment_of.pop(key, None)
+        if seg is not None:
+            self._keys[seg] = None
+            self._dead += 1
+
+    def _maybe_rebuild(self) -> None:
+        if self._dead > max(1024, len(self._segment_of)):
+            self._rebuild_locked()
+
+    def _rebuild_locked(self) -> None:
+        hay = self._flush_locked()
+        live = []
+        for seg, key in enumerate(self._keys):
+            if key is None:
+                continue
+            start = self._starts[seg] + 1
+            end = self._starts[seg + 1] if seg + 1 < len(self._starts) else len(hay)
+            live.append((key, hay[start:end]))
+        self.clear()
+        self.add_many(live)
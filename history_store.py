@@ -0,0 +1,414 @@
+"""
+history_store.py
+==================
+
+Disk-backed clipboard history.
+
+Each history entry is a small metadata record. The records live in memory and
+in an append-only ``index.jsonl`` log under ``<data_dir>/history``. Payloads
+(images and long text) go into content-addressed blob files
+(``blobs/<aa>/<sha256>``). They are read back only when an entry is actually
+selected, so memory stays flat even with tens of thousands of entries.
+Loading trusts the index and does not check the blobs; an entry whose blob
+has gone missing is dropped when it is first read.
+
+Metadata record keys:
+
+- ``key``: content key used for de-duplication
+- ``type``: ``"text"``, ``"image"`` or ``"file"``
+- ``preview``: short single-line text used for labels
+- ``data``: inline payload (file paths and short text only)
+- ``blob``: sha256 of the blob file holding the payload (images/long text)
+- ``size``: payload size in bytes
+- ``seq``: monotonically increasing insertion counter
+
+Log records of blob-backed text also carry ``search``, the text indexed for
+search (see :mod:`history_search`), so a restart indexes the same text as the
+original add without reading the blob. It is not kept in memory.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, List, Optional
+
+import memory_accounting
+from history_search import HistorySearchIndex, searchable_text
+from i18n import tr
+
+try:
+    from . import paths  # type: ignore
+except ImportError:
+    import paths  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# 短いテキストは index に直接持つ（これより長いものは blob に逃がす）
+INLINE_TEXT_LIMIT = 1024
+PREVIEW_LENGTH = 200
+
+
+def _default_root() -> Path:
+    root = paths.get_data_dir() / "history"
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def decode_image_payload(item: Dict[str, Any]) -> Optional[bytes]:
+    """Return raw PNG bytes for an ``image``/``image_compressed`` item."""
+    try:
+        raw = base64.b64decode(item.get("data", ""))
+    except Exception:
+        return None
+    if item.get("type") == "image_compressed":
+        try:
+            import zlib
+            raw = zlib.decompress(raw)
+        except Exception:
+            return None
+    return raw
+
+
+def text_key(text: str) -> str:
+    """Content key of a text entry. Surrounding whitespace is ignored, so
+    ``"abc\\n"`` and ``"abc"`` are the same entry whichever path added them."""
+    return "text:" + hashlib.sha1(text.strip().encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def history_label(meta: Dict[str, Any], max_len: int = 60) -> str:
+    """Build a one-line label for a history entry without loading its payload."""
+    t = meta.get("type")
+    if t == "text":
+        text = str(meta.get("preview", ""))
+        size = int(meta.get("size", len(text)) or 0)
+        truncated = len(text) > max_len or size > len(text.encode("utf-8"))
+        return text[:max_len] + ("…" if truncated else "")
+    if t == "image":
+        return tr("history.image")
+    if t == "file":
+        return "[" + tr("history.file_name_prefix", name=Path(str(meta.get("data", ""))).name) + "]"
+    return tr("history.unknown")
+
+
+class HistoryStore:
+    """Persistent, size-bounded clipboard history with lazy payload loading."""
+
+    def __init__(self, root: Optional[Path] = None, max_entries: int = 20):
+        self.root = Path(root) if root else _default_root()
+        self.blob_dir = self.root / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index.jsonl"
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.RLock()
+        # key -> meta。末尾が最新（move_to_end / popitem(last=False) で O(1)）
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._blob_refs: Dict[str, int] = {}
+        self._search = HistorySearchIndex()
+        self._seq = 0
+        self._log_lines = 0
+        self._load()
+        # 本体はディスク上の blob なので、ここで数えるのはメタデータと索引だけ
+        memory_accounting.register("history", self.memory_usage, self.trim_memory)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def entries(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return metadata records, newest first."""
+        with self._lock:
+            newest_first = reversed(self._entries.values())
+            if limit is None:
+                return list(newest_first)
+            return list(islice(newest_first, limit))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def search(self, query: str, limit: int = 50, prefix: bool = False) -> List[Dict[str, Any]]:
+        """Return metadata records whose text or file name matches *query*, newest first."""
+        if not query or not query.strip():
+            return self.entries(limit)
+        with self._lock:
+            keys = self._search.search(query, limit=limit, prefix=prefix)
+            return [self._entries[k] for k in keys if k in self._entries]
+
+    def add(self, item: Dict[str, Any], key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Add a ``{"type", "data"}`` item. Duplicates are moved to the front.
+
+        *key* may be the clipboard monitor's signature (:func:`text_key` /
+        ``img:<sha1>`` of the PNG bytes), which uses the same scheme as the
+        store and saves re-hashing the payload.
+        """
+        meta, blob_bytes = self._build_meta(item, key)
+        if meta is None:
+            return None
+        with self._lock:
+            # 先に参照を増やしてから旧エントリを解放する（同一 blob を消さないため）
+            if blob_bytes is not None:
+                self._write_blob(meta["blob"], blob_bytes)
+                self._blob_refs[meta["blob"]] = self._blob_refs.get(meta["blob"], 0) + 1
+            old = self._entries.pop(meta["key"], None)
+            if old is not None:
+                self._release_blob(old.get("blob"))
+            self._seq += 1
+            meta["seq"] = self._seq
+            self._entries[meta["key"]] = meta
+            # 長文テキストは blob 側にしかないので、追加時に全文の先頭部分を索引し、
+            # 再起動後も同じ文字列で索引できるようログにも残す（メモリ上の meta には持たない）
+            record = {"op": "put", **meta}
+            if meta["type"] == "text" and "data" not in meta:
+                record["search"] = searchable_text({"type": "text", "data": str(item.get("data", ""))})
+                self._search.add(meta["key"], record["search"])
+            else:
+                self._search.add(meta["key"], searchable_text(meta))
+            self._append_log(record)
+            self._evict()
+            self._maybe_compact()
+        return meta
+
+    def load(self, meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Materialize the full ``{"type", "data"}`` item for a metadata record."""
+        t = meta.get("type")
+        if "data" in meta:
+            return {"type": t, "data": meta["data"]}
+        blob = meta.get("blob")
+        if not blob:
+            return None
+        try:
+            raw = self._blob_path(blob).read_bytes()
+        except FileNotFoundError:
+            # 起動時には blob の有無を確かめないので、消えていたらここで履歴から外す
+            logger.warning("history blob %s is missing; dropping the entry", blob)
+            self._forget(meta.get("key"))
+            return None
+        except Exception as e:
+            logger.error("HistoryStore.load - blob %s unreadable: %s", blob, e)
+            return None
+        if t == "image":
+            # key を付けておくと、サムネイルや画像準備のキャッシュがペイロードを再ハッシュせずに済む
+            return {"type": "image", "data": base64.b64encode(raw).decode("utf-8"), "key": meta.get("key")}
+        return {"type": t, "data": raw.decode("utf-8", "replace")}
+
+    def read_blob(self, digest: str) -> Optional[bytes]:
+        """Return raw blob bytes (PNG bytes for image entries) or None."""
+        try:
+            return self._blob_path(digest).read_bytes()
+        except Exception:
+            return None
+
+    def set_max_entries(self, max_entries: int) -> None:
+        with self._lock:
+            self.max_entries = max(1, int(max_entries))
+            self._evict()
+            self._maybe_compact()
+
+    def memory_usage(self) -> Dict[str, int]:
+        with self._lock:
+            meta_bytes = memory_accounting.deep_sizeof(self._entries)
+            entries = len(self._entries)
+        return {"bytes": meta_bytes + self._search.memory_estimate(), "entries": entries}
+
+    def trim_memory(self, target_bytes: int) -> int:
+        """Drop the oldest entries until metadata and search index fit in *target_bytes*; returns the count.
+
+        Called by the memory monitor when the ``history`` budget is exceeded.
+        Dropped entries are deleted like entries beyond ``max_entries``.
+        """
+        with self._lock:
+            held = self.memory_usage()["bytes"]
+            count = len(self._entries)
+            if not count or held <= target_bytes:
+                return 0
+            # deep_sizeof を繰り返さないよう、1件あたりの平均から残す件数を見積もる
+            keep = max(1, int(count * max(0, target_bytes) / held))
+            self._evict(keep)
+            self._search.compact()
+            self._maybe_compact()
+            dropped = count - len(self._entries)
+        logger.warning("history over its memory budget; dropped the %d oldest entries", dropped)
+        return dropped
+
+    def clear(self) -> None:
+        with self._lock:
+            for meta in self._entries.values():
+                self._release_blob(meta.get("blob"))
+            self._entries.clear()
+            self._search.clear()
+            self._rewrite_index()
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+    def _build_meta(self, item: Dict[str, Any], key: Optional[str] = None):
+        t = item.get("type")
+        data = item.get("data")
+        if t == "text":
+            text = str(data or "")
+            if not text.strip():
+                return None, None
+            encoded = text.encode("utf-8", "surrogatepass")
+            meta: Dict[str, Any] = {
+                "key": key if key and key.startswith("text:") else text_key(text),
+                "type": "text",
+                "preview": text[:PREVIEW_LENGTH].replace("\n", " "),
+                "size": len(encoded),
+            }
+            if len(text) <= INLINE_TEXT_LIMIT:
+                meta["data"] = text
+                return meta, None
+            meta["blob"] = hashlib.sha256(encoded).hexdigest()
+            return meta, encoded
+        if t in ("image", "image_compressed"):
+            raw = decode_image_payload(item)
+            if not raw:
+                return None, None
+            return {
+                "key": key if key and key.startswith("img:") else "img:" + hashlib.sha1(raw).hexdigest(),
+                "type": "image",
+                "blob": hashlib.sha256(raw).hexdigest(),
+                "size": len(raw),
+            }, raw
+        if t == "file":
+            path = str(data or "")
+            if not path:
+                return None, None
+            return {
+                "key": "file:" + path,
+                "type": "file",
+                "data": path,
+                "preview": Path(path).name,
+                "size": 0,
+            }, None
+        return None, None
+
+    def _evict(self, limit: Optional[int] = None) -> None:
+        limit = self.max_entries if limit is None else limit
+        while len(self._entries) > limit:
+            key, old = self._entries.popitem(last=False)
+            self._search.remove(key)
+            self._release_blob(old.get("blob"))
+            self._append_log({"op": "del", "key": old.get("key")})
+
+    def _forget(self, key: Optional[str]) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None) if key else None
+            if old is None:
+                return
+            self._search.remove(key)
+            self._release_blob(old.get("blob"))
+            self._append_log({"op": "del", "key": key})
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest
+
+    def _write_blob(self, digest: str, data: bytes) -> None:
+        path = self._blob_path(digest)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.error("HistoryStore - failed to write blob %s: %s", digest, e)
+
+    def _release_blob(self, digest: Optional[str]) -> None:
+        if not digest:
+            return
+        count = self._blob_refs.get(digest, 0) - 1
+        if count > 0:
+            self._blob_refs[digest] = count
+            return
+        self._blob_refs.pop(digest, None)
+        try:
+            self._blob_path(digest).unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error("HistoryStore - failed to delete blob %s: %s", digest, e)
+
+    def _append_log(self, record: Dict[str, Any]) -> None:
+        try:
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._log_lines += 1
+        except Exception as e:
+            logger.error("HistoryStore - failed to append index: %s", e)
+
+    def _maybe_compact(self) -> None:
+        # ログが生存エントリの2倍を超えたら書き直す
+        if self._log_lines > 2 * len(self._entries) + 64:
+            self._rewrite_index()
+
+    def _rewrite_index(self) -> None:
+        tmp = self.index_path.with_suffix(".tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for key, meta in self._entries.items():
+                    record = {"op": "put", **meta}
+                    if meta.get("type") == "text" and "data" not in meta:
+                        record["search"] = self._search.text_of(key) or ""
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            os.replace(tmp, self.index_path)
+            self._log_lines = len(self._entries)
+        except Exception as e:
+            logger.error("HistoryStore - failed to rewrite index: %s", e)
+
+    def _load(self) -> None:
+        started = time.perf_counter()
+        live: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        indexed: Dict[str, str] = {}
+        lines = 0
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        lines += 1
+                        try:
+                            rec = json.loads(line)
+                        except Exception:
+                            # 書き込み途中で落ちた末尾行などは無視
+                            continue
+                        key = rec.pop("key", None)
+                        op = rec.pop("op", None)
+                        search = rec.pop("search", None)
+                        if not key:
+                            continue
+                        # ログは追記順なので、put を末尾へ積むだけで新旧順が再現できる
+                        live.pop(key, None)
+                        indexed.pop(key, None)
+                        if op == "put":
+                            rec["key"] = key
+                            live[key] = rec
+                            if search is not None:
+                                indexed[key] = search
+            except Exception as e:
+                logger.error("HistoryStore - failed to read index: %s", e)
+        # index を信用し、blob の存在確認（エントリ数ぶんの stat）はしない。
+        # 失われた blob は load() で読んだ時点で検出して外す。
+        for key, meta in live.items():
+            blob = meta.get("blob")
+            self._entries[key] = meta
+            if blob:
+                self._blob_refs[blob] = self._blob_refs.get(blob, 0) + 1
+        self._search.add_many((k, indexed[k] if k in indexed else searchable_text(m)) for k, m in self._entries.items())
+        self._seq = max((int(m.get("seq", 0)) for m in self._entries.values()), default=0)
+        self._log_lines = lines
+        self._evict()
+        self._maybe_compact()
+        logger.debug("HistoryStore loaded %d entries in %.1f ms", len(self._entries), (time.perf_counter() - started) * 1000)
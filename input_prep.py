@@ -0,0 +1,513 @@
+"""
+input_prep.py
+===============
+
+Image preparation for requests, in a process pool.
+
+Turning an input item into an image part is CPU work: base64 and zlib
+decoding of history payloads, decoding the image and re-encoding it.
+On a 500-image matrix run this kept the one core the worker loop gets (the
+GIL) busy before the network was. :class:`InputPreparer` runs it in worker
+processes instead:
+
+- image files are read by the worker itself; only the path is sent.
+- in-memory payloads (``image``/``image_compressed`` items) and the encoded
+  result go through a shared memory slot rather than being pickled. The
+  preparer owns ``2 × workers`` slots of :data:`SLOT_BYTES`; a worker reads
+  the payload from its slot and writes the result back into the same slot.
+  The parent copies it once into the ``bytes`` the SDK needs and reuses the
+  slot. Anything larger than a slot falls back to pickling.
+
+How an image is encoded follows the prompt's ``image_policy``
+(``common_models.ImagePolicy``): longest edge, PNG/JPEG/WebP and quality.
+Without a policy images go out at full size as lossless PNG, as before.
+With ``tile_aware`` (the default), the image is also shrunk by up to
+:data:`TILE_SLACK` when that saves one of the model's image tiles. Gemini
+2.x bills an image as 258 tokens per 768×768 tile, or 258 in total when
+both edges are at most 384 px; :func:`image_tokens` estimates this. The
+bytes sent and the estimated image tokens are counted in
+``gem_clip_image_bytes_total`` / ``gem_clip_image_tokens_total`` and set
+on the request span (``image_bytes``, ``image_tokens``).
+
+Prepared parts are kept in an LRU (:data:`CACHE_BYTES`) keyed by source and
+encoding: path, mtime and size for files (no hashing), the history key or
+a digest of the payload for in-memory images, plus the encoding spec of the
+policy. Running more prompts on the same inputs then prepares each image
+once per policy. The cache reports to :mod:`memory_accounting` as
+``image_prep``.
+
+The number of processes comes from ``prep_workers`` in the config or
+``GEM_CLIP_PREP_WORKERS`` (the environment wins). ``None`` means the CPU
+count minus one (at most :data:`MAX_AUTO_WORKERS`). ``0`` prepares on a
+thread of this process, as before. Payloads under :data:`INLINE_BYTES` are
+also prepared on a thread, because the process hop would cost more than it
+saves.
+
+Workers are started with ``spawn``, so they do not inherit the UI threads.
+They import ``main.py`` as ``__mp_main__``, which must not import the app at
+module level.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import memory_accounting
+import metrics
+from matrix_import import IMAGE_FILE_TYPE
+
+logger = logging.getLogger(__name__)
+
+PREP_WORKERS_ENV = "GEM_CLIP_PREP_WORKERS"
+MAX_AUTO_WORKERS = 8
+INLINE_BYTES = 64 * 1024
+SLOT_BYTES = 16 * memory_accounting.MiB
+CACHE_BYTES = 64 * memory_accounting.MiB
+
+# モデルごとの画像タイル（Gemini 2.x は 768px 四方で 258 トークン、両辺 384px 以下なら 1 枚分）
+DEFAULT_TILE = 768
+TILE_SIZES: Dict[str, int] = {"gemini-2.5": 768, "gemini-2.0": 768}
+TOKENS_PER_TILE = 258
+# タイルを 1 枚減らせるならここまでは縮める
+TILE_SLACK = 0.15
+FORMATS: Dict[str, Tuple[str, str]] = {"png": ("PNG", "image/png"), "jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+# (format, quality, max_edge, tile)。None は従来どおり原寸の PNG
+EncodeSpec = Optional[Tuple[str, int, Optional[int], Optional[int]]]
+Prepared = Tuple[bytes, str, Optional[Tuple[int, int]]]
+
+PREP_SECONDS = metrics.REGISTRY.histogram("gem_clip_image_prep_seconds", "Time to prepare one image part.", ("mode",))
+PREP_CACHE_TOTAL = metrics.REGISTRY.counter("gem_clip_image_prep_cache_total", "Image part cache lookups.", ("result",))
+IMAGE_BYTES_TOTAL = metrics.REGISTRY.counter("gem_clip_image_bytes_total", "Bytes of image parts sent.", ("format",))
+IMAGE_TOKENS_TOTAL = metrics.REGISTRY.counter("gem_clip_image_tokens_total", "Estimated input tokens of image parts sent.")
+
+
+# ----------------------------------------------------------------------
+# Policy
+# ----------------------------------------------------------------------
+def tile_size(model: Optional[str]) -> int:
+    for prefix, size in TILE_SIZES.items():
+        if model and model.startswith(prefix):
+            return size
+    return DEFAULT_TILE
+
+
+def image_tokens(width: int, height: int, tile: int = DEFAULT_TILE) -> int:
+    """Estimated input tokens of a *width* × *height* image."""
+    if width <= tile // 2 and height <= tile // 2:
+        return TOKENS_PER_TILE
+    return math.ceil(width / tile) * math.ceil(height / tile) * TOKENS_PER_TILE
+
+
+def fit_size(width: int, height: int, max_edge: Optional[int] = None, tile: Optional[int] = None) -> Tuple[int, int]:
+    """Target size: at most *max_edge* on the longest side, then tile-aligned when *tile* is given.
+
+    Never enlarges. The tile step picks the smallest shrink (no more than
+    :data:`TILE_SLACK`) that gives the fewest tiles.
+    """
+    scale = 1.0
+    if max_edge and max(width, height) > max_edge:
+        scale = max_edge / max(width, height)
+    w, h = width * scale, height * scale
+    if tile:
+        best_tokens, best = image_tokens(int(w), int(h), tile), 1.0
+        # 各辺を 1 つ下のタイル境界へ合わせる候補と、小さい画像（tile/2 以下）にする候補
+        candidates = [(math.ceil(edge / tile) - 1) * tile / edge for edge in (w, h) if edge > tile]
+        candidates.append((tile // 2) / max(w, h))
+        for s in sorted(candidates, reverse=True):
+            if s >= 1.0 or s < 1.0 - TILE_SLACK:
+                continue
+            tokens = image_tokens(int(w * s), int(h * s), tile)
+            if tokens < best_tokens:
+                best_tokens, best = tokens, s
+        scale *= best
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def encode_spec(policy: Any, model: Optional[str] = None) -> EncodeSpec:
+    """Hashable, picklable encoding spec of an ``ImagePolicy`` (or dict) for *model*."""
+    if policy is None:
+        return None
+    data = policy.model_dump() if hasattr(policy, "model_dump") else dict(policy)
+    fmt = str(data.get("format") or "png").lower()
+    if fmt not in FORMATS:
+        fmt = "png"
+    max_edge = data.get("max_edge")
+    tile = tile_size(model) if data.get("tile_aware", True) else None
+    return fmt, int(data.get("quality") or 85), int(max_edge) if max_edge else None, tile
+
+
+# ----------------------------------------------------------------------
+# Encoding (runs in the worker processes, or on a thread when inline)
+# ----------------------------------------------------------------------
+def decode_payload(data: Any, compressed: bool = False) -> bytes:
+    """Raw image bytes from a base64 payload (``str``, ``bytes`` or a memoryview)."""
+    raw = base64.b64decode(data)
+    if compressed:
+        try:
+            return zlib.decompress(raw)
+        except zlib.error:
+            # 圧縮されていなかった古い履歴はそのまま使う
+            pass
+    return raw
+
+
+def encode_image(raw: bytes, spec: EncodeSpec = None) -> Prepared:
+    """Re-encode image bytes; returns ``(data, mime_type, (width, height))``.
+
+    Without *spec* the image is normalised to full-size PNG. Bytes that
+    still carry zlib compression (history fallback) are inflated first. Data
+    PIL cannot read is returned unchanged, with no size.
+    """
+    from PIL import Image
+
+    # 典型的な zlib ヘッダ（0x78, 0x9C/0xDA 等）を簡易判定
+    if len(raw) > 2 and raw[0] == 0x78 and raw[1] in (0x01, 0x5E, 0x9C, 0xDA):
+        try:
+            raw = zlib.decompress(raw)
+        except Exception:
+            pass
+    try:
+        with Image.open(BytesIO(raw)) as im:
+            if im.mode != "RGB":
+                im = im.convert("RGB")
+            fmt, quality, max_edge, tile = spec or ("png", 0, None, None)
+            size = fit_size(im.width, im.height, max_edge, tile)
+            if size != im.size:
+                im = im.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+            pil_format, mime = FORMATS[fmt]
+            buf = BytesIO()
+            if pil_format == "PNG":
+                # optimize=True でサイズを抑えつつ互換性維持
+                im.save(buf, format="PNG", optimize=True)
+            else:
+                im.save(buf, format=pil_format, quality=quality)
+            return buf.getvalue(), mime, im.size
+    except Exception:
+        # 画像として読み込めない場合は、最終手段としてそのまま送る
+        return raw, "image/png", None
+
+
+_attached: Dict[str, SharedMemory] = {}
+
+
+def _attach(name: str) -> SharedMemory:
+    """Open a slot created by the parent, once per worker."""
+    shm = _attached.get(name)
+    if shm is None:
+        try:
+            shm = SharedMemory(name=name, track=False)  # type: ignore[call-arg]
+        except TypeError:
+            # 3.12 以前は開くだけでも resource_tracker に登録される。トラッカーは親と共有で
+            # 登録は重複しないため、親の unlink でまとめて外れる
+            shm = SharedMemory(name=name)
+        _attached[name] = shm
+    return shm
+
+
+def _prepare_in_worker(slot: Optional[str], kind: str, ref: Any, compressed: bool,
+                       spec: EncodeSpec = None) -> Tuple[str, Any, str, Optional[Tuple[int, int]]]:
+    """Prepare one image. *kind* is ``path``, ``slot`` (payload of *ref* bytes in *slot*) or ``payload``.
+
+    Returns ``("slot", length, mime, size)`` when the result was written to
+    *slot*, otherwise ``("bytes", data, mime, size)``.
+    """
+    shm = _attach(slot) if slot else None
+    if kind == "path":
+        raw = Path(ref).read_bytes()
+    elif kind == "slot" and shm is not None:
+        with shm.buf[:ref] as view:
+            raw = decode_payload(view, compressed)
+    else:
+        raw = decode_payload(ref, compressed)
+    data, mime, size = encode_image(raw, spec)
+    if shm is not None and len(data) <= shm.size:
+        shm.buf[:len(data)] = data
+        return "slot", len(data), mime, size
+    return "bytes", data, mime, size
+
+
+def _prepare_local(item: Dict[str, Any], spec: EncodeSpec = None) -> Prepared:
+    if item.get("type") == IMAGE_FILE_TYPE:
+        raw = Path(item["data"]).read_bytes()
+    else:
+        raw = decode_payload(item.get("data", ""), item.get("type") == "image_compressed")
+    return encode_image(raw, spec)
+
+
+# ----------------------------------------------------------------------
+# Parent side
+# ----------------------------------------------------------------------
+def workers_from_env(default: Optional[int] = None) -> Optional[int]:
+    raw = (os.environ.get(PREP_WORKERS_ENV) or "").strip()
+    if not raw:
+        return default
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        return default
+
+
+def auto_workers() -> int:
+    return max(1, min(MAX_AUTO_WORKERS, (os.cpu_count() or 2) - 1))
+
+
+class _PartCache:
+    """LRU of prepared ``(data, mime, size)`` bounded by total bytes; thread-safe."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Any, Prepared]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Prepared]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: Prepared) -> None:
+        size = len(value[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._items[key] = value
+            self._bytes += size
+            self._trim(self.max_bytes)
+
+    def trim(self, target_bytes: int) -> None:
+        with self._lock:
+            self._trim(target_bytes)
+
+    def _trim(self, target_bytes: int) -> None:
+        while self._items and self._bytes > target_bytes:
+            _, value = self._items.popitem(last=False)
+            self._bytes -= len(value[0])
+
+    def usage(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"bytes": self._bytes, "items": len(self._items)}
+
+
+class InputPreparer:
+    """Prepares image parts on *workers* processes (``0`` = a thread of this process).
+
+    The pool and the slots are created on first use. The async methods are
+    meant to be used from one event loop.
+    """
+
+    def __init__(self, workers: Optional[int] = None, cache_bytes: int = CACHE_BYTES):
+        self.workers = auto_workers() if workers is None else max(0, int(workers))
+        self.cache = _PartCache(cache_bytes)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: List[SharedMemory] = []
+        self._free: Optional["asyncio.Queue[SharedMemory]"] = None
+        self._lock = threading.Lock()
+        self._memory_token = memory_accounting.register("image_prep", self.memory_usage, self.trim_memory)
+
+    # ------------------------------------------------------------------
+    async def image_part(self, item: Dict[str, Any], policy: Any = None, model: Optional[str] = None,
+                         span: Any = None) -> Dict[str, Any]:
+        """``inline_data`` part for an ``image``, ``image_compressed`` or ``image_file`` item.
+
+        *policy* is the prompt's ``image_policy`` and *model* its model (for
+        the tile size). The part's bytes and estimated tokens are added to
+        *span* (a ``request_trace.Span``) when given.
+        """
+        spec = encode_spec(policy, model)
+        data, mime, size = await self.prepare(item, spec)
+        tokens = image_tokens(*size, tile_size(model)) if size else 0
+        IMAGE_BYTES_TOTAL.inc(len(data), format=mime.split("/")[-1])
+        IMAGE_TOKENS_TOTAL.inc(tokens)
+        if span is not None:
+            span.set(image_bytes=span.attrs.get("image_bytes", 0) + len(data),
+                     image_tokens=span.attrs.get("image_tokens", 0) + tokens)
+        return {"inline_data": {"mime_type": mime, "data": data}}
+
+    async def prepare(self, item: Dict[str, Any], spec: EncodeSpec = None) -> Prepared:
+        source = await asyncio.to_thread(self.cache_key, item)
+        key = (source, spec) if source is not None else None
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            PREP_CACHE_TOTAL.inc(result="hit")
+            return cached
+        PREP_CACHE_TOTAL.inc(result="miss")
+        started = time.perf_counter()
+        pool = self._ensure_pool() if self._worth_a_process(item) else None
+        mode = "process" if pool is not None else "thread"
+        try:
+            result = await self._prepare_in_pool(pool, item, spec) if pool is not None else None
+        except BrokenProcessPool as e:
+            logger.warning("image preparation pool broke (%s); preparing in this process from now on", e)
+            self.close_pool()
+            self.workers = 0
+            result = None
+        if result is None:
+            mode = "thread"
+            result = await asyncio.to_thread(_prepare_local, item, spec)
+        PREP_SECONDS.observe(time.perf_counter() - started, mode=mode)
+        if key is not None:
+            self.cache.put(key, result)
+        return result
+
+    @staticmethod
+    def cache_key(item: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+        t = item.get("type")
+        if t == IMAGE_FILE_TYPE:
+            try:
+                st = os.stat(item["data"])
+            except OSError:
+                return None
+            return ("file", str(item["data"]), st.st_mtime_ns, st.st_size)
+        if t in ("image", "image_compressed"):
+            if item.get("key"):
+                return ("history", item["key"])
+            data = item.get("data") or ""
+            payload = data.encode("ascii", "ignore") if isinstance(data, str) else bytes(data)
+            return ("payload", hashlib.blake2b(payload, digest_size=16).hexdigest())
+        return None
+
+    def _worth_a_process(self, item: Dict[str, Any]) -> bool:
+        if self.workers <= 0:
+            return False
+        if item.get("type") == IMAGE_FILE_TYPE:
+            try:
+                return os.path.getsize(item["data"]) >= INLINE_BYTES
+            except OSError:
+                return False
+        return len(item.get("data") or "") >= INLINE_BYTES
+
+    def _ensure_pool(self) -> Optional[ProcessPoolExecutor]:
+        with self._lock:
+            if self._pool is None and self.workers > 0:
+                try:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+                    self._slots = [SharedMemory(create=True, size=SLOT_BYTES) for _ in range(self.workers * 2)]
+                except Exception as e:
+                    logger.warning("could not start the image preparation pool (%s); preparing in this process", e)
+                    self._release_pool()
+                    self.workers = 0
+            return self._pool
+
+    async def _prepare_in_pool(self, pool: ProcessPoolExecutor, item: Dict[str, Any], spec: EncodeSpec) -> Prepared:
+        if self._free is None:
+            self._free = asyncio.Queue()
+            for shm in self._slots:
+                self._free.put_nowait(shm)
+        free = self._free
+        shm = await free.get()
+        loop = asyncio.get_running_loop()
+        compressed = item.get("type") == "image_compressed"
+        if item.get("type") == IMAGE_FILE_TYPE:
+            args: Tuple[Any, ...] = (shm.name, "path", str(item["data"]), False)
+        else:
+            data = item.get("data") or ""
+            payload = data.encode("ascii", "ignore") if isinstance(data, str) else bytes(data)
+            if len(payload) <= shm.size:
+                shm.buf[:len(payload)] = payload
+                args = (shm.name, "slot", len(payload), compressed)
+            else:
+                args = (shm.name, "payload", payload, compressed)
+        fut = loop.run_in_executor(pool, _prepare_in_worker, *args, spec)
+        try:
+            kind, value, mime, size = await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            # ワーカーが書き終えるまでスロットは再利用しない
+            fut.add_done_callback(lambda _f: free.put_nowait(shm))
+            raise
+        except BaseException:
+            free.put_nowait(shm)
+            raise
+        try:
+            data = bytes(shm.buf[:value]) if kind == "slot" else value
+        finally:
+            free.put_nowait(shm)
+        return data, mime, size
+
+    # ------------------------------------------------------------------
+    def memory_usage(self) -> Dict[str, Any]:
+        usage = self.cache.usage()
+        usage["slots"] = len(self._slots)
+        return usage
+
+    def trim_memory(self, target_bytes: int) -> None:
+        self.cache.trim(target_bytes)
+
+    def close_pool(self) -> None:
+        with self._lock:
+            self._release_pool()
+
+    def _release_pool(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        for shm in self._slots:
+            try:
+                shm.close()
+                shm.unlink()
+            except Exception:
+                pass
+        self._slots = []
+        self._free = None
+
+    def close(self) -> None:
+        self.close_pool()
+        memory_accounting.unregister(self._memory_token)
+        self._memory_token = None
+
+
+_preparer: Optional[InputPreparer] = None
+_configured_workers: Optional[int] = None
+_preparer_lock = threading.Lock()
+
+
+def configure(workers: Optional[int] = None) -> None:
+    """Set the process count from the config (``GEM_CLIP_PREP_WORKERS`` overrides it)."""
+    global _configured_workers, _preparer
+    with _preparer_lock:
+        _configured_workers = workers
+        old, _preparer = _preparer, None
+    if old is not None:
+        old.close()
+
+
+def get_preparer() -> InputPreparer:
+    global _preparer
+    with _preparer_lock:
+        if _preparer is None:
+            _preparer = InputPreparer(workers_from_env(_configured_workers))
+        return _preparer
+
+
+async def image_part(item: Dict[str, Any], policy: Any = None, model: Optional[str] = None, span: Any = None) -> Dict[str, Any]:
+    """Image part for *item* from the shared preparer, encoded per *policy* for *model*."""
+    return await get_preparer().image_part(item, policy, model, span)
+
+
+def shutdown() -> None:
+    global _preparer
+    with _preparer_lock:
+        old, _preparer = _preparer, None
+    if old is not None:
+        old.close()
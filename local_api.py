@@ -0,0 +1,480 @@
+"""
+local_api.py
+==============
+
+Local HTTP API served from the agent's worker loop, plus single-instance
+handoff.
+
+The server listens on ``127.0.0.1`` (port from ``GEM_CLIP_API_PORT``, or a
+free one). On Linux and macOS it also listens on a Unix socket,
+``<data_dir>/api.sock``. The address and a random access token are written
+to ``<data_dir>/api.json``, which only the current user can read. Every
+request must send the token as ``Authorization: Bearer <token>``.
+
+The server always runs, so a second ``main.py`` launch can hand off to the
+running instance (``POST /v1/activate``) instead of starting a second tray
+icon. The other endpoints are served only when ``local_api_enabled`` is set
+in the config (or ``GEM_CLIP_API=1``). They reuse the running app's prompts,
+API key and loaded SDK:
+
+- ``GET  /v1/health``
+- ``GET  /v1/prompts``
+- ``POST /v1/run`` ``{"prompt_id", "text" | "input": {"type", "data"}, "stream": true}``
+  streams NDJSON events (``chunk``, then ``end`` with the full ``text``).
+  With ``"stream": false`` it returns the result as one JSON object.
+- ``POST /v1/matrix`` ``{"prompt_ids": [...] | "prompt_set": name, "inputs": [...] | "source": path, "concurrency": n}``
+  starts a job and returns its ``job_id``
+- ``GET  /v1/jobs``, ``GET /v1/jobs/<id>``, ``DELETE /v1/jobs/<id>`` (cancel)
+- ``GET  /v1/jobs/<id>/events``: NDJSON events from the start, following the
+  job until it ends
+- ``GET  /v1/history?limit=20&q=...``, ``GET /v1/history/item?key=...``
+
+Example::
+
+    TOKEN=$(python -c "import json,paths;print(json.load(open(paths.get_data_dir()/'api.json'))['token'])")
+    curl -N --unix-socket "$HOME/.config/Gem Clip/data/api.sock" -H "Authorization: Bearer $TOKEN" \\
+         -d '{"prompt_id": "summarize", "text": "..."}' http://localhost/v1/run
+
+All LLM calls from the API share one concurrency limit
+(``GEM_CLIP_API_CONCURRENCY``, default 4).
+
+With ``GEM_CLIP_STANDALONE=1`` a launch neither hands off nor serves, so it
+runs next to an existing instance without touching its socket or
+``api.json`` (used by ``startup_profile.py --full``).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import http.client
+import json
+import logging
+import os
+import secrets
+import sys
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    from . import paths  # type: ignore
+except ImportError:
+    import paths  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+API_ENV = "GEM_CLIP_API"
+API_PORT_ENV = "GEM_CLIP_API_PORT"
+API_CONCURRENCY_ENV = "GEM_CLIP_API_CONCURRENCY"
+STANDALONE_ENV = "GEM_CLIP_STANDALONE"
+DEFAULT_CONCURRENCY = 4
+MAX_BODY_BYTES = 64 * 1024 * 1024
+# ヘッダと本文を読み終えるまでの上限（黙ったままの接続を抱え続けない）
+READ_TIMEOUT_S = 30.0
+HANDOFF_TIMEOUT_S = 2.0
+# 起動中に受けた activate は、画面ができるまでこの時間だけ待ってから実行する
+ACTIVATE_WAIT_S = 60.0
+UNIX_SOCKETS = sys.platform != "win32"
+
+
+def discovery_path() -> Path:
+    return paths.get_data_dir() / "api.json"
+
+
+def socket_path() -> Path:
+    return paths.get_data_dir() / "api.sock"
+
+
+def standalone() -> bool:
+    return os.environ.get(STANDALONE_ENV) == "1"
+
+
+def read_discovery() -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(discovery_path().read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _int_param(value: Any, name: str, default: int) -> int:
+    """Positive integer from a query or body value; a bad value is the client's error (400)."""
+    if value in (None, ""):
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"'{name}' must be an integer")
+    if number < 1:
+        raise HttpError(400, f"'{name}' must be at least 1")
+    return number
+
+
+# ----------------------------------------------------------------------
+# Handoff (client side; stdlib only so it runs before the app is imported)
+# ----------------------------------------------------------------------
+def hand_off(argv: List[str], timeout: float = HANDOFF_TIMEOUT_S) -> bool:
+    """Ask a running instance to come to the front (with *argv* files). True if one answered."""
+    if standalone():
+        return False
+    info = read_discovery()
+    if not info or not info.get("port"):
+        return False
+    files = [str(Path(a).resolve()) for a in argv if Path(a).exists()]
+    body = json.dumps({"files": files}).encode("utf-8")
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", int(info["port"]), timeout=timeout)
+        conn.request("POST", "/v1/activate", body=body, headers={
+            "Authorization": f"Bearer {info.get('token', '')}", "Content-Type": "application/json",
+        })
+        ok = conn.getresponse().status == 200
+        conn.close()
+        return ok
+    except OSError:
+        # 前回異常終了した残骸（誰も待ち受けていない）
+        return False
+
+
+# ----------------------------------------------------------------------
+# Server
+# ----------------------------------------------------------------------
+class LocalApiServer:
+    """HTTP/1.1 (one request per connection) on loopback TCP and a Unix socket.
+
+    :meth:`start` and :meth:`stop` are called from the Tk thread. Everything
+    else runs on the agent's worker loop.
+    """
+
+    def __init__(self, agent: Any, enabled: bool = False):
+        self.agent = agent
+        self.enabled = enabled or os.environ.get(API_ENV) == "1"
+        self.token = secrets.token_urlsafe(32)
+        self.port: Optional[int] = None
+        self._servers: List[asyncio.AbstractServer] = []
+        self._limiter: Optional[asyncio.Semaphore] = None
+        self._jobs = None
+        self._pending_activation: Optional[asyncio.Task] = None
+
+    def start(self, timeout: float = 5.0) -> bool:
+        loop = self.agent.loop
+        if loop is None:
+            return False
+        if standalone():
+            logger.info("local API not started (%s=1)", STANDALONE_ENV)
+            return False
+        try:
+            asyncio.run_coroutine_threadsafe(self._start(), loop).result(timeout)
+        except Exception as e:
+            logger.error("local API could not start: %s", e)
+            return False
+        self._write_discovery()
+        logger.info("local API listening on 127.0.0.1:%s%s (endpoints %s)", self.port,
+                    f" and {socket_path()}" if UNIX_SOCKETS else "", "enabled" if self.enabled else "disabled; handoff only")
+        return True
+
+    def stop(self, timeout: float = 2.0) -> None:
+        info = read_discovery()
+        if info and info.get("pid") == os.getpid():
+            for p in (discovery_path(), socket_path()):
+                try:
+                    p.unlink()
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.warning("local API: could not remove %s: %s", p, e)
+        loop = self.agent.loop
+        if loop is not None and loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self._stop(), loop).result(timeout)
+            except Exception:
+                pass
+
+    async def _start(self) -> None:
+        from prompt_runner import JobRegistry
+
+        self._jobs = JobRegistry()
+        try:
+            limit = int(os.environ.get(API_CONCURRENCY_ENV, DEFAULT_CONCURRENCY))
+        except ValueError:
+            limit = DEFAULT_CONCURRENCY
+        self._limiter = asyncio.Semaphore(max(1, limit))
+        try:
+            port = int(os.environ.get(API_PORT_ENV, "0"))
+        except ValueError:
+            port = 0
+        tcp = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        self._servers.append(tcp)
+        self.port = tcp.sockets[0].getsockname()[1]
+        if UNIX_SOCKETS:
+            sock = socket_path()
+            try:
+                sock.unlink()
+            except FileNotFoundError:
+                pass
+            try:
+                self._servers.append(await asyncio.start_unix_server(self._handle, path=str(sock)))
+                os.chmod(sock, 0o600)
+            except OSError as e:
+                # パスが長すぎる等。TCP だけで続ける
+                logger.warning("local API: Unix socket %s unavailable: %s", sock, e)
+
+    async def _stop(self) -> None:
+        for server in self._servers:
+            server.close()
+        self._servers.clear()
+
+    def _write_discovery(self) -> None:
+        path = discovery_path()
+        data = {"pid": os.getpid(), "port": self.port, "socket": str(socket_path()) if UNIX_SOCKETS else None, "token": self.token}
+        # トークンを含むので本人だけが読めるように作る
+        fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    # ------------------------------------------------------------------
+    # HTTP plumbing
+    # ------------------------------------------------------------------
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                method, target, headers, body = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                raise HttpError(408, "request not received in time")
+            if headers.get("authorization") != f"Bearer {self.token}":
+                raise HttpError(401, "missing or wrong token")
+            url = urlsplit(target)
+            result = await self._route(method, url.path.rstrip("/") or "/", parse_qs(url.query), body)
+            if hasattr(result, "__aiter__"):
+                await self._send_stream(writer, result)
+            else:
+                status, payload = result if isinstance(result, tuple) else (200, result)
+                await self._send_json(writer, status, payload)
+        except HttpError as e:
+            await self._send_json(writer, e.status, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.exception("local API request failed")
+            try:
+                await self._send_json(writer, 500, {"error": str(e)})
+            except Exception:
+                pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], Any]:
+        line = (await reader.readline()).decode("latin-1").strip()
+        parts = line.split()
+        if len(parts) != 3:
+            raise HttpError(400, "bad request line")
+        method, target = parts[0].upper(), parts[1]
+        headers: Dict[str, str] = {}
+        while True:
+            h = (await reader.readline()).decode("latin-1")
+            if h in ("\r\n", "\n", ""):
+                break
+            name, _, value = h.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400, "bad Content-Length")
+        if length < 0:
+            raise HttpError(400, "bad Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, "request body too large")
+        body: Any = None
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                raise HttpError(400, "body is not JSON")
+            if not isinstance(body, dict):
+                raise HttpError(400, "body must be a JSON object")
+        return method, target, headers, body
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: Any) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {http.client.responses.get(status, '')}\r\n"
+                     f"Content-Type: application/json; charset=utf-8\r\nContent-Length: {len(data)}\r\n"
+                     "Connection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+    async def _send_stream(self, writer: asyncio.StreamWriter, events: AsyncIterator[Dict[str, Any]]) -> None:
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson; charset=utf-8\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+        async for event in events:
+            line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+            writer.write(f"{len(line):x}\r\n".encode("latin-1") + line + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    # ------------------------------------------------------------------
+    # Endpoints
+    # ------------------------------------------------------------------
+    async def _route(self, method: str, path: str, query: Dict[str, List[str]], body: Any) -> Any:
+        if (method, path) == ("POST", "/v1/activate"):
+            return self._activate(body or {})
+        if (method, path) == ("GET", "/v1/health"):
+            return {"ok": True, "pid": os.getpid(), "api_enabled": self.enabled}
+        if not self.enabled:
+            raise HttpError(403, "the local API is disabled (set local_api_enabled in the config or GEM_CLIP_API=1)")
+        if (method, path) == ("GET", "/v1/prompts"):
+            return [{"id": pid, "name": p.name, "model": p.model} for pid, p in self.agent.config.prompts.items()]
+        if (method, path) == ("POST", "/v1/run"):
+            return await self._run(body or {})
+        if (method, path) == ("POST", "/v1/matrix"):
+            return await self._matrix(body or {})
+        if (method, path) == ("GET", "/v1/jobs"):
+            return self._jobs.list()
+        if path.startswith("/v1/jobs/"):
+            job_id, _, sub = path[len("/v1/jobs/"):].partition("/")
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise HttpError(404, f"no such job: {job_id}")
+            if method == "GET" and not sub:
+                return job.status()
+            if method == "GET" and sub == "events":
+                return job.follow()
+            if method == "DELETE" and not sub:
+                if job.task is not None and not job.task.done():
+                    job.task.cancel()
+                return job.status()
+        if (method, path) == ("GET", "/v1/history"):
+            limit = _int_param((query.get("limit") or [None])[0], "limit", 20)
+            q = (query.get("q") or [""])[0]
+            store = await asyncio.to_thread(lambda: self.agent.history_store)
+            return store.search(q, limit=limit) if q else store.entries(limit)
+        if (method, path) == ("GET", "/v1/history/item"):
+            key = (query.get("key") or [""])[0]
+            store = await asyncio.to_thread(lambda: self.agent.history_store)
+            meta = store.get(key)
+            if meta is None:
+                raise HttpError(404, f"no such history entry: {key}")
+            return await asyncio.to_thread(store.load, meta)
+        raise HttpError(404, f"no such endpoint: {method} {path}")
+
+    def _activate(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        files = [f for f in body.get("files") or [] if isinstance(f, str)]
+        app = getattr(self.agent, "app", None)
+        if app is None:
+            # 起動途中。断ると 2 つめのインスタンスが立ち上がるので、受け付けて画面ができてから行う
+            self._pending_activation = asyncio.create_task(self._activate_when_ready(files))
+            return {"ok": True, "queued": True}
+        self._show(app, files)
+        return {"ok": True}
+
+    async def _activate_when_ready(self, files: List[str]) -> None:
+        deadline = asyncio.get_running_loop().time() + ACTIVATE_WAIT_S
+        while getattr(self.agent, "app", None) is None:
+            if asyncio.get_running_loop().time() > deadline:
+                logger.warning("local API: dropped an activate request; the app did not finish starting")
+                return
+            await asyncio.sleep(0.1)
+        self._show(self.agent.app, files)
+
+    def _show(self, app: Any, files: List[str]) -> None:
+        if files:
+            app.after(0, lambda: self.agent._show_action_selector_gui(file_paths=files))
+        else:
+            app.after(0, self.agent._show_main_window)
+
+    async def _require_api_key(self) -> None:
+        if not await asyncio.to_thread(lambda: self.agent.api_key):
+            raise HttpError(503, "no API key is configured")
+
+    def _prompt(self, prompt_id: Any):
+        prompt = self.agent.config.prompts.get(str(prompt_id))
+        if prompt is None:
+            raise HttpError(404, f"no such prompt: {prompt_id}")
+        return prompt
+
+    async def _run(self, body: Dict[str, Any]) -> Any:
+        from prompt_runner import INPUT_TYPES, Job, contents_for_item, stream_prompt
+        from request_trace import Span
+        import loop_monitor
+
+        prompt = self._prompt(body.get("prompt_id"))
+        item = body.get("input") or {"type": "text", "data": body.get("text")}
+        if not isinstance(item, dict) or item.get("data") in (None, ""):
+            raise HttpError(400, "give 'text' or 'input': {'type', 'data'}")
+        if item.get("type") not in INPUT_TYPES:
+            raise HttpError(400, f"unsupported input type {item.get('type')!r} (one of {', '.join(INPUT_TYPES)})")
+        await self._require_api_key()
+        job = self._jobs.add(Job("api_run", total=1, prompt_id=body.get("prompt_id")))
+
+        async def _work():
+            span = Span("api_run", job.id, prompt_id=body.get("prompt_id"), model=prompt.model, input_type=item.get("type"))
+            parts: List[str] = []
+            try:
+                async with self._limiter:
+                    job.state = "running"
+                    span.mark("started")
+                    contents = await contents_for_item(item, span, prompt)
+                    async for text in stream_prompt(prompt, contents, span):
+                        parts.append(text)
+                        job.emit({"type": "chunk", "text": text})
+                job.completed = 1
+                job.info["text"] = "".join(parts)
+                job.finish("done", text=job.info["text"])
+            except asyncio.CancelledError:
+                span.end("cancelled")
+                job.finish("cancelled")
+                raise
+            except Exception as e:
+                span.fail(e)
+                job.failed = 1
+                job.finish("failed", str(e))
+            span.end()
+
+        job.task = asyncio.create_task(_work(), name=loop_monitor.task_name("api", job.id))
+        if body.get("stream", True):
+            return job.follow()
+        await asyncio.shield(job.task)
+        status = job.status()
+        return (200 if job.state == "done" else 502), status
+
+    async def _matrix(self, body: Dict[str, Any]) -> Any:
+        from prompt_runner import INPUT_TYPES, Job, load_prompt_set, run_matrix
+        import loop_monitor
+
+        if body.get("prompt_set"):
+            try:
+                prompts = list((await asyncio.to_thread(load_prompt_set, str(body["prompt_set"]))).items())
+            except FileNotFoundError as e:
+                raise HttpError(404, str(e))
+        else:
+            prompts = [(str(pid), self._prompt(pid)) for pid in body.get("prompt_ids") or []]
+        if not prompts:
+            raise HttpError(400, "give 'prompt_ids' or 'prompt_set'")
+        items = body.get("inputs")
+        if body.get("source"):
+            from matrix_import import iter_import_items
+
+            try:
+                items = await asyncio.to_thread(lambda: list(iter_import_items(Path(body["source"]), body.get("text_column"))))
+            except (OSError, ValueError) as e:
+                raise HttpError(400, str(e))
+        if not isinstance(items, list) or not items or not all(isinstance(i, dict) for i in items):
+            raise HttpError(400, "give 'inputs' (a list of {'type', 'data'}) or 'source' (a CSV/JSONL file or directory)")
+        bad = sorted({str(i.get("type")) for i in items if i.get("type") not in INPUT_TYPES})
+        if bad:
+            raise HttpError(400, f"unsupported input type(s) {', '.join(bad)} (one of {', '.join(INPUT_TYPES)})")
+        concurrency = _int_param(body.get("concurrency"), "concurrency", 5)
+        await self._require_api_key()
+        job = self._jobs.add(Job("api_matrix", prompt_ids=[pid for pid, _ in prompts]))
+        job.task = asyncio.create_task(
+            run_matrix(job, items, prompts, concurrency=concurrency, limiter=self._limiter, span_kind="api_matrix_cell"),
+            name=loop_monitor.task_name("api", job.id),
+        )
+        return 202, job.status()
+
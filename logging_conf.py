@@ -7,15 +7,28 @@ It writes logs both to the console and to rotating log files located in the
 application's log directory. The log files rotate at 10MB and keep up to 5
 backups. The configuration can be invoked from the application entry point
 to ensure consistent logging across modules.
+
+Logging calls never touch the disk or console on the caller's thread. Records
+are put on a queue, and a background ``QueueListener`` formats and writes them.
+Records are enqueued unformatted, so ``%``-style arguments are only rendered
+on the listener thread, and only for records that pass the level check.
+
+Request trace spans (see ``request_trace.py``) go to the ``gem_clip.trace``
+logger and are written as JSON lines to ``<log_dir>/trace.jsonl``.
 """
 
 from __future__ import annotations
 
+import atexit
+import json
 import logging
 import logging.handlers
+import queue
 from pathlib import Path
+from typing import List, Optional
 
 from constants import APP_NAME
+from request_trace import TRACE_LOGGER_NAME
 # Import paths module. When executed as a script, relative import will fail. Use
 # dynamic loading as a fallback.
 try:
@@ -31,7 +44,60 @@ except ImportError:
     _paths_spec.loader.exec_module(paths)  # type: ignore
 
 
-def setup_logging(level: int = logging.INFO) -> None:
+_listeners: List[logging.handlers.QueueListener] = []
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that enqueues the record as-is.
+
+    The stock ``prepare()`` formats the message on the calling thread. The
+    queue never leaves this process, so the listener can format it instead.
+    Callers must not mutate objects they passed as log arguments.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per record: ``ts``, ``level``, ``logger`` and the payload.
+
+    A dict passed as the single log argument (``logger.info("span", payload)``)
+    is merged into the object. Anything else becomes the ``msg`` field.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name}
+        if isinstance(record.args, dict):
+            data["event"] = record.msg
+            data.update(record.args)
+        else:
+            data["msg"] = record.getMessage()
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _start_listener(logger: logging.Logger, *handlers: logging.Handler) -> None:
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    logger.addHandler(_DeferredQueueHandler(q))
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener threads."""
+    while _listeners:
+        try:
+            _listeners.pop().stop()
+        except Exception:
+            pass
+
+
+def setup_logging(level: int = logging.INFO, trace: Optional[bool] = None) -> None:
     """Configure logging for the application.
 
     This function sets up two handlers:
@@ -40,9 +106,14 @@ def setup_logging(level: int = logging.INFO) -> None:
       10MB with up to 5 backups.
     - A StreamHandler that writes to stderr (console).
 
+    Both run behind a queue listener thread.
+
     Args:
         level: Logging level for the root logger. Defaults to INFO.
+        trace: Write request trace spans to ``<log_dir>/trace.jsonl``.
+            Defaults to on.
     """
+    stop_logging()
     log_dir: Path = paths.get_log_dir()
     log_file = log_dir / "app.log"
     # Define formatters
@@ -62,10 +133,23 @@ def setup_logging(level: int = logging.INFO) -> None:
     root_logger = logging.getLogger()
     root_logger.setLevel(level)
     # Clear existing handlers to avoid duplicate logs when reconfiguring
-    for h in list(root_logger.handlers):
-        root_logger.removeHandler(h)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    _start_listener(root_logger, file_handler, console_handler)
     # Reduce noise from third-party libraries
     logging.getLogger("google").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+    # Trace spans: JSON lines in their own file, not echoed to app.log / console
+    trace_logger = logging.getLogger(TRACE_LOGGER_NAME)
+    trace_logger.propagate = False
+    if trace is False:
+        trace_logger.setLevel(logging.CRITICAL + 1)
+    else:
+        trace_logger.setLevel(logging.INFO)
+        trace_handler = logging.handlers.RotatingFileHandler(
+            log_dir / "trace.jsonl", maxBytes=10 * 1024 * 1024, backupCount=3, encoding="utf-8"
+        )
+        trace_handler.setFormatter(JsonLineFormatter())
+        _start_listener(trace_logger, trace_handler)
+
+
+atexit.register(stop_logging)
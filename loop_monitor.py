@@ -0,0 +1,164 @@
+"""
+loop_monitor.py
+=================
+
+Scheduling lag and task inventory of the worker event loop.
+
+All LLM work runs on one asyncio loop (``ClipboardToolAgent.loop``). A
+blocking call there (sync streaming, image encoding, a screen grab) delays
+every other request. :class:`LoopMonitor` schedules a heartbeat on the loop
+with ``call_at`` and measures how late it runs. Each beat's lag goes to the
+``gem_clip_loop_lag_seconds`` histogram.
+
+A watcher thread checks the heartbeat from outside the loop. When the loop
+has not reached the beat for longer than the threshold (default 100 ms,
+``GEM_CLIP_LOOP_LAG_MS``; ``0`` turns the monitor off), it logs the task that
+is running and the loop thread's stack while the loop is still blocked.
+
+The monitor also keeps an inventory of pending tasks by kind (``hotkey``,
+``matrix_cell``, ``flow_row``, ``summary``, ``api``; anything else is ``other``). The
+kind comes from the task name, which callers set with :func:`task_name`. The
+inventory is exported as ``gem_clip_loop_tasks{kind}`` and logged with each
+stall.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import metrics
+from profiler import format_thread_stack
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_MS_ENV = "GEM_CLIP_LOOP_LAG_MS"
+DEFAULT_LAG_MS = 100.0
+HEARTBEAT_MS = 50
+INVENTORY_INTERVAL_S = 1.0
+TASK_KINDS = ("hotkey", "matrix_cell", "flow_row", "summary", "api")
+
+LOOP_LAG_SECONDS = metrics.REGISTRY.histogram(
+    "gem_clip_loop_lag_seconds", "How late worker loop heartbeats ran.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS_TOTAL = metrics.REGISTRY.counter("gem_clip_loop_stalls_total", "Times the worker loop was blocked longer than the lag threshold.")
+LOOP_TASKS = metrics.REGISTRY.gauge("gem_clip_loop_tasks", "Pending tasks on the worker loop by kind.", ("kind",))
+
+
+def lag_threshold_ms() -> float:
+    try:
+        return float(os.environ.get(LOOP_LAG_MS_ENV, DEFAULT_LAG_MS))
+    except ValueError:
+        return DEFAULT_LAG_MS
+
+
+def task_name(kind: str, *detail: Any) -> str:
+    """Name for ``create_task(name=...)`` so the inventory can group the task (``kind:detail``)."""
+    return ":".join([kind, *(str(d) for d in detail)])
+
+
+def task_kind(task: "asyncio.Task[Any]") -> str:
+    kind = task.get_name().split(":", 1)[0]
+    return kind if kind in TASK_KINDS else "other"
+
+
+def describe_task(task: Optional["asyncio.Task[Any]"]) -> str:
+    if task is None:
+        return "(no task; a callback or the loop itself)"
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', repr(coro))})"
+
+
+class LoopMonitor:
+    """Heartbeat-based lag monitor for an asyncio loop that runs in another thread.
+
+    :meth:`start` may be called from any thread once the loop exists.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold_ms: Optional[float] = None, interval_ms: int = HEARTBEAT_MS):
+        self.loop = loop
+        self.threshold_ms = lag_threshold_ms() if threshold_ms is None else float(threshold_ms)
+        self.interval = interval_ms / 1000
+        self._loop_thread_id: Optional[int] = None
+        self._expected = 0.0
+        self._last_beat = time.monotonic()
+        self._next_inventory = 0.0
+        self._inventory: Dict[str, int] = {}
+        self._stack_logged = False
+        self._stalled_in = ""
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.threshold_ms <= 0 or self._thread is not None:
+            return
+        self._last_beat = time.monotonic()
+        self.loop.call_soon_threadsafe(self._start_on_loop)
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def inventory(self) -> Dict[str, int]:
+        """Pending task counts by kind, as of the last refresh (at most ~1 s old)."""
+        return dict(self._inventory)
+
+    def pending_tasks(self) -> List[str]:
+        """Names of pending tasks; call on the loop thread."""
+        return sorted(describe_task(t) for t in asyncio.all_tasks(self.loop) if not t.done())
+
+    # ------------------------------------------------------------------
+    def _start_on_loop(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._expected = self.loop.time() + self.interval
+        self.loop.call_at(self._expected, self._beat)
+
+    def _beat(self) -> None:
+        now = self.loop.time()
+        lag = max(0.0, now - self._expected)
+        self._last_beat = time.monotonic()
+        LOOP_LAG_SECONDS.observe(lag)
+        if now >= self._next_inventory:
+            self._refresh_inventory()
+            self._next_inventory = now + INVENTORY_INTERVAL_S
+        if lag * 1000 > self.threshold_ms:
+            LOOP_STALLS_TOTAL.inc()
+            self._refresh_inventory()
+            logger.warning("worker loop was blocked for %.0f ms (threshold %.0f ms)%s; pending tasks: %s",
+                           lag * 1000, self.threshold_ms, f" in {self._stalled_in}" if self._stalled_in else "", self._format_inventory())
+        self._stack_logged = False
+        self._stalled_in = ""
+        if not self._stop.is_set():
+            self._expected = now + self.interval
+            self.loop.call_at(self._expected, self._beat)
+
+    def _refresh_inventory(self) -> None:
+        counts = Counter(task_kind(t) for t in asyncio.all_tasks(self.loop) if not t.done())
+        # モニタ自身はタスクを持たないので、数はそのまま利用者のタスク数になる
+        self._inventory = {kind: counts.get(kind, 0) for kind in (*TASK_KINDS, "other")}
+        for kind, n in self._inventory.items():
+            LOOP_TASKS.set(n, kind=kind)
+
+    def _format_inventory(self) -> str:
+        return ", ".join(f"{kind}={n}" for kind, n in self._inventory.items() if n) or "none"
+
+    def _watch(self) -> None:
+        poll = max(0.02, self.threshold_ms / 4000)
+        while not self._stop.wait(poll):
+            if self._loop_thread_id is None or not self.loop.is_running():
+                continue
+            blocked_ms = (time.monotonic() - self._last_beat - self.interval) * 1000
+            if blocked_ms > self.threshold_ms and not self._stack_logged:
+                # 1回の停止につき1度だけ、止まっている最中のタスクとスタックを出す
+                self._stack_logged = True
+                self._stalled_in = describe_task(asyncio.current_task(self.loop))
+                logger.warning("worker loop blocked for %.0f ms so far in %s; stack:\n%s",
+                               blocked_ms, self._stalled_in, format_thread_stack(self._loop_thread_id))
@@ -1,5 +1,24 @@
 # main.py
-from app import ClipboardToolApp
+import startup_profile  # 起動時刻の基準（最初に import する）
+import sys
+
+if __name__ == "__main__":
+    # 画像前処理のプロセスプール（input_prep.py）を凍結ビルドでも動かすため
+    import multiprocessing
+    multiprocessing.freeze_support()
+
+if __name__ == "__main__" and sys.argv[1:2] and sys.argv[1] in ("run", "matrix"):
+    # コマンドラインモード（Tk もトレイも作らない。cli.py 参照）
+    import cli
+    sys.exit(cli.main(sys.argv[1:]))
+
+if __name__ == "__main__":
+    # 既に起動中なら前面に出してもらい終了する（重い import の前に確認する）
+    import local_api
+    if local_api.hand_off(sys.argv[1:]):
+        sys.exit(0)
+    # プロセスプールの子は本ファイルを __mp_main__ として読み込むので、UI はここでだけ import する
+    from app import ClipboardToolApp
 # Import logging_conf dynamically to support running as a script (no package context)
 try:
     # When run as a package (python -m agent.main) logging_conf will be found as a sibling module
@@ -15,10 +34,14 @@ except Exception:
     _logging_conf_module = importlib.util.module_from_spec(_log_conf_spec)
     _log_conf_spec.loader.exec_module(_logging_conf_module)  # type: ignore
     setup_logging = _logging_conf_module.setup_logging
+startup_profile.mark("imports")
 
 if __name__ == "__main__":
     # Initialize logging before starting the application. This ensures that
     # messages emitted during app startup are captured.
     setup_logging()
+    # Prometheus 形式のメトリクスをログディレクトリへ定期出力（GEM_CLIP_METRICS_PORT 指定時は HTTP でも公開）
+    import metrics
+    metrics.start_exporter()
     app_instance = ClipboardToolApp()
     app_instance.run()
@@ -2,31 +2,49 @@ import mimetypes
 import customtkinter as ctk
 import tkinter as tk
 import logging
-
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 from tkinter import messagebox, filedialog
 from typing import List, Dict, Any, Optional, Callable
 import asyncio
 import threading
 import time
+import uuid
 import pyperclip
 from common_models import LlmAgent, Prompt
 from PIL import Image
 from io import BytesIO
 import base64
-from google.generativeai import types
-import google.generativeai as genai
 # from google.api_core import exceptions
+import input_prep
+import loop_monitor
+import memory_accounting
 import styles
 from i18n import tr
 from pathlib import Path
 from constants import DELETE_ICON_FILE
 import traceback
-from common_models import create_image_part # create_image_partをインポート
-from google.generativeai.generative_models import GenerativeModel # GenerativeModelをインポート
+from common_models import load_genai_async
 from history_dialogs import HistoryEditDialog
+from history_store import history_label
+from matrix_cell_store import MatrixCellStore
+from matrix_session_store import SessionStore, safe_session_name
+from matrix_tab_views import TabViewCache
+from matrix_export import EXPORT_FILETYPES, ExportCancelled, MatrixExportSource, export_matrix
+from matrix_import import IMAGE_FILE_TYPE, iter_batches, iter_import_items
+from request_trace import Span, new_job_id
+from thumbnail_cache import get_thumbnail_cache, image_bytes_loader, key_for_item as thumbnail_key_for_item
 from CTkMessagebox import CTkMessagebox
 
+logger = logging.getLogger(__name__)
+
+
+def _output_tokens(resp) -> Optional[int]:
+    """Output token count from a response's usage metadata, if reported."""
+    try:
+        return resp.usage_metadata.candidates_token_count or None
+    except Exception:
+        return None
+
+
 class SizerGrip(tk.Frame):
     def __init__(self, parent, **kwargs):
         super().__init__(parent, **kwargs)
@@ -46,17 +64,29 @@ class SizerGrip(tk.Frame):
 
 
 class MatrixBatchProcessorWindow(ctk.CTkToplevel):
+    # 表示範囲の外側に余分に描画しておく行数/列数（スクロール時のちらつき防止）
+    GRID_OVERSCAN_ROWS = 3
+    GRID_OVERSCAN_COLS = 1
+    # プロンプト列数の上限。データ行の結果セルは可視列ぶんしか作らないが、見出し行・列まとめ行は
+    # 全列ぶんのウィジェットを持ち、各行フレームも全列の幅になる。Tk のウィンドウ/座標は
+    # 32767px までなので、入力列と行まとめ列を含めてその幅に収まる列数に抑える。
+    MAX_PROMPT_COLUMNS = 32767 // (styles.MATRIX_CELL_WIDTH + 10) - 2
+    # 最近使ったタブの表示状態（セルストアとまとめ）をスナップショットせずに保持する数
+    TAB_VIEW_CACHE_SIZE = 3
+    # セッション自動保存をまとめる待ち時間（連続した変更は1回の書き込みにする）
+    SESSION_SAVE_DEBOUNCE_MS = 800
+
     def __init__(self, prompts: Dict[str, Prompt], on_processing_completed: Callable, llm_agent_factory: Callable[[str, Prompt], LlmAgent], notification_callback: Callable[[str, str, str], None], worker_loop: asyncio.AbstractEventLoop, parent_app: ctk.CTk, agent: Any):
         super().__init__(parent_app)
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.prompts = prompts
-        logging.debug(f"DEBUG: __init__ - Initial self.prompts keys: {list(self.prompts.keys())}")
+        logger.debug("__init__ - Initial self.prompts keys: %s", list(self.prompts))
         try:
-            self._initial_prompts = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
-            logging.debug(f"DEBUG: __init__ - _initial_prompts keys: {list(self._initial_prompts.keys())}")
+            self._initial_prompts = self._copy_prompts(self.prompts)
+            logger.debug("__init__ - _initial_prompts keys: %s", list(self._initial_prompts))
         except Exception:
             self._initial_prompts = dict(self.prompts)
-            logging.debug(f"DEBUG: __init__ - _initial_prompts (exception) keys: {list(self._initial_prompts.keys())}")
+            logger.debug("__init__ - _initial_prompts (exception) keys: %s", list(self._initial_prompts))
         self.on_processing_completed = on_processing_completed
         self.llm_agent_factory = llm_agent_factory
         self.notification_callback = notification_callback
@@ -77,8 +107,27 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         self.total_tasks = 0
         self.completed_tasks = 0
         self.progress_lock = threading.Lock()
-        # 入力セルのフレーム参照を保持して、部分更新で再描画を最小化
-        self._input_row_frames: List[ctk.CTkFrame] = []
+        # 取り込み/書き出しのワーカースレッド
+        self._import_thread: Optional[threading.Thread] = None
+        # 取り込み開始時のタブ。閉じられたり全消去されたら None にして残りのバッチを捨てる
+        self._import_target: Optional[dict] = None
+        self._export_thread: Optional[threading.Thread] = None
+        self._export_cancel = threading.Event()
+        # --- 仮想化グリッド ---
+        # データ行は表示範囲（+前後の余白）のぶんだけウィジェットを作り、スクロール時は再利用する。
+        # row -> 行ビュー（canvas 上のウィンドウ1つ + 入力セル + 可視列ぶんの結果セル）
+        self._row_views: Dict[int, Dict[str, Any]] = {}
+        self._row_view_pool: List[Dict[str, Any]] = []
+        self._grid_refresh_job: Optional[str] = None
+        self._header_frame: Optional[ctk.CTkFrame] = None
+        self._header_window_id: Optional[int] = None
+        self._row_summary_header: Optional[ctk.CTkFrame] = None
+        self._footer_frame: Optional[ctk.CTkFrame] = None
+        self._footer_window_id: Optional[int] = None
+        self._footer_traces: List[tuple] = []
+        self._delete_icon: Optional[ctk.CTkImage] = None
+        self._delete_icon_loaded = False
+        self.tooltip_window = None
 
         # 進捗エリアの背景はMATRIX_TOP_BG_COLOR（キャンバスより少し暗め）
         self.progress_frame = ctk.CTkFrame(self, fg_color=styles.MATRIX_TOP_BG_COLOR)
@@ -88,9 +137,8 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 
 
         self.input_data: List[Dict[str, Any]] = [{"type": "text", "data": ""}]
-        self.checkbox_states: List[List[ctk.BooleanVar]] = []
-        self.results: List[List[ctk.StringVar]] = []
-        self._full_results: List[List[str]] = []
+        # セルの状態（チェック/表示/全文/スタイル）は (row, col) 配列で保持し、Tk変数は可視セルだけに持たせる
+        self._cells = MatrixCellStore()
         self._row_summaries: List[ctk.StringVar] = []
         self._col_summaries: List[ctk.StringVar] = []
         self._history_popup: Optional['ClipboardHistorySelectorPopup'] = None
@@ -102,7 +150,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         self._col_header_frames: List[ctk.CTkFrame] = []
         self._col_drag_data: Dict[str, Any] = {}
         self._col_drag_active_frame: Optional[ctk.CTkFrame] = None
-        self._col_drop_line_id: Optional[int] = None  # legacy (canvas)
+        self._col_drop_line_id: Optional[int] = None  # canvas window item of the indicator
         self._col_drop_indicator_widget: Optional[tk.Frame] = None
 
         # --- Flow run state ---
@@ -110,10 +158,9 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             self.max_flow_steps: int = int(getattr(self.agent.config, 'max_flow_steps', 5))
         except Exception:
             self.max_flow_steps: int = 5
-        self._result_textboxes: List[List[Optional[ctk.CTkTextbox]]] = []
-        self._cell_style: List[List[str]] = []  # "normal" or "flow"
         self._flow_cancel_requested: bool = False
         self._flow_tasks: List[asyncio.Task] = []
+        self._flow_job_id: Optional[str] = None
 
         # --- UIリサイズ用プロパティ ---
         # 各列の幅と各行の高さを保持するリスト。0番目は固定列/ヘッダ行に対応。
@@ -129,6 +176,8 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 
         self._create_toolbar()
         self._init_tabs()
+        # 開いているタブ（LRU に預けたものを含む）の結果をメモリ予算の対象にする
+        self._memory_token = memory_accounting.register("matrix", self._memory_usage, self._enforce_memory_budget)
         self._create_main_grid_frame()
         self.after(100, self._update_ui) # 遅延させてUIを更新
         self.state('zoomed') # ウィンドウを最大化
@@ -144,15 +193,24 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 # Persist current active tab prompts/state before closing
                 if hasattr(self, '_tabs') and self._tabs:
                     try:
-                        self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
+                        self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
                         self._tabs[self._active_tab_index]['state'] = self._snapshot_state()
                     except Exception:
                         pass
                     if save_choice:
-                        self._save_session()
+                        self._save_session(flush=True)
             except Exception:
                 pass
+            if self._session_save_job is not None:
+                try:
+                    self.after_cancel(self._session_save_job)
+                except Exception:
+                    pass
+                self._session_save_job = None
+            # キュー済みの書き込みが終わるのを待ってから閉じる
+            self._session_store.close()
             self._is_closing = True
+            self._export_cancel.set()
             if hasattr(self, '_cursor_update_job') and self._cursor_update_job:
                 self.after_cancel(self._cursor_update_job)
                 self._cursor_update_job = None
@@ -162,7 +220,11 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 for task in self.processing_tasks:
                     if not task.done():
                         task.cancel()
-            
+
+            memory_accounting.unregister(self._memory_token)
+            # ディスクへ逃がした長い結果の一時ファイルを片付ける
+            self._drop_tab_views()
+            self._cells.close()
             self.destroy()
 
     def on_prompts_updated(self, updated_prompts: Dict[str, Prompt]):
@@ -180,14 +242,12 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 self._tabs.insert(0, {'name': tr('matrix.tab.default'), 'prompts_obj': {}, 'state': None})
                 default_idx = 0
             # デフォルトタブのプロンプトを更新
-            self._tabs[default_idx]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in filtered.items()}
-            logging.debug(f"DEBUG: on_prompts_updated - default tab prompts updated: {list(filtered.keys())}")
+            self._tabs[default_idx]['prompts_obj'] = self._copy_prompts(filtered)
+            logger.debug("on_prompts_updated - default tab prompts updated: %s", list(filtered))
             # アクティブがデフォルトなら表示も更新
             if self._active_tab_index == default_idx:
-                self.prompts = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in filtered.items()}
-                self.checkbox_states = []
-                self.results = []
-                self._full_results = []
+                self.prompts = self._share_prompts(self._tabs[default_idx]['prompts_obj'])
+                self._cells.clear()
                 self._update_ui()
         except Exception:
             try:
@@ -215,6 +275,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         ctk.CTkButton(toolbar_frame, text=tr("matrix.clear"), command=self._clear_active_set, fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR).grid(row=0, column=3, padx=5, pady=5, sticky="ew")
         ctk.CTkButton(toolbar_frame, text=tr("matrix.set_manager"), command=self._open_set_manager, fg_color=styles.MATRIX_BUTTON_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR).grid(row=0, column=4, padx=5, pady=5, sticky="ew")
         ctk.CTkButton(toolbar_frame, text=tr("matrix.session_manager"), command=self._open_session_manager, fg_color=styles.MATRIX_BUTTON_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR).grid(row=0, column=5, padx=5, pady=5, sticky="ew")
+        ctk.CTkButton(toolbar_frame, text=tr("matrix.import"), command=self._import_inputs, fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR).grid(row=0, column=6, padx=5, pady=5, sticky="ew")
         # タブ削除は各タブの「×」で実行
         
         try:
@@ -262,43 +323,19 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         return out
 
     def _snapshot_state(self) -> dict:
-        chk: list[list[bool]] = []
-        for r in self.checkbox_states:
-            try:
-                chk.append([bool(v.get()) if hasattr(v, 'get') else bool(v) for v in r])
-            except Exception:
-                chk.append([False for _ in r])
-        results_full: list[list[str]] = []
-        for r in self._full_results:
-            results_full.append([str(c or '') for c in r])
-        row_summ = [sv.get() if hasattr(sv, 'get') else str(sv or '') for sv in self._row_summaries]
-        col_summ = [sv.get() if hasattr(sv, 'get') else str(sv or '') for sv in self._col_summaries]
-        return {'checkbox': chk, 'full_results': results_full, 'row_summaries': row_summ, 'col_summaries': col_summ}
+        return self._build_state(self._cells, self._row_summaries, self._col_summaries)
+
+    def _build_state(self, cells: MatrixCellStore, row_summaries: list, col_summaries: list) -> dict:
+        state = cells.to_state()
+        row_summ = [sv.get() if hasattr(sv, 'get') else str(sv or '') for sv in row_summaries]
+        col_summ = [sv.get() if hasattr(sv, 'get') else str(sv or '') for sv in col_summaries]
+        state.update({'row_summaries': row_summ, 'col_summaries': col_summ})
+        return state
 
     def _apply_state(self, state: Optional[dict]):
         if not state:
             return
-        chk = state.get('checkbox', [])
-        self.checkbox_states = []
-        for r in range(len(self.input_data)):
-            row = []
-            src = chk[r] if r < len(chk) else []
-            for c in range(len(self.prompts)):
-                val = bool(src[c]) if c < len(src) else False
-                row.append(ctk.BooleanVar(value=val))
-            self.checkbox_states.append(row)
-        self._full_results = []
-        self.results = []
-        fr = state.get('full_results', [])
-        for r in range(len(self.input_data)):
-            self._full_results.append([])
-            self.results.append([])
-            src_row = fr[r] if r < len(fr) else []
-            for c in range(len(self.prompts)):
-                cell_full = str(src_row[c]) if c < len(src_row) else ''
-                self._full_results[r].append(cell_full)
-                sv = ctk.StringVar(value=self._truncate_result(cell_full))
-                self.results[r].append(sv)
+        self._cells.load_state(state, len(self.input_data), len(self.prompts))
         self._row_summaries = []
         rs = state.get('row_summaries', [])
         for r in range(len(self.input_data)):
@@ -325,17 +362,24 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         return d
 
     def _session_file_for(self, name: str) -> Path:
-        safe = name.strip().replace('/', '_').replace('\\', '_')
-        return self._sessions_dir() / f"{safe}.json"
+        return self._session_store.named_path(name)
 
     def _init_tabs(self):
         # Custom browser-like tab bar container
         # タブバーの背景は進捗エリアと統一（MATRIX_TOP_BG_COLOR）
         self.tabbar_frame = ctk.CTkFrame(self, fg_color=styles.MATRIX_TOP_BG_COLOR)
         self.tabbar_frame.pack(fill='x', padx=10, pady=(0,0))
+        # セッションの保存先（書き込みはバックグラウンドで、変更のあったタブだけ）
+        self._session_store = SessionStore(self._prompt_set_dir() / 'session', self._sessions_dir(), legacy_file=self._session_file())
+        self._session_save_job: Optional[str] = None
         # Per-tab storage
         self._tabs: list[dict] = []
         self._active_tab_index: int = 0
+        # 最近使ったタブの表示状態（古いものから追い出す）
+        self._tab_views = TabViewCache(self.TAB_VIEW_CACHE_SIZE, lambda: self._tabs, self._build_state,
+                                       new_summary=lambda: ctk.StringVar(value=""))
+        # self._cells / まとめに現在載っている状態がどのタブのものか
+        self._live_tab: Optional[dict] = None
         self._tab_slot_width: Optional[int] = None
         # Load from session or default and render
         self._start_with_default_only: bool = True
@@ -355,51 +399,174 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         # Apply active prompts/state
         active = self._tabs[self._active_tab_index]
         prompts_obj = active.get('prompts_obj') if isinstance(active.get('prompts_obj', {}), dict) else self._deserialize_prompts(active.get('prompts', {}))
-        self.prompts = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in prompts_obj.items()} if prompts_obj else {}
-        logging.debug(f"DEBUG: _rebuild_tabs - self.prompts keys set to: {list(self.prompts.keys())}")
-        self.checkbox_states = []
-        self.results = []
-        self._full_results = []
-        self._row_summaries = []
-        self._col_summaries = []
-        self._apply_state(active.get('state'))
+        self.prompts = self._share_prompts(prompts_obj)
+        logger.debug("_rebuild_tabs - self.prompts keys set to: %s", list(self.prompts))
+        self._activate_tab_view(active)
         self._render_tabbar()
 
     def _on_tab_clicked(self, idx: int):
         if idx == self._active_tab_index:
             return
+        started = time.perf_counter()
+        old_count = self._grid_column_count()
+        had_row_summary = bool(self._row_summaries)
         try:
             if 0 <= self._active_tab_index < len(self._tabs):
-                self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
-                self._tabs[self._active_tab_index]['state'] = self._snapshot_state()
+                # 状態のスナップショットは取らない（表示状態ごと _tab_views に預ける）
+                self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
         except Exception:
             pass
         self._active_tab_index = idx
         try:
             t = self._tabs[self._active_tab_index]
             prompts_obj = t.get('prompts_obj') if isinstance(t.get('prompts_obj', {}), dict) else self._deserialize_prompts(t.get('prompts', {}))
-            self.prompts = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in prompts_obj.items()} if prompts_obj else {}
-            logging.debug(f"DEBUG: _on_tab_clicked - self.prompts keys set to: {list(self.prompts.keys())}")
+            self.prompts = self._share_prompts(prompts_obj)
+            logger.debug("_on_tab_clicked - self.prompts keys set to: %s", list(self.prompts))
         except Exception as e:
             self.prompts = {}
-            logging.error(f"ERROR: _on_tab_clicked - Error setting self.prompts: {e}")
-        # 状態を適用し新規フレームに描画（確実な切替を優先）
-        self._result_textboxes = []
-        self._cell_style = []
-        self.checkbox_states = []
-        self.results = []
-        self._full_results = []
-        self._row_summaries = []
-        self._col_summaries = []
-        self._apply_state(self._tabs[self._active_tab_index].get('state'))
-        new_frame = ctk.CTkFrame(self.canvas, fg_color="transparent")
-        self.scrollable_content_frame = new_frame
-        try:
-            self.canvas.itemconfigure(self._window_id, window=self.scrollable_content_frame)
-        except Exception:
-            pass
-        self._update_ui()
+            logger.error("_on_tab_clicked - Error setting self.prompts: %s", e)
+        # 最近のタブなら保持している状態をそのまま戻し、行ビューも作り直さずに付け替える
+        self._activate_tab_view(self._tabs[self._active_tab_index])
+        self._switch_grid(old_count, had_row_summary)
         self._render_tabbar()
+        if logger.isEnabledFor(logging.DEBUG):
+            # ウィジェット数の集計は木を辿るので DEBUG 有効時だけ行う
+            logger.debug("tab switch took %.2f ms (%d cached tab views, %d widgets)", (time.perf_counter() - started) * 1000, len(self._tab_views), self._count_widgets())
+
+    # --- Live tab views ---
+    def _copy_prompts(self, prompts: Dict[str, Prompt]) -> Dict[str, Prompt]:
+        """外部（エージェント設定）から受け取ったプロンプトをこのウィンドウ用に複製する"""
+        return {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in prompts.items()}
+
+    def _share_prompts(self, prompts: Optional[Dict[str, Prompt]]) -> Dict[str, Prompt]:
+        """タブ間でプロンプトを共有する（copy-on-write）。
+
+        ウィンドウ内では Prompt を書き換えず、編集時は新しいインスタンスに差し替える
+        （PromptEditorDialog は新しい Prompt を返す）。そのため dict の複製だけで足りる。
+        """
+        if not prompts:
+            return {}
+        if len(prompts) > self.MAX_PROMPT_COLUMNS:
+            # 上限を超える列は表示できないので切り詰めて知らせる
+            logger.warning("matrix has %d prompt columns; keeping the first %d", len(prompts), self.MAX_PROMPT_COLUMNS)
+            self.notification_callback(tr("common.warning"), tr("matrix.column_limit_message", max=self.MAX_PROMPT_COLUMNS), "warning")
+            return dict(list(prompts.items())[:self.MAX_PROMPT_COLUMNS])
+        return dict(prompts)
+
+    def _activate_tab_view(self, tab: dict):
+        """tab の状態を self._cells / まとめに載せる。
+
+        直前のタブの状態は LRU に預け、対象が LRU にあればそのまま戻す。なければ保存済み state から復元する。
+        self.prompts は先に対象タブのものにしておくこと。
+        """
+        live = self._live_tab
+        if live is tab:
+            return
+        if self._tab_views.is_open(live):
+            self._tab_views.park(live, self._cells, self._row_summaries, self._col_summaries)
+        else:
+            self._cells.close()
+        entry = self._tab_views.take(tab)
+        if entry is not None:
+            self._cells = entry['cells']
+            self._row_summaries = entry['row_summaries']
+            self._col_summaries = entry['col_summaries']
+        else:
+            self._cells = MatrixCellStore()
+            self._row_summaries = []
+            self._col_summaries = []
+            self._apply_state(tab.get('state'))
+        self._live_tab = tab
+        # 閉じられたタブのぶんと、上限を超えたぶんを追い出す
+        self._tab_views.prune()
+
+    def _sync_cached_tab_rows(self, deleted_row: Optional[int] = None):
+        """入力行は全タブ共通なので、行の追加/削除を LRU に預けたタブの状態にも反映する"""
+        self._tab_views.sync_rows(len(self.input_data), deleted_row)
+
+    def _drop_tab_views(self):
+        self._tab_views.clear()
+
+    # --- Memory budget ---
+    def _memory_usage(self) -> Dict[str, int]:
+        """メモリ監視スレッドから呼ばれる。セルストアはロック付き、その他は読み取りのみ。"""
+        stores = [self._cells] + self._tab_views.stores()
+        total = 0
+        spilled_chars = 0
+        for store in stores:
+            est = store.memory_estimate()
+            total += est['bytes']
+            spilled_chars += est['spilled_chars']
+        total += memory_accounting.deep_sizeof([self._row_summaries, self._col_summaries])
+        # LRU から外れたタブは state（全結果のリスト）として持っている
+        cached = {id(self._live_tab)} | self._tab_views.ids()
+        for tab in list(self._tabs):
+            if id(tab) not in cached and tab.get('state'):
+                total += memory_accounting.deep_sizeof(tab['state'])
+        return {'bytes': total, 'stores': len(stores), 'spilled_chars': spilled_chars}
+
+    def _enforce_memory_budget(self, target_bytes: int):
+        # _tab_views は Tk スレッドでしか触らないので、そちらで実行する
+        if not self._is_closing:
+            self.after(0, lambda: self._free_matrix_memory(target_bytes))
+
+    def _free_matrix_memory(self, target_bytes: int):
+        """予算を超えたら、裏のタブ → 表示中のタブの順で結果をディスクへ逃がす。"""
+        if self._is_closing:
+            return
+        moved = 0
+        for store in self._tab_views.stores() + [self._cells]:
+            if self._memory_usage()['bytes'] <= target_bytes:
+                break
+            moved += store.spill_results()
+        held = self._memory_usage()['bytes']
+        if held > target_bytes:
+            logger.warning("matrix memory is %.1f MiB after spilling %d results (budget %.1f MiB); close unused tabs to free more",
+                           held / memory_accounting.MiB, moved, target_bytes / memory_accounting.MiB)
+        else:
+            logger.info("matrix memory budget: spilled %d results to disk (now %.1f MiB)", moved, held / memory_accounting.MiB)
+
+    def _tab_state(self, tab: dict) -> Optional[dict]:
+        """保存用の state。LRU に預けてあるタブはそこから作る。"""
+        entry = self._tab_views.get(tab)
+        if entry is not None:
+            return self._build_state(entry['cells'], entry['row_summaries'], entry['col_summaries'])
+        return tab.get('state')
+
+    def _switch_grid(self, old_count: int, had_row_summary: bool):
+        """行ビューを壊さずに、アクティブタブの内容へ付け替える（列数の差分だけ設定し直す）"""
+        if self._is_closing or not self.winfo_exists():
+            return
+        if self._header_frame is None or bool(self._row_summaries) != had_row_summary:
+            # 行まとめ列の有無が変わると行ビューの構成が違うので作り直す
+            self._update_ui()
+            return
+        if self._grid_refresh_job is not None:
+            try:
+                self.after_cancel(self._grid_refresh_job)
+            except Exception:
+                pass
+            self._grid_refresh_job = None
+        self._ensure_grid_state()
+        for r in list(self._row_views):
+            self._release_row_view(self._row_views.pop(r))
+        self._relayout_columns(old_count)
+        self._build_header_row()
+        self._update_column_summary_row()
+        self._place_row_summary_widgets()
+        self._refresh_visible_rows()
+
+    def _count_widgets(self) -> int:
+        count = 0
+        stack = list(self.winfo_children())
+        while stack:
+            w = stack.pop()
+            count += 1
+            try:
+                stack.extend(w.winfo_children())
+            except Exception:
+                pass
+        return count
 
     def _render_tabbar(self):
         # Clear and rebuild tab buttons
@@ -567,19 +734,9 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 self._active_tab_index = len(self._tabs) - 1
         # 再描画と内容の即時切替
         self._rebuild_tabs()
-        # 高速切替: 既存フレームがあれば表示差し替え、なければ構築
-        tab_frame = self._tabs[self._active_tab_index].get('frame')
-        if tab_frame:
-            self.scrollable_content_frame = tab_frame
-            try:
-                self.canvas.itemconfigure(self._window_id, window=self.scrollable_content_frame)
-                self.after(1, lambda: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-            except Exception:
-                pass
-        else:
-            self._update_ui()
+        self._update_ui()
         try:
-            self._save_session()
+            self._schedule_session_save()
         except Exception:
             pass
 
@@ -594,16 +751,16 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         self._tabs[idx]['name'] = new_name
         self._render_tabbar()
         try:
-            self._save_session()
+            self._schedule_session_save()
         except Exception:
             pass
 
     def _load_session_or_default(self):
-        import json
-        sf = self._session_file()
-        if sf.exists() and not getattr(self, '_start_with_default_only', False):
+        if not getattr(self, '_start_with_default_only', False):
             try:
-                data = json.loads(sf.read_text(encoding='utf-8'))
+                data = self._session_store.load()
+                if not data:
+                    raise ValueError('no session')
                 tabs_data = data.get('tabs', [])
                 self._tabs = []
                 for t_data in tabs_data[:5]:
@@ -614,69 +771,106 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                     prompts = t_data.get('prompts') or {}
                     state = t_data.get('state') or None
                     prompts_obj = self._deserialize_prompts(prompts)
-                    self._tabs.append({'name': name, 'prompts_obj': prompts_obj, 'state': state})
-                    logging.debug(f"DEBUG: _load_session_or_default - Loaded tab '{name}' with prompts_obj keys: {list(prompts_obj.keys())}")
+                    self._tabs.append({'name': name, 'prompts_obj': prompts_obj, 'state': state, 'uid': t_data.get('uid')})
+                    logger.debug("_load_session_or_default - Loaded tab '%s' with prompts_obj keys: %s", name, list(prompts_obj))
                 self._active_tab_index = int(data.get('active', 0)) if self._tabs else 0
                 # Fallback: if loaded tabs are empty and we have initial prompts, seed default
                 if (not self._tabs) or (len(self._tabs) == 1 and not self._tabs[0].get('prompts_obj') and getattr(self, '_initial_prompts', {})):
                     initial_prompts_filtered = {pid: p for pid, p in getattr(self, '_initial_prompts', {}).items() if getattr(p, 'include_in_matrix', False)}
-                    self._tabs = [{'name': tr('matrix.tab.default'), 'prompts_obj': {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in initial_prompts_filtered.items()}, 'state': None}]
+                    self._tabs = [{'name': tr('matrix.tab.default'), 'prompts_obj': self._share_prompts(initial_prompts_filtered), 'state': None}]
                     self._active_tab_index = 0
-                    logging.debug(f"DEBUG: _load_session_or_default - Fallback to default tab with filtered _initial_prompts keys: {list(initial_prompts_filtered.keys())}")
+                    logger.debug("_load_session_or_default - Fallback to default tab with filtered _initial_prompts keys: %s", list(initial_prompts_filtered))
                 if not self._tabs:
                     raise ValueError('empty')
                 # Ensure UI tabs are constructed when loading from session
                 self._rebuild_tabs()
                 return
             except Exception as e:
-                logging.error(f"ERROR: _load_session_or_default - Error loading session: {e}")
+                logger.error("_load_session_or_default - Error loading session: %s", e)
                 pass
         # Default single tab from current prompts (store Prompt objects)
         base_prompts = getattr(self, '_initial_prompts', self.prompts)
         base_prompts_filtered = {pid: p for pid, p in base_prompts.items() if getattr(p, 'include_in_matrix', False)}
-        self._tabs = [{'name': tr('matrix.tab.default'), 'prompts_obj': {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in base_prompts_filtered.items()}, 'state': None}]
+        self._tabs = [{'name': tr('matrix.tab.default'), 'prompts_obj': self._share_prompts(base_prompts_filtered), 'state': None}]
         self._active_tab_index = 0
-        logging.debug(f"DEBUG: _load_session_or_default - Initializing with default tab from filtered base_prompts keys: {list(base_prompts_filtered.keys())}")
+        logger.debug("_load_session_or_default - Initializing with default tab from filtered base_prompts keys: %s", list(base_prompts_filtered))
         # Build UI tabs
         self._rebuild_tabs()
         # After first build, disable the flag so future loads can open sessions if needed
         self._start_with_default_only = False
 
-    def _save_session(self):
+    def _save_session(self, flush: bool = False):
         """セッション保存: 現在開いている全タブ（最大5）とアクティブタブ、
-        各タブのプロンプトセットとマトリクスのチェック/結果状態を `prompt_set/session.json` に保存します。
+        各タブのプロンプトセットとマトリクスのチェック/結果状態を `prompt_set/session/` に保存します。
+        前回から変わったタブだけをスナップショットし、書き込みはバックグラウンドで行います。
         次回起動時はこのセッションを復元します（プリセットとは別管理）。"""
-        import json
-        # Snapshot active before saving and serialize
+        if self._session_save_job is not None:
+            try:
+                self.after_cancel(self._session_save_job)
+            except Exception:
+                pass
+            self._session_save_job = None
         try:
             if 0 <= self._active_tab_index < len(self._tabs):
-                self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
-                self._tabs[self._active_tab_index]['state'] = self._snapshot_state()
+                self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
         except Exception:
             pass
-        tabs_payload = []
+        manifest_tabs = []
+        payloads: Dict[str, dict] = {}
+        fingerprints: Dict[str, Any] = {}
         for t in self._tabs[:5]:
             try:
-                tabs_payload.append({
+                uid = self._tab_uid(t)
+                manifest_tabs.append({'uid': uid, 'name': t.get('name')})
+                fp = self._tab_fingerprint(t)
+                if not self._session_store.is_dirty(uid, fp):
+                    continue
+                payloads[uid] = {
                     'name': t.get('name'),
                     'prompts': self._serialize_prompts(t.get('prompts_obj', {})),
-                    'state': t.get('state')
-                })
+                    'state': self._snapshot_state() if t is self._live_tab else self._tab_state(t)
+                }
+                fingerprints[uid] = fp
             except Exception:
                 continue
-        data = { 'tabs': tabs_payload, 'active': self._active_tab_index }
-        try:
-            self._session_file().write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
-        except Exception:
-            pass
+        self._session_store.save({'tabs': manifest_tabs, 'active': self._active_tab_index}, payloads, fingerprints)
+        if flush:
+            self._session_store.flush()
+
+    def _schedule_session_save(self):
+        """連続した変更をまとめて、少し待ってから _save_session を1回だけ実行する"""
+        if self._session_save_job is not None:
+            try:
+                self.after_cancel(self._session_save_job)
+            except Exception:
+                pass
+        self._session_save_job = self.after(self.SESSION_SAVE_DEBOUNCE_MS, self._save_session)
+
+    def _tab_uid(self, tab: dict) -> str:
+        uid = tab.get('uid')
+        if not uid:
+            uid = tab['uid'] = uuid.uuid4().hex[:12]
+        return uid
+
+    def _tab_fingerprint(self, tab: dict) -> tuple:
+        """タブの内容が前回の保存から変わったかを判定するための値（スナップショットより十分安い）"""
+        # Prompt は差し替えでしか変わらないので、オブジェクトの比較で足りる
+        prompts = tuple((tab.get('prompts_obj') or {}).items())
+        if tab is self._live_tab:
+            cells, rs, cs = self._cells, self._row_summaries, self._col_summaries
+        else:
+            entry = self._tab_views.get(tab)
+            if entry is None:
+                return (tab.get('name'), prompts, tab.get('state'))
+            cells, rs, cs = entry['cells'], entry['row_summaries'], entry['col_summaries']
+        summaries = tuple(sv.get() if hasattr(sv, 'get') else str(sv or '') for sv in list(rs) + list(cs))
+        return (tab.get('name'), prompts, cells.version, summaries)
 
     def _save_session_as(self, name: str):
-        """セッションを任意の名前で保存（複数保存対応）。"""
-        import json
+        """セッションを任意の名前で保存（複数保存対応）。書き込みはバックグラウンドで行う。"""
         try:
             if 0 <= self._active_tab_index < len(self._tabs):
-                self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
-                self._tabs[self._active_tab_index]['state'] = self._snapshot_state()
+                self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
         except Exception:
             pass
         tabs_payload = []
@@ -685,17 +879,21 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 tabs_payload.append({
                     'name': t.get('name'),
                     'prompts': self._serialize_prompts(t.get('prompts_obj', {})),
-                    'state': t.get('state')
+                    'state': self._snapshot_state() if t is self._live_tab else self._tab_state(t)
                 })
             except Exception:
                 continue
         data = { 'tabs': tabs_payload, 'active': self._active_tab_index }
-        self._session_file_for(name).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+        future = self._session_store.save_named(name, data)
+
+        def _on_done(f):
+            err = f.exception()
+            if err is not None and not self._is_closing:
+                self.after(0, lambda: CTkMessagebox(title=tr("common.error"), message=tr("matrix.session.save_failed", details=str(err)), icon="cancel"))
+        future.add_done_callback(_on_done)
 
     def _load_session_named(self, name: str):
-        import json
-        f = self._session_file_for(name)
-        data = json.loads(f.read_text(encoding='utf-8'))
+        data = self._session_store.load_named(name)
         tabs_data = data.get('tabs', [])
         self._tabs = []
         for t_data in tabs_data[:5]:
@@ -722,11 +920,10 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         if preset is None:
             return
         name, prompts = preset
-        # Snapshot current active tab BEFORE switching
+        # Keep current active tab's prompts BEFORE switching (its state stays live in _tab_views)
         try:
             if 0 <= self._active_tab_index < len(self._tabs):
-                self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
-                self._tabs[self._active_tab_index]['state'] = self._snapshot_state()
+                self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
         except Exception:
             pass
         if not name:
@@ -759,7 +956,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             import json, time
             serialized = self._serialize_prompts(self.prompts)
             self._tabs[self._active_tab_index]['name'] = name
-            self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
+            self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
             file = self._prompt_set_dir() / f"{name}.json"
             file.write_text(json.dumps({'name': name, 'prompts': serialized}, ensure_ascii=False, indent=2), encoding='utf-8')
             # Update tab title
@@ -791,23 +988,11 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             # 削除位置に応じてインデックス調整
             if self._active_tab_index >= len(self._tabs):
                 self._active_tab_index = len(self._tabs) - 1
-        # UI再構築と保存
+        # UI再構築と保存（新しいアクティブタブの内容は _rebuild_tabs で反映される）
         self._rebuild_tabs()
-        # 新しいアクティブタブの内容を反映
-        try:
-            t = self._tabs[self._active_tab_index]
-            prompts_obj = t.get('prompts_obj', {})
-            self.prompts = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in prompts_obj.items()} if prompts_obj else {}
-        except Exception:
-            self.prompts = {}
-        self.checkbox_states = []
-        self.results = []
-        self._full_results = []
-        self._row_summaries = []
-        self._col_summaries = []
         self._update_ui()
         try:
-            self._save_session()
+            self._schedule_session_save()
         except Exception:
             pass
 
@@ -890,13 +1075,9 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             self.prompts = {}
         except Exception:
             self.prompts = {}
-        self.checkbox_states = []
-        self.results = []
-        self._full_results = []
+        self._cells.clear()
         self._row_summaries = []
         self._col_summaries = []
-        self._result_textboxes = []
-        self._cell_style = []
         self._update_ui()
 
     def _open_summary_settings(self):
@@ -981,7 +1162,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 serialized = self._serialize_prompts(self.prompts)
                 # 更新: タブ表示名とプロンプトオブジェクト
                 self._tabs[self._active_tab_index]['name'] = name
-                self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
+                self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
                 file = self._prompt_set_dir() / f"{name}.json"
                 file.write_text(json.dumps({'name': name, 'prompts': serialized}, ensure_ascii=False, indent=2), encoding='utf-8')
                 self._rebuild_tabs()
@@ -1046,8 +1227,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         row2 = ctk.CTkFrame(dlg, fg_color="transparent")
         row2.pack(fill='x', padx=12, pady=6)
         try:
-            sess_files = sorted(self._sessions_dir().glob('*.json'), key=lambda p: p.stat().st_mtime, reverse=True)
-            sess_names = [p.stem for p in sess_files]
+            sess_names = self._session_store.list_named()
         except Exception:
             sess_names = []
         sess_var = ctk.StringVar(value=(sess_names[0] if sess_names else ""))
@@ -1069,9 +1249,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             if not name:
                 return
             try:
-                f = self._session_file_for(name)
-                if f.exists():
-                    f.unlink()
+                if self._session_store.delete_named(name):
                     CTkMessagebox(title=tr("common.success"), message=tr("matrix.session.deleted"), icon="info").wait_window()
                     dlg.destroy()
             except Exception as e:
@@ -1102,7 +1280,13 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             pass
 
     def _create_main_grid_frame(self):
-        """マトリクスグリッドを配置するためのスクロール可能フレームを作成する"""
+        """マトリクスグリッドを配置するためのスクロール可能キャンバスを作成する。
+
+        見出し行・列まとめ行・各データ行は、それぞれ canvas 上の独立したウィンドウとして置く。
+        データ行は表示範囲にあるものだけを作り、スクロールに合わせて位置と内容を差し替えて再利用する。
+        行内の結果セルも表示範囲の列だけに作る。見出し行と列まとめ行は全列ぶん作るため、
+        列数は MAX_PROMPT_COLUMNS までに制限している。
+        """
         self.canvas_frame = ctk.CTkFrame(self, fg_color=styles.MATRIX_CANVAS_BACKGROUND_COLOR)
         self.canvas_frame.pack(fill="both", expand=True, padx=10, pady=(0,5))
 
@@ -1114,35 +1298,21 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 
         self.v_scrollbar = ctk.CTkScrollbar(self.canvas_frame, orientation="vertical", command=self.canvas.yview)
         self.v_scrollbar.pack(side="right", fill="y")
-        self.canvas.configure(yscrollcommand=self.v_scrollbar.set)
+        self.canvas.configure(yscrollcommand=self._on_grid_yscroll)
 
         self.h_scrollbar = ctk.CTkScrollbar(self, orientation="horizontal", command=self.canvas.xview)
         self.h_scrollbar.pack(fill="x", side="bottom", padx=10, pady=(0, 10))
-        self.canvas.configure(xscrollcommand=self.h_scrollbar.set)
+        self.canvas.configure(xscrollcommand=self._on_grid_xscroll)
 
-        # タブごとの内容フレーム（キャッシュ）
-        self.scrollable_content_frame = ctk.CTkFrame(self.canvas, fg_color="transparent")
-        self._window_id = self.canvas.create_window((0, 0), window=self.scrollable_content_frame, anchor="nw")
-        # タブにフレームを格納し、切替時はフレームを差し替える
-        try:
-            if 0 <= self._active_tab_index < len(self._tabs):
-                self._tabs[self._active_tab_index]['frame'] = self.scrollable_content_frame
-        except Exception:
-            pass
-
-        self.scrollable_content_frame.bind("<Configure>", self._on_frame_configure)
         self.canvas.bind("<Configure>", self._on_canvas_configure)
 
-        self.scrollable_content_frame.grid_columnconfigure(0, weight=0)
-        self.scrollable_content_frame.grid_rowconfigure(0, weight=0)
-
         self.run_button_frame = ctk.CTkFrame(self, fg_color=styles.MATRIX_TOP_BG_COLOR)
         self.run_button_frame.pack(fill="x", padx=10, pady=10, side="bottom")
         self.run_button_frame.grid_columnconfigure((0, 1, 2, 3, 4, 5), weight=1)
 
         # Order: 実行, フロー実行, 行まとめ, 列まとめ, 行列まとめ, エクセル出力
         ctk.CTkButton(self.run_button_frame, text=tr("matrix.run"), command=self._run_batch_processing, fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR).grid(row=0, column=0, padx=5, pady=5, sticky="ew")
-        
+
         self.flow_run_button = ctk.CTkButton(self.run_button_frame, text=tr("matrix.run_flow"), command=self._run_flow_processing, fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR)
         self.flow_run_button.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
 
@@ -1155,21 +1325,329 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         self.summarize_matrix_button = ctk.CTkButton(self.run_button_frame, text=tr("matrix.matrix_summary"), command=self._summarize_matrix, state="disabled", fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR)
         self.summarize_matrix_button.grid(row=0, column=4, padx=5, pady=5, sticky="ew")
 
-        self.export_excel_button = ctk.CTkButton(self.run_button_frame, text="Excel", command=self._export_to_excel, state="disabled", fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR)
+        self.export_excel_button = ctk.CTkButton(self.run_button_frame, text=tr("matrix.export.button"), command=self._export_results, state="disabled", fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR)
         self.export_excel_button.grid(row=0, column=5, padx=5, pady=5, sticky="ew")
 
-    def _on_frame_configure(self, event):
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-        self.tooltip_window = None
+    # --- Virtualized grid ---
+    def _grid_row_pitch(self) -> int:
+        # セル高さ + 上下の pady(5)
+        return styles.MATRIX_RESULT_CELL_HEIGHT + 10
+
+    def _grid_col_pitch(self) -> int:
+        # セル幅 + 左右の padx(5)
+        return styles.MATRIX_CELL_WIDTH + 10
+
+    def _grid_column_count(self) -> int:
+        return 1 + len(self.prompts) + (1 if self._row_summaries else 0)
+
+    def _configure_grid_columns(self, frame) -> None:
+        """行フレームの列幅を固定する（空き列も同じ幅にして、見出し・各行の列位置を揃える）"""
+        col_pitch = self._grid_col_pitch()
+        for i in range(self._grid_column_count()):
+            frame.grid_columnconfigure(i, weight=0, minsize=col_pitch)
+        frame.grid_rowconfigure(0, weight=0, minsize=self._grid_row_pitch())
+
+    def _on_grid_yscroll(self, first, last):
+        self.v_scrollbar.set(first, last)
+        self._schedule_grid_refresh()
+
+    def _on_grid_xscroll(self, first, last):
+        self.h_scrollbar.set(first, last)
+        self._schedule_grid_refresh()
 
     def _on_canvas_configure(self, event):
-        self.canvas.coords(self._window_id, 0, 0)
-        self._on_frame_configure(event)
+        self._schedule_grid_refresh()
+
+    def _schedule_grid_refresh(self):
+        # スクロール中の連続イベントは1回の更新にまとめる
+        if self._grid_refresh_job is not None or self._is_closing:
+            return
+        try:
+            self._grid_refresh_job = self.after_idle(self._refresh_visible_rows)
+        except tk.TclError:
+            self._grid_refresh_job = None
+
+    def _visible_row_range(self) -> tuple[int, int]:
+        """表示範囲にかかるデータ行 [first, last) を返す（前後の余白行を含む）"""
+        pitch = self._grid_row_pitch()
+        try:
+            top = self.canvas.canvasy(0)
+            height = max(1, self.canvas.winfo_height())
+        except tk.TclError:
+            return 0, 0
+        # 0 行目は見出しなので、データ行 r は y = (r + 1) * pitch から始まる
+        first = int((top - pitch) // pitch) - self.GRID_OVERSCAN_ROWS
+        last = int((top + height - pitch) // pitch) + 1 + self.GRID_OVERSCAN_ROWS
+        return max(0, first), min(len(self.input_data), max(0, last))
+
+    def _visible_col_range(self) -> tuple[int, int]:
+        """表示範囲にかかるプロンプト列 [first, last) を返す（入力列・行まとめ列は常に表示）"""
+        pitch = self._grid_col_pitch()
+        try:
+            left = self.canvas.canvasx(0)
+            width = max(1, self.canvas.winfo_width())
+        except tk.TclError:
+            return 0, 0
+        first = int((left - pitch) // pitch) - self.GRID_OVERSCAN_COLS
+        last = int((left + width - pitch) // pitch) + 1 + self.GRID_OVERSCAN_COLS
+        return max(0, first), min(len(self.prompts), max(0, last))
+
+    def _layout_grid(self):
+        """スクロール領域と列まとめ行の位置を、行数・列数から直接計算して設定する"""
+        pitch = self._grid_row_pitch()
+        body_bottom = pitch * (len(self.input_data) + 1)
+        height = body_bottom
+        try:
+            if self._footer_frame is not None and self._footer_window_id is not None:
+                self.canvas.coords(self._footer_window_id, 0, body_bottom)
+                height += max(pitch, self._footer_frame.winfo_reqheight())
+            width = self._grid_column_count() * self._grid_col_pitch()
+            self.canvas.configure(scrollregion=(0, 0, width, height))
+        except tk.TclError:
+            pass
+
+    def _refresh_visible_rows(self):
+        """表示範囲に入った行/列にだけウィジェットを割り当て、外れたものは回収して再利用する"""
+        self._grid_refresh_job = None
+        if self._is_closing or not self.winfo_exists():
+            return
+        first, last = self._visible_row_range()
+        col_first, col_last = self._visible_col_range()
+        for r in [r for r in self._row_views if not (first <= r < last)]:
+            self._release_row_view(self._row_views.pop(r))
+        for r in range(first, last):
+            view = self._row_views.get(r)
+            if view is None:
+                view = self._row_view_pool.pop() if self._row_view_pool else self._create_row_view()
+                self._bind_row_view(view, r)
+                self._row_views[r] = view
+            self._sync_row_cells(view, col_first, col_last)
+
+    def _get_delete_icon(self) -> Optional[ctk.CTkImage]:
+        """行/列削除ボタンのアイコン（ファイルは一度だけ読み込む）"""
+        if not self._delete_icon_loaded:
+            self._delete_icon_loaded = True
+            try:
+                icon_path = Path(DELETE_ICON_FILE)
+                if icon_path.exists():
+                    icon_img = Image.open(icon_path)
+                    size = (16, 16)
+                    icon_img.thumbnail(size)
+                    self._delete_icon = ctk.CTkImage(light_image=icon_img, dark_image=icon_img, size=size)
+            except Exception:
+                self._delete_icon = None
+        return self._delete_icon
+
+    def _create_row_view(self) -> Dict[str, Any]:
+        """データ1行ぶんの入れ物を作る。どの行を表示するかは _bind_row_view で決まる。"""
+        frame = ctk.CTkFrame(self.canvas, fg_color="transparent")
+        self._configure_grid_columns(frame)
+        view: Dict[str, Any] = {"frame": frame, "row": -1, "cells": {}, "spare": [], "input_widget": None, "summary": None}
+
+        input_cell_frame = ctk.CTkFrame(frame, border_width=1, border_color=styles.MATRIX_CELL_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
+        input_cell_frame.grid(row=0, column=0, padx=5, pady=5, sticky="nsew")
+        input_cell_frame.grid_propagate(False)
+        input_cell_frame.grid_columnconfigure(2, weight=1)
+        view["input_frame"] = input_cell_frame
+
+        row_header_frame = ctk.CTkFrame(input_cell_frame)
+        row_header_frame.grid(row=0, column=0, padx=(5, 2), pady=2, sticky="w")
+        row_header_frame.grid_columnconfigure(0, weight=1)
+
+        row_num_label = ctk.CTkLabel(row_header_frame, text="", font=styles.MATRIX_FONT_BOLD)
+        row_num_label.grid(row=0, column=0, sticky="w")
+        view["row_label"] = row_num_label
+
+        delete_row_icon = self._get_delete_icon()
+        # 行ビューは使い回すので、コールバックは押された時点の view["row"] を参照する
+        delete_row_button = ctk.CTkButton(row_header_frame, text="" if delete_row_icon else tr("common.delete"), image=delete_row_icon, width=24, height=24, fg_color=styles.MATRIX_DELETE_BUTTON_COLOR, hover_color=styles.MATRIX_DELETE_BUTTON_HOVER_COLOR, command=lambda v=view: self._delete_row(v["row"]))
+        delete_row_button.grid(row=0, column=1, padx=(5, 0), sticky="e")
+
+        input_label = ctk.CTkLabel(input_cell_frame, text=tr("action.input").rstrip(':'), font=styles.MATRIX_FONT_BOLD, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
+        input_label.grid(row=0, column=1, padx=(5, 2), pady=2, sticky="w")
+
+        attach_button = ctk.CTkButton(input_cell_frame, text=tr("action.attach"), width=50, fg_color=styles.FILE_ATTACH_BUTTON_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR, command=lambda v=view: self._select_input_source(v["row"]))
+        attach_button.grid(row=0, column=3, padx=2, pady=2, sticky="e")
+
+        history_button = ctk.CTkButton(input_cell_frame, text=tr("history.button"), width=50, fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR, command=lambda v=view: self._show_clipboard_history_popup(v["row"]))
+        history_button.grid(row=0, column=4, padx=2, pady=2, sticky="e")
+        input_cell_frame.grid_columnconfigure(4, weight=0)
+
+        if self._row_summaries:
+            view["summary"] = self._create_summary_cell_view(frame, len(self.prompts) + 1, lambda v=view: self._show_full_row_summary_popup(v["row"]))
+
+        view["window_id"] = self.canvas.create_window((0, 0), window=frame, anchor="nw", state="hidden")
+        return view
+
+    def _create_cell_view(self, view: Dict[str, Any]) -> Dict[str, Any]:
+        cell: Dict[str, Any] = {"col": -1}
+        cell_frame = ctk.CTkFrame(view["frame"], border_width=1, border_color=styles.MATRIX_CELL_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
+        cell_frame.grid_propagate(False)
+        cell_frame.grid_columnconfigure(1, weight=1)
+
+        # チェック状態の正本は self._cells。Tk変数はこのセルビュー（可視セル）だけが持つ
+        check_var = ctk.BooleanVar(value=False)
+        checkbox = ctk.CTkCheckBox(cell_frame, text="", width=15, variable=check_var, command=lambda v=view, cl=cell: self._on_cell_checkbox(v, cl))
+        checkbox.grid(row=0, column=0, padx=0, pady=2, sticky="w")
+
+        inner_h = max(20, styles.MATRIX_RESULT_CELL_HEIGHT - 6)
+        result_textbox = ctk.CTkTextbox(cell_frame, wrap="word", height=inner_h, font=styles.MATRIX_RESULT_FONT, fg_color=styles.HISTORY_ITEM_FG_COLOR, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
+        result_textbox.grid(row=0, column=1, padx=(0,2), pady=2, sticky="nsew")
+        result_textbox.configure(state="disabled")
+        result_textbox.bind("<Button-1>", lambda event, v=view, cl=cell: self._show_full_result_popup(v["row"], cl["col"]))
+
+        cell.update(frame=cell_frame, checkbox=checkbox, check_var=check_var, textbox=result_textbox)
+        return cell
+
+    def _on_cell_checkbox(self, view: Dict[str, Any], cell: Dict[str, Any]):
+        r, c = view["row"], cell["col"]
+        if 0 <= r < self._cells.rows and 0 <= c < self._cells.cols:
+            self._cells.set_checked(r, c, bool(cell["check_var"].get()))
+
+    def _create_summary_cell_view(self, parent, column: int, on_click: Callable[[], None]) -> Dict[str, Any]:
+        cell: Dict[str, Any] = {"col": column, "var": None, "trace": None}
+        summary_cell_frame = ctk.CTkFrame(parent, border_width=1, border_color=styles.MATRIX_CELL_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
+        summary_cell_frame.grid_propagate(False)
+        summary_cell_frame.grid(row=0, column=column, padx=5, pady=5, sticky="nsew")
+        inner_h = max(20, styles.MATRIX_RESULT_CELL_HEIGHT - 6)
+        summary_textbox = ctk.CTkTextbox(summary_cell_frame, width=styles.MATRIX_CELL_WIDTH, height=inner_h, wrap="word", fg_color=styles.HISTORY_ITEM_FG_COLOR, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
+        summary_textbox.configure(state="disabled")
+        summary_textbox.pack(fill="both", expand=True, padx=2, pady=2)
+        summary_textbox.bind("<Button-1>", lambda e: on_click())
+        summary_textbox.bind("<Enter>", lambda e: e.widget.configure(cursor="hand2"))
+        summary_textbox.bind("<Leave>", lambda e: e.widget.configure(cursor=""))
+        cell.update(frame=summary_cell_frame, textbox=summary_textbox)
+        return cell
+
+    def _bind_row_view(self, view: Dict[str, Any], r: int):
+        """行ビューをデータ行 r に割り当て、canvas 上の位置と表示内容を差し替える"""
+        view["row"] = r
+        try:
+            self._fill_input_cell(view, self.input_data[r])
+            for c, cell in view["cells"].items():
+                # 範囲外になった列は直後の _sync_row_cells で回収される
+                if c < len(self.prompts):
+                    self._bind_cell(view, cell, c)
+            summary = view.get("summary")
+            if summary is not None and r < len(self._row_summaries):
+                self._bind_summary_cell(summary, self._row_summaries[r])
+            self._place_row_view(view)
+            self.canvas.itemconfigure(view["window_id"], state="normal")
+        except tk.TclError:
+            pass
+
+    def _place_row_view(self, view: Dict[str, Any]):
+        r = view["row"]
+        view["row_label"].configure(text=f"{r + 1}")
+        self.canvas.coords(view["window_id"], 0, self._grid_row_pitch() * (r + 1))
+
+    def _sync_row_cells(self, view: Dict[str, Any], col_first: int, col_last: int):
+        """行ビュー内の結果セルを表示範囲の列 [col_first, col_last) に合わせる"""
+        cells = view["cells"]
+        for c in [c for c in cells if not (col_first <= c < col_last)]:
+            cell = cells.pop(c)
+            cell["col"] = -1
+            try:
+                cell["frame"].grid_remove()
+            except tk.TclError:
+                pass
+            view["spare"].append(cell)
+        for c in range(col_first, col_last):
+            if c not in cells:
+                cell = view["spare"].pop() if view["spare"] else self._create_cell_view(view)
+                self._bind_cell(view, cell, c)
+                cells[c] = cell
+
+    def _bind_cell(self, view: Dict[str, Any], cell: Dict[str, Any], c: int):
+        if cell["col"] != c:
+            cell["frame"].grid(row=0, column=c + 1, padx=5, pady=5, sticky="nsew")
+        cell["col"] = c
+        self._refresh_cell_view(view, cell)
+
+    def _bind_summary_cell(self, cell: Dict[str, Any], var: ctk.StringVar):
+        self._unbind_var(cell)
+        cell["var"] = var
+        cell["trace"] = var.trace_add("write", lambda *args, cl=cell: self._refresh_summary_cell(cl))
+        self._refresh_summary_cell(cell)
+
+    def _unbind_var(self, cell: Dict[str, Any]):
+        var, trace = cell.get("var"), cell.get("trace")
+        if var is not None and trace:
+            try:
+                var.trace_remove("write", trace)
+            except Exception:
+                pass
+        cell["var"] = None
+        cell["trace"] = None
+
+    def _refresh_cell_view(self, view: Dict[str, Any], cell: Dict[str, Any]):
+        r, c = view["row"], cell["col"]
+        if not (0 <= r < self._cells.rows and 0 <= c < self._cells.cols):
+            return
+        cell["check_var"].set(self._cells.is_checked(r, c))
+        self._set_textbox_text(cell["textbox"], self._cells.display(r, c), self._cells.style(r, c))
+
+    def _refresh_cell(self, r_idx: int, c_idx: int):
+        """(r, c) が表示中ならセルビューをストアの内容で描き直す（画面外なら何もしない）"""
+        cell = self._cell_view(r_idx, c_idx)
+        if cell is not None:
+            self._refresh_cell_view(self._row_views[r_idx], cell)
+
+    def _set_cell_result(self, r_idx: int, c_idx: int, text: str):
+        if 0 <= r_idx < self._cells.rows and 0 <= c_idx < self._cells.cols:
+            self._cells.set_result(r_idx, c_idx, text)
+            self._refresh_cell(r_idx, c_idx)
+
+    def _set_cell_display(self, r_idx: int, c_idx: int, text: Optional[str]):
+        if 0 <= r_idx < self._cells.rows and 0 <= c_idx < self._cells.cols:
+            self._cells.set_display(r_idx, c_idx, text)
+            self._refresh_cell(r_idx, c_idx)
+
+    def _set_cell_checked(self, r_idx: int, c_idx: int, value: bool):
+        if 0 <= r_idx < self._cells.rows and 0 <= c_idx < self._cells.cols:
+            self._cells.set_checked(r_idx, c_idx, value)
+            self._refresh_cell(r_idx, c_idx)
+
+    def _refresh_summary_cell(self, cell: Dict[str, Any]):
+        var = cell.get("var")
+        if var is not None:
+            self._set_textbox_text(cell["textbox"], var.get())
+
+    def _cell_view(self, r_idx: int, c_idx: int) -> Optional[Dict[str, Any]]:
+        view = self._row_views.get(r_idx)
+        return view["cells"].get(c_idx) if view is not None else None
+
+    def _release_row_view(self, view: Dict[str, Any]):
+        """表示範囲から外れた行ビューを隠してプールへ戻す"""
+        if view.get("summary") is not None:
+            self._unbind_var(view["summary"])
+        view["row"] = -1
+        try:
+            self.canvas.itemconfigure(view["window_id"], state="hidden")
+        except tk.TclError:
+            pass
+        self._row_view_pool.append(view)
+
+    def _destroy_row_views(self):
+        for view in list(self._row_views.values()) + self._row_view_pool:
+            if view.get("summary") is not None:
+                self._unbind_var(view["summary"])
+            try:
+                self.canvas.delete(view["window_id"])
+                view["frame"].destroy()
+            except tk.TclError:
+                pass
+        self._row_views = {}
+        self._row_view_pool = []
+
+    def _ensure_grid_state(self) -> None:
+        # ウィジェットは可視範囲だけだが、状態は全セルぶん持つ（実行・保存は全行が対象）
+        self._cells.resize(len(self.input_data), len(self.prompts))
 
     def _update_input_row_display(self, row_idx: int):
-        for widget in self.scrollable_content_frame.grid_slaves(row=row_idx + 1, column=0):
-            widget.destroy()
-        self._add_input_row_widgets(row_idx, self.input_data[row_idx])
+        view = self._row_views.get(row_idx)
+        if view is not None:
+            self._fill_input_cell(view, self.input_data[row_idx])
 
     def _show_tooltip(self, text):
         if self.tooltip_window:
@@ -1189,55 +1667,52 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 
     def _update_row_summary_column(self):
         """行まとめ列の表示/非表示、および内容の更新を行う"""
-        num_prompts = len(self.prompts)
-        summary_col_idx = num_prompts + 1
-
-        for widget in self.scrollable_content_frame.grid_slaves(column=summary_col_idx):
-            widget.destroy()
-
-        if self._row_summaries:
-            self.scrollable_content_frame.grid_columnconfigure(summary_col_idx, weight=0, minsize=styles.MATRIX_CELL_WIDTH)
-            summary_header_frame = ctk.CTkFrame(self.scrollable_content_frame, border_width=1, border_color=styles.MATRIX_HEADER_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
-            summary_header_frame.grid_propagate(False)
-            ctk.CTkLabel(summary_header_frame, text=tr("matrix.row_summary_header"), font=styles.MATRIX_FONT_BOLD).pack(fill="x", padx=2, pady=2)
-            summary_header_frame.grid(row=0, column=summary_col_idx, padx=5, pady=5, sticky="nsew")
+        # 列構成が変わるため見出しと可視行を作り直す（作るのは可視範囲ぶんだけ）
+        self._update_ui()
 
-            for r_idx, summary_var in enumerate(self._row_summaries):
-                summary_cell_frame = ctk.CTkFrame(self.scrollable_content_frame, border_width=1, border_color=styles.MATRIX_CELL_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
-                summary_cell_frame.grid_propagate(False)
-                summary_cell_frame.grid(row=r_idx + 1, column=summary_col_idx, padx=5, pady=5, sticky="nsew")
-                inner_h = max(20, styles.MATRIX_RESULT_CELL_HEIGHT - 6)
-                summary_textbox = ctk.CTkTextbox(summary_cell_frame, width=styles.MATRIX_CELL_WIDTH, height=inner_h, wrap="word", fg_color=styles.HISTORY_ITEM_FG_COLOR, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
-                summary_textbox.insert("1.0", summary_var.get())
-                summary_textbox.configure(state="disabled")
-                summary_textbox.pack(fill="both", expand=True, padx=2, pady=2)
-                summary_textbox.bind("<Button-1>", lambda e, r=r_idx: self._show_full_row_summary_popup(r))
-                summary_textbox.bind("<Enter>", lambda e: e.widget.configure(cursor="hand2"))
-                summary_textbox.bind("<Leave>", lambda e: e.widget.configure(cursor=""))
-                summary_var.trace_add("write", lambda name, index, mode, sv=summary_var, tb=summary_textbox: self._update_textbox_from_stringvar(sv, tb))
-        else:
-            self.scrollable_content_frame.grid_columnconfigure(summary_col_idx, weight=0, minsize=0)
+    def _ensure_footer_frame(self) -> ctk.CTkFrame:
+        if self._footer_frame is None:
+            frame = ctk.CTkFrame(self.canvas, fg_color="transparent")
+            self._configure_grid_columns(frame)
+            # SizerGrip でまとめセルが伸びたらスクロール領域も追従させる
+            frame.bind("<Configure>", lambda e: self._layout_grid())
+            self._footer_frame = frame
+            self._footer_window_id = self.canvas.create_window((0, self._grid_row_pitch() * (len(self.input_data) + 1)), window=frame, anchor="nw")
+        return self._footer_frame
+
+    def _destroy_footer_row(self):
+        for var, trace in self._footer_traces:
+            try:
+                var.trace_remove("write", trace)
+            except Exception:
+                pass
+        self._footer_traces = []
+        try:
+            if self._footer_frame is not None:
+                self._footer_frame.destroy()
+            if self._footer_window_id is not None:
+                self.canvas.delete(self._footer_window_id)
+        except tk.TclError:
+            pass
+        self._footer_frame = None
+        self._footer_window_id = None
 
     def _update_column_summary_row(self):
         """列まとめ行の表示/非表示、および内容の更新を行う"""
-        num_inputs = len(self.input_data)
-        summary_row_idx = num_inputs + 1
-
-        for widget in self.scrollable_content_frame.grid_slaves(row=summary_row_idx):
-            widget.destroy()
+        self._destroy_footer_row()
 
         if self._col_summaries:
-            self.scrollable_content_frame.grid_rowconfigure(summary_row_idx, weight=0, minsize=styles.MATRIX_RESULT_CELL_HEIGHT)
-            summary_header_frame = ctk.CTkFrame(self.scrollable_content_frame, border_width=1, border_color=styles.MATRIX_HEADER_BORDER_COLOR, height=styles.MATRIX_RESULT_CELL_HEIGHT)
+            footer = self._ensure_footer_frame()
+            summary_header_frame = ctk.CTkFrame(footer, border_width=1, border_color=styles.MATRIX_HEADER_BORDER_COLOR, height=styles.MATRIX_RESULT_CELL_HEIGHT)
             summary_header_frame.grid_propagate(False)
             ctk.CTkLabel(summary_header_frame, text=tr("matrix.col_summary_header"), font=styles.MATRIX_FONT_BOLD).pack(fill="x", padx=2, pady=2)
-            summary_header_frame.grid(row=summary_row_idx, column=0, padx=5, pady=5, sticky="nsew")
+            summary_header_frame.grid(row=0, column=0, padx=5, pady=5, sticky="nsew")
 
             for c_idx, summary_var in enumerate(self._col_summaries):
-                summary_cell_frame = ctk.CTkFrame(self.scrollable_content_frame, border_width=1, border_color=styles.MATRIX_CELL_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
-                summary_cell_frame.grid(row=summary_row_idx, column=c_idx + 1, padx=5, pady=5, sticky="nsew")
+                summary_cell_frame = ctk.CTkFrame(footer, border_width=1, border_color=styles.MATRIX_CELL_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
+                summary_cell_frame.grid(row=0, column=c_idx + 1, padx=5, pady=5, sticky="nsew")
                 summary_cell_frame.grid_propagate(False)
-                
+
                 summary_cell_frame.grid_rowconfigure(0, weight=1)
                 summary_cell_frame.grid_columnconfigure(0, weight=1)
 
@@ -1249,72 +1724,251 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 summary_textbox.bind("<Button-1>", lambda e, c=c_idx: self._show_full_col_summary_popup(c))
                 summary_textbox.bind("<Enter>", lambda e: e.widget.configure(cursor="hand2"))
                 summary_textbox.bind("<Leave>", lambda e: e.widget.configure(cursor=""))
-                summary_var.trace_add("write", lambda *args, sv=summary_var, tb=summary_textbox: self._update_textbox_from_stringvar(sv, tb))
+                trace = summary_var.trace_add("write", lambda *args, sv=summary_var, tb=summary_textbox: self._set_textbox_text(tb, sv.get()))
+                self._footer_traces.append((summary_var, trace))
 
                 sizer = SizerGrip(summary_cell_frame)
                 sizer.grid(row=1, column=1, sticky="se")
+        self._layout_grid()
+
+    def _build_header_row(self):
+        if self._header_frame is not None:
+            try:
+                self._header_frame.destroy()
+            except tk.TclError:
+                pass
+        self._header_frame = ctk.CTkFrame(self.canvas, fg_color="transparent")
+        self._configure_grid_columns(self._header_frame)
+
+        ctk.CTkLabel(self._header_frame, text="").grid(row=0, column=0, padx=5, pady=5, sticky="nsew")
+        # Reset header frames list before rebuilding
+        self._col_header_frames = []
+        for col_idx, (prompt_id, prompt_config) in enumerate(self.prompts.items()):
+            self._add_prompt_header_widgets(col_idx, prompt_id, prompt_config)
+
+        self._row_summary_header = None
+        if self._row_summaries:
+            summary_header_frame = ctk.CTkFrame(self._header_frame, border_width=1, border_color=styles.MATRIX_HEADER_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
+            summary_header_frame.grid_propagate(False)
+            ctk.CTkLabel(summary_header_frame, text=tr("matrix.row_summary_header"), font=styles.MATRIX_FONT_BOLD).pack(fill="x", padx=2, pady=2)
+            summary_header_frame.grid(row=0, column=len(self.prompts) + 1, padx=5, pady=5, sticky="nsew")
+            self._row_summary_header = summary_header_frame
+
+        if self._header_window_id is None:
+            self._header_window_id = self.canvas.create_window((0, 0), window=self._header_frame, anchor="nw")
         else:
-            self.scrollable_content_frame.grid_rowconfigure(summary_row_idx, weight=0, minsize=0)
+            self.canvas.itemconfigure(self._header_window_id, window=self._header_frame)
 
     def _update_ui(self):
-        self.scrollable_content_frame.update_idletasks()
+        """グリッドを描き直す。作るのは見出し行・列まとめ行と、表示範囲にあるデータ行だけ。"""
         if self._is_closing or not self.winfo_exists():
             return
+        if self._grid_refresh_job is not None:
+            try:
+                self.after_cancel(self._grid_refresh_job)
+            except Exception:
+                pass
+            self._grid_refresh_job = None
 
-        for widget in self.scrollable_content_frame.winfo_children():
-            widget.destroy()
-
-        num_prompts = len(self.prompts)
-        num_inputs = len(self.input_data)
-        
-        total_cols = 1 + num_prompts + (1 if self._row_summaries else 0)
-        for i in range(total_cols):
-            self.scrollable_content_frame.grid_columnconfigure(i, weight=0)
-        self.scrollable_content_frame.grid_columnconfigure(0, weight=0)
-        for i in range(1, num_prompts + 1):
-            self.scrollable_content_frame.grid_columnconfigure(i, weight=0, minsize=styles.MATRIX_CELL_WIDTH)
-        if self._row_summaries:
-            self.scrollable_content_frame.grid_columnconfigure(num_prompts + 1, weight=0, minsize=styles.MATRIX_CELL_WIDTH)
-
-        total_rows = 1 + num_inputs + (1 if self._col_summaries else 0)
-        for i in range(total_rows):
-            self.scrollable_content_frame.grid_rowconfigure(i, weight=0)
-        self.scrollable_content_frame.grid_rowconfigure(0, weight=0, minsize=styles.MATRIX_RESULT_CELL_HEIGHT)
-        for i in range(1, num_inputs + 1):
-            self.scrollable_content_frame.grid_rowconfigure(i, weight=0, minsize=styles.MATRIX_RESULT_CELL_HEIGHT)
+        self._ensure_grid_state()
+        # 列構成が変わっている可能性があるので、行ビューはプールごと作り直す
+        self._destroy_row_views()
+        self._build_header_row()
+        self._update_column_summary_row()
+        self._refresh_visible_rows()
+
+    # --- Incremental grid edits ---
+    # 行/列の追加・削除・移動では、状態配列を該当行/列だけ更新し、ウィジェットは
+    # 見出しと可視範囲のセルを付け替えるだけにする（_update_ui による全体の作り直しはしない）。
+    def _log_grid_edit(self, op: str, started: float):
+        logger.debug("matrix grid %s took %.2f ms (%d rows x %d cols, %d live rows)", op, (time.perf_counter() - started) * 1000, len(self.input_data), len(self.prompts), len(self._row_views))
+
+    def _state_delete_row(self, r: int):
+        self._cells.delete_row(r)
+        if self._row_summaries and 0 <= r < len(self._row_summaries):
+            self._row_summaries.pop(r)
+        if self._row_heights and 0 <= r + 1 < len(self._row_heights):
+            self._row_heights.pop(r + 1)
+        self._sync_cached_tab_rows(deleted_row=r)
+
+    def _state_insert_column(self, c: int):
+        """列 c に空の状態を差し込む（self.prompts には追加済みであること）"""
+        self._cells.resize(len(self.input_data), len(self.prompts) - 1)
+        self._cells.insert_col(c)
         if self._col_summaries:
-            self.scrollable_content_frame.grid_rowconfigure(num_inputs + 1, weight=0, minsize=styles.MATRIX_RESULT_CELL_HEIGHT)
+            self._col_summaries.insert(c, ctk.StringVar(value=""))
+
+    def _state_delete_column(self, c: int):
+        self._cells.delete_col(c)
+        if self._col_summaries and 0 <= c < len(self._col_summaries):
+            self._col_summaries.pop(c)
+        if self._column_widths and 0 <= c + 1 < len(self._column_widths):
+            self._column_widths.pop(c + 1)
+
+    def _state_move_column(self, src: int, dst: int):
+        self._cells.move_col(src, dst)
+        if self._col_summaries and max(src, dst) < len(self._col_summaries):
+            self._col_summaries.insert(dst, self._col_summaries.pop(src))
+        if self._column_widths:
+            while len(self._column_widths) < len(self.prompts):
+                self._column_widths.append(styles.MATRIX_CELL_WIDTH)
+            self._column_widths.insert(dst, self._column_widths.pop(src))
+
+    def _grid_frames(self) -> List[Any]:
+        """列構成を共有する行フレーム（見出し・列まとめ・可視行・プール）"""
+        frames = [self._header_frame, self._footer_frame]
+        frames += [v["frame"] for v in self._row_views.values()]
+        frames += [v["frame"] for v in self._row_view_pool]
+        return [f for f in frames if f is not None]
+
+    def _relayout_columns(self, old_count: int):
+        """列数の増減に合わせて、増えた/減った列の幅設定だけを更新する"""
+        new_count = self._grid_column_count()
+        col_pitch = self._grid_col_pitch()
+        for frame in self._grid_frames():
+            try:
+                for i in range(min(old_count, new_count), max(old_count, new_count)):
+                    frame.grid_columnconfigure(i, minsize=col_pitch if i < new_count else 0)
+            except tk.TclError:
+                pass
 
-        ctk.CTkLabel(self.scrollable_content_frame, text="").grid(row=0, column=0, padx=5, pady=5, sticky="nsew")
-        # Reset header frames list before rebuilding
-        self._col_header_frames = []
+    def _regrid_headers(self, start: int = 0):
+        for idx in range(start, len(self._col_header_frames)):
+            frame = self._col_header_frames[idx]
+            if frame is None:
+                continue
+            try:
+                frame.grid_configure(column=idx + 1)
+                label = getattr(frame, "_col_label", None)
+                if label is not None:
+                    label.configure(text=chr(ord('A') + idx))
+            except tk.TclError:
+                pass
 
-        for col_idx, (prompt_id, prompt_config) in enumerate(self.prompts.items()):
-            self._add_prompt_header_widgets(col_idx, prompt_id, prompt_config)
+    def _place_row_summary_widgets(self):
+        """行まとめ列（見出しと各行ビューのセル）を最終列へ置き直す"""
+        if not self._row_summaries:
+            return
+        column = len(self.prompts) + 1
+        try:
+            if self._row_summary_header is not None:
+                self._row_summary_header.grid_configure(column=column)
+            for view in list(self._row_views.values()) + self._row_view_pool:
+                summary = view.get("summary")
+                if summary is not None:
+                    summary["col"] = column
+                    summary["frame"].grid_configure(column=column)
+        except tk.TclError:
+            pass
 
-        for row_idx, input_item in enumerate(self.input_data):
-            self._add_input_row_widgets(row_idx, input_item)
+    def _remap_row_cells(self, mapping: Callable[[int], Optional[int]]):
+        """可視行の結果セルを新しい列番号へ付け替える。mapping が None を返した列のセルは回収する。
 
-        self._update_row_summary_column()
-        self._update_column_summary_row()
-        # アクティブタブに現在の変数参照を保存（高速切替用）
-        try:
-            if 0 <= self._active_tab_index < len(self._tabs):
-                self._tabs[self._active_tab_index]['vars'] = {
-                    'checkbox_states': self.checkbox_states,
-                    'results': self.results,
-                    '_full_results': self._full_results,
-                    '_row_summaries': self._row_summaries,
-                    '_col_summaries': self._col_summaries,
-                    '_result_textboxes': self._result_textboxes,
-                    '_cell_style': self._cell_style
-                }
-                self._tabs[self._active_tab_index]['frame'] = self.scrollable_content_frame
-        except Exception:
-            pass
+        セルストアの列も同じように移動しているので、表示内容の描き直しは不要。
+        """
+        for view in self._row_views.values():
+            remapped: Dict[int, Dict[str, Any]] = {}
+            for c, cell in view["cells"].items():
+                new_c = mapping(c)
+                try:
+                    if new_c is None:
+                        cell["col"] = -1
+                        cell["frame"].grid_remove()
+                        view["spare"].append(cell)
+                        continue
+                    if new_c != c:
+                        cell["col"] = new_c
+                        cell["frame"].grid_configure(column=new_c + 1)
+                except tk.TclError:
+                    pass
+                remapped[new_c] = cell
+            view["cells"] = remapped
+
+    def _view_delete_row(self, r: int):
+        view = self._row_views.pop(r, None)
+        if view is not None:
+            self._release_row_view(view)
+        # 後続の可視行を1行ぶん上へ詰める（セルストアも同じだけ詰まっているので位置と入力欄だけ直す）
+        shifted: Dict[int, Dict[str, Any]] = {}
+        for vr, v in self._row_views.items():
+            if vr > r:
+                v["row"] = vr - 1
+                try:
+                    self._fill_input_cell(v, self.input_data[vr - 1])
+                    self._place_row_view(v)
+                except tk.TclError:
+                    pass
+                shifted[vr - 1] = v
+            else:
+                shifted[vr] = v
+        self._row_views = shifted
+        self._layout_grid()
+        self._refresh_visible_rows()
+
+    def _view_insert_column(self, c: int, prompt_id: str, prompt_config: Prompt):
+        if self._header_frame is None:
+            self._update_ui()
+            return
+        self._relayout_columns(self._grid_column_count() - 1)
+        self._col_header_frames.insert(c, None)  # type: ignore
+        self._add_prompt_header_widgets(c, prompt_id, prompt_config)
+        self._regrid_headers(c + 1)
+        self._remap_row_cells(lambda old_c: old_c + 1 if old_c >= c else old_c)
+        self._place_row_summary_widgets()
+        if self._col_summaries:
+            self._update_column_summary_row()
+        else:
+            self._layout_grid()
+        self._refresh_visible_rows()
+
+    def _view_delete_column(self, c: int, old_count: int):
+        if 0 <= c < len(self._col_header_frames):
+            frame = self._col_header_frames.pop(c)
+            try:
+                if frame is not None:
+                    frame.destroy()
+            except tk.TclError:
+                pass
+            self._regrid_headers(c)
+        self._remap_row_cells(lambda old_c: None if old_c == c else (old_c - 1 if old_c > c else old_c))
+        self._place_row_summary_widgets()
+        self._relayout_columns(old_count)
+        if self._col_summaries or self._footer_frame is not None:
+            self._update_column_summary_row()
+        else:
+            self._layout_grid()
+        self._refresh_visible_rows()
+
+    def _move_column(self, src: int, dst: int):
+        """列 src を dst へ移動する。状態は O(行数)、ウィジェットは見出しと可視セルのみ更新。"""
+        started = time.perf_counter()
+        ids = list(self.prompts.keys())
+        if src == dst or not (0 <= src < len(ids) and 0 <= dst < len(ids)):
+            return
+        ids.insert(dst, ids.pop(src))
+        self._state_move_column(src, dst)
+        self.prompts = {pid: self.prompts[pid] for pid in ids}
+
+        if 0 <= src < len(self._col_header_frames) and 0 <= dst < len(self._col_header_frames):
+            self._col_header_frames.insert(dst, self._col_header_frames.pop(src))
+            self._regrid_headers(min(src, dst))
+
+        def mapping(old_c: int) -> int:
+            if old_c == src:
+                return dst
+            if src < old_c <= dst:
+                return old_c - 1
+            if dst <= old_c < src:
+                return old_c + 1
+            return old_c
+        self._remap_row_cells(mapping)
+        if self._col_summaries:
+            self._update_column_summary_row()
+        self._refresh_visible_rows()
+        self._log_grid_edit(f"move_column {src}->{dst}", started)
 
     def _add_prompt_header_widgets(self, col_idx: int, prompt_id: str, prompt_config: Prompt):
-        header_frame = ctk.CTkFrame(self.scrollable_content_frame, border_width=1, border_color=styles.MATRIX_HEADER_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
+        header_frame = ctk.CTkFrame(self._header_frame, border_width=1, border_color=styles.MATRIX_HEADER_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
         header_frame.grid(row=0, column=col_idx + 1, padx=5, pady=5, sticky="nsew")
         header_frame.grid_propagate(False)
         header_frame.grid_columnconfigure(0, weight=1)
@@ -1339,24 +1993,15 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         col_letter = chr(ord('A') + col_idx)
         col_num_label = ctk.CTkLabel(col_header_inner_frame, text=f"{col_letter}", font=styles.MATRIX_FONT_BOLD, anchor="center")
         col_num_label.grid(row=0, column=0, sticky="ew")
+        setattr(header_frame, "_col_label", col_num_label)
         # Bind drag events to child widgets as well so drags starting on them work
         col_num_label.bind("<ButtonPress-1>", self._on_col_press)
         col_num_label.bind("<B1-Motion>", self._on_col_motion)
         col_num_label.bind("<ButtonRelease-1>", self._on_col_release)
 
-        delete_col_icon = None
-        try:
-            icon_path = Path(DELETE_ICON_FILE)
-            if icon_path.exists():
-                from PIL import Image
-                icon_img = Image.open(icon_path)
-                size = (16, 16)
-                icon_img.thumbnail(size)
-                delete_col_icon = ctk.CTkImage(light_image=icon_img, dark_image=icon_img, size=size)
-        except Exception:
-            delete_col_icon = None
+        delete_col_icon = self._get_delete_icon()
 
-        delete_col_button = ctk.CTkButton(col_header_inner_frame, text="" if delete_col_icon else tr("common.delete"), image=delete_col_icon, width=24, height=24, fg_color=styles.MATRIX_DELETE_BUTTON_COLOR, hover_color=styles.MATRIX_DELETE_BUTTON_HOVER_COLOR, command=lambda c=col_idx: self._delete_column(c))
+        delete_col_button = ctk.CTkButton(col_header_inner_frame, text="" if delete_col_icon else tr("common.delete"), image=delete_col_icon, width=24, height=24, fg_color=styles.MATRIX_DELETE_BUTTON_COLOR, hover_color=styles.MATRIX_DELETE_BUTTON_HOVER_COLOR, command=lambda f=header_frame: self._delete_column(self._col_header_frames.index(f)))
         delete_col_button.grid(row=0, column=1, padx=(5, 0), sticky="e")
         delete_col_button.bind("<ButtonPress-1>", self._on_col_press)
         delete_col_button.bind("<B1-Motion>", self._on_col_motion)
@@ -1440,77 +2085,8 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             drop_index = self._compute_col_drop_index(event.x_root)
             start_index = self._col_drag_data.get("index", 0)
             if 0 <= drop_index < len(self._col_header_frames) and drop_index != start_index:
-                # Compute old/new id order
-                old_ids = list(self.prompts.keys())
-                moving_id = old_ids.pop(start_index)
-                new_ids = old_ids.copy()
-                new_ids.insert(drop_index, moving_id)
-
-                # Reorder per-column state arrays to match new order
-                try:
-                    id_to_old_index = {pid: i for i, pid in enumerate(list(self.prompts.keys()))}
-                    # checkbox, results, full_results
-                    for r in range(len(self.input_data)):
-                        if r < len(self.checkbox_states):
-                            old_row = self.checkbox_states[r]
-                            new_row = []
-                            for pid in new_ids:
-                                oi = id_to_old_index.get(pid, None)
-                                if oi is None or oi >= len(old_row):
-                                    new_row.append(ctk.BooleanVar(value=False))
-                                else:
-                                    new_row.append(old_row[oi])
-                            self.checkbox_states[r] = new_row
-                        if r < len(self.results):
-                            old_row_r = self.results[r]
-                            new_row_r = []
-                            for pid in new_ids:
-                                oi = id_to_old_index.get(pid, None)
-                                if oi is None or oi >= len(old_row_r):
-                                    new_row_r.append(ctk.StringVar(value=""))
-                                else:
-                                    new_row_r.append(old_row_r[oi])
-                            self.results[r] = new_row_r
-                        if r < len(self._full_results):
-                            old_row_f = self._full_results[r]
-                            new_row_f = []
-                            for pid in new_ids:
-                                oi = id_to_old_index.get(pid, None)
-                                if oi is None or oi >= len(old_row_f):
-                                    new_row_f.append("")
-                                else:
-                                    new_row_f.append(old_row_f[oi])
-                            self._full_results[r] = new_row_f
-                    # per-column summaries
-                    if self._col_summaries:
-                        old_cols = self._col_summaries
-                        new_cols = []
-                        for pid in new_ids:
-                            oi = id_to_old_index.get(pid, None)
-                            if oi is None or oi >= len(old_cols):
-                                new_cols.append(ctk.StringVar(value=""))
-                            else:
-                                new_cols.append(old_cols[oi])
-                        self._col_summaries = new_cols
-                    # widths
-                    if self._column_widths:
-                        old_w = self._column_widths
-                        # Ensure length equals number of prompts
-                        while len(old_w) < len(new_ids):
-                            old_w.append(styles.MATRIX_CELL_WIDTH)
-                        new_w = []
-                        for pid in new_ids:
-                            oi = id_to_old_index.get(pid, 0)
-                            new_w.append(old_w[oi])
-                        self._column_widths = new_w
-                except Exception:
-                    pass
-
-                # Rebuild dict in new order
-                new_prompts = {pid: self.prompts[pid] for pid in new_ids}
-                self.prompts = new_prompts
-                # Rebuild UI to reflect new column order
-                self._update_ui()
+                # 状態配列・見出し・可視セルを列単位で並べ替える（グリッド全体は作り直さない）
+                self._move_column(start_index, drop_index)
             # Reset highlights
             for fr in self._col_header_frames:
                 if fr is None or not fr.winfo_exists():
@@ -1584,15 +2160,17 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             boundaries.append(rights[-1])
             # Find nearest boundary to pointer
             bx = min(boundaries, key=lambda b: abs(b - x_root))
-            # Convert to local coordinate within the scrollable content frame
-            local_x = bx - self.scrollable_content_frame.winfo_rootx()
-            # Create/update overlay frame as vertical indicator
-            h = max(2, self.scrollable_content_frame.winfo_height())
+            # Convert to canvas coordinates (rows are separate canvas windows)
+            canvas_x = self.canvas.canvasx(bx - self.canvas.winfo_rootx())
+            top = self.canvas.canvasy(0)
+            # Create/update overlay frame as vertical indicator spanning the visible area
+            h = max(2, self.canvas.winfo_height())
             if self._col_drop_indicator_widget is None or not self._col_drop_indicator_widget.winfo_exists():
-                self._col_drop_indicator_widget = tk.Frame(self.scrollable_content_frame, bg="#FFFFFF", width=2, height=h)
-                self._col_drop_indicator_widget.place(x=local_x, y=0, width=2, relheight=1.0)
+                self._col_drop_indicator_widget = tk.Frame(self.canvas, bg="#FFFFFF", width=2, height=h)
+                self._col_drop_line_id = self.canvas.create_window((canvas_x, top), window=self._col_drop_indicator_widget, anchor="nw", width=2, height=h)
             else:
-                self._col_drop_indicator_widget.place_configure(x=local_x, y=0)
+                self.canvas.coords(self._col_drop_line_id, canvas_x, top)
+            self._col_drop_indicator_widget.lift()
         except Exception:
             pass
 
@@ -1605,63 +2183,43 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             pass
         self._open_prompt_editor(prompt_id)
 
-    def _add_input_row_widgets(self, row_idx: int, input_item: Dict[str, Any]):
-        while len(self._full_results) <= row_idx:
-            self._full_results.append([])
-        input_cell_frame = ctk.CTkFrame(self.scrollable_content_frame, border_width=1, border_color=styles.MATRIX_CELL_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
-        input_cell_frame.grid(row=row_idx + 1, column=0, padx=5, pady=5, sticky="nsew")
-        input_cell_frame.grid_propagate(False)
-        input_cell_frame.grid_columnconfigure(2, weight=1)
-        while len(self._input_row_frames) <= row_idx:
-            self._input_row_frames.append(None)
-        self._input_row_frames[row_idx] = input_cell_frame
-
-        row_header_frame = ctk.CTkFrame(input_cell_frame)
-        row_header_frame.grid(row=0, column=0, padx=(5, 2), pady=2, sticky="w")
-        row_header_frame.grid_columnconfigure(0, weight=1)
-
-        row_num_label = ctk.CTkLabel(row_header_frame, text=f"{row_idx + 1}", font=styles.MATRIX_FONT_BOLD)
-        row_num_label.grid(row=0, column=0, sticky="w")
-
-        delete_row_icon = None
-        try:
-            icon_path = Path(DELETE_ICON_FILE)
-            if icon_path.exists():
-                from PIL import Image
-                icon_img = Image.open(icon_path)
-                size = (16, 16)
-                icon_img.thumbnail(size)
-                delete_row_icon = ctk.CTkImage(light_image=icon_img, dark_image=icon_img, size=size)
-        except Exception:
-            delete_row_icon = None
-
-        delete_row_button = ctk.CTkButton(row_header_frame, text="" if delete_row_icon else tr("common.delete"), image=delete_row_icon, width=24, height=24, fg_color=styles.MATRIX_DELETE_BUTTON_COLOR, hover_color=styles.MATRIX_DELETE_BUTTON_HOVER_COLOR, command=lambda r=row_idx: self._delete_row(r))
-        delete_row_button.grid(row=0, column=1, padx=(5, 0), sticky="e")
-
-        input_label = ctk.CTkLabel(input_cell_frame, text=tr("action.input").rstrip(':'), font=styles.MATRIX_FONT_BOLD, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
-        input_label.grid(row=0, column=1, padx=(5, 2), pady=2, sticky="w")
+    def _fill_input_cell(self, view: Dict[str, Any], input_item: Dict[str, Any]):
+        """行ビューの入力セルの中身（テキスト/画像/ファイル）を作り直す"""
+        old_widget = view.get("input_widget")
+        if old_widget is not None:
+            try:
+                old_widget.destroy()
+            except tk.TclError:
+                pass
+        view["input_widget"] = None
+        input_cell_frame = view["input_frame"]
+        row_idx = view["row"]
 
         if input_item["type"] == "text":
             input_entry = ctk.CTkEntry(input_cell_frame, placeholder_text=tr("matrix.input_placeholder", n=row_idx + 1), fg_color=styles.HISTORY_ITEM_FG_COLOR, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
             input_entry.insert(0, input_item["data"])
             input_entry.configure(state="readonly")
-            input_entry.bind("<Button-1>", lambda event, r=row_idx: self._open_history_edit_dialog(r))
+            input_entry.bind("<Button-1>", lambda event, v=view: self._open_history_edit_dialog(v["row"]))
             input_entry.grid(row=0, column=2, padx=2, pady=2, sticky="ew")
-        elif input_item["type"] in ("image", "image_compressed"):
-            try:
-                raw_bytes = base64.b64decode(input_item["data"])
-                if input_item["type"] == "image_compressed":
-                    import zlib
-                    raw_bytes = zlib.decompress(raw_bytes)
-                image = Image.open(BytesIO(raw_bytes))
-                image.thumbnail(styles.MATRIX_IMAGE_THUMBNAIL_SIZE)
-                ctk_image = ctk.CTkImage(light_image=image, dark_image=image, size=styles.MATRIX_IMAGE_THUMBNAIL_SIZE)
-                image_label = ctk.CTkLabel(input_cell_frame, image=ctk_image, text="", text_color=styles.HISTORY_ITEM_TEXT_COLOR)
+            view["input_widget"] = input_entry
+        elif input_item["type"] in ("image", "image_compressed", IMAGE_FILE_TYPE):
+            try:
+                # サムネイルはキャッシュから即表示し、未生成ならバックグラウンドで作る
+                thumbs = get_thumbnail_cache(styles.MATRIX_IMAGE_THUMBNAIL_SIZE)
+                thumb_key = thumbnail_key_for_item(input_item)
+                image_label = ctk.CTkLabel(input_cell_frame, text="…", width=styles.MATRIX_IMAGE_THUMBNAIL_SIZE[0], height=styles.MATRIX_IMAGE_THUMBNAIL_SIZE[1], text_color=styles.HISTORY_ITEM_TEXT_COLOR)
                 image_label.grid(row=0, column=2, padx=2, pady=2, sticky="w")
-                image_label.bind("<Button-1>", lambda event=None, r=row_idx: self._show_image_preview(r))
+                image_label.bind("<Button-1>", lambda event=None, v=view: self._show_image_preview(v["row"]))
+                view["input_widget"] = image_label
+                cached = thumbs.get_cached(thumb_key)
+                if cached is not None:
+                    self._apply_thumbnail(image_label, cached)
+                else:
+                    thumbs.request(thumb_key, image_bytes_loader(input_item), lambda img, lbl=image_label: self.after(0, self._apply_thumbnail, lbl, img))
             except Exception as e:
                 error_label = ctk.CTkLabel(input_cell_frame, text=tr("matrix.image_error"), text_color=styles.NOTIFICATION_COLORS["error"])
                 error_label.grid(row=0, column=2, padx=2, pady=2, sticky="w")
+                view["input_widget"] = error_label
                 print(f"DEBUG: 画像表示エラー (行{row_idx}): {str(e)}")
         elif input_item["type"] == "file":
             file_path = Path(input_item["data"])
@@ -1669,61 +2227,22 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             file_label.grid(row=0, column=2, padx=2, pady=2, sticky="ew")
             file_label.bind("<Enter>", lambda event=None, p=str(file_path): self._show_tooltip(p))
             file_label.bind("<Leave>", lambda event=None: self._hide_tooltip())
+            view["input_widget"] = file_label
 
-        attach_button = ctk.CTkButton(input_cell_frame, text=tr("action.attach"), width=50, fg_color=styles.FILE_ATTACH_BUTTON_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR, command=lambda r=row_idx: self._select_input_source(r))
-        attach_button.grid(row=0, column=3, padx=2, pady=2, sticky="e")
-
-        history_button = ctk.CTkButton(input_cell_frame, text=tr("history.button"), width=50, fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR, command=lambda r=row_idx: self._show_clipboard_history_popup(r))
-        history_button.grid(row=0, column=4, padx=2, pady=2, sticky="e")
-        input_cell_frame.grid_columnconfigure(4, weight=0)
-
-        for col_idx in range(len(self.prompts)):
-            self._create_result_cell(row_idx, col_idx)
-
-    def _create_result_cell(self, row_idx: int, col_idx: int):
-        """指定された行と列に結果表示用のセルウィジェットを作成する"""
-        while len(self.checkbox_states) <= row_idx:
-            self.checkbox_states.append([])
-        while len(self.checkbox_states[row_idx]) <= col_idx:
-            self.checkbox_states[row_idx].append(ctk.BooleanVar(value=False))
-        
-        while len(self.results) <= row_idx:
-            self.results.append([])
-        while len(self.results[row_idx]) <= col_idx:
-            self.results[row_idx].append(ctk.StringVar(value=""))
-        
-        while len(self._full_results) <= row_idx:
-            self._full_results.append([])
-        while len(self._full_results[row_idx]) <= col_idx:
-            self._full_results[row_idx].append("")
-
-        cell_frame = ctk.CTkFrame(self.scrollable_content_frame, border_width=1, border_color=styles.MATRIX_CELL_BORDER_COLOR, width=styles.MATRIX_CELL_WIDTH, height=styles.MATRIX_RESULT_CELL_HEIGHT)
-        cell_frame.grid(row=row_idx + 1, column=col_idx + 1, padx=5, pady=5, sticky="nsew")
-        cell_frame.grid_propagate(False)
-        cell_frame.grid_columnconfigure(1, weight=1)
-
-        checkbox = ctk.CTkCheckBox(cell_frame, text="", variable=self.checkbox_states[row_idx][col_idx], width=15)
-        checkbox.grid(row=0, column=0, padx=0, pady=2, sticky="w")
-
-        inner_h = max(20, styles.MATRIX_RESULT_CELL_HEIGHT - 6)
-        result_textbox = ctk.CTkTextbox(cell_frame, wrap="word", height=inner_h, font=styles.MATRIX_RESULT_FONT, fg_color=styles.HISTORY_ITEM_FG_COLOR, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
-        result_textbox.grid(row=0, column=1, padx=(0,2), pady=2, sticky="nsew")
-        result_textbox.insert("1.0", self.results[row_idx][col_idx].get())
-        result_textbox.configure(state="disabled")
-        result_textbox.bind("<Button-1>", lambda event, r=row_idx, c=col_idx: self._show_full_result_popup(r, c))
-        self.results[row_idx][col_idx].trace_add("write", lambda *args, sv=self.results[row_idx][col_idx], tb=result_textbox: self._update_textbox_from_stringvar(sv, tb))
-
-        # Track textbox reference and style matrix
-        while len(self._result_textboxes) <= row_idx:
-            self._result_textboxes.append([])
-        while len(self._result_textboxes[row_idx]) <= col_idx:
-            self._result_textboxes[row_idx].append(None)
-        self._result_textboxes[row_idx][col_idx] = result_textbox
-
-        while len(self._cell_style) <= row_idx:
-            self._cell_style.append([])
-        while len(self._cell_style[row_idx]) <= col_idx:
-            self._cell_style[row_idx].append("normal")
+    def _apply_thumbnail(self, label: ctk.CTkLabel, image: Optional[Image.Image]):
+        if self._is_closing:
+            return
+        try:
+            if not label.winfo_exists():
+                return
+            if image is None:
+                label.configure(text=tr("matrix.image_error"), text_color=styles.NOTIFICATION_COLORS["error"])
+                return
+            ctk_image = ctk.CTkImage(light_image=image, dark_image=image, size=image.size)
+            label.configure(image=ctk_image, text="")
+            label._thumb_ref = ctk_image  # GC 防止
+        except tk.TclError:
+            pass
 
     def _add_input_row(self):
         try:
@@ -1737,16 +2256,99 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         if self._row_summaries:
             self._row_summaries.append(ctk.StringVar(value=""))
 
-        self._add_input_row_widgets(new_row_idx, self.input_data[new_row_idx])
-        
-        self.after(10, lambda: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+        started = time.perf_counter()
+        self._cells.resize(new_row_idx, len(self.prompts))
+        self._cells.insert_row(new_row_idx)
+        self._sync_cached_tab_rows()
+        # 行が増えてもスクロール領域を伸ばすだけ。ウィジェットは見えている場合にのみ作られる
+        self._layout_grid()
+        self._refresh_visible_rows()
+        self._log_grid_edit("insert_row", started)
 
         try:
             self.configure(cursor='')
         except Exception:
             pass
 
+    # --- Bulk import ---
+    IMPORT_BATCH_ROWS = 500
+
+    def _import_inputs(self):
+        """CSV/JSONL ファイルまたはフォルダから入力行をまとめて取り込む（読み込みはワーカースレッドで逐次）"""
+        if self._import_thread is not None and self._import_thread.is_alive():
+            messagebox.showinfo(tr("matrix.import.title"), tr("matrix.import.busy"))
+            return
+        choice = CTkMessagebox(title=tr("matrix.import.title"), message=tr("matrix.import.message"), icon="question", option_1=tr("common.cancel"), option_2=tr("matrix.import.from_file"), option_3=tr("matrix.import.from_folder")).get()
+        if choice == tr("matrix.import.from_file"):
+            source = filedialog.askopenfilename(title=tr("matrix.import.title"), filetypes=[("CSV / JSONL", "*.csv *.jsonl *.ndjson"), ("All Files", "*.*")])
+        elif choice == tr("matrix.import.from_folder"):
+            source = filedialog.askdirectory(title=tr("matrix.import.title"))
+        else:
+            return
+        if not source:
+            return
+        # 初期状態の空行1つだけなら、取り込んだ先頭行で置き換える
+        replace_placeholder = len(self.input_data) == 1 and self.input_data[0] == {"type": "text", "data": ""}
+        target = self._tabs[self._active_tab_index]
+        self._import_target = target
+        self._import_thread = threading.Thread(target=self._import_worker, args=(Path(source), replace_placeholder, target), daemon=True)
+        self._import_thread.start()
+
+    def _import_worker(self, source: Path, replace_placeholder: bool, target: dict):
+        count = 0
+        started = time.perf_counter()
+        try:
+            for batch in iter_batches(iter_import_items(source), self.IMPORT_BATCH_ROWS):
+                if self._is_closing or self._import_target is not target:
+                    logger.info("matrix import from %s stopped after %d rows", source, count)
+                    return
+                self.after(0, self._append_input_rows, batch, replace_placeholder and count == 0, target)
+                count += len(batch)
+                self.after(0, lambda n=count: self.progress_label.configure(text=tr("matrix.import.progress_fmt", count=n)))
+        except Exception as e:
+            logger.exception("_import_worker - import from %s failed", source)
+            self.after(0, lambda err=str(e): messagebox.showerror(tr("common.error_title"), tr("matrix.import.failed", details=err)))
+            return
+        logger.debug("matrix import of %d rows from %s took %.1f ms", count, source, (time.perf_counter() - started) * 1000)
+        self.after(0, self._finish_import, target, count)
+
+    def _finish_import(self, target: dict, count: int):
+        if self._import_target is not target:
+            return
+        self._import_target = None
+        self._update_progress_label()
+        messagebox.showinfo(tr("matrix.import.title"), tr("matrix.import.done_fmt", count=count))
+
+    def _append_input_rows(self, items: List[Dict[str, Any]], replace_placeholder: bool = False, target: Optional[dict] = None):
+        """取り込んだ行を末尾に足す。ウィジェットは表示範囲に入った行のぶんだけ作られる
+
+        target は取り込みを始めたタブ。入力行は全タブ共通なので、target が表示中でなくても
+        行は足し、LRU に預けたタブのセルも合わせて伸ばす。target が閉じられたか全消去されたあとのバッチは捨てる。
+        """
+        if self._is_closing or not items:
+            return
+        if target is not None:
+            if self._import_target is not target or not any(t is target for t in self._tabs):
+                self._import_target = None
+                return
+        started = time.perf_counter()
+        if replace_placeholder and len(self.input_data) == 1 and self.input_data[0] == {"type": "text", "data": ""}:
+            self.input_data[0] = items[0]
+            items = items[1:]
+            self._update_input_row_display(0)
+        self.input_data.extend(items)
+        if self._row_summaries:
+            self._row_summaries.extend(ctk.StringVar(value="") for _ in items)
+        self._cells.resize(len(self.input_data), len(self.prompts))
+        self._sync_cached_tab_rows()
+        self._layout_grid()
+        self._refresh_visible_rows()
+        self._log_grid_edit("import_rows", started)
+
     def _add_prompt_column(self):
+        if len(self.prompts) >= self.MAX_PROMPT_COLUMNS:
+            CTkMessagebox(title=tr("matrix.tab.limit_title"), message=tr("matrix.column_limit_message", max=self.MAX_PROMPT_COLUMNS), icon="warning").wait_window()
+            return
         try:
             self.configure(cursor='watch')
             self.update_idletasks()
@@ -1761,19 +2363,15 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         self.prompts[new_prompt_id] = new_prompt_config
         try:
             # update active tab prompt objects snapshot
-            self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
+            self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
         except Exception:
             pass
         self._column_widths.append(styles.MATRIX_CELL_WIDTH)
 
-        if self._col_summaries:
-            self._col_summaries.append(ctk.StringVar(value=""))
-
-        self._add_prompt_header_widgets(new_col_idx, new_prompt_id, new_prompt_config)
-        for row_idx in range(len(self.input_data)):
-            self._create_result_cell(row_idx, new_col_idx)
-
-        self.after(10, lambda: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+        started = time.perf_counter()
+        self._state_insert_column(new_col_idx)
+        self._view_insert_column(new_col_idx, new_prompt_id, new_prompt_config)
+        self._log_grid_edit("insert_column", started)
 
         try:
             self.configure(cursor='')
@@ -1785,10 +2383,9 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             return
 
         self.input_data = [{"type": "text", "data": ""}]
+        self._import_target = None
         self.prompts = {}
-        self.checkbox_states = []
-        self.results = []
-        self._full_results = []
+        self._cells.clear()
         self._row_summaries = []
         self._col_summaries = []
         self._row_heights = []
@@ -1813,11 +2410,9 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         self._update_ui()
 
     def _run_batch_processing(self):
-        checked_tasks = []
-        for r_idx, row_input in enumerate(self.input_data):
-            for c_idx, prompt_id in enumerate(self.prompts.keys()):
-                if self.checkbox_states[r_idx][c_idx].get():
-                    checked_tasks.append((r_idx, c_idx, row_input, prompt_id))
+        self._ensure_grid_state()
+        prompt_ids = list(self.prompts.keys())
+        checked_tasks = [(r_idx, c_idx, self.input_data[r_idx], prompt_ids[c_idx]) for r_idx, c_idx in self._cells.checked_cells()]
         
         if not checked_tasks:
             messagebox.showinfo(tr("matrix.run_title"), tr("matrix.no_checked_combinations"))
@@ -1827,80 +2422,57 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         self.completed_tasks = 0
         self._update_progress_label()
 
-        num_inputs = len(self.input_data)
-        num_prompts = len(self.prompts)
-
-        while len(self.results) < num_inputs:
-            self.results.append([])
-        for r_idx in range(num_inputs):
-            while len(self.results[r_idx]) < num_prompts:
-                self.results[r_idx].append(ctk.StringVar(value=""))
-
-        while len(self._full_results) < num_inputs:
-            self._full_results.append([])
-        for r_idx in range(num_inputs):
-            while len(self._full_results[r_idx]) < num_prompts:
-                self._full_results[r_idx].append("")
-
         for r_idx, c_idx, _, _ in checked_tasks:
-            self.results[r_idx][c_idx].set(tr("common.processing"))
             # Normal run uses default color
-            self._set_cell_style(r_idx, c_idx, "normal")
+            self._cells.set_style(r_idx, c_idx, "normal")
+            self._set_cell_display(r_idx, c_idx, tr("common.processing"))
 
         asyncio.run_coroutine_threadsafe(self._execute_llm_tasks(checked_tasks), self.worker_loop)
 
     def _set_cell_style(self, r_idx: int, c_idx: int, style: str):
         try:
-            while len(self._cell_style) <= r_idx:
-                self._cell_style.append([])
-            while len(self._cell_style[r_idx]) <= c_idx:
-                self._cell_style[r_idx].append("normal")
-            self._cell_style[r_idx][c_idx] = style
-            tb = None
-            if 0 <= r_idx < len(self._result_textboxes) and 0 <= c_idx < len(self._result_textboxes[r_idx]):
-                tb = self._result_textboxes[r_idx][c_idx]
-            if tb and tb.winfo_exists():
-                tb.configure(state="normal")
-                if style == "flow":
-                    tb.configure(text_color=styles.FLOW_RESULT_TEXT_COLOR)
-                else:
-                    tb.configure(text_color=styles.HISTORY_ITEM_TEXT_COLOR)
-                tb.configure(state="disabled")
+            if 0 <= r_idx < self._cells.rows and 0 <= c_idx < self._cells.cols:
+                self._cells.set_style(r_idx, c_idx, style)
+                # 画面外のセルはスタイルを覚えておくだけ（表示時に反映される）
+                self._refresh_cell(r_idx, c_idx)
         except Exception:
             pass
 
-    def _update_cell_on_main_thread(self, r_idx: int, c_idx: int, text_content: str, is_final: bool = False):
+    def _update_cell_on_main_thread(self, r_idx: int, c_idx: int, text_content: str, is_final: bool = False, span: Optional[Span] = None):
         if self._is_closing or not self.winfo_exists():
+            if span is not None:
+                span.end("cancelled")
             return
-        current_text = ""
-        if 0 <= r_idx < len(self.results) and 0 <= c_idx < len(self.results[r_idx]):
-            current_text = self.results[r_idx][c_idx].get()
-        else:
+        if not (0 <= r_idx < self._cells.rows and 0 <= c_idx < self._cells.cols):
+            logger.warning("_update_cell_on_main_thread - セル (%d, %d) が範囲外です。結果の保存をスキップします。", r_idx, c_idx)
+            if span is not None:
+                span.end("dropped")
             return
 
-        new_text = text_content if is_final else current_text + text_content
-        
         try:
-            self.results[r_idx][c_idx].set(new_text)
+            if is_final:
+                self._set_cell_result(r_idx, c_idx, text_content)
+            else:
+                self._set_cell_display(r_idx, c_idx, self._cells.display(r_idx, c_idx) + text_content)
         except tk.TclError:
             pass
 
+        if span is not None:
+            span.mark("ui_applied")
+            span.end()
         if is_final:
-            if 0 <= r_idx < len(self._full_results) and 0 <= c_idx < len(self._full_results[r_idx]):
-                self._full_results[r_idx][c_idx] = new_text
-            else:
-                print(f"ERROR: _update_cell_on_main_thread - _full_results のインデックス ({r_idx}, {c_idx}) が範囲外です。最終結果の保存をスキップします。")
-            
             with self.progress_lock:
                 self.completed_tasks += 1
                 self._update_progress_label()
 
     async def _execute_llm_tasks(self, tasks_to_run: List[tuple]):
         self.processing_tasks = []
+        job_id = new_job_id("matrix")
         for r_idx, c_idx, row_input, prompt_id in tasks_to_run:
             prompt_config = self.prompts.get(prompt_id)
             if prompt_config:
-                task = asyncio.create_task(self._process_single_cell(r_idx, c_idx, row_input, prompt_config))
+                span = Span("matrix_cell", job_id, row=r_idx + 1, col=c_idx + 1, prompt_id=prompt_id, model=prompt_config.model, input_type=row_input.get("type"))
+                task = asyncio.create_task(self._process_single_cell(r_idx, c_idx, row_input, prompt_config, span), name=loop_monitor.task_name("matrix_cell", r_idx + 1, c_idx + 1))
                 self.processing_tasks.append(task)
             else:
                 print(f"ERROR: _execute_llm_tasks - prompt_id '{prompt_id}' not found.")
@@ -1919,8 +2491,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             if self.summarize_matrix_button:
                 self.summarize_matrix_button.configure(state="normal")
             for r_idx, c_idx, _, _ in tasks_to_run:
-                if 0 <= r_idx < len(self.checkbox_states) and 0 <= c_idx < len(self.checkbox_states[r_idx]):
-                    self.checkbox_states[r_idx][c_idx].set(False)
+                self._set_cell_checked(r_idx, c_idx, False)
         
         self.after(0, show_completion_notification)
 
@@ -1942,8 +2513,8 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         overwrite = False
         for r_idx, cols in plans.items():
             for c_idx in cols:
-                if 0 <= r_idx < len(self._full_results) and 0 <= c_idx < len(self._full_results[r_idx]):
-                    if self._full_results[r_idx][c_idx]:
+                if 0 <= r_idx < self._cells.rows and 0 <= c_idx < self._cells.cols:
+                    if self._cells.has_result(r_idx, c_idx):
                         overwrite = True
                         break
             if overwrite:
@@ -1958,15 +2529,17 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
     def _run_flow_processing(self):
         # Build per-row plans of selected columns, limited and sorted by column index (A..)
         plans: Dict[int, List[int]] = {}
-        for r_idx, row_input in enumerate(self.input_data):
-            sel_cols = [c_idx for c_idx, _ in enumerate(self.prompts.keys()) if self.checkbox_states[r_idx][c_idx].get()]
-            sel_cols.sort()
-            if sel_cols:
-                try:
-                    self.max_flow_steps = int(getattr(self.agent.config, 'max_flow_steps', self.max_flow_steps))
-                except Exception:
-                    pass
-                plans[r_idx] = sel_cols[: int(self.max_flow_steps)]
+        self._ensure_grid_state()
+        selected: Dict[int, List[int]] = {}
+        for r_idx, c_idx in self._cells.checked_cells():
+            selected.setdefault(r_idx, []).append(c_idx)
+        for r_idx, sel_cols in selected.items():
+            # checked_cells は行内で列順に返る
+            try:
+                self.max_flow_steps = int(getattr(self.agent.config, 'max_flow_steps', self.max_flow_steps))
+            except Exception:
+                pass
+            plans[r_idx] = sel_cols[: int(self.max_flow_steps)]
 
         if not self._confirm_flow(plans):
             return
@@ -1980,8 +2553,8 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         # Mark target cells as processing and flow-styled
         for r_idx, cols in plans.items():
             for c_idx in cols:
-                self.results[r_idx][c_idx].set(tr("common.processing"))
-                self._set_cell_style(r_idx, c_idx, "flow")
+                self._cells.set_style(r_idx, c_idx, "flow")
+                self._set_cell_display(r_idx, c_idx, tr("common.processing"))
 
         # Launch per-row flows concurrently
         self._flow_cancel_requested = False
@@ -1993,6 +2566,8 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         asyncio.run_coroutine_threadsafe(self._execute_flow_tasks(plans), self.worker_loop)
 
     async def _execute_flow_for_row(self, r_idx: int, cols: List[int]):
+        # SDK の初回 import はワーカースレッドで（UI やループを止めない）
+        genai = await load_genai_async()
         # Conversation history as alternating user/model messages (dicts)
         conv: List[Dict[str, Any]] = []
         # Prepare initial user parts
@@ -2000,15 +2575,15 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         initial_parts: List[Any] = []
         if input_item["type"] == "text":
             initial_parts = [{"text": input_item["data"]}]
-        elif input_item["type"] in ("image", "image_compressed"):
-            img_b64 = input_item["data"]
-            if input_item["type"] == "image_compressed":
-                try:
-                    import zlib
-                    img_b64 = base64.b64encode(zlib.decompress(base64.b64decode(img_b64))).decode("utf-8")
-                except Exception:
-                    pass
-            initial_parts = [create_image_part(img_b64)]
+        elif input_item["type"] in ("image", "image_compressed", IMAGE_FILE_TYPE):
+            # 画像は全ステップで共有するので最初のステップのプロンプトの方針で変換する
+            try:
+                first_prompt = self.prompts[list(self.prompts.keys())[cols[0]]]
+                initial_parts = [await input_prep.image_part(input_item, first_prompt.image_policy, first_prompt.model)]
+            except Exception as e:
+                err = tr("matrix.error_prefix") + str(e)
+                self.after(0, self._update_cell_on_main_thread, r_idx, cols[0], err, True)
+                return
         elif input_item["type"] == "file":
             file_path = input_item["data"]
             try:
@@ -2053,13 +2628,15 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 conv.append({"role": "user", "parts": combined_parts})
             except Exception:
                 conv.append({"role": "user", "parts": [{"text": str(combined_parts)}]})
+            span = Span("matrix_flow_step", self._flow_job_id, row=r_idx + 1, col=c_idx + 1, step=step_idx + 1, prompt_id=prompt_id, model=prompt_config.model)
             try:
                 async with self.semaphore:
-                    gemini_model = GenerativeModel(prompt_config.model, system_instruction=prompt_config.system_prompt)
+                    span.mark("started")
+                    gemini_model = genai.GenerativeModel(prompt_config.model, system_instruction=prompt_config.system_prompt)
                     # Detect tools setting
                     has_url_text = any(isinstance(p, dict) and "text" in p and isinstance(p["text"], str) and p["text"].strip().startswith(("http://", "https://")) for p in combined_parts)
                     tools_list = [{"google_search": {}}] if getattr(prompt_config, 'enable_web', False) or has_url_text else None
-                    generate_content_config = types.GenerationConfig(
+                    generate_content_config = genai.types.GenerationConfig(
                         temperature=prompt_config.parameters.temperature,
                         top_p=prompt_config.parameters.top_p,
                         top_k=prompt_config.parameters.top_k,
@@ -2078,9 +2655,11 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                     except Exception:
                         if tools_list:
                             try:
+                                span.set(retries=1)
                                 alt_tools = [{"google_search_retrieval": {}}]
                                 response = await asyncio.to_thread(_gen_sync, generate_content_config, conv, alt_tools)
                             except Exception:
+                                span.set(retries=2)
                                 response = await asyncio.to_thread(_gen_sync, generate_content_config, conv, None)
                         else:
                             raise
@@ -2097,17 +2676,21 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                             return getattr(resp, 'text', '') or ''
                         except Exception:
                             return ''
+                    span.mark("first_token")
                     out_text = _extract_text(response)
                     if not out_text:
                         out_text = tr("matrix.response_empty")
+                    span.mark("completed")
+                    span.set(output_tokens=_output_tokens(response))
             except Exception as e:
+                span.fail(e)
                 out_text = tr("matrix.error_prefix") + str(e)
 
             # Update cell with result and style, and uncheck the box
-            self.after(0, self._update_cell_on_main_thread, r_idx, c_idx, out_text, True)
-            self._set_cell_style(r_idx, c_idx, "flow")
+            self.after(0, self._update_cell_on_main_thread, r_idx, c_idx, out_text, True, span)
             try:
-                self.after(0, lambda rr=r_idx, cc=c_idx: self.checkbox_states[rr][cc].set(False))
+                self.after(0, self._set_cell_style, r_idx, c_idx, "flow")
+                self.after(0, self._set_cell_checked, r_idx, c_idx, False)
             except Exception:
                 pass
             # Append model message and set next input as its text
@@ -2121,7 +2704,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         def _clear_checks():
             for c_idx in cols:
                 try:
-                    self.checkbox_states[r_idx][c_idx].set(False)
+                    self._set_cell_checked(r_idx, c_idx, False)
                 except Exception:
                     pass
         self.after(0, _clear_checks)
@@ -2129,8 +2712,9 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         # Enable summary/export buttons after flows (all tasks completion is handled globally too)
     async def _execute_flow_tasks(self, plans: Dict[int, List[int]]):
         self._flow_tasks = []
+        self._flow_job_id = new_job_id("flow")
         for r_idx, cols in plans.items():
-            task = asyncio.create_task(self._execute_flow_for_row(r_idx, cols))
+            task = asyncio.create_task(self._execute_flow_for_row(r_idx, cols), name=loop_monitor.task_name("flow_row", r_idx + 1))
             self._flow_tasks.append(task)
         try:
             await asyncio.gather(*self._flow_tasks)
@@ -2152,26 +2736,21 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 pass
         self.after(0, _enable_actions)
 
-    async def _process_single_cell(self, r_idx: int, c_idx: int, input_item: Dict[str, Any], prompt_config: Prompt):
+    async def _process_single_cell(self, r_idx: int, c_idx: int, input_item: Dict[str, Any], prompt_config: Prompt, span: Optional[Span] = None):
         full_result = ""
+        span = span or Span("matrix_cell", row=r_idx + 1, col=c_idx + 1, model=prompt_config.model)
         try:
             async with self.semaphore:
-                gemini_model = GenerativeModel(prompt_config.model, system_instruction=prompt_config.system_prompt)
+                span.mark("started")
+                genai = await load_genai_async()
+                gemini_model = genai.GenerativeModel(prompt_config.model, system_instruction=prompt_config.system_prompt)
                 contents_to_send = []
 
                 if input_item["type"] == "text":
                     contents_to_send.append(input_item["data"])
-                elif input_item["type"] in ("image", "image_compressed"):
-                    img_b64 = input_item["data"]
-                    if input_item["type"] == "image_compressed":
-                        try:
-                            import zlib
-                            decompressed = zlib.decompress(base64.b64decode(img_b64))
-                            img_b64 = base64.b64encode(decompressed).decode('utf-8')
-                        except Exception:
-                            pass
-                    image_part = create_image_part(img_b64)
-                    contents_to_send.append(image_part)
+                elif input_item["type"] in ("image", "image_compressed", IMAGE_FILE_TYPE):
+                    # デコードと PNG 化はプロセスプールで。一括取り込みした画像もここで初めて読み込む
+                    contents_to_send.append(await input_prep.image_part(input_item, prompt_config.image_policy, prompt_config.model, span))
                 elif input_item["type"] == "file":
                     file_path = input_item["data"]
                     try:
@@ -2180,6 +2759,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                             mime_type = "application/octet-stream"
                         uploaded_file = await asyncio.to_thread(genai.upload_file, path=file_path, mime_type=mime_type)
                         contents_to_send.append(uploaded_file)
+                        span.mark("upload_done")
                     except Exception as e:
                         raise RuntimeError(tr("notify.file_upload_failed", details=str(e)))
                 else:
@@ -2189,9 +2769,9 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 tools_list = [{"google_search": {}}] if getattr(prompt_config, 'enable_web', False) or has_url_text else None
 
                 try:
-                    generate_content_config = types.GenerationConfig(temperature=prompt_config.parameters.temperature, top_p=prompt_config.parameters.top_p, top_k=prompt_config.parameters.top_k, max_output_tokens=prompt_config.parameters.max_output_tokens, stop_sequences=prompt_config.parameters.stop_sequences, tools=tools_list)
+                    generate_content_config = genai.types.GenerationConfig(temperature=prompt_config.parameters.temperature, top_p=prompt_config.parameters.top_p, top_k=prompt_config.parameters.top_k, max_output_tokens=prompt_config.parameters.max_output_tokens, stop_sequences=prompt_config.parameters.stop_sequences, tools=tools_list)
                 except TypeError:
-                    generate_content_config = types.GenerationConfig(temperature=prompt_config.parameters.temperature, top_p=prompt_config.parameters.top_p, top_k=prompt_config.parameters.top_k, max_output_tokens=prompt_config.parameters.max_output_tokens, stop_sequences=prompt_config.parameters.stop_sequences)
+                    generate_content_config = genai.types.GenerationConfig(temperature=prompt_config.parameters.temperature, top_p=prompt_config.parameters.top_p, top_k=prompt_config.parameters.top_k, max_output_tokens=prompt_config.parameters.max_output_tokens, stop_sequences=prompt_config.parameters.stop_sequences)
 
                 def _gen_sync(config):
                     return gemini_model.generate_content(contents=contents_to_send, generation_config=config)
@@ -2201,14 +2781,18 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 except Exception:
                     if tools_list:
                         try:
+                            span.set(retries=1)
                             alt_tools = [{"google_search_retrieval": {}}]
-                            alt_config = types.GenerationConfig(temperature=generate_content_config.temperature, top_p=generate_content_config.top_p, top_k=generate_content_config.top_k, max_output_tokens=generate_content_config.max_output_tokens, stop_sequences=generate_content_config.stop_sequences, tools=alt_tools)
+                            alt_config = genai.types.GenerationConfig(temperature=generate_content_config.temperature, top_p=generate_content_config.top_p, top_k=generate_content_config.top_k, max_output_tokens=generate_content_config.max_output_tokens, stop_sequences=generate_content_config.stop_sequences, tools=alt_tools)
                             response = await asyncio.to_thread(_gen_sync, alt_config)
                         except Exception:
-                            no_tool_config = types.GenerationConfig(temperature=generate_content_config.temperature, top_p=generate_content_config.top_p, top_k=generate_content_config.top_k, max_output_tokens=generate_content_config.max_output_tokens, stop_sequences=generate_content_config.stop_sequences)
+                            span.set(retries=2)
+                            no_tool_config = genai.types.GenerationConfig(temperature=generate_content_config.temperature, top_p=generate_content_config.top_p, top_k=generate_content_config.top_k, max_output_tokens=generate_content_config.max_output_tokens, stop_sequences=generate_content_config.stop_sequences)
                             response = await asyncio.to_thread(_gen_sync, no_tool_config)
                     else:
                         raise
+                # 非ストリーミング呼び出しなので、応答の到着を first_token とする
+                span.mark("first_token")
                 
                 def _extract_text(resp) -> str:
                     try:
@@ -2231,13 +2815,16 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 else:
                     extracted = _extract_text(response)
                     full_result = extracted if extracted else (tr("matrix.response_empty") + f" finish_reason={getattr(response.candidates[0], 'finish_reason', None)}")
+                span.mark("completed")
+                span.set(output_tokens=_output_tokens(response))
 
         except Exception as e:
+            span.fail(e)
             full_result = tr("matrix.error_prefix") + str(e)
             self.after(0, lambda err=e: self.notification_callback(tr("matrix.processing_error_title"), tr("matrix.cell_error_fmt", row=r_idx+1, col=c_idx+1, details=str(err)), "error"))
             traceback.print_exc()
         finally:
-            self.after(0, self._update_cell_on_main_thread, r_idx, c_idx, full_result, True)
+            self.after(0, self._update_cell_on_main_thread, r_idx, c_idx, full_result, True, span)
 
     async def _summarize_content_with_llm(self, content_list: List[str], summary_type: str, r_idx: Optional[int] = None, c_idx: Optional[int] = None) -> str:
         combined_content = "\n\n".join(content_list)
@@ -2257,10 +2844,14 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         summary_prompt_config = cfg_prompt or Prompt(name=f"{summary_type}要約", model="gemini-2.5-flash-lite", system_prompt="与えられた情報を簡潔に要約してください。" )
         
         full_summary_result = ""
+        span = Span("summary", model=summary_prompt_config.model, target=summary_type)
         try:
+            span.mark("started")
+            genai = await load_genai_async()
             generation_config = genai.types.GenerationConfig(temperature=summary_prompt_config.parameters.temperature, top_p=summary_prompt_config.parameters.top_p, top_k=summary_prompt_config.parameters.top_k, max_output_tokens=summary_prompt_config.parameters.max_output_tokens, stop_sequences=summary_prompt_config.parameters.stop_sequences)
-            gemini_model = GenerativeModel(summary_prompt_config.model, system_instruction=summary_prompt_config.system_prompt)
+            gemini_model = genai.GenerativeModel(summary_prompt_config.model, system_instruction=summary_prompt_config.system_prompt)
             response = await asyncio.to_thread(gemini_model.generate_content, contents=[summary_prompt_text], generation_config=generation_config)
+            span.mark("first_token")
             
             def _extract_text(resp) -> str:
                 try:
@@ -2283,11 +2874,16 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             else:
                 extracted = _extract_text(response)
                 full_summary_result = extracted if extracted else tr("matrix.response_empty")
+            span.mark("completed")
+            span.set(output_tokens=_output_tokens(response))
             
         except Exception as e:
+            span.fail(e)
             full_summary_result = tr("matrix.final_summary.error_fmt", details=str(e))
             self.after(0, lambda err=e: self.notification_callback(tr("matrix.final_summary.error_title"), tr("matrix.final_summary.error_fmt", details=str(err)), "error"))
             traceback.print_exc()
+        finally:
+            span.end()
         
         return full_summary_result
 
@@ -2299,11 +2895,11 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 
         summary_tasks = []
         for r_idx in range(len(self.input_data)):
-            row_results = [self._full_results[r_idx][c_idx] for c_idx in range(len(self.prompts))]
+            row_results = [self._cells.full(r_idx, c_idx) for c_idx in range(min(len(self.prompts), self._cells.cols))] if r_idx < self._cells.rows else []
             valid_results = [res for res in row_results if res and res != tr("common.processing") and not res.startswith(tr("matrix.error_prefix").strip())]
             
             if valid_results:
-                task = asyncio.create_task(self._summarize_content_with_llm(valid_results, f"{tr('matrix.row_summary_header')} {r_idx+1}", r_idx=r_idx))
+                task = asyncio.create_task(self._summarize_content_with_llm(valid_results, f"{tr('matrix.row_summary_header')} {r_idx+1}", r_idx=r_idx), name=loop_monitor.task_name("summary", "row", r_idx + 1))
                 summary_tasks.append((r_idx, task))
             else:
                 self._row_summaries[r_idx].set(tr("matrix.summary.target_none"))
@@ -2326,11 +2922,11 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 
         summary_tasks = []
         for c_idx in range(len(self.prompts)):
-            col_results = [self._full_results[r_idx][c_idx] for r_idx in range(len(self.input_data))]
+            col_results = [self._cells.full(r_idx, c_idx) for r_idx in range(min(len(self.input_data), self._cells.rows))] if c_idx < self._cells.cols else []
             valid_results = [res for res in col_results if res and res != tr("common.processing") and not res.startswith(tr("matrix.error_prefix").strip())]
 
             if valid_results:
-                task = asyncio.create_task(self._summarize_content_with_llm(valid_results, f"{tr('matrix.col_summary_header')} {chr(ord('A') + c_idx)}", c_idx=c_idx))
+                task = asyncio.create_task(self._summarize_content_with_llm(valid_results, f"{tr('matrix.col_summary_header')} {chr(ord('A') + c_idx)}", c_idx=c_idx), name=loop_monitor.task_name("summary", "col", c_idx + 1))
                 summary_tasks.append((c_idx, task))
             else:
                 self._col_summaries[c_idx].set(tr("matrix.summary.target_none"))
@@ -2396,16 +2992,14 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 pass
 
     def _update_matrix_summary_cell(self, summary_text: str):
-        num_inputs = len(self.input_data)
-        num_prompts = len(self.prompts)
-        summary_row_idx = num_inputs + 1
-        summary_col_idx = num_prompts + 1
-
-        for widget in self.scrollable_content_frame.grid_slaves(row=summary_row_idx, column=summary_col_idx):
+        summary_col_idx = len(self.prompts) + 1
+        # 行列まとめは列まとめ行の右端（行まとめ列の位置）に置く
+        footer = self._ensure_footer_frame()
+        for widget in footer.grid_slaves(row=0, column=summary_col_idx):
             widget.destroy()
 
-        resizable_frame = tk.Frame(self.scrollable_content_frame, borderwidth=1, relief="solid")
-        resizable_frame.grid(row=summary_row_idx, column=summary_col_idx, padx=5, pady=5, sticky="nsew")
+        resizable_frame = tk.Frame(footer, borderwidth=1, relief="solid")
+        resizable_frame.grid(row=0, column=summary_col_idx, padx=5, pady=5, sticky="nsew")
         resizable_frame.grid_rowconfigure(0, weight=1)
         resizable_frame.grid_columnconfigure(0, weight=1)
 
@@ -2420,6 +3014,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 
         sizer = SizerGrip(resizable_frame)
         sizer.grid(row=1, column=1, sticky="se")
+        self._layout_grid()
 
     def _show_final_summary_popup(self, summary_text: str):
         popup = ctk.CTkToplevel(self, fg_color=styles.HISTORY_ITEM_FG_COLOR)
@@ -2442,42 +3037,20 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 
         self.wait_window(popup)
 
-    def _truncate_result(self, result: str, max_length: int = 100) -> str:
-        if len(result) > max_length:
-            return result[:max_length] + "..."
-        return result
-
-    def _update_textbox_from_stringvar(self, string_var: ctk.StringVar, textbox: ctk.CTkTextbox):
+    def _set_textbox_text(self, textbox: ctk.CTkTextbox, text: str, style: str = "normal"):
         if self._is_closing or not self.winfo_exists():
             return
         try:
             textbox.configure(state="normal")
             textbox.delete("1.0", "end")
-            textbox.insert("1.0", string_var.get())
-            # Apply style-based text color if tracked
-            try:
-                # Find indices of this textbox if possible
-                for r_idx, row in enumerate(self._result_textboxes):
-                    for c_idx, tb in enumerate(row):
-                        if tb is textbox:
-                            style = None
-                            try:
-                                style = self._cell_style[r_idx][c_idx]
-                            except Exception:
-                                style = None
-                            if style == "flow":
-                                textbox.configure(text_color=styles.FLOW_RESULT_TEXT_COLOR)
-                            else:
-                                textbox.configure(text_color=styles.HISTORY_ITEM_TEXT_COLOR)
-                            raise StopIteration
-            except StopIteration:
-                pass
+            textbox.insert("1.0", text)
+            textbox.configure(text_color=styles.FLOW_RESULT_TEXT_COLOR if style == "flow" else styles.HISTORY_ITEM_TEXT_COLOR)
             textbox.configure(state="disabled")
         except tk.TclError:
             pass
 
     def _show_full_result_popup(self, r_idx: int, c_idx: int):
-        full_result = self._full_results[r_idx][c_idx]
+        full_result = self._cells.full(r_idx, c_idx)
         popup = ctk.CTkToplevel(self, fg_color=styles.HISTORY_ITEM_FG_COLOR)
         popup.title(tr("matrix.result_preview_title_fmt", row=r_idx+1, col=c_idx+1))
         popup.geometry(styles.MATRIX_POPUP_GEOMETRY)
@@ -2532,8 +3105,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 
     def _save_full_result_and_close_popup(self, popup: ctk.CTkToplevel, textbox: ctk.CTkTextbox, r_idx: int, c_idx: int):
         edited_content = textbox.get("1.0", "end-1c")
-        self._full_results[r_idx][c_idx] = edited_content
-        self.results[r_idx][c_idx].set(self._truncate_result(edited_content))
+        self._set_cell_result(r_idx, c_idx, edited_content)
         popup.destroy()
 
     def _save_full_row_summary_and_close_popup(self, popup: ctk.CTkToplevel, textbox: ctk.CTkTextbox, r_idx: int):
@@ -2552,27 +3124,21 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
     def _delete_row(self, row_idx: int):
         if not messagebox.askyesno(tr("matrix.delete_row_title"), f"{tr('matrix.delete_row_confirm_fmt', row=row_idx + 1)}\n{tr('common.cannot_undo')}"):
             return
-        try:
-            for widget in list(self.scrollable_content_frame.grid_slaves(row=row_idx + 1)):
-                widget.destroy()
-        except Exception:
-            pass
         def finalize_delete():
+            if not (0 <= row_idx < len(self.input_data)):
+                return
+            started = time.perf_counter()
             try:
-                if 0 <= row_idx < len(self.input_data):
-                    self.input_data.pop(row_idx)
-                    self.checkbox_states.pop(row_idx)
-                    self.results.pop(row_idx)
-                    self._full_results.pop(row_idx)
-                    if self._row_summaries and 0 <= row_idx < len(self._row_summaries):
-                        self._row_summaries.pop(row_idx)
-                    if self._row_heights and 0 <= row_idx + 1 < len(self._row_heights):
-                        self._row_heights.pop(row_idx + 1)
+                self.input_data.pop(row_idx)
+                self._state_delete_row(row_idx)
             except Exception:
                 pass
             if not self.input_data:
                 self._clear_all()
-            self._update_ui()
+                self._update_ui()
+                return
+            self._view_delete_row(row_idx)
+            self._log_grid_edit("delete_row", started)
         self.after(10, finalize_delete)
 
     def _open_prompt_editor(self, prompt_id: str):
@@ -2588,7 +3154,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         if result_prompt:
             self.prompts[prompt_id] = result_prompt
             try:
-                self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
+                self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
             except Exception:
                 pass
             self._update_prompt_header_display(prompt_id)
@@ -2599,7 +3165,9 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         except ValueError:
             return
 
-        for widget in self.scrollable_content_frame.grid_slaves(row=0, column=col_idx + 1):
+        if self._header_frame is None:
+            return
+        for widget in self._header_frame.grid_slaves(row=0, column=col_idx + 1):
             widget.destroy()
         
         prompt_config = self.prompts[prompt_id]
@@ -2609,36 +3177,27 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
         col_letter = chr(ord('A') + col_idx)
         if not messagebox.askyesno(tr("matrix.delete_col_title"), f"{tr('matrix.delete_col_confirm_fmt', col=col_letter)}\n{tr('common.cannot_undo')}"):
             return
-        try:
-            for widget in list(self.scrollable_content_frame.grid_slaves(column=col_idx + 1)):
-                widget.destroy()
-        except Exception:
-            pass
         def finalize_delete():
+            prompt_keys = list(self.prompts.keys())
+            if not (0 <= col_idx < len(prompt_keys)):
+                return
+            started = time.perf_counter()
+            old_count = self._grid_column_count()
             try:
-                prompt_keys = list(self.prompts.keys())
-                if 0 <= col_idx < len(prompt_keys):
-                    del self.prompts[prompt_keys[col_idx]]
-                for r_idx in range(len(self.input_data)):
-                    if r_idx < len(self.checkbox_states) and 0 <= col_idx < len(self.checkbox_states[r_idx]):
-                        self.checkbox_states[r_idx].pop(col_idx)
-                    if r_idx < len(self.results) and 0 <= col_idx < len(self.results[r_idx]):
-                        self.results[r_idx].pop(col_idx)
-                    if r_idx < len(self._full_results) and 0 <= col_idx < len(self._full_results[r_idx]):
-                        self._full_results[r_idx].pop(col_idx)
-                if self._col_summaries and 0 <= col_idx < len(self._col_summaries):
-                    self._col_summaries.pop(col_idx)
-                if self._column_widths and 0 <= col_idx + 1 < len(self._column_widths):
-                    self._column_widths.pop(col_idx + 1)
+                del self.prompts[prompt_keys[col_idx]]
+                self._state_delete_column(col_idx)
                 try:
-                    self._tabs[self._active_tab_index]['prompts_obj'] = {pid: (p.model_copy(deep=True) if hasattr(p, 'model_copy') else Prompt(**p.model_dump())) for pid, p in self.prompts.items()}
+                    self._tabs[self._active_tab_index]['prompts_obj'] = self._share_prompts(self.prompts)
                 except Exception:
                     pass
             except Exception:
                 pass
             if not self.prompts:
                 self._clear_all()
-            self._update_ui()
+                self._update_ui()
+                return
+            self._view_delete_column(col_idx, old_count)
+            self._log_grid_edit("delete_column", started)
         self.after(10, finalize_delete)
 
     def _select_input_source(self, row_idx: int):
@@ -2665,31 +3224,34 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
     
     def _show_image_preview(self, row_idx: int):
         input_item = self.input_data[row_idx]
-        if input_item["type"] in ("image", "image_compressed"):
-            try:
-                raw = base64.b64decode(input_item["data"])
-                if input_item["type"] == "image_compressed":
-                    import zlib
-                    raw = zlib.decompress(raw)
-                image = Image.open(BytesIO(raw))
-                popup = ctk.CTkToplevel(self, fg_color=styles.HISTORY_ITEM_FG_COLOR)
-                popup.title(tr("matrix.image_preview_title_fmt", row=row_idx+1))
-                max_width = self.winfo_width() * 0.8
-                max_height = self.winfo_height() * 0.8
-                image.thumbnail((max_width, max_height), Image.LANCZOS)
-                ctk_image = ctk.CTkImage(light_image=image, dark_image=image, size=image.size)
-                image_label = ctk.CTkLabel(popup, image=ctk_image, text="", text_color=styles.HISTORY_ITEM_TEXT_COLOR)
-                image_label.pack(padx=10, pady=10)
-                close_button = ctk.CTkButton(popup, text=tr("common.close"), command=popup.destroy, fg_color=styles.CANCEL_BUTTON_COLOR, text_color=styles.CANCEL_BUTTON_TEXT_COLOR)
-                close_button.pack(pady=5)
-                popup.grab_set()
-                self.wait_window(popup)
-                self.grab_release()
-            except Exception as e:
-                messagebox.showerror(tr("common.error_title"), tr("matrix.image_preview_failed", details=str(e)))
+        if input_item["type"] in ("image", "image_compressed", IMAGE_FILE_TYPE):
+            # フルサイズのデコードは Tk スレッド外で行い、完了後にポップアップを開く
+            max_size = (max(1, int(self.winfo_width() * 0.8)), max(1, int(self.winfo_height() * 0.8)))
+            thumbs = get_thumbnail_cache(styles.MATRIX_IMAGE_THUMBNAIL_SIZE)
+            thumbs.decode_preview(image_bytes_loader(input_item), max_size, lambda img, r=row_idx: self.after(0, self._open_image_preview_popup, r, img))
         else:
             messagebox.showinfo(tr("common.info"), tr("matrix.not_image_row"))
 
+    def _open_image_preview_popup(self, row_idx: int, image: Optional[Image.Image]):
+        if self._is_closing or not self.winfo_exists():
+            return
+        if image is None:
+            messagebox.showerror(tr("common.error_title"), tr("matrix.image_preview_failed", details=tr("matrix.image_error")))
+            return
+        try:
+            popup = ctk.CTkToplevel(self, fg_color=styles.HISTORY_ITEM_FG_COLOR)
+            popup.title(tr("matrix.image_preview_title_fmt", row=row_idx+1))
+            ctk_image = ctk.CTkImage(light_image=image, dark_image=image, size=image.size)
+            image_label = ctk.CTkLabel(popup, image=ctk_image, text="", text_color=styles.HISTORY_ITEM_TEXT_COLOR)
+            image_label.pack(padx=10, pady=10)
+            close_button = ctk.CTkButton(popup, text=tr("common.close"), command=popup.destroy, fg_color=styles.CANCEL_BUTTON_COLOR, text_color=styles.CANCEL_BUTTON_TEXT_COLOR)
+            close_button.pack(pady=5)
+            popup.grab_set()
+            self.wait_window(popup)
+            self.grab_release()
+        except Exception as e:
+            messagebox.showerror(tr("common.error_title"), tr("matrix.image_preview_failed", details=str(e)))
+
     def _update_progress_label(self):
         if self._is_closing or not self.winfo_exists():
             return
@@ -2800,44 +3362,72 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
             except tk.TclError:
                 pass
 
-    def _export_to_excel(self):
-        try:
-            header_parts = [tr("matrix.export.header_input"), tr("matrix.export.header_prompt_name"), tr("matrix.export.header_system_prompt")] + [p.name for p in self.prompts.values()]
-            if self._row_summaries:
-                header_parts.append(tr("matrix.row_summary_header"))
-            tsv_data = ["\t".join(header_parts)]
-            for r_idx, input_item in enumerate(self.input_data):
-                input_display = input_item["data"] if input_item["type"] == "text" else f"[{input_item['type']}]"
-                row_parts = [input_display, "", ""]
-                for c_idx in range(len(self.prompts)):
-                    cell_result = self._full_results[r_idx][c_idx] if r_idx < len(self._full_results) and c_idx < len(self._full_results[r_idx]) else ""
-                    row_parts.append(cell_result.replace('\n', ' ').replace('\r', ''))
-                if self._row_summaries:
-                    row_summary = self._row_summaries[r_idx].get() if r_idx < len(self._row_summaries) else ""
-                    row_parts.append(row_summary.replace('\n', ' ').replace('\r', ''))
-                tsv_data.append("\t".join(row_parts))
-            if self._col_summaries:
-                col_summary_parts = [tr("matrix.col_summary_header"), "", ""] + [self._col_summaries[c_idx].get().replace('\n', ' ').replace('\r', '') if c_idx < len(self._col_summaries) else "" for c_idx in range(len(self.prompts))]
-                if self._row_summaries:
-                    col_summary_parts.append("")
-                tsv_data.append("\t".join(col_summary_parts))
-            pyperclip.copy("\n".join(tsv_data))
-            messagebox.showinfo(tr("matrix.export.title"), tr("matrix.export.copied"))
+    def _export_results(self):
+        """結果をファイルへ書き出す（CSV/XLSX/JSONL、ワーカースレッドで1行ずつ）"""
+        if self._export_thread is not None and self._export_thread.is_alive():
+            messagebox.showinfo(tr("matrix.export.title"), tr("matrix.export.busy"))
+            return
+        try:
+            tab_name = str(self._tabs[self._active_tab_index].get('name') or "matrix")
+        except Exception:
+            tab_name = "matrix"
+        target = filedialog.asksaveasfilename(title=tr("matrix.export.title"), defaultextension=".csv", filetypes=EXPORT_FILETYPES, initialfile=f"{safe_session_name(tab_name)}.csv")
+        if not target:
+            return
+        try:
+            # 入力・まとめ・セルはここ（UI スレッド）で固定する。書き出し中に行/列の編集、実行、
+            # タブ切替やタブの追い出しがあってもファイルの内容は押した時点のまま
+            source = MatrixExportSource(
+                inputs=list(self.input_data),
+                cells=None,
+                prompts=[(pid, p.name) for pid, p in self.prompts.items()],
+                header_labels=[tr("matrix.export.header_input"), tr("matrix.export.header_prompt_name"), tr("matrix.export.header_system_prompt")],
+                row_summaries=[v.get() for v in self._row_summaries] if self._row_summaries else None,
+                col_summaries=[v.get() for v in self._col_summaries] if self._col_summaries else None,
+                row_summary_label=tr("matrix.row_summary_header"),
+                col_summary_label=tr("matrix.col_summary_header"),
+            )
+            source.cells = self._cells.snapshot()
         except Exception as e:
             messagebox.showerror(tr("common.error_title"), tr("matrix.export.error", details=str(e)))
+            return
+        self._export_cancel.clear()
+        self._export_thread = threading.Thread(target=self._export_worker, args=(Path(target), source), daemon=True)
+        self._export_thread.start()
+
+    def _export_worker(self, target: Path, source: MatrixExportSource):
+        started = time.perf_counter()
+
+        def on_progress(done: int, total: int):
+            self.after(0, lambda: self.progress_label.configure(text=tr("matrix.export.progress_fmt", done=done, total=total)))
+
+        try:
+            rows = export_matrix(target, source, progress=on_progress, cancel=self._export_cancel)
+        except ExportCancelled:
+            logger.debug("matrix export to %s cancelled", target)
+            return
+        except Exception as e:
+            logger.exception("_export_worker - export to %s failed", target)
+            self.after(0, lambda err=str(e): [self._update_progress_label(), messagebox.showerror(tr("common.error_title"), tr("matrix.export.error", details=err))])
+            return
+        finally:
+            source.cells.close()
+        logger.debug("matrix export of %d rows to %s took %.1f ms", rows, target.name, (time.perf_counter() - started) * 1000)
+        self.after(0, lambda: [self._update_progress_label(), messagebox.showinfo(tr("matrix.export.title"), tr("matrix.export.saved_fmt", path=str(target)))])
 
     def _show_clipboard_history_popup(self, row_idx: int):
         if not self.agent or not hasattr(self.agent, 'clipboard_history'):
             self.notification_callback(tr("common.error"), tr("history.unavailable"), "error")
             return
-        history_for_popup = []
-        for item in self.agent.clipboard_history:
-            if isinstance(item, str):
-                history_for_popup.append({"type": "text", "data": item})
-            elif isinstance(item, dict) and "type" in item and "data" in item:
-                history_for_popup.append(item)
+        # メタデータのみ渡し、選択された項目だけペイロードを読み込む
+        store = getattr(self.agent, 'history_store', None)
+        history_for_popup = store.entries(ClipboardHistorySelectorPopup.MAX_VISIBLE_ITEMS) if store is not None else []
         def on_select(selected_item: Dict[str, Any]):
-            self._set_input_data_from_history(row_idx, selected_item)
+            loaded = self.agent.load_history_item(selected_item) if "key" in selected_item else selected_item
+            if not loaded:
+                self.notification_callback(tr("common.error"), tr("history.unavailable"), "error")
+                return
+            self._set_input_data_from_history(row_idx, loaded)
         if self._history_popup and self._history_popup.winfo_exists():
             try:
                 self._history_popup.destroy()
@@ -2845,7 +3435,7 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
                 pass
         def _on_popup_destroy():
             self._history_popup = None
-        self._history_popup = ClipboardHistorySelectorPopup(parent_app=self, clipboard_history=history_for_popup, on_select_callback=on_select, on_destroy_callback=_on_popup_destroy)
+        self._history_popup = ClipboardHistorySelectorPopup(parent_app=self, clipboard_history=history_for_popup, on_select_callback=on_select, on_destroy_callback=_on_popup_destroy, search_callback=(lambda q, n: store.search(q, limit=n)) if store is not None else None, thumbnail_loader=(lambda meta: store.read_blob(meta.get("blob", ""))) if store is not None else None)
         self._history_popup.show_at_cursor()
 
     def _open_history_edit_dialog(self, row_idx: int):
@@ -2879,8 +3469,14 @@ class MatrixBatchProcessorWindow(ctk.CTkToplevel):
 ## Duplicate MatrixSummarySettingsDialog removed; use main prompt manager window instead
 
 class ClipboardHistorySelectorPopup(ctk.CTkToplevel):
-    """クリップボード履歴から項目を選択するためのポップアップウィンドウ。"""
-    def __init__(self, parent_app: ctk.CTk, clipboard_history: List[Dict[str, Any]], on_select_callback: Callable[[Dict[str, Any]], None], on_destroy_callback: Optional[Callable] = None):
+    """クリップボード履歴から項目を選択するためのポップアップウィンドウ。
+
+    search_callback(query, limit) を渡すと、上部の入力欄で全履歴を絞り込める。
+    表示するボタンは常に最大 MAX_VISIBLE_ITEMS 件に抑える。
+    """
+    MAX_VISIBLE_ITEMS = 50
+
+    def __init__(self, parent_app: ctk.CTk, clipboard_history: List[Dict[str, Any]], on_select_callback: Callable[[Dict[str, Any]], None], on_destroy_callback: Optional[Callable] = None, search_callback: Optional[Callable[[str, int], List[Dict[str, Any]]]] = None, thumbnail_loader: Optional[Callable[[Dict[str, Any]], Optional[bytes]]] = None):
         super().__init__(parent_app)
         self.transient(parent_app)
         self.grab_set()
@@ -2891,43 +3487,113 @@ class ClipboardHistorySelectorPopup(ctk.CTkToplevel):
         
         self.on_select_callback = on_select_callback
         self._on_destroy_callback = on_destroy_callback
-        self._history_items = clipboard_history
+        self._search_callback = search_callback
+        self._thumbnail_loader = thumbnail_loader
+        self._history_items = clipboard_history[:self.MAX_VISIBLE_ITEMS]
         self._buttons: List[ctk.CTkButton] = []
         self._current_selection_index = 0
         self._is_destroying = False
+        self._filter_job: Optional[str] = None
 
         self.main_frame = ctk.CTkFrame(self, fg_color=styles.POPUP_BG_COLOR)
         self.main_frame.pack(fill="both", expand=True)
-        self.main_frame.grid_rowconfigure(0, weight=1)
+        self.main_frame.grid_rowconfigure(1, weight=1)
         self.main_frame.grid_columnconfigure(0, weight=1)
 
+        self.search_entry = ctk.CTkEntry(self.main_frame, placeholder_text=tr("history.search_placeholder"))
+        self.search_entry.grid(row=0, column=0, sticky="ew", padx=5, pady=(5, 0))
+        self.search_entry.bind("<KeyRelease>", self._on_search_key)
+        self.search_entry.bind("<Return>", lambda e: self._select_current())
+        self.search_entry.bind("<Up>", lambda e: self._move_selection(-1))
+        self.search_entry.bind("<Down>", lambda e: self._move_selection(1))
+
         self.scrollable_frame = ctk.CTkScrollableFrame(self.main_frame)
-        self.scrollable_frame.grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
+        self.scrollable_frame.grid(row=1, column=0, sticky="nsew", padx=5, pady=5)
         self.scrollable_frame.grid_columnconfigure(0, weight=1)
 
-        for i, item in enumerate(self._history_items):
+        self._render_items(self._history_items)
+
+        cancel_button = ctk.CTkButton(self.main_frame, text=tr("common.cancel"), command=self.destroy, fg_color=styles.CANCEL_BUTTON_COLOR, text_color=styles.CANCEL_BUTTON_TEXT_COLOR)
+        cancel_button.grid(row=2, column=0, sticky="ew", padx=5, pady=(0, 5))
+
+        self.bind("<Escape>", lambda e: self.destroy())
+
+    def _render_items(self, items: List[Dict[str, Any]]):
+        for button in self._buttons:
             try:
-                if item.get("type") == "text":
-                    text = item.get("data", "")
-                    label = text.replace("\n", " ")[:80] + ("..." if len(text) > 80 else "")
-                elif item.get("type") in ("image", "image_compressed"):
-                    label = tr("history.image")
-                elif item.get("type") == "file":
-                    label = f"[" + tr("history.file_name_prefix", name=Path(item.get('data', '')).name) + "]"
-                else:
-                    label = tr("history.unknown")
+                button.destroy()
+            except Exception:
+                pass
+        self._buttons = []
+        self._history_items = items
+        for i, item in enumerate(items):
+            try:
+                label = history_label(item, max_len=80)
             except Exception:
                 label = tr("history.display_error", error="")
 
             button = ctk.CTkButton(self.scrollable_frame, text=label, command=lambda i=item: self._on_item_selected(i), anchor="w", fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR)
             button.grid(row=i, column=0, sticky="ew", padx=5, pady=2)
             self._buttons.append(button)
+            if item.get("type") == "image" and item.get("blob") and self._thumbnail_loader is not None:
+                self._attach_thumbnail(button, item)
+        self._current_selection_index = 0
+        self._update_selection_highlight()
 
-        cancel_button = ctk.CTkButton(self.main_frame, text=tr("common.cancel"), command=self.destroy, fg_color=styles.CANCEL_BUTTON_COLOR, text_color=styles.CANCEL_BUTTON_TEXT_COLOR)
-        cancel_button.grid(row=1, column=0, sticky="ew", padx=5, pady=(0, 5))
+    def _attach_thumbnail(self, button: ctk.CTkButton, item: Dict[str, Any]):
+        thumbs = get_thumbnail_cache(styles.HISTORY_THUMBNAIL_SIZE)
+        key = item.get("blob")
+        cached = thumbs.get_cached(key)
+        if cached is not None:
+            self._apply_button_thumbnail(button, cached)
+            return
+        loader = self._thumbnail_loader
+        thumbs.request(key, lambda m=item: loader(m), lambda img, b=button: self.after(0, self._apply_button_thumbnail, b, img))
 
-        self.bind("<Escape>", lambda e: self.destroy())
-        self._update_selection_highlight()
+    def _apply_button_thumbnail(self, button: ctk.CTkButton, image: Optional[Image.Image]):
+        if self._is_destroying or image is None:
+            return
+        try:
+            if button.winfo_exists():
+                ctk_image = ctk.CTkImage(light_image=image, dark_image=image, size=image.size)
+                button.configure(image=ctk_image, compound="left")
+                button._thumb_ref = ctk_image  # GC 防止
+        except tk.TclError:
+            pass
+
+    def _on_search_key(self, event):
+        if event.keysym in ("Up", "Down", "Return", "Escape"):
+            return
+        if self._search_callback is None:
+            return
+        if self._filter_job is not None:
+            try:
+                self.after_cancel(self._filter_job)
+            except Exception:
+                pass
+        self._filter_job = self.after(120, self._apply_filter)
+
+    def _apply_filter(self):
+        self._filter_job = None
+        if self._is_destroying or self._search_callback is None:
+            return
+        try:
+            items = self._search_callback(self.search_entry.get(), self.MAX_VISIBLE_ITEMS)
+        except Exception as e:
+            logger.error("ClipboardHistorySelectorPopup - search failed: %s", e)
+            return
+        self._render_items(list(items))
+
+    def _move_selection(self, delta: int):
+        if self._buttons:
+            self._current_selection_index = (self._current_selection_index + delta) % len(self._buttons)
+            self._update_selection_highlight()
+        return "break"
+
+    def _select_current(self):
+        if 0 <= self._current_selection_index < len(self._history_items):
+            self._on_item_selected(self._history_items[self._current_selection_index])
+        return "break"
 
     def _on_item_selected(self, item: Dict[str, Any]):
         try:
@@ -2961,6 +3627,10 @@ class ClipboardHistorySelectorPopup(ctk.CTkToplevel):
         self.deiconify()
         self.lift()
         self.focus_force()
+        try:
+            self.search_entry.focus_set()
+        except Exception:
+            pass
 
     def destroy(self):
         self.grab_release()
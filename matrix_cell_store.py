@@ -0,0 +1,433 @@
+"""
+matrix_cell_store.py
+======================
+
+Index-addressed cell storage for the matrix batch processor.
+
+Each cell has a checked flag, a display style, an optional display override
+(e.g. "processing…") and the full result text. This state lives in compact
+per-row arrays (``bytearray`` for flags and styles, plain lists for text)
+instead of one Tk variable per cell. Costs are:
+
+- get/set by ``(row, col)``: O(1)
+- insert or delete a row: O(columns)
+- insert, delete or move a column: O(rows)
+
+Results longer than ``SPILL_THRESHOLD_CHARS`` go to a temporary spill file.
+Only a short preview stays in memory, so memory follows the size of the
+result data rather than the number of cells or widgets.
+
+:meth:`MatrixCellStore.snapshot` gives background readers (export) a frozen
+view: it copies the row arrays by reference and keeps spill files alive until
+the snapshot is closed, so later edits, runs or ``close()`` do not change it.
+"""
+
+from __future__ import annotations
+
+import shutil
+import sys
+import tempfile
+import threading
+from itertools import count
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# これより長い結果はディスクへ逃がす
+SPILL_THRESHOLD_CHARS = 256 * 1024
+PREVIEW_CHARS = 200
+
+_STYLE_NAMES = ("normal", "flow")
+_STYLE_CODES = {name: code for code, name in enumerate(_STYLE_NAMES)}
+
+# 全ストア共通の変更カウンタ（version が同じなら内容も同じ、と判定できるようにする）
+_versions = count(1)
+
+
+class _Spilled:
+    """Reference to a result string stored in a spill file."""
+
+    __slots__ = ("path", "length", "preview")
+
+    def __init__(self, path: Path, length: int, preview: str):
+        self.path = path
+        self.length = length
+        self.preview = preview
+
+
+class _Row:
+    __slots__ = ("checked", "style", "display", "full")
+
+    def __init__(self, cols: int):
+        self.checked = bytearray(cols)
+        self.style = bytearray(cols)
+        # None = 表示は full をそのまま使う
+        self.display: List[Optional[str]] = [None] * cols
+        self.full: List[Any] = [None] * cols
+
+
+class MatrixCellSnapshot:
+    """Read-only view of a store's checked flags and results at one point in time.
+
+    Has the same read methods as :class:`MatrixCellStore` (``rows``, ``cols``,
+    ``full``, ``is_checked``). Call :meth:`close` when done so the store can
+    delete spill files that were replaced in the meantime.
+    """
+
+    def __init__(self, store: "MatrixCellStore", rows: List[Tuple[bytes, List[Any]]], cols: int):
+        self._store: Optional[MatrixCellStore] = store
+        self._rows = rows
+        self._cols = cols
+
+    @property
+    def rows(self) -> int:
+        return len(self._rows)
+
+    @property
+    def cols(self) -> int:
+        return self._cols
+
+    def is_checked(self, r: int, c: int) -> bool:
+        return bool(self._rows[r][0][c])
+
+    def full(self, r: int, c: int) -> str:
+        value = self._rows[r][1][c]
+        if value is None:
+            return ""
+        if isinstance(value, _Spilled):
+            return MatrixCellStore._read_spill(value)
+        return value
+
+    def close(self) -> None:
+        store, self._store = self._store, None
+        if store is not None:
+            store._unpin()
+
+    def __enter__(self) -> "MatrixCellSnapshot":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class MatrixCellStore:
+    """Row-major (row, col) store for matrix cell state.
+
+    ``version`` changes on every mutation that affects :meth:`to_state` and is
+    unique across stores, so callers can cheaply tell whether a store changed
+    since they last persisted it.
+    """
+
+    def __init__(self, rows: int = 0, cols: int = 0, spill_threshold: int = SPILL_THRESHOLD_CHARS):
+        self.spill_threshold = max(1, int(spill_threshold))
+        self._lock = threading.RLock()
+        self._rows: List[_Row] = []
+        self._cols = 0
+        self._spill_dir: Optional[Path] = None
+        self._spill_seq = 0
+        self._spilled = 0
+        # 開いているスナップショットの数。0 になるまで spill ファイルの削除を遅らせる
+        self._pins = 0
+        self._deferred: List[Path] = []
+        self.version = next(_versions)
+        self.resize(rows, cols)
+
+    # ------------------------------------------------------------------
+    # Shape
+    # ------------------------------------------------------------------
+    @property
+    def rows(self) -> int:
+        return len(self._rows)
+
+    @property
+    def cols(self) -> int:
+        return self._cols
+
+    def resize(self, rows: int, cols: int) -> None:
+        """Grow or shrink to ``rows`` x ``cols``. New cells are empty and unchecked."""
+        rows, cols = max(0, int(rows)), max(0, int(cols))
+        if rows == len(self._rows) and cols == self._cols:
+            return
+        with self._lock:
+            self.version = next(_versions)
+            if cols != self._cols:
+                for row in self._rows:
+                    if cols > self._cols:
+                        extra = cols - self._cols
+                        row.checked.extend(bytes(extra))
+                        row.style.extend(bytes(extra))
+                        row.display.extend([None] * extra)
+                        row.full.extend([None] * extra)
+                    else:
+                        for value in row.full[cols:]:
+                            self._release(value)
+                        del row.checked[cols:]
+                        del row.style[cols:]
+                        del row.display[cols:]
+                        del row.full[cols:]
+                self._cols = cols
+            while len(self._rows) < rows:
+                self._rows.append(_Row(cols))
+            while len(self._rows) > rows:
+                self._release_row(self._rows.pop())
+
+    def insert_row(self, r: int) -> None:
+        with self._lock:
+            self.version = next(_versions)
+            self._rows.insert(r, _Row(self._cols))
+
+    def delete_row(self, r: int) -> None:
+        with self._lock:
+            if 0 <= r < len(self._rows):
+                self.version = next(_versions)
+                self._release_row(self._rows.pop(r))
+
+    def insert_col(self, c: int) -> None:
+        with self._lock:
+            self.version = next(_versions)
+            c = max(0, min(c, self._cols))
+            for row in self._rows:
+                row.checked.insert(c, 0)
+                row.style.insert(c, 0)
+                row.display.insert(c, None)
+                row.full.insert(c, None)
+            self._cols += 1
+
+    def delete_col(self, c: int) -> None:
+        with self._lock:
+            if not (0 <= c < self._cols):
+                return
+            self.version = next(_versions)
+            for row in self._rows:
+                self._release(row.full[c])
+                del row.checked[c]
+                del row.style[c]
+                del row.display[c]
+                del row.full[c]
+            self._cols -= 1
+
+    def move_col(self, src: int, dst: int) -> None:
+        with self._lock:
+            if src == dst or not (0 <= src < self._cols and 0 <= dst < self._cols):
+                return
+            self.version = next(_versions)
+            for row in self._rows:
+                for arr in (row.checked, row.style, row.display, row.full):
+                    arr.insert(dst, arr.pop(src))
+
+    def clear(self) -> None:
+        """Drop every row and column and delete spill files."""
+        with self._lock:
+            self.version = next(_versions)
+            self._rows = []
+            self._cols = 0
+            self._spilled = 0
+            if self._spill_dir is not None:
+                if self._pins:
+                    self._deferred.append(self._spill_dir)
+                else:
+                    shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+
+    close = clear
+
+    # ------------------------------------------------------------------
+    # Cell access
+    # ------------------------------------------------------------------
+    def is_checked(self, r: int, c: int) -> bool:
+        return bool(self._rows[r].checked[c])
+
+    def set_checked(self, r: int, c: int, value: bool) -> None:
+        self._rows[r].checked[c] = 1 if value else 0
+        self.version = next(_versions)
+
+    def style(self, r: int, c: int) -> str:
+        return _STYLE_NAMES[self._rows[r].style[c]]
+
+    def set_style(self, r: int, c: int, style: str) -> None:
+        self._rows[r].style[c] = _STYLE_CODES.get(style, 0)
+
+    def display(self, r: int, c: int) -> str:
+        """Text shown in the cell widget (override, else the result or its preview)."""
+        row = self._rows[r]
+        text = row.display[c]
+        if text is not None:
+            return text
+        value = row.full[c]
+        if value is None:
+            return ""
+        if isinstance(value, _Spilled):
+            return value.preview
+        return value
+
+    def set_display(self, r: int, c: int, text: Optional[str]) -> None:
+        """Override the displayed text without touching the stored result."""
+        self._rows[r].display[c] = text
+
+    def full(self, r: int, c: int) -> str:
+        """Full result text (read back from disk if it was spilled).
+
+        Safe to call from other threads (export, memory monitor): the lock
+        keeps the spill file from being released or replaced mid-read.
+        """
+        with self._lock:
+            value = self._rows[r].full[c]
+            if value is None:
+                return ""
+            if isinstance(value, _Spilled):
+                return self._read_spill(value)
+            return value
+
+    def has_result(self, r: int, c: int) -> bool:
+        return self._rows[r].full[c] is not None
+
+    def set_result(self, r: int, c: int, text: Optional[str]) -> None:
+        """Store the full result and clear any display override."""
+        text = text or ""
+        with self._lock:
+            self.version = next(_versions)
+            row = self._rows[r]
+            self._release(row.full[c])
+            row.display[c] = None
+            if len(text) > self.spill_threshold:
+                row.full[c] = self._spill(text)
+            else:
+                row.full[c] = text or None
+
+    def checked_cells(self) -> Iterator[Tuple[int, int]]:
+        """Yield ``(row, col)`` of checked cells in row-major order."""
+        for r, row in enumerate(self._rows):
+            c = row.checked.find(1)
+            while c >= 0:
+                yield r, c
+                c = row.checked.find(1, c + 1)
+
+    def snapshot(self) -> MatrixCellSnapshot:
+        """Frozen view for another thread. O(rows); cell text is shared, not copied."""
+        with self._lock:
+            self._pins += 1
+            rows = [(bytes(row.checked), list(row.full)) for row in self._rows]
+            return MatrixCellSnapshot(self, rows, self._cols)
+
+    def _unpin(self) -> None:
+        with self._lock:
+            self._pins = max(0, self._pins - 1)
+            if self._pins:
+                return
+            deferred, self._deferred = self._deferred, []
+        for path in deferred:
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                self._unlink(path)
+
+    # ------------------------------------------------------------------
+    # Session state (same shape as the previous nested lists)
+    # ------------------------------------------------------------------
+    def to_state(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'checkbox': [[bool(b) for b in row.checked] for row in self._rows],
+                'full_results': [[self.full(r, c) for c in range(self._cols)] for r in range(len(self._rows))],
+            }
+
+    def load_state(self, state: Optional[Dict[str, Any]], rows: int, cols: int) -> None:
+        with self._lock:
+            self.clear()
+            self.resize(rows, cols)
+            if not state:
+                return
+            chk = state.get('checkbox', []) or []
+            fr = state.get('full_results', []) or []
+            for r in range(rows):
+                src = chk[r] if r < len(chk) else []
+                for c in range(min(cols, len(src))):
+                    if src[c]:
+                        self._rows[r].checked[c] = 1
+                src_row = fr[r] if r < len(fr) else []
+                for c in range(min(cols, len(src_row))):
+                    if src_row[c]:
+                        self.set_result(r, c, str(src_row[c]))
+
+    def memory_estimate(self) -> Dict[str, int]:
+        """Rough in-memory footprint in bytes (spilled text is counted separately)."""
+        in_memory = 0
+        spilled_chars = 0
+        with self._lock:
+            for row in self._rows:
+                in_memory += sys.getsizeof(row.checked) + sys.getsizeof(row.style)
+                in_memory += sys.getsizeof(row.display) + sys.getsizeof(row.full)
+                for text in row.display:
+                    if text is not None:
+                        in_memory += sys.getsizeof(text)
+                for value in row.full:
+                    if isinstance(value, _Spilled):
+                        in_memory += sys.getsizeof(value.preview)
+                        spilled_chars += value.length
+                    elif value is not None:
+                        in_memory += sys.getsizeof(value)
+        return {'bytes': in_memory, 'spilled_cells': self._spilled, 'spilled_chars': spilled_chars}
+
+    def spill_results(self, min_chars: int = PREVIEW_CHARS) -> int:
+        """Move in-memory results of at least *min_chars* to spill files; returns the cell count.
+
+        The content does not change, so ``version`` is left alone.
+        """
+        moved = 0
+        with self._lock:
+            for row in self._rows:
+                for c, value in enumerate(row.full):
+                    if isinstance(value, str) and len(value) >= min_chars:
+                        spilled = self._spill(value)
+                        if spilled is value:
+                            # 書き込みに失敗した（ディスク不足など）ので打ち切る
+                            return moved
+                        row.full[c] = spilled
+                        moved += 1
+        return moved
+
+    # ------------------------------------------------------------------
+    # Spill files
+    # ------------------------------------------------------------------
+    def _spill(self, text: str) -> Any:
+        try:
+            if self._spill_dir is None:
+                self._spill_dir = Path(tempfile.mkdtemp(prefix="gem_clip_matrix_"))
+            self._spill_seq += 1
+            path = self._spill_dir / f"{self._spill_seq}.txt"
+            # バイナリで書く（テキストモードだと \r\n などの改行が変換されて結果が変わる）
+            path.write_bytes(text.encode("utf-8", "surrogatepass"))
+        except Exception as e:
+            print(f"ERROR: MatrixCellStore - failed to spill result ({len(text)} chars): {e}")
+            return text
+        self._spilled += 1
+        return _Spilled(path, len(text), text[:PREVIEW_CHARS] + "...")
+
+    @staticmethod
+    def _read_spill(value: _Spilled) -> str:
+        try:
+            return value.path.read_bytes().decode("utf-8", "surrogatepass")
+        except Exception as e:
+            print(f"ERROR: MatrixCellStore - spilled result unreadable ({value.path}): {e}")
+            return value.preview
+
+    def _release(self, value: Any) -> None:
+        if isinstance(value, _Spilled):
+            self._spilled -= 1
+            if self._pins:
+                # スナップショットがまだ読むかもしれない
+                self._deferred.append(value.path)
+            else:
+                self._unlink(value.path)
+
+    @staticmethod
+    def _unlink(path: Path) -> None:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"ERROR: MatrixCellStore - failed to delete spill file {path}: {e}")
+
+    def _release_row(self, row: _Row) -> None:
+        for value in row.full:
+            self._release(value)
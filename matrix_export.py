@@ -0,0 +1,221 @@
+"""
+matrix_export.py
+==================
+
+Streaming export of matrix results to CSV, XLSX or JSONL.
+
+Rows are produced one at a time from the live cell store and written
+straight to disk, so memory use does not grow with the grid:
+
+- ``.csv``: UTF-8 with BOM (so Excel detects the encoding), standard
+  quoting, newlines inside cells preserved
+- ``.xlsx``: openpyxl in write-only mode (optional dependency)
+- ``.jsonl``: one object per row with per-cell metadata (prompt id/name,
+  checked flag, result)
+
+The output goes to a temporary file next to the target and is renamed into
+place when complete, so a failed or cancelled export never leaves a partial
+file behind. Nothing here touches Tk. Callers snapshot the Tk-owned values
+(summary StringVars) on the UI thread and run :func:`export_matrix` on a
+worker thread.
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FILETYPES = [("CSV", "*.csv"), ("Excel", "*.xlsx"), ("JSON Lines", "*.jsonl")]
+# Excel のセル上限（超える分は切り詰める）
+XLSX_MAX_CELL_CHARS = 32767
+PROGRESS_EVERY_ROWS = 200
+
+ProgressCallback = Callable[[int, int], None]
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class MatrixExportSource:
+    """What to export: input items, the cell store and pre-read summary strings.
+
+    ``inputs``, ``row_summaries`` and ``col_summaries`` are shallow copies taken
+    on the UI thread. ``cells`` is a store or a ``MatrixCellSnapshot``; results
+    are read lazily from it row by row.
+    """
+
+    def __init__(self, inputs: List[Dict[str, Any]], cells: Any, prompts: List[Any], header_labels: List[str],
+                 row_summaries: Optional[List[str]] = None, col_summaries: Optional[List[str]] = None,
+                 row_summary_label: str = "", col_summary_label: str = ""):
+        self.inputs = inputs
+        self.cells = cells
+        # (prompt_id, name) の組
+        self.prompts = prompts
+        self.header_labels = header_labels
+        self.row_summaries = row_summaries
+        self.col_summaries = col_summaries
+        self.row_summary_label = row_summary_label
+        self.col_summary_label = col_summary_label
+
+    @property
+    def total_rows(self) -> int:
+        return len(self.inputs)
+
+    def header(self) -> List[str]:
+        header = list(self.header_labels) + [name for _, name in self.prompts]
+        if self.row_summaries is not None:
+            header.append(self.row_summary_label)
+        return header
+
+    def result(self, r: int, c: int) -> str:
+        cells = self.cells
+        if r < cells.rows and c < cells.cols:
+            return cells.full(r, c)
+        return ""
+
+    def checked(self, r: int, c: int) -> bool:
+        cells = self.cells
+        return r < cells.rows and c < cells.cols and cells.is_checked(r, c)
+
+    def row_summary(self, r: int) -> str:
+        if self.row_summaries is None or r >= len(self.row_summaries):
+            return ""
+        return self.row_summaries[r]
+
+
+def input_display(item: Dict[str, Any]) -> str:
+    t = item.get("type")
+    if t == "text":
+        return item.get("data") or ""
+    if t in ("file", "image_file"):
+        # パス参照はそのまま出す（中身は読まない）
+        return str(item.get("data") or "")
+    return f"[{t}]"
+
+
+def iter_table_rows(source: MatrixExportSource, cancel: Optional[threading.Event] = None) -> Iterator[List[str]]:
+    """Header, one list per input row, then the column-summary row (if any)."""
+    yield source.header()
+    pad = [""] * (len(source.header_labels) - 1)
+    n_cols = len(source.prompts)
+    for r, item in enumerate(source.inputs):
+        if cancel is not None and cancel.is_set():
+            raise ExportCancelled()
+        row = [input_display(item)] + pad + [source.result(r, c) for c in range(n_cols)]
+        if source.row_summaries is not None:
+            row.append(source.row_summary(r))
+        yield row
+    if source.col_summaries is not None:
+        row = [source.col_summary_label] + pad + [source.col_summaries[c] if c < len(source.col_summaries) else "" for c in range(n_cols)]
+        if source.row_summaries is not None:
+            row.append("")
+        yield row
+
+
+def iter_jsonl_records(source: MatrixExportSource, cancel: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+    for r, item in enumerate(source.inputs):
+        if cancel is not None and cancel.is_set():
+            raise ExportCancelled()
+        record: Dict[str, Any] = {
+            "row": r + 1,
+            "input": {"type": item.get("type"), "value": input_display(item)},
+            "cells": [
+                {"col": c + 1, "prompt_id": pid, "prompt": name, "checked": source.checked(r, c), "result": source.result(r, c)}
+                for c, (pid, name) in enumerate(source.prompts)
+            ],
+        }
+        if source.row_summaries is not None:
+            record["row_summary"] = source.row_summary(r)
+        yield record
+    if source.col_summaries is not None:
+        yield {"col_summaries": [
+            {"col": c + 1, "prompt_id": pid, "prompt": name, "summary": source.col_summaries[c] if c < len(source.col_summaries) else ""}
+            for c, (pid, name) in enumerate(source.prompts)
+        ]}
+
+
+def export_matrix(path: Path, source: MatrixExportSource, progress: Optional[ProgressCallback] = None,
+                  cancel: Optional[threading.Event] = None) -> int:
+    """Write *source* to *path* (format from the suffix). Returns the number of input rows written."""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    writers = {".csv": _write_csv, ".xlsx": _write_xlsx, ".jsonl": _write_jsonl}
+    writer = writers.get(suffix)
+    if writer is None:
+        raise ValueError(f"Unsupported export format: {suffix or path.name}")
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        writer(tmp, source, _Progress(source.total_rows, progress), cancel)
+        os.replace(tmp, path)
+    finally:
+        try:
+            tmp.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("matrix_export - failed to remove %s: %s", tmp, e)
+    return source.total_rows
+
+
+class _Progress:
+    """Throttled ``(done, total)`` reporter."""
+
+    def __init__(self, total: int, callback: Optional[ProgressCallback]):
+        self.total = total
+        self.callback = callback
+        self.done = 0
+
+    def step(self) -> None:
+        self.done += 1
+        if self.callback is not None and (self.done % PROGRESS_EVERY_ROWS == 0 or self.done == self.total):
+            self.callback(self.done, self.total)
+
+
+def _write_csv(path: Path, source: MatrixExportSource, progress: _Progress, cancel: Optional[threading.Event]) -> None:
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        rows = iter_table_rows(source, cancel)
+        writer.writerow(next(rows))
+        for i, row in enumerate(rows):
+            writer.writerow(row)
+            if i < source.total_rows:
+                progress.step()
+
+
+def _write_xlsx(path: Path, source: MatrixExportSource, progress: _Progress, cancel: Optional[threading.Event]) -> None:
+    try:
+        from openpyxl import Workbook  # type: ignore
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE  # type: ignore
+    except ImportError:
+        raise RuntimeError("XLSX export requires openpyxl (pip install openpyxl). Use CSV instead.")
+
+    def clean(value: str) -> str:
+        value = ILLEGAL_CHARACTERS_RE.sub("", value)
+        return value[:XLSX_MAX_CELL_CHARS]
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Matrix")
+    rows = iter_table_rows(source, cancel)
+    ws.append([clean(v) for v in next(rows)])
+    for i, row in enumerate(rows):
+        ws.append([clean(v) for v in row])
+        if i < source.total_rows:
+            progress.step()
+    wb.save(path)
+
+
+def _write_jsonl(path: Path, source: MatrixExportSource, progress: _Progress, cancel: Optional[threading.Event]) -> None:
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        for i, record in enumerate(iter_jsonl_records(source, cancel)):
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write("\n")
+            if i < source.total_rows:
+                progress.step()
@@ -0,0 +1,162 @@
+"""
+matrix_import.py
+==================
+
+Streaming bulk import of matrix input rows.
+
+:func:`iter_import_items` turns a CSV file, a JSONL file or a directory into
+matrix input items (``{"type", "data"}``) one at a time. Nothing is read up
+front. CSV and JSONL are parsed line by line. Directory entries become path
+references that are only opened when needed:
+
+- ``image_file``: a thumbnail is made when the row scrolls into view, and
+  the bytes are read when the row is executed
+- ``file``: uploaded when the row is executed, as with a manually attached
+  file
+
+The module has no Tk dependency, so the GUI (in batches from a worker
+thread) and headless callers share the same pipeline.
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp"}
+FILE_SUFFIXES = {".pdf", ".txt", ".md", ".csv", ".py", ".mp3", ".wav", ".xlsx", ".doc", ".docx"}
+# CSV でこの名前の列があれば入力として使う（なければ先頭列）
+TEXT_COLUMN_CANDIDATES = ("input", "text", "prompt", "content", "入力", "テキスト")
+
+# 画像ファイルを参照だけで持つ入力タイプ（中身は実行/表示のときに読む）
+IMAGE_FILE_TYPE = "image_file"
+
+
+def iter_import_items(source: Path, text_column: Optional[str] = None, recursive: bool = False) -> Iterator[Dict[str, Any]]:
+    """Yield matrix input items from a CSV/JSONL file or a directory."""
+    source = Path(source)
+    if source.is_dir():
+        yield from _iter_directory(source, recursive)
+        return
+    suffix = source.suffix.lower()
+    if suffix == ".csv":
+        yield from _iter_csv(source, text_column)
+    elif suffix in (".jsonl", ".ndjson"):
+        yield from _iter_jsonl(source)
+    else:
+        raise ValueError(f"Unsupported import source: {source}")
+
+
+def iter_batches(items: Iterable[Dict[str, Any]], size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def item_for_path(path: Path) -> Optional[Dict[str, Any]]:
+    """Reference item for a file on disk (payload is not read)."""
+    suffix = path.suffix.lower()
+    if suffix in IMAGE_SUFFIXES:
+        return {"type": IMAGE_FILE_TYPE, "data": str(path)}
+    if suffix in FILE_SUFFIXES:
+        return {"type": "file", "data": str(path)}
+    return None
+
+
+def _iter_directory(root: Path, recursive: bool) -> Iterator[Dict[str, Any]]:
+    # scandir で1階層ずつ。名前順にするため各階層の一覧だけは並べ替える
+    pending = [root]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda e: e.name.lower())
+        except OSError as e:
+            print(f"ERROR: matrix_import - cannot list {current}: {e}")
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirs.append(Path(entry.path))
+                    continue
+            except OSError:
+                continue
+            item = item_for_path(Path(entry.path))
+            if item is not None:
+                yield item
+        pending.extend(reversed(subdirs))
+
+
+def _iter_csv(path: Path, text_column: Optional[str]) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        index = _pick_text_column(header, text_column)
+        if index is None:
+            # 見出し行がない CSV: 先頭行もデータとして扱う
+            index = 0
+            if header and header[0].strip():
+                yield {"type": "text", "data": header[0]}
+        for row in reader:
+            if index < len(row) and row[index].strip():
+                yield {"type": "text", "data": row[index]}
+
+
+def _pick_text_column(header: List[str], text_column: Optional[str]) -> Optional[int]:
+    names = [h.strip().lower() for h in header]
+    if text_column:
+        wanted = text_column.strip().lower()
+        if wanted in names:
+            return names.index(wanted)
+        raise ValueError(f"Column '{text_column}' not found in CSV header")
+    for candidate in TEXT_COLUMN_CANDIDATES:
+        if candidate in names:
+            return names.index(candidate)
+    return None
+
+
+def _iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except Exception as e:
+                print(f"ERROR: matrix_import - {path.name}:{lineno} is not valid JSON: {e}")
+                continue
+            item = _item_from_record(record, path.parent)
+            if item is not None:
+                yield item
+
+
+def _item_from_record(record: Any, base: Path) -> Optional[Dict[str, Any]]:
+    if isinstance(record, str):
+        return {"type": "text", "data": record} if record.strip() else None
+    if not isinstance(record, dict):
+        return None
+    t = record.get("type")
+    if t in ("text", "image", "image_compressed", "file", IMAGE_FILE_TYPE) and isinstance(record.get("data"), str):
+        return {"type": t, "data": record["data"]}
+    path = record.get("path") or record.get("file")
+    if isinstance(path, str) and path:
+        p = Path(path)
+        return item_for_path(p if p.is_absolute() else base / p)
+    for key in TEXT_COLUMN_CANDIDATES:
+        value = record.get(key)
+        if isinstance(value, str) and value.strip():
+            return {"type": "text", "data": value}
+    return None
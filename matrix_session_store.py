@@ -0,0 +1,250 @@
+"""
+matrix_session_store.py
+=========================
+
+Background, incremental persistence for matrix batch processor sessions.
+
+The last session lives under ``prompt_set/session/``:
+
+- ``manifest.json``: tab order, names and the active tab
+- ``tabs/<uid>.json``: one file per tab (prompts and cell state)
+
+A save rewrites only the tab files whose fingerprint changed since the last
+write. The caller computes fingerprints cheaply on the Tk thread. Encoding and
+disk I/O run on one background thread, and every file is written to a
+temporary file and renamed into place, so a crash mid-write never leaves a
+half-written file. The manifest is written last.
+
+Named sessions are single files, ``prompt_set/sessions/<name>.json``. They
+are listed from ``sessions/.index.json`` instead of opening every file. The
+leading dot keeps the index from colliding with a session named ``index``;
+an ``index.json`` written by earlier versions is adopted and removed.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_FORMAT_VERSION = 1
+
+
+def _dumps(obj: Any) -> str:
+    # indent なしのコンパクト形式（大きな結果でも書き込み量を抑える）
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Write *text* to a temp file next to *path* and rename it into place."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def safe_session_name(name: str) -> str:
+    return name.strip().replace('/', '_').replace('\\', '_')
+
+
+class SessionStore:
+    """Debounce-friendly writer for the last session plus an index of named sessions."""
+
+    def __init__(self, root: Path, sessions_dir: Path, legacy_file: Optional[Path] = None):
+        self.root = Path(root)
+        self.tabs_dir = self.root / "tabs"
+        self.manifest_path = self.root / "manifest.json"
+        self.sessions_dir = Path(sessions_dir)
+        self.index_path = self.sessions_dir / ".index.json"
+        self._legacy_index_path = self.sessions_dir / "index.json"
+        self.legacy_file = legacy_file
+        self._lock = threading.Lock()
+        # uid -> 最後に書き込みを依頼したときの fingerprint
+        self._written: Dict[str, Any] = {}
+        self._index: Optional[Dict[str, Dict[str, Any]]] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self._pending: Optional[Future] = None
+
+    # ------------------------------------------------------------------
+    # Last session
+    # ------------------------------------------------------------------
+    def is_dirty(self, uid: str, fingerprint: Any) -> bool:
+        with self._lock:
+            return uid not in self._written or self._written[uid] != fingerprint
+
+    def save(self, manifest: Dict[str, Any], tabs: Dict[str, Dict[str, Any]], fingerprints: Dict[str, Any]) -> Future:
+        """Queue a write of *manifest* and the changed *tabs* (``uid -> payload``)."""
+        live_uids = {str(t.get("uid")) for t in manifest.get("tabs", [])}
+        with self._lock:
+            self._written = {uid: fp for uid, fp in self._written.items() if uid in live_uids}
+            self._written.update(fingerprints)
+        manifest = dict(manifest, version=SESSION_FORMAT_VERSION)
+        return self._submit(self._write_session, manifest, tabs, live_uids)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Return ``{'tabs': [{'uid', 'name', 'prompts', 'state'}], 'active'}`` or None.
+
+        Falls back to the legacy single-file ``session.json``.
+        """
+        if self.manifest_path.exists():
+            try:
+                manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+                tabs = []
+                for t in manifest.get("tabs", []):
+                    uid = str(t.get("uid") or "")
+                    try:
+                        payload = json.loads((self.tabs_dir / f"{uid}.json").read_text(encoding="utf-8"))
+                    except Exception as e:
+                        logger.warning("SessionStore.load - tab %s unreadable: %s", uid, e)
+                        payload = {}
+                    tabs.append({"uid": uid, "name": t.get("name") or payload.get("name"), "prompts": payload.get("prompts") or {}, "state": payload.get("state")})
+                return {"tabs": tabs, "active": manifest.get("active", 0)}
+            except Exception as e:
+                logger.warning("SessionStore.load - manifest unreadable: %s", e)
+        if self.legacy_file is not None and self.legacy_file.exists():
+            try:
+                return json.loads(self.legacy_file.read_text(encoding="utf-8"))
+            except Exception as e:
+                logger.warning("SessionStore.load - %s unreadable: %s", self.legacy_file, e)
+        return None
+
+    def _write_session(self, manifest: Dict[str, Any], tabs: Dict[str, Dict[str, Any]], live_uids: set) -> None:
+        started = time.perf_counter()
+        failed = []
+        for uid, payload in tabs.items():
+            try:
+                atomic_write_text(self.tabs_dir / f"{uid}.json", _dumps(payload))
+            except Exception as e:
+                logger.exception("SessionStore - failed to write tab %s", uid)
+                failed.append(uid)
+        if failed:
+            # 次回の保存で書き直されるように記録を消す
+            with self._lock:
+                for uid in failed:
+                    self._written.pop(uid, None)
+        # マニフェストは最後に差し替える（途中で落ちても前回のマニフェストと完全なタブファイルが残る）
+        try:
+            atomic_write_text(self.manifest_path, _dumps(manifest))
+        except Exception as e:
+            logger.exception("SessionStore - failed to write manifest")
+            return
+        try:
+            for f in self.tabs_dir.glob("*.json"):
+                if f.stem not in live_uids:
+                    f.unlink()
+        except Exception:
+            pass
+        logger.debug("SessionStore wrote %d/%d tabs in %.1f ms", len(tabs), len(live_uids), (time.perf_counter() - started) * 1000)
+
+    # ------------------------------------------------------------------
+    # Named sessions
+    # ------------------------------------------------------------------
+    def named_path(self, name: str) -> Path:
+        return self.sessions_dir / f"{safe_session_name(name)}.json"
+
+    def list_named(self) -> List[str]:
+        """Session names, most recently saved first."""
+        index = self._load_index()
+        with self._lock:
+            items = sorted(index.items(), key=lambda kv: kv[1].get("saved_at", 0), reverse=True)
+        return [name for name, _ in items]
+
+    def save_named(self, name: str, data: Dict[str, Any]) -> Future:
+        return self._submit(self._write_named, name, data)
+
+    def load_named(self, name: str) -> Dict[str, Any]:
+        self.flush()
+        return json.loads(self.named_path(name).read_text(encoding="utf-8"))
+
+    def delete_named(self, name: str) -> bool:
+        self.flush()
+        path = self.named_path(name)
+        existed = path.exists()
+        if existed:
+            path.unlink()
+        index = self._load_index()
+        with self._lock:
+            index.pop(safe_session_name(name), None)
+            snapshot = dict(index)
+        atomic_write_text(self.index_path, _dumps(snapshot))
+        return existed
+
+    def _write_named(self, name: str, data: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        key = safe_session_name(name)
+        atomic_write_text(self.named_path(name), _dumps(dict(data, version=SESSION_FORMAT_VERSION)))
+        index = self._load_index()
+        with self._lock:
+            index[key] = {"file": f"{key}.json", "saved_at": time.time(), "tabs": len(data.get("tabs", []))}
+            snapshot = dict(index)
+        atomic_write_text(self.index_path, _dumps(snapshot))
+        logger.debug("SessionStore saved session '%s' in %.1f ms", key, (time.perf_counter() - started) * 1000)
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            if self._index is not None:
+                return self._index
+        index: Dict[str, Dict[str, Any]] = {}
+        try:
+            if self.index_path.exists():
+                index = json.loads(self.index_path.read_text(encoding="utf-8"))
+            elif self._is_legacy_index(self._legacy_index_path):
+                # 旧バージョンの索引（sessions/index.json）を引き継ぐ
+                index = json.loads(self._legacy_index_path.read_text(encoding="utf-8"))
+                atomic_write_text(self.index_path, _dumps(index))
+                self._legacy_index_path.unlink()
+            else:
+                # 索引がない（旧バージョンで保存された）場合は一度だけファイル一覧から作る
+                for f in self.sessions_dir.glob("*.json"):
+                    if f == self.index_path:
+                        continue
+                    index[f.stem] = {"file": f.name, "saved_at": f.stat().st_mtime}
+                if index:
+                    atomic_write_text(self.index_path, _dumps(index))
+        except Exception as e:
+            logger.warning("SessionStore - failed to load session index: %s", e)
+        with self._lock:
+            if self._index is None:
+                self._index = index
+            return self._index
+
+    @staticmethod
+    def _is_legacy_index(path: Path) -> bool:
+        """True if *path* is an old-style index (name -> {"file": ...}), not a saved session."""
+        if not path.exists():
+            return False
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return False
+        return isinstance(data, dict) and "tabs" not in data and all(isinstance(v, dict) and "file" in v for v in data.values())
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+    def _submit(self, fn, *args) -> Future:
+        fut = self._executor.submit(fn, *args)
+        self._pending = fut
+        return fut
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Wait until every queued write has finished."""
+        fut = self._pending
+        if fut is not None:
+            try:
+                fut.result(timeout=timeout)
+            except Exception as e:
+                logger.error("SessionStore.flush - %s", e)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
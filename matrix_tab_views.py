@@ -0,0 +1,110 @@
+"""
+matrix_tab_views.py
+=====================
+
+LRU of the display state of recently used matrix tabs.
+
+The matrix window shows one tab at a time. On a tab switch the outgoing
+tab's cell store and summary variables are parked here, and the incoming
+tab's are taken back out, so a recent tab returns without being rebuilt from
+its saved ``state``. An entry is evicted once the cache holds more than
+``limit`` tabs or its tab is closed. An evicted tab that is still open gets
+its ``state`` rebuilt through *build_state*, and the cell store is closed.
+
+Nothing here touches Tk. Summary values are whatever the window keeps
+(``StringVar`` in the app) and new ones come from *new_summary*, so the
+bookkeeping can be tested without a display.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+# 1 タブぶんの表示状態: {'tab', 'cells', 'row_summaries', 'col_summaries'}
+TabView = Dict[str, Any]
+
+
+class TabViewCache:
+    """Recently used tab views keyed by tab identity, oldest first."""
+
+    def __init__(self, limit: int, tabs: Callable[[], List[dict]], build_state: Callable[[Any, list, list], dict],
+                 new_summary: Callable[[], Any] = str):
+        self.limit = max(0, int(limit))
+        self._tabs = tabs
+        self._build_state = build_state
+        self._new_summary = new_summary
+        # id(tab) -> TabView（古いものから追い出す）
+        self._entries: "OrderedDict[int, TabView]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[TabView]:
+        return iter(list(self._entries.values()))
+
+    def is_open(self, tab: Optional[dict]) -> bool:
+        return tab is not None and any(t is tab for t in self._tabs())
+
+    def get(self, tab: dict) -> Optional[TabView]:
+        entry = self._entries.get(id(tab))
+        return entry if entry is not None and entry.get('tab') is tab else None
+
+    def ids(self) -> Set[int]:
+        return set(self._entries)
+
+    def stores(self) -> List[Any]:
+        """Cell stores of the cached tabs (a copy; safe to call from the memory monitor thread)."""
+        return [entry['cells'] for entry in list(self._entries.values()) if 'cells' in entry]
+
+    def park(self, tab: dict, cells: Any, row_summaries: list, col_summaries: list) -> None:
+        """Keep *tab*'s live state as the most recently used entry."""
+        self._entries[id(tab)] = {'tab': tab, 'cells': cells, 'row_summaries': row_summaries, 'col_summaries': col_summaries}
+        self._entries.move_to_end(id(tab))
+
+    def take(self, tab: dict) -> Optional[TabView]:
+        """Remove and return *tab*'s entry, or None if it has to be rebuilt from its ``state``."""
+        entry = self._entries.pop(id(tab), None)
+        if entry is None:
+            return None
+        if entry['tab'] is not tab:
+            # id が再利用された別のタブの残り
+            self._evict(entry)
+            return None
+        return entry
+
+    def prune(self) -> None:
+        """Evict entries of closed tabs, then the oldest ones beyond ``limit``."""
+        for key, entry in list(self._entries.items()):
+            if not self.is_open(entry['tab']):
+                self._evict(self._entries.pop(key))
+        while len(self._entries) > self.limit:
+            self._evict(self._entries.popitem(last=False)[1])
+
+    def sync_rows(self, rows: int, deleted_row: Optional[int] = None) -> None:
+        """Input rows are shared by all tabs: apply a row delete and the new row count to every entry."""
+        for entry in self._entries.values():
+            cells, row_summaries = entry.get('cells'), entry.get('row_summaries')
+            if cells is None:
+                continue
+            if deleted_row is not None:
+                cells.delete_row(deleted_row)
+                if row_summaries and 0 <= deleted_row < len(row_summaries):
+                    row_summaries.pop(deleted_row)
+            cells.resize(rows, cells.cols)
+            if row_summaries:
+                del row_summaries[rows:]
+                row_summaries.extend(self._new_summary() for _ in range(rows - len(row_summaries)))
+
+    def clear(self) -> None:
+        """Close every cached store without saving (the window is going away)."""
+        for entry in self._entries.values():
+            entry['cells'].close()
+        self._entries.clear()
+
+    def _evict(self, entry: TabView) -> None:
+        tab = entry['tab']
+        if self.is_open(tab):
+            tab['state'] = self._build_state(entry['cells'], entry['row_summaries'], entry['col_summaries'])
+        entry['cells'].close()
+        entry.clear()
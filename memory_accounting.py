@@ -0,0 +1,317 @@
+"""
+memory_accounting.py
+======================
+
+Per-subsystem memory accounting, budgets and tracemalloc snapshots.
+
+Subsystems register a usage reporter and, optionally, an enforcer:
+
+- ``history``: clipboard history metadata and search index (payloads are
+  already on disk)
+- ``matrix``: result stores of every open matrix tab, including cached tab
+  views and the saved state of inactive tabs
+- ``thumbnails``: decoded thumbnails held in the in-memory LRU
+
+Later subsystems (image part caches, upload registries) register the same
+way. Reporters are held by weak reference, so a closed window that was never
+unregistered drops out of the report by itself. A window that still shows
+up after it was closed has leaked.
+
+Budgets are configured per subsystem in MiB (``memory_budgets_mb`` in the
+config; unset subsystems use :data:`DEFAULT_BUDGETS_MB`, and ``0`` means
+no limit). :class:`MemoryMonitor` checks the budgets periodically. A
+subsystem over its budget has its enforcer called with a target in bytes.
+The matrix spills results to disk, thumbnails shrink their LRU and the
+history drops its oldest entries.
+
+:func:`write_report` writes the usage table and, if tracemalloc is tracing,
+the top allocation differences since the previous report to
+``<log_dir>/memory/``. Tracing slows every allocation, so it only runs when
+``GEM_CLIP_TRACEMALLOC=1`` is set at launch; reports never start it.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from itertools import count
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+try:
+    from . import paths  # type: ignore
+except ImportError:
+    import paths  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+DEFAULT_BUDGETS_MB: Dict[str, int] = {"history": 32, "matrix": 256, "thumbnails": 64}
+CHECK_INTERVAL_S = 60.0
+TRACEMALLOC_ENV = "GEM_CLIP_TRACEMALLOC"
+TRACEMALLOC_FRAMES = 10
+REPORT_TOP_STATS = 30
+
+MEMORY_BYTES = metrics.REGISTRY.gauge("gem_clip_memory_bytes", "Estimated bytes held per subsystem.", ("subsystem",))
+BUDGET_ENFORCEMENTS_TOTAL = metrics.REGISTRY.counter("gem_clip_memory_budget_enforcements_total", "Times a subsystem exceeded its memory budget.", ("subsystem",))
+
+Reporter = Callable[[], Dict[str, Any]]
+Enforcer = Callable[[int], Any]
+
+
+class _Provider:
+    __slots__ = ("name", "_report", "_enforce")
+
+    def __init__(self, name: str, report: Reporter, enforce: Optional[Enforcer]):
+        self.name = name
+        self._report = _weak(report)
+        self._enforce = _weak(enforce) if enforce is not None else None
+
+    def report(self) -> Optional[Reporter]:
+        return self._report()
+
+    def enforce(self) -> Optional[Enforcer]:
+        return self._enforce() if self._enforce is not None else None
+
+
+def _weak(fn: Callable) -> Callable[[], Optional[Callable]]:
+    # バウンドメソッドは所有者を生かし続けないよう WeakMethod で持つ
+    if hasattr(fn, "__self__") and hasattr(fn, "__func__"):
+        return weakref.WeakMethod(fn)  # type: ignore[arg-type]
+    return lambda: fn
+
+
+_providers: Dict[int, _Provider] = {}
+_provider_ids = count(1)
+_lock = threading.Lock()
+_budgets_mb: Dict[str, int] = dict(DEFAULT_BUDGETS_MB)
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def register(name: str, report: Reporter, enforce: Optional[Enforcer] = None) -> int:
+    """Add a usage reporter (returns a token for :func:`unregister`).
+
+    *report* returns at least ``{"bytes": int}``. *enforce* gets a target in
+    bytes and should free memory down to it. It may be called from the
+    monitor thread, so UI owners should marshal the work to their own thread.
+    """
+    token = next(_provider_ids)
+    with _lock:
+        _providers[token] = _Provider(name, report, enforce)
+    return token
+
+
+def unregister(token: Optional[int]) -> None:
+    if token is None:
+        return
+    with _lock:
+        _providers.pop(token, None)
+
+
+def set_budgets(budgets_mb: Optional[Dict[str, int]]) -> None:
+    """Override budgets per subsystem (MiB; 0 = unlimited). Unlisted ones keep their defaults."""
+    global _budgets_mb
+    merged = dict(DEFAULT_BUDGETS_MB)
+    for name, value in (budgets_mb or {}).items():
+        try:
+            merged[str(name)] = max(0, int(value))
+        except (TypeError, ValueError):
+            logger.warning("memory budget for %s is not a number: %r", name, value)
+    _budgets_mb = merged
+
+
+def budgets_mb() -> Dict[str, int]:
+    return dict(_budgets_mb)
+
+
+def deep_sizeof(obj: Any, limit: int = 200_000) -> int:
+    """Approximate size of *obj* and the containers/strings inside it (visits at most *limit* objects)."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack and len(seen) < limit:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        try:
+            total += sys.getsizeof(o)
+        except TypeError:
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+    return total
+
+
+def _live_providers() -> List[Tuple[int, _Provider, Reporter]]:
+    with _lock:
+        items = list(_providers.items())
+    live = []
+    dead = []
+    for token, provider in items:
+        fn = provider.report()
+        if fn is None:
+            dead.append(token)
+        else:
+            live.append((token, provider, fn))
+    if dead:
+        with _lock:
+            for token in dead:
+                _providers.pop(token, None)
+    return live
+
+
+def usage() -> Dict[str, Dict[str, Any]]:
+    """Bytes and details per subsystem (summed over its providers)."""
+    result: Dict[str, Dict[str, Any]] = {}
+    for _, provider, fn in _live_providers():
+        try:
+            data = fn() or {}
+        except Exception as e:
+            logger.error("memory report for %s failed: %s", provider.name, e)
+            continue
+        entry = result.setdefault(provider.name, {"bytes": 0, "instances": 0})
+        entry["instances"] += 1
+        for key, value in data.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                entry[key] = entry.get(key, 0) + value
+    return result
+
+
+def process_rss() -> Optional[int]:
+    try:
+        import psutil  # type: ignore
+    except ImportError:
+        return None
+    try:
+        return int(psutil.Process().memory_info().rss)
+    except Exception:
+        return None
+
+
+def check_budgets() -> Dict[str, Dict[str, Any]]:
+    """Update the memory gauges and enforce budgets. Returns the usage that was measured."""
+    current = usage()
+    for name, entry in current.items():
+        MEMORY_BYTES.set(entry["bytes"], subsystem=name)
+    for name, entry in current.items():
+        limit = _budgets_mb.get(name, 0) * MiB
+        if not limit or entry["bytes"] <= limit:
+            continue
+        BUDGET_ENFORCEMENTS_TOTAL.inc(subsystem=name)
+        logger.warning("memory: %s holds %.1f MiB (budget %.0f MiB); freeing", name, entry["bytes"] / MiB, limit / MiB)
+        providers = [(p, fn) for _, p, fn in _live_providers() if p.name == name]
+        for provider, fn in providers:
+            enforce = provider.enforce()
+            if enforce is None:
+                continue
+            try:
+                # 複数インスタンスがあれば、今の使用量に比例して目標を割り振る
+                held = (fn() or {}).get("bytes", 0)
+                share = int(limit * held / entry["bytes"]) if entry["bytes"] else limit
+                enforce(share)
+            except Exception as e:
+                logger.error("memory: enforcing the %s budget failed: %s", name, e)
+    return current
+
+
+# ----------------------------------------------------------------------
+# tracemalloc
+# ----------------------------------------------------------------------
+def start_tracing(frames: int = TRACEMALLOC_FRAMES) -> bool:
+    """Start tracemalloc (no-op if already tracing). Returns True if it was started now."""
+    global _last_snapshot
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    _last_snapshot = tracemalloc.take_snapshot()
+    return True
+
+
+def snapshot_diff(top: int = REPORT_TOP_STATS) -> List[str]:
+    """Top allocation changes since the previous call (or since tracing started)."""
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    lines: List[str] = []
+    if _last_snapshot is not None:
+        for stat in snapshot.compare_to(_last_snapshot, "traceback")[:top]:
+            lines.append(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks), now {stat.size / 1024:.1f} KiB")
+            lines.extend("    " + line for line in stat.traceback.format(limit=4))
+    _last_snapshot = snapshot
+    return lines
+
+
+def write_report() -> Path:
+    """Write the usage table (and a tracemalloc diff) to ``<log_dir>/memory/``; returns the file."""
+    current = check_budgets()
+    out_dir = paths.get_log_dir() / "memory"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-memory.txt"
+    lines = [f"Memory report {time.strftime('%Y-%m-%d %H:%M:%S')}"]
+    rss = process_rss()
+    if rss is not None:
+        lines.append(f"process RSS: {rss / MiB:.1f} MiB")
+    if tracemalloc.is_tracing():
+        traced, peak = tracemalloc.get_traced_memory()
+        lines.append(f"tracemalloc: {traced / MiB:.1f} MiB traced, peak {peak / MiB:.1f} MiB")
+    lines.append("")
+    for name in sorted(current):
+        entry = current[name]
+        budget = _budgets_mb.get(name, 0)
+        details = ", ".join(f"{k}={v}" for k, v in sorted(entry.items()) if k != "bytes")
+        lines.append(f"{name}: {entry['bytes'] / MiB:.2f} MiB (budget {f'{budget} MiB' if budget else 'none'}; {details})")
+    lines.append("")
+    if tracemalloc.is_tracing():
+        diff = snapshot_diff()
+        lines.append("Top allocation changes since the previous report:" if diff else "No allocation changes recorded.")
+        lines.extend(diff)
+    else:
+        lines.append(f"tracemalloc is off; launch with {TRACEMALLOC_ENV}=1 to include allocation changes.")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    logger.info("memory report written to %s", path)
+    return path
+
+
+# ----------------------------------------------------------------------
+# Monitor
+# ----------------------------------------------------------------------
+class MemoryMonitor:
+    """Checks budgets every *interval* seconds on a daemon thread."""
+
+    def __init__(self, interval: float = CHECK_INTERVAL_S):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        if os.environ.get(TRACEMALLOC_ENV) == "1":
+            start_tracing()
+        self._thread = threading.Thread(target=self._run, name="memory-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                check_budgets()
+            except Exception as e:
+                logger.error("memory: budget check failed: %s", e)
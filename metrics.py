@@ -0,0 +1,281 @@
+"""
+metrics.py
+============
+
+In-process metrics registry with Prometheus text exposition.
+
+Request metrics are labeled by ``model`` and ``source`` (``hotkey``,
+``matrix``, ``flow``, ``summary``):
+
+- latency, time to first token, tokens per second and queue wait
+  (histograms)
+- requests and retries (counters)
+- requests in flight (gauge)
+
+Cache lookups are counted per cache and result, so the hit rate is
+``hit / (hit + miss)``.
+
+Most request metrics are filled in from :class:`request_trace.Span` when a
+span ends. Call sites only have to mark their events and set ``model``,
+``output_tokens`` and ``retries`` on the span.
+
+:func:`start_exporter` rewrites ``<log_dir>/metrics.prom`` periodically,
+which the node_exporter textfile collector can read. When
+``GEM_CLIP_METRICS_PORT`` is set it also serves ``/metrics`` on
+127.0.0.1.
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    from . import paths  # type: ignore
+except ImportError:
+    import paths  # type: ignore
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TPS_BUCKETS = (1.0, 5.0, 10.0, 25.0, 50.0, 100.0, 200.0, 400.0)
+METRICS_PORT_ENV = "GEM_CLIP_METRICS_PORT"
+TEXTFILE_NAME = "metrics.prom"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    value = float(value)
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def _label_str(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, key)]
+        if extra is not None:
+            pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._label_str(k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count], sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[idx] += 1
+            self._sums[key] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(c), self._sums[k]) for k, c in sorted(self._counts.items())]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{self._label_str(key, ('le', _fmt(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_str(key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._label_str(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(self.render(), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+REQUESTS_TOTAL = REGISTRY.counter("gem_clip_requests_total", "Model requests by outcome.", ("model", "source", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("gem_clip_request_duration_seconds", "Time from getting a slot to completion.", ("model", "source"))
+TTFT_SECONDS = REGISTRY.histogram("gem_clip_time_to_first_token_seconds", "Time from getting a slot to the first token (whole response for non-streaming calls).", ("model", "source"))
+TOKENS_PER_SECOND = REGISTRY.histogram("gem_clip_output_tokens_per_second", "Output tokens per second of generation time.", ("model", "source"), TPS_BUCKETS)
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("gem_clip_queue_wait_seconds", "Time spent queued before a request got a slot.", ("source",))
+RETRIES_TOTAL = REGISTRY.counter("gem_clip_retries_total", "Fallback retries (e.g. without tools).", ("model", "source"))
+IN_FLIGHT = REGISTRY.gauge("gem_clip_requests_in_flight", "Requests that have a slot and have not finished.", ("source",))
+CACHE_LOOKUPS_TOTAL = REGISTRY.counter("gem_clip_cache_lookups_total", "Cache lookups by result (hit/miss).", ("cache", "result"))
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS_TOTAL.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# ----------------------------------------------------------------------
+# Export
+# ----------------------------------------------------------------------
+_exporter_stop = threading.Event()
+_exporter_thread: Optional[threading.Thread] = None
+_server: Optional[ThreadingHTTPServer] = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa: N802 - http.server API
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # 1リクエストごとのアクセスログは出さない
+        pass
+
+
+def start_exporter(interval: float = 15.0, port: Optional[int] = None) -> None:
+    """Write ``metrics.prom`` every *interval* seconds; serve HTTP on 127.0.0.1 if a port is given."""
+    global _exporter_thread, _server
+    if _exporter_thread is not None:
+        return
+    path = paths.get_log_dir() / TEXTFILE_NAME
+
+    def _loop():
+        while not _exporter_stop.wait(interval):
+            try:
+                REGISTRY.write_textfile(path)
+            except Exception as e:
+                print(f"ERROR: metrics - failed to write {path}: {e}")
+
+    _exporter_thread = threading.Thread(target=_loop, name="metrics-exporter", daemon=True)
+    _exporter_thread.start()
+    atexit.register(stop_exporter)
+
+    if port is None:
+        try:
+            port = int(os.environ.get(METRICS_PORT_ENV, "") or 0) or None
+        except ValueError:
+            port = None
+    if port:
+        try:
+            _server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"INFO: metrics available at http://127.0.0.1:{port}/metrics")
+        except OSError as e:
+            print(f"ERROR: metrics - cannot listen on 127.0.0.1:{port}: {e}")
+            _server = None
+
+
+def stop_exporter() -> None:
+    """Stop exporting and write the textfile one last time."""
+    global _exporter_thread, _server
+    _exporter_stop.set()
+    if _server is not None:
+        _server.shutdown()
+        _server = None
+    if _exporter_thread is not None:
+        _exporter_thread = None
+        try:
+            REGISTRY.write_textfile(paths.get_log_dir() / TEXTFILE_NAME)
+        except Exception as e:
+            print(f"ERROR: metrics - final write failed: {e}")
@@ -0,0 +1,241 @@
+"""
+profiler.py
+=============
+
+On-demand CPU profiles and a Tk main-thread stall watchdog.
+
+:class:`StallWatchdog` schedules a Tk ``after()`` heartbeat. A separate
+thread checks how long ago the last beat ran. When the UI thread is late by
+more than the threshold (default 200 ms, ``GEM_CLIP_STALL_MS``; ``0`` turns
+the watchdog off), the stack of the UI thread is logged while it is still
+blocked, so the log shows what froze the UI. When the next beat runs, the
+stall duration is logged and counted in :mod:`metrics`.
+
+:class:`Profiler` runs ``cProfile`` on the Tk thread and on the worker event
+loop at the same time. Up to Python 3.11 a cProfile profiler only sees the
+thread that enabled it, so each one is started and stopped on its own thread.
+Stopping writes ``<log_dir>/profiles/<timestamp>-ui.prof`` and
+``-worker.prof`` (for snakeviz or ``pstats``), with a ``.txt`` summary next
+to each. From 3.12 only one profiler can be active and it sees every thread,
+so a single ``-all.prof`` is written instead. Profiling is toggled from the
+tray menu. ``GEM_CLIP_PROFILE=1`` profiles from startup until quit.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+
+try:
+    from . import paths  # type: ignore
+except ImportError:
+    import paths  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+STALL_MS_ENV = "GEM_CLIP_STALL_MS"
+PROFILE_ENV = "GEM_CLIP_PROFILE"
+DEFAULT_STALL_MS = 200.0
+HEARTBEAT_MS = 100
+STATS_LINES = 60
+# 3.12 以降の cProfile は sys.monitoring 上で動き、全スレッドを1つのプロファイラで計測する
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+UI_STALLS_TOTAL = metrics.REGISTRY.counter("gem_clip_ui_stalls_total", "Times the Tk thread was blocked longer than the stall threshold.")
+UI_STALL_SECONDS = metrics.REGISTRY.histogram("gem_clip_ui_stall_seconds", "Duration of Tk thread stalls over the threshold.")
+
+
+def stall_threshold_ms() -> float:
+    try:
+        return float(os.environ.get(STALL_MS_ENV, DEFAULT_STALL_MS))
+    except ValueError:
+        return DEFAULT_STALL_MS
+
+
+def format_thread_stack(thread_id: int) -> str:
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return "(thread not running)"
+    return "".join(traceback.format_stack(frame))
+
+
+class StallWatchdog:
+    """Logs the Tk thread's stack when an ``after()`` heartbeat is late by more than *threshold_ms*.
+
+    Create and :meth:`start` it on the Tk thread.
+    """
+
+    def __init__(self, root: Any, threshold_ms: Optional[float] = None, interval_ms: int = HEARTBEAT_MS):
+        self.root = root
+        self.threshold_ms = stall_threshold_ms() if threshold_ms is None else float(threshold_ms)
+        self.interval_ms = interval_ms
+        self._ui_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stack_logged = False
+        self._job: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.threshold_ms <= 0 or self._thread is not None:
+            return
+        self._last_beat = time.perf_counter()
+        self._job = self.root.after(self.interval_ms, self._beat)
+        self._thread = threading.Thread(target=self._watch, name="ui-stall-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._job is not None:
+            try:
+                self.root.after_cancel(self._job)
+            except Exception:
+                pass
+            self._job = None
+
+    def _beat(self) -> None:
+        now = time.perf_counter()
+        late_ms = (now - self._last_beat) * 1000 - self.interval_ms
+        self._last_beat = now
+        if late_ms > self.threshold_ms:
+            UI_STALLS_TOTAL.inc()
+            UI_STALL_SECONDS.observe(late_ms / 1000)
+            logger.warning("UI thread was blocked for %.0f ms (threshold %.0f ms)", late_ms, self.threshold_ms)
+        self._stack_logged = False
+        if not self._stop.is_set():
+            try:
+                self._job = self.root.after(self.interval_ms, self._beat)
+            except Exception:
+                # ルートウィンドウが破棄された
+                self._stop.set()
+
+    def _watch(self) -> None:
+        # 判定の粒度は閾値の 1/4 程度で十分
+        poll = max(0.02, self.threshold_ms / 4000)
+        while not self._stop.wait(poll):
+            blocked_ms = (time.perf_counter() - self._last_beat) * 1000 - self.interval_ms
+            if blocked_ms > self.threshold_ms and not self._stack_logged:
+                # 1回の停止につき1度だけ、止まっている最中のスタックを出す
+                self._stack_logged = True
+                logger.warning("UI thread blocked for %.0f ms so far; stack:\n%s", blocked_ms, format_thread_stack(self._ui_thread_id))
+
+
+class Profiler:
+    """cProfile on the Tk thread and the worker loop, started and stopped together.
+
+    Create it on the Tk thread.
+    """
+
+    def __init__(self, root: Any, loop_getter: Callable[[], Any]):
+        self.root = root
+        self.loop_getter = loop_getter
+        self._ui_thread_id = threading.get_ident()
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._profiles)
+
+    def _targets(self) -> Dict[str, Callable[[Callable[[], None]], None]]:
+        """Thread name -> function that runs a callable on that thread."""
+        if PROCESS_WIDE_PROFILER:
+            return {"all": lambda fn: fn()}
+        targets: Dict[str, Callable[[Callable[[], None]], None]] = {"ui": self._run_on_ui}
+        loop = self.loop_getter()
+        if loop is not None and loop.is_running():
+            targets["worker"] = loop.call_soon_threadsafe
+        return targets
+
+    def _run_on_ui(self, fn: Callable[[], None]) -> None:
+        if threading.get_ident() == self._ui_thread_id:
+            fn()
+        else:
+            self.root.after(0, fn)
+
+    def start(self) -> bool:
+        with self._lock:
+            if self._profiles:
+                return False
+            for name, run_on in self._targets().items():
+                prof = cProfile.Profile()
+                self._profiles[name] = prof
+                run_on(prof.enable)
+        logger.info("profiling started (%s)", ", ".join(self._profiles))
+        return True
+
+    def stop(self, on_saved: Optional[Callable[[List[Path]], None]] = None, timeout: float = 10.0, background: bool = True) -> bool:
+        """Stop profiling and write the results (from a background thread unless *background* is False).
+
+        *on_saved* receives the written paths.
+        """
+        with self._lock:
+            profiles, self._profiles = self._profiles, {}
+        if not profiles:
+            return False
+        targets = self._targets()
+        done: Dict[str, threading.Event] = {}
+        for name, prof in profiles.items():
+            event = done[name] = threading.Event()
+            run_on = targets.get(name)
+            if run_on is None:
+                # ループが止まっている（終了処理中）
+                event.set()
+                continue
+
+            def _disable(prof=prof, event=event):
+                prof.disable()
+                event.set()
+
+            run_on(_disable)
+
+        def _write():
+            out_dir = paths.get_log_dir() / "profiles"
+            out_dir.mkdir(parents=True, exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            written: List[Path] = []
+            for name, prof in profiles.items():
+                if not done[name].wait(timeout):
+                    logger.warning("profiler: %s thread did not respond; its profile is skipped", name)
+                    continue
+                try:
+                    written.extend(_dump(prof, out_dir / f"{stamp}-{name}"))
+                except Exception as e:
+                    logger.error("profiler: failed to write %s profile: %s", name, e)
+            logger.info("profiles written: %s", ", ".join(str(p) for p in written))
+            if on_saved is not None:
+                on_saved(written)
+
+        if background:
+            threading.Thread(target=_write, name="profiler-writer", daemon=True).start()
+        else:
+            _write()
+        return True
+
+
+def _dump(prof: cProfile.Profile, base: Path) -> List[Path]:
+    prof_path = base.with_suffix(".prof")
+    prof.dump_stats(str(prof_path))
+    buf = io.StringIO()
+    stats = pstats.Stats(prof, stream=buf)
+    stats.sort_stats("cumulative").print_stats(STATS_LINES)
+    buf.write("\n")
+    stats.sort_stats("tottime").print_stats(STATS_LINES)
+    txt_path = base.with_suffix(".txt")
+    txt_path.write_text(buf.getvalue(), encoding="utf-8")
+    return [prof_path, txt_path]
+
+
+def profile_from_startup() -> bool:
+    return os.environ.get(PROFILE_ENV) == "1"
@@ -0,0 +1,452 @@
+"""
+prompt_runner.py
+==================
+
+Runs prompts without any UI, for the local API (and other front ends that
+have no Tk window).
+
+- :func:`contents_for_item` turns a matrix/history input item
+  (``{"type", "data"}``) into request parts.
+- :func:`stream_prompt` yields text chunks. It uses the same tool fallback as
+  the hotkey path: ``google_search``, then ``google_search_retrieval``, then no
+  tools. The SDK's streaming iterator is consumed on a worker thread, so the
+  event loop never waits on the network.
+- :class:`Job` and :class:`JobRegistry` track long-running work (matrix jobs,
+  streamed runs) as an append-only list of events that any number of readers
+  can follow.
+- :func:`run_matrix` processes input items × prompts with bounded
+  concurrency and reports each cell as a job event. An optional
+  :class:`Budget` caps the number of requests or their estimated cost.
+
+Every call is traced with a :class:`request_trace.Span` created by the
+caller, like the GUI paths.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import mimetypes
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import input_prep
+from common_models import Prompt, load_genai_async
+from i18n import tr
+from matrix_import import IMAGE_FILE_TYPE
+from request_trace import Span, new_job_id
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+# 終わったジョブをいくつまで状態照会に残すか
+MAX_FINISHED_JOBS = 100
+
+
+class PromptBlocked(RuntimeError):
+    """The request or the response was blocked by safety settings."""
+
+
+def prompt_set_dir() -> Path:
+    """Named prompt sets, as saved from the matrix window (``prompt_set/<name>.json``)."""
+    return Path.cwd() / "prompt_set"
+
+
+def load_prompt_set(name: str) -> Dict[str, Prompt]:
+    """Prompts of a named set, in file order. Entries that are not valid prompts are skipped."""
+    path = prompt_set_dir() / f"{name}.json"
+    if not path.is_file():
+        raise FileNotFoundError(f"prompt set not found: {path}")
+    data = json.loads(path.read_text(encoding="utf-8"))
+    out: Dict[str, Prompt] = {}
+    for pid, pd in (data.get("prompts") or {}).items():
+        try:
+            out[pid] = Prompt(**pd)
+        except Exception:
+            continue
+    return out
+
+
+def _output_tokens(resp: Any) -> Optional[int]:
+    try:
+        return resp.usage_metadata.candidates_token_count or None
+    except Exception:
+        return None
+
+
+def _input_tokens(resp: Any) -> Optional[int]:
+    try:
+        return resp.usage_metadata.prompt_token_count or None
+    except Exception:
+        return None
+
+
+def _tier_pricing(model_info: Dict[str, Any], input_token_count: int) -> Optional[tuple]:
+    if "tiers" in model_info:
+        # トークン数に応じた価格を取得
+        for tier in sorted(model_info["tiers"], key=lambda x: x.get("threshold_tokens", 0), reverse=True):
+            if input_token_count <= tier.get("threshold_tokens", 0) or tier.get("threshold_tokens", 0) == -1:
+                return (
+                    tier.get("input_cost_per_thousand_tokens", 0.0),
+                    tier.get("output_cost_per_thousand_tokens", 0.0)
+                )
+        # デフォルト価格を使用
+        default = model_info.get("default", {})
+        return (
+            default.get("input_cost_per_thousand_tokens", 0.0),
+            default.get("output_cost_per_thousand_tokens", 0.0)
+        )
+    # 階層情報がない場合（フラットな構造）
+    if "input_cost_per_thousand_tokens" in model_info:
+        return (
+            model_info.get("input_cost_per_thousand_tokens", 0.0),
+            model_info.get("output_cost_per_thousand_tokens", 0.0)
+        )
+    return None
+
+
+def model_pricing(price_info: Dict[str, Any], model_name: str, input_token_count: int = 0) -> tuple:
+    """``(input, output)`` cost per thousand tokens from ``api_price.json`` data.
+
+    Tries the exact model name first, then any key contained in the name.
+    Unknown models cost ``(0.0, 0.0)``.
+    """
+    if not price_info:
+        return 0.0, 0.0
+    model_info = price_info.get(model_name)
+    if model_info:
+        found = _tier_pricing(model_info, input_token_count)
+        if found:
+            return found
+    # 部分一致で検索
+    for key, model_info in price_info.items():
+        if key in model_name:
+            found = _tier_pricing(model_info, input_token_count)
+            if found:
+                return found
+    return 0.0, 0.0
+
+
+def load_price_info(path: Path = Path("api_price.json")) -> Dict[str, Any]:
+    """Price table next to the app (``api_price.json``); empty when missing or unreadable."""
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"ERROR: API価格情報の読み込みに失敗しました: {e}")
+        return {}
+
+
+class Budget:
+    """Soft limit on the number of requests and their estimated cost (USD).
+
+    :meth:`allow` is checked before a request starts and :meth:`record` adds
+    its cost from the span's token counts once it ends. Requests already in
+    flight when the limit is reached still finish, so the final cost can
+    exceed *max_cost* by up to the concurrency × the cost of one request.
+    """
+
+    def __init__(self, max_requests: Optional[int] = None, max_cost: Optional[float] = None,
+                 price_info: Optional[Dict[str, Any]] = None):
+        self.max_requests = max_requests
+        self.max_cost = max_cost
+        self.price_info = price_info or {}
+        self.requests = 0
+        self.cost = 0.0
+        self.skipped = 0
+
+    def allow(self) -> bool:
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return False
+        if self.max_cost is not None and self.cost >= self.max_cost:
+            return False
+        self.requests += 1
+        return True
+
+    def record(self, span: Span) -> float:
+        input_tokens = int(span.attrs.get("input_tokens") or 0)
+        output_tokens = int(span.attrs.get("output_tokens") or 0)
+        in_cost, out_cost = model_pricing(self.price_info, str(span.attrs.get("model") or ""), input_tokens)
+        cost = (input_tokens / 1000) * in_cost + (output_tokens / 1000) * out_cost
+        self.cost += cost
+        return cost
+
+    def summary(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "skipped": self.skipped, "estimated_cost": round(self.cost, 6)}
+
+
+# contents_for_item が扱える入力タイプ（API では受け付ける前に確かめる）
+INPUT_TYPES = ("text", "image", "image_compressed", IMAGE_FILE_TYPE, "file")
+
+
+async def contents_for_item(item: Dict[str, Any], span: Optional[Span] = None, prompt: Optional[Prompt] = None) -> List[Any]:
+    """Request parts for an input item (text, image, image_compressed, image_file or file).
+
+    Images are encoded per *prompt*'s ``image_policy``.
+    """
+    t = item.get("type")
+    data = item.get("data")
+    if t == "text":
+        return [str(data or "")]
+    if t in ("image", "image_compressed", IMAGE_FILE_TYPE):
+        # デコードと PNG 化はプロセスプールで（input_prep.py 参照）
+        return [await input_prep.image_part(item, getattr(prompt, "image_policy", None), getattr(prompt, "model", None), span)]
+    if t == "file":
+        mime_type = mimetypes.guess_type(str(data))[0] or "application/octet-stream"
+        genai = await load_genai_async()
+        try:
+            uploaded = await asyncio.to_thread(genai.upload_file, path=str(data), mime_type=mime_type)
+        except Exception as e:
+            raise RuntimeError(tr("notify.file_upload_failed", details=str(e)))
+        if span is not None:
+            span.mark("upload_done")
+        return [uploaded]
+    raise ValueError(f"Unsupported input type: {t}")
+
+
+def _tool_attempts(prompt: Prompt, contents: List[Any]) -> List[Optional[List[Dict[str, Any]]]]:
+    has_url_text = any(isinstance(c, str) and c.strip().startswith(("http://", "https://")) for c in contents)
+    if getattr(prompt, "enable_web", False) or has_url_text:
+        return [[{"google_search": {}}], [{"google_search_retrieval": {}}], None]
+    return [None]
+
+
+def generation_config(types: Any, prompt: Prompt, tools: Optional[List[Dict[str, Any]]] = None) -> Any:
+    p = prompt.parameters
+    kwargs = dict(temperature=p.temperature, top_p=p.top_p, top_k=p.top_k, max_output_tokens=p.max_output_tokens, stop_sequences=p.stop_sequences)
+    if tools:
+        try:
+            return types.GenerationConfig(tools=tools, **kwargs)
+        except TypeError:
+            # tools 未対応の SDK
+            pass
+    return types.GenerationConfig(**kwargs)
+
+
+_END = object()
+
+
+async def _iterate_in_thread(make_iter: Callable[[], Iterator[Any]]) -> AsyncIterator[Any]:
+    """Consume a blocking iterator on a worker thread and yield its items on the loop."""
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue[Any]" = asyncio.Queue()
+    stop = threading.Event()
+
+    def _pump():
+        try:
+            for item in make_iter():
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (_END, e))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (_END, None))
+
+    threading.Thread(target=_pump, name="genai-stream", daemon=True).start()
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # 途中で読むのをやめた場合（キャンセル等）は次のチャンクでスレッドを止める
+        stop.set()
+
+
+async def stream_prompt(prompt: Prompt, contents: List[Any], span: Optional[Span] = None) -> AsyncIterator[str]:
+    """Yield the response text of *prompt* for *contents* chunk by chunk.
+
+    Raises :class:`PromptBlocked` when nothing was produced because of safety
+    settings. The caller marks ``started`` and ends the span.
+    """
+    genai = await load_genai_async()
+    model = genai.GenerativeModel(prompt.model, system_instruction=prompt.system_prompt)
+    attempts = _tool_attempts(prompt, contents)
+    if span is not None:
+        span.set(model=prompt.model)
+    for attempt, tools in enumerate(attempts):
+        config = generation_config(genai.types, prompt, tools)
+        emitted = False
+        last = None
+        try:
+            async for chunk in _iterate_in_thread(lambda: iter(model.generate_content(contents=contents, generation_config=config, stream=True))):
+                last = chunk
+                try:
+                    text = chunk.text
+                except Exception:
+                    text = None
+                if text:
+                    if not emitted and span is not None:
+                        span.mark("first_token")
+                    emitted = True
+                    yield text
+                elif getattr(chunk, "prompt_feedback", None) and chunk.prompt_feedback.block_reason:
+                    raise PromptBlocked(tr("safety.request_blocked_message"))
+                elif not emitted and getattr(chunk, "candidates", None) and chunk.candidates[0].finish_reason not in (None, 0, 1):
+                    # STOP(1) 以外の理由で何も出さずに終わった
+                    raise PromptBlocked(tr("safety.response_blocked_message"))
+        except PromptBlocked:
+            raise
+        except Exception:
+            # ツール指定の失敗は出力前に起きる。出力後やツールなしでの失敗はそのまま返す
+            if emitted or attempt == len(attempts) - 1:
+                raise
+            if span is not None:
+                span.set(retries=attempt + 1)
+            continue
+        if span is not None:
+            span.mark("completed")
+            tokens = _output_tokens(last)
+            if tokens:
+                span.set(output_tokens=tokens)
+            tokens = _input_tokens(last)
+            if tokens:
+                span.set(input_tokens=tokens)
+        return
+
+
+async def run_prompt(prompt: Prompt, contents: List[Any], span: Optional[Span] = None) -> str:
+    return "".join([text async for text in stream_prompt(prompt, contents, span)])
+
+
+# ----------------------------------------------------------------------
+# Jobs
+# ----------------------------------------------------------------------
+class Job:
+    """Status and event log of one background job; used from the event loop only."""
+
+    def __init__(self, kind: str, total: int = 0, **info: Any):
+        self.id = new_job_id(kind)
+        self.kind = kind
+        self.state = "queued"
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.info = info
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        self.task: Optional["asyncio.Task[Any]"] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        self.events.append(event)
+        # 待っている読み手を起こし、次の待機用に作り直す
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def finish(self, state: str, error: Optional[str] = None, **extra: Any) -> None:
+        if self.done:
+            return
+        self.state = state
+        self.finished = time.time()
+        self.error = error
+        self.emit({"type": "end", "state": state, **({"error": error} if error else {}), **extra})
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id, "kind": self.kind, "state": self.state, "total": self.total,
+            "completed": self.completed, "failed": self.failed, "created": round(self.created, 3),
+            "finished": round(self.finished, 3) if self.finished else None, **self.info,
+            **({"error": self.error} if self.error else {}),
+        }
+
+    async def follow(self, start: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """Yield events from index *start*, waiting for new ones until the job ends."""
+        i = start
+        while True:
+            while i < len(self.events):
+                yield self.events[i]
+                i += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class JobRegistry:
+    """Jobs by id; keeps the most recent finished ones for status queries."""
+
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._jobs: Dict[str, Job] = {}
+
+    def add(self, job: Job) -> Job:
+        self._jobs[job.id] = job
+        finished = [j for j in self._jobs.values() if j.done]
+        for old in finished[: max(0, len(finished) - self.max_finished)]:
+            self._jobs.pop(old.id, None)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [job.status() for job in self._jobs.values()]
+
+
+async def run_matrix(job: Job, items: List[Dict[str, Any]], prompts: List[tuple], concurrency: int = 5,
+                     limiter: Optional[asyncio.Semaphore] = None, span_kind: str = "matrix_cell",
+                     budget: Optional[Budget] = None) -> None:
+    """Run every ``(prompt_id, Prompt)`` in *prompts* on every item, emitting one ``cell`` event per result.
+
+    *limiter* is an optional process-wide semaphore shared with other jobs.
+    Cells that *budget* no longer allows are emitted with ``skipped: "budget"``.
+    """
+    job.state = "running"
+    job.total = len(items) * len(prompts)
+    job.emit({"type": "start", "rows": len(items), "cols": [pid for pid, _ in prompts]})
+    local = asyncio.Semaphore(max(1, concurrency))
+
+    async def _cell(r: int, c: int, item: Dict[str, Any], prompt_id: str, prompt: Prompt):
+        span = Span(span_kind, job.id, row=r + 1, col=c + 1, prompt_id=prompt_id, model=prompt.model, input_type=item.get("type"))
+        event: Dict[str, Any] = {"type": "cell", "row": r, "col": c, "prompt_id": prompt_id}
+        try:
+            async with local:
+                if budget is not None and not budget.allow():
+                    budget.skipped += 1
+                    event["skipped"] = "budget"
+                    job.emit(event)
+                    return
+                if limiter is not None:
+                    await limiter.acquire()
+                try:
+                    span.mark("started")
+                    contents = await contents_for_item(item, span, prompt)
+                    event["text"] = await run_prompt(prompt, contents, span)
+                    job.completed += 1
+                finally:
+                    if limiter is not None:
+                        limiter.release()
+        except asyncio.CancelledError:
+            span.end("cancelled")
+            raise
+        except Exception as e:
+            span.fail(e)
+            job.failed += 1
+            event["error"] = str(e)
+        span.end()
+        if budget is not None:
+            event["cost"] = round(budget.record(span), 6)
+        job.emit(event)
+
+    try:
+        await asyncio.gather(*(
+            _cell(r, c, item, pid, prompt)
+            for r, item in enumerate(items)
+            for c, (pid, prompt) in enumerate(prompts)
+        ))
+    except asyncio.CancelledError:
+        job.finish("cancelled")
+        raise
+    extra = budget.summary() if budget is not None else {}
+    job.finish("done" if not job.failed or job.completed else "failed", **extra)
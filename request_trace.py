@@ -0,0 +1,138 @@
+"""
+request_trace.py
+==================
+
+Per-request trace spans, written as structured JSON lines.
+
+A span opens when a request is queued and ends once its result has been
+applied to the UI. Events in between are recorded as milliseconds since the
+span opened:
+
+- ``started``: the request left the queue or got a concurrency slot
+- ``upload_done``: attached files are uploaded (only when there were any)
+- ``first_token``: first streamed chunk; for non-streaming calls, the response
+- ``completed``: the model call finished
+- ``ui_applied``: the result reached the cell, or the clipboard and popup
+
+Each span carries a job id, a kind (``clipboard``, ``matrix_cell``,
+``matrix_flow_step``, ``summary``, and ``api_run``/``api_matrix_cell`` for
+requests from :mod:`local_api`) and attributes such as the cell
+coordinates. It is emitted once, from :meth:`Span.end`, to the
+``gem_clip.trace`` logger. ``logging_conf`` routes that logger to
+``trace.jsonl`` and serialises the record on its listener thread.
+
+Ending a span also feeds the request metrics in :mod:`metrics`. The span's
+``model``, ``output_tokens`` and ``retries`` attributes are used as labels
+and values.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from itertools import count
+from typing import Any, Dict, Optional
+
+import metrics
+
+TRACE_LOGGER_NAME = "gem_clip.trace"
+
+_logger = logging.getLogger(TRACE_LOGGER_NAME)
+_job_ids = count(1)
+# メトリクスの source ラベル
+SOURCE_BY_KIND = {"clipboard": "hotkey", "matrix_cell": "matrix", "matrix_flow_step": "flow", "summary": "summary",
+                  "api_run": "api", "api_matrix_cell": "api", "cli_run": "cli", "cli_matrix_cell": "cli"}
+
+
+def new_job_id(prefix: str = "job") -> str:
+    return f"{prefix}-{int(time.time())}-{next(_job_ids)}"
+
+
+class Span:
+    """Timing of one request from queueing to UI apply."""
+
+    __slots__ = ("kind", "job_id", "attrs", "events", "error", "_t0", "_wall", "_ended")
+
+    def __init__(self, kind: str, job_id: Optional[str] = None, **attrs: Any):
+        self.kind = kind
+        self.job_id = job_id or new_job_id(kind)
+        self.attrs: Dict[str, Any] = attrs
+        self.events: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self._t0 = time.perf_counter()
+        self._wall = time.time()
+        self._ended = False
+
+    @property
+    def source(self) -> str:
+        return SOURCE_BY_KIND.get(self.kind, self.kind)
+
+    def mark(self, event: str) -> None:
+        """Record *event* (only its first occurrence counts)."""
+        if event not in self.events:
+            self.events[event] = round((time.perf_counter() - self._t0) * 1000, 2)
+            if event == "started":
+                metrics.IN_FLIGHT.inc(source=self.source)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def fail(self, error: Any) -> None:
+        self.error = str(error)[:500]
+
+    def end(self, status: Optional[str] = None) -> None:
+        """Close the span and emit it (later calls are ignored)."""
+        if self._ended:
+            return
+        self._ended = True
+        status = status or ("error" if self.error else "ok")
+        ev = dict(self.events)
+        self._record_metrics(status, ev)
+        if not _logger.isEnabledFor(logging.INFO):
+            return
+        total = round((time.perf_counter() - self._t0) * 1000, 2)
+        payload: Dict[str, Any] = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": status,
+            "start": round(self._wall, 3),
+            "total_ms": total,
+            "events": ev,
+        }
+        # よく見る区間は集計しやすいよう差分でも出す
+        if "started" in ev:
+            payload["queue_wait_ms"] = ev["started"]
+            if "upload_done" in ev:
+                payload["upload_ms"] = round(ev["upload_done"] - ev["started"], 2)
+            if "first_token" in ev:
+                payload["first_token_ms"] = round(ev["first_token"] - ev["started"], 2)
+        if "completed" in ev and "ui_applied" in ev:
+            payload["ui_apply_ms"] = round(ev["ui_applied"] - ev["completed"], 2)
+        payload.update(self.attrs)
+        if self.error:
+            payload["error"] = self.error
+        _logger.info("span", payload)
+
+    def _record_metrics(self, status: str, ev: Dict[str, float]) -> None:
+        source = self.source
+        model = str(self.attrs.get("model") or "unknown")
+        metrics.REQUESTS_TOTAL.inc(model=model, source=source, status=status)
+        started = ev.get("started")
+        if started is None:
+            return
+        metrics.IN_FLIGHT.dec(source=source)
+        metrics.QUEUE_WAIT_SECONDS.observe(started / 1000, source=source)
+        retries = self.attrs.get("retries")
+        if retries:
+            metrics.RETRIES_TOTAL.inc(retries, model=model, source=source)
+        done = ev.get("completed")
+        if done is None:
+            return
+        metrics.REQUEST_SECONDS.observe((done - started) / 1000, model=model, source=source)
+        if "first_token" in ev:
+            metrics.TTFT_SECONDS.observe((ev["first_token"] - started) / 1000, model=model, source=source)
+        # 生成時間はアップロード完了（なければ開始）から完了まで
+        gen_ms = done - ev.get("upload_done", started)
+        output_tokens = self.attrs.get("output_tokens")
+        if output_tokens and gen_ms > 0:
+            metrics.TOKENS_PER_SECOND.observe(output_tokens / (gen_ms / 1000), model=model, source=source)
@@ -0,0 +1,222 @@
+"""
+startup_profile.py
+====================
+
+Phase timing from launch to the tray icon being shown, concurrent startup
+init tasks, and a small startup benchmark with a regression threshold.
+
+Inside the app, :func:`mark` is called at each phase boundary (imports,
+config/locale, Tk root, agent, main window, tray visible). Independent init
+steps (keyring lookup, price table, history index, hotkeys) run as
+:class:`StartupTasks` in the background, each after its dependencies.
+:func:`report` logs both breakdowns once the tray icon is visible.
+
+Benchmark (run from the repository root)::
+
+    python startup_profile.py                 # import cost of app.py, no display needed
+    python startup_profile.py --full          # launch the app and exit once the tray is shown
+    python startup_profile.py --budget-ms 900 --runs 5
+
+The exit status is 1 when the median exceeds the budget, or when a module
+that must stay lazy (Gemini SDK, matrix window) was imported during
+startup.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# main.py はこのモジュールを最初に import するので、ここを起動時刻とみなす
+_START = time.perf_counter()
+_marks: List[Tuple[str, float]] = []
+# 並行初期化タスク名 -> (開始, 終了) の perf_counter
+_task_times: Dict[str, Tuple[float, float]] = {}
+_reported = False
+
+# 起動時に読み込まれてはいけない（初回利用時まで遅延させる）モジュール
+LAZY_MODULES = ("google.generativeai", "google.api_core", "matrix_batch_processor", "thumbnail_cache")
+# --full ではトレイ表示までに pystray が読み込まれるので、import だけの計測でのみ確認する
+IMPORT_ONLY_LAZY_MODULES = LAZY_MODULES + ("pystray",)
+
+DEFAULT_IMPORT_BUDGET_MS = 800.0
+DEFAULT_FULL_BUDGET_MS = 2500.0
+BUDGET_ENV = "GEM_CLIP_STARTUP_BUDGET_MS"
+# ベンチマーク用: トレイ表示後に結果を1行出して終了する
+EXIT_AFTER_TRAY_ENV = "GEM_CLIP_STARTUP_EXIT"
+RESULT_PREFIX = "STARTUP_PROFILE "
+
+
+def mark(phase: str) -> None:
+    """Record the end of *phase* (time since launch)."""
+    _marks.append((phase, time.perf_counter()))
+
+
+def phases() -> List[Tuple[str, float]]:
+    """``(phase, duration_ms)`` for each marked phase, in order."""
+    result = []
+    prev = _START
+    for name, t in list(_marks):
+        result.append((name, (t - prev) * 1000))
+        prev = t
+    return result
+
+
+def summary() -> Dict[str, Any]:
+    total = (_marks[-1][1] - _START) * 1000 if _marks else 0.0
+    return {
+        "total_ms": round(total, 1),
+        "phases": {name: round(ms, 1) for name, ms in phases()},
+        "tasks": {name: {"start_ms": round((s - _START) * 1000, 1), "ms": round((e - s) * 1000, 1)} for name, (s, e) in list(_task_times.items())},
+        "lazy_loaded": [m for m in LAZY_MODULES if m in sys.modules],
+    }
+
+
+def budget_ms(default: float = DEFAULT_FULL_BUDGET_MS) -> float:
+    try:
+        return float(os.environ.get(BUDGET_ENV, default))
+    except ValueError:
+        return default
+
+
+def report() -> None:
+    """Log the startup breakdown once (called when the tray icon becomes visible)."""
+    global _reported
+    if _reported:
+        return
+    _reported = True
+    data = summary()
+    breakdown = ", ".join(f"{name} {ms:.0f} ms" for name, ms in data["phases"].items())
+    logger.debug("startup %.0f ms to tray (%s)", data["total_ms"], breakdown)
+    if data["tasks"]:
+        tasks = ", ".join(f"{name} {t['ms']:.0f} ms @{t['start_ms']:.0f}" for name, t in data["tasks"].items())
+        logger.debug("startup background init (%s)", tasks)
+    limit = budget_ms()
+    if data["total_ms"] > limit:
+        logger.warning("startup took %.0f ms (budget %.0f ms)", data["total_ms"], limit)
+    if data["lazy_loaded"]:
+        logger.warning("modules loaded during startup that should be lazy: %s", ", ".join(data["lazy_loaded"]))
+    if os.environ.get(EXIT_AFTER_TRAY_ENV) == "1":
+        print(RESULT_PREFIX + json.dumps(data), flush=True)
+        os._exit(0)
+
+
+class StartupTasks:
+    """Named init steps that run concurrently, each after its dependencies.
+
+    Every task gets its own daemon thread (there are only a handful), so a task
+    that waits on its dependencies never blocks an unrelated one. A failed
+    dependency fails its dependents with the same exception.
+    """
+
+    def __init__(self):
+        self._futures: Dict[str, Future] = {}
+
+    def add(self, name: str, fn: Callable[[], Any], deps: Iterable[str] = ()) -> Future:
+        deps = [self._futures[d] for d in deps]
+        fut: Future = Future()
+        self._futures[name] = fut
+
+        def run():
+            try:
+                for dep in deps:
+                    dep.result()
+                started = time.perf_counter()
+                value = fn()
+                _task_times[name] = (started, time.perf_counter())
+            except BaseException as e:
+                logger.error("startup task '%s' failed: %s", name, e)
+                fut.set_exception(e)
+            else:
+                fut.set_result(value)
+
+        threading.Thread(target=run, name=f"startup-{name}", daemon=True).start()
+        return fut
+
+    def result(self, name: str, timeout: Optional[float] = None) -> Any:
+        """Block until *name* has finished and return its value (re-raises its error)."""
+        return self._futures[name].result(timeout=timeout)
+
+    def done(self, name: str) -> bool:
+        return self._futures[name].done()
+
+
+# ----------------------------------------------------------------------
+# Benchmark runner
+# ----------------------------------------------------------------------
+_IMPORT_PROBE = (
+    "import json, sys, time\n"
+    "t = time.perf_counter()\n"
+    "import app\n"
+    "ms = (time.perf_counter() - t) * 1000\n"
+    "print({prefix!r} + json.dumps({{'total_ms': round(ms, 1), 'phases': {{'import app': round(ms, 1)}}, "
+    "'lazy_loaded': [m for m in {lazy!r} if m in sys.modules]}}))\n"
+)
+
+
+def _run_once(full: bool, timeout: float) -> Optional[Dict[str, Any]]:
+    root = Path(__file__).resolve().parent
+    env = dict(os.environ)
+    if full:
+        env[EXIT_AFTER_TRAY_ENV] = "1"
+        # 起動中のインスタンスへ引き継がず、その API ソケットにも触れない（local_api.STANDALONE_ENV）
+        env["GEM_CLIP_STANDALONE"] = "1"
+        cmd = [sys.executable, str(root / "main.py")]
+    else:
+        cmd = [sys.executable, "-c", _IMPORT_PROBE.format(prefix=RESULT_PREFIX, lazy=IMPORT_ONLY_LAZY_MODULES)]
+    try:
+        proc = subprocess.run(cmd, cwd=root, env=env, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f"ERROR: startup benchmark timed out after {timeout:.0f} s")
+        return None
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    print(f"ERROR: startup benchmark produced no result (exit {proc.returncode})\n{proc.stderr[-2000:]}")
+    return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure gem_clip startup time by phase.")
+    parser.add_argument("--full", action="store_true", help="launch the app and stop when the tray icon is shown")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    limit = args.budget_ms if args.budget_ms is not None else budget_ms(DEFAULT_FULL_BUDGET_MS if args.full else DEFAULT_IMPORT_BUDGET_MS)
+    results = []
+    for i in range(max(1, args.runs)):
+        data = _run_once(args.full, args.timeout)
+        if data is None:
+            return 2
+        results.append(data)
+        print(f"run {i + 1}: {data['total_ms']:.0f} ms  " + "  ".join(f"{k}={v:.0f}" for k, v in data["phases"].items()))
+
+    median = statistics.median(r["total_ms"] for r in results)
+    lazy = sorted({m for r in results for m in r.get("lazy_loaded", [])})
+    print(f"median {median:.0f} ms (budget {limit:.0f} ms)")
+    failed = False
+    if median > limit:
+        print(f"FAIL: startup regression, {median:.0f} ms > {limit:.0f} ms")
+        failed = True
+    if lazy:
+        print(f"FAIL: loaded eagerly at startup: {', '.join(lazy)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -92,6 +92,7 @@ MATRIX_SUMMARY_FG_COLOR = PRIMARY_CONTAINER
 
 HISTORY_SELECTOR_POPUP_WIDTH = 350
 HISTORY_SELECTOR_POPUP_MAX_HEIGHT = 400
+HISTORY_THUMBNAIL_SIZE = (32, 32)
 
 # メインキャンバスの背景色
 MATRIX_CANVAS_BACKGROUND_COLOR = SURFACE
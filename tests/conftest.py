@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# モジュールはリポジトリ直下に平置きなので、テストからも直接 import できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,102 @@
+"""Tab-view LRU of the matrix window, without Tk (see test_matrix_tab_views.py for the window)."""
+
+from matrix_cell_store import MatrixCellStore
+from matrix_tab_views import TabViewCache
+
+LIMIT = 3
+ROWS, COLS = 4, 2
+
+
+def _build_state(cells, row_summaries, col_summaries):
+    state = cells.to_state()
+    state.update({"row_summaries": list(row_summaries), "col_summaries": list(col_summaries)})
+    return state
+
+
+class _Window:
+    """The parts of MatrixBatchProcessorWindow._activate_tab_view that move state in and out of the cache."""
+
+    def __init__(self, n_tabs):
+        self.tabs = [{"name": f"tab {i}", "state": None} for i in range(n_tabs)]
+        self.views = TabViewCache(LIMIT, lambda: self.tabs, _build_state)
+        self.live = None
+        self.cells = MatrixCellStore(ROWS, COLS)
+        self.rebuilt = []
+
+    def activate(self, tab):
+        if self.views.is_open(self.live):
+            self.views.park(self.live, self.cells, [], [])
+        else:
+            self.cells.close()
+        entry = self.views.take(tab)
+        if entry is not None:
+            self.cells = entry["cells"]
+        else:
+            self.rebuilt.append(tab["name"])
+            self.cells = MatrixCellStore()
+            self.cells.load_state(tab.get("state"), ROWS, COLS)
+        self.live = tab
+        self.views.prune()
+
+
+def test_evicts_least_recently_used_and_keeps_results():
+    w = _Window(5)
+    for i in range(1000):
+        tab = w.tabs[i % 5]
+        w.activate(tab)
+        w.cells.set_result(0, 0, f"{tab['name']} #{i}")
+        assert len(w.views) <= LIMIT
+    # 5 タブを順に回すと LRU (3) に残らないので毎回 state から戻る
+    assert len(w.rebuilt) == 1000
+    assert [e["tab"]["name"] for e in w.views] == ["tab 1", "tab 2", "tab 3"]
+    assert w.tabs[0]["state"]["full_results"][0][0] == "tab 0 #995"
+    assert len(w.views.stores()) == LIMIT
+
+
+def test_recent_tabs_come_back_without_rebuild():
+    w = _Window(5)
+    for i in range(100):
+        w.activate(w.tabs[i % 3])
+    assert w.rebuilt == ["tab 0", "tab 1", "tab 2"]
+
+
+def test_closed_tab_is_evicted_and_its_store_closed():
+    w = _Window(3)
+    for tab in w.tabs:
+        w.activate(tab)
+        w.cells.set_result(1, 1, tab["name"])
+    closed = w.tabs.pop(0)
+    store = w.views.get(closed)["cells"]
+    w.views.prune()
+    assert w.views.get(closed) is None
+    assert store.rows == 0
+    # 閉じたタブの state は作り直さない
+    assert closed["state"] is None
+    assert [e["tab"]["name"] for e in w.views] == ["tab 1"]
+
+
+def test_sync_rows_resizes_cached_stores():
+    w = _Window(2)
+    w.activate(w.tabs[0])
+    w.cells.set_result(2, 0, "kept")
+    w.activate(w.tabs[1])
+    cached = w.views.get(w.tabs[0])
+    cached["row_summaries"].extend(["a", "b", "c", "d"])
+    w.views.sync_rows(ROWS - 1, deleted_row=1)
+    assert cached["cells"].rows == ROWS - 1
+    assert cached["cells"].full(1, 0) == "kept"
+    assert cached["row_summaries"] == ["a", "c", "d"]
+    w.views.sync_rows(ROWS + 1)
+    assert cached["cells"].rows == ROWS + 1
+    assert cached["row_summaries"] == ["a", "c", "d", "", ""]
+
+
+def test_clear_closes_everything():
+    w = _Window(3)
+    for tab in w.tabs:
+        w.activate(tab)
+        w.cells.set_result(0, 0, "x" * 10)
+    stores = w.views.stores()
+    w.views.clear()
+    assert len(w.views) == 0
+    assert all(s.rows == 0 for s in stores)
@@ -0,0 +1,109 @@
+"""Tab switching in the matrix window must not accumulate state or widgets.
+
+Needs customtkinter and a display (Tk); skipped otherwise.
+"""
+
+import asyncio
+import gc
+import threading
+
+import pytest
+
+ctk = pytest.importorskip("customtkinter")
+
+SWITCHES = 1000
+
+
+@pytest.fixture
+def window(tmp_path, monkeypatch):
+    # 設定・セッション（prompt_set/）は使い捨てのディレクトリへ
+    for var in ("APPDATA", "XDG_CONFIG_HOME", "HOME", "USERPROFILE"):
+        monkeypatch.setenv(var, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+
+    from common_models import AppConfig, Prompt
+    from i18n import set_locale
+    from matrix_batch_processor import MatrixBatchProcessorWindow
+
+    try:
+        root = ctk.CTk()
+    except Exception as e:  # tkinter.TclError: no display
+        pytest.skip(f"Tk is not available: {e}")
+    root.withdraw()
+    set_locale("en")
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    prompts = {f"p{c}": Prompt(name=f"P{c}", model="gemini-2.5-flash", system_prompt="x", include_in_matrix=True) for c in range(3)}
+
+    class _Agent:
+        config = AppConfig(prompts=prompts)
+
+    w = MatrixBatchProcessorWindow(
+        prompts=prompts, on_processing_completed=lambda *a, **k: None, llm_agent_factory=lambda *a, **k: None,
+        notification_callback=lambda *a, **k: None, worker_loop=loop, parent_app=root, agent=_Agent(),
+    )
+    w.input_data = [{"type": "text", "data": f"row {r}"} for r in range(20)]
+    w._tabs = [{"name": f"tab {i}", "prompts_obj": dict(prompts), "state": None} for i in range(5)]
+    w._active_tab_index = 0
+    w._rebuild_tabs()
+    w._update_ui()
+    root.update()
+    try:
+        yield w
+    finally:
+        import memory_accounting
+
+        memory_accounting.unregister(w._memory_token)
+        w._is_closing = True
+        w._session_store.close()
+        w._cells.close()
+        w._drop_tab_views()
+        w.destroy()
+        root.destroy()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def _live_cell_stores():
+    from matrix_cell_store import MatrixCellStore
+
+    gc.collect()
+    return sum(1 for o in gc.get_objects() if isinstance(o, MatrixCellStore))
+
+
+def test_tab_switches_keep_state_bounded(window):
+    import memory_accounting
+
+    limit = window.TAB_VIEW_CACHE_SIZE
+    widgets = None
+    for i in range(SWITCHES):
+        window._on_tab_clicked((window._active_tab_index + 1) % len(window._tabs))
+        window._set_cell_result(0, 0, f"result {i}")
+        if i % 50 == 0:
+            window.update()
+        if i == 10:
+            widgets = window._count_widgets()
+        assert len(window._tab_views) <= limit
+
+    window.update()
+    usage = memory_accounting.usage()["matrix"]
+    assert usage["instances"] == 1
+    assert usage["stores"] <= limit + 1
+    # 表示中のタブ + LRU のぶんだけ（閉じたストアはどこからも参照されない）
+    assert _live_cell_stores() <= limit + 1
+    assert window._count_widgets() <= widgets + 10
+    # 最後に書いた結果は各タブに残っている
+    assert window._cells.full(0, 0).startswith("result ")
+
+
+def test_rows_added_in_one_tab_resize_cached_tabs(window):
+    import customtkinter
+
+    window._row_summaries = [customtkinter.StringVar(value=f"s{r}") for r in range(len(window.input_data))]
+    window._on_tab_clicked(1)
+    window._add_input_row()
+    window._append_input_rows([{"type": "text", "data": "imported"}] * 3)
+    window._on_tab_clicked(0)
+    rows = len(window.input_data)
+    assert window._cells.rows == rows
+    assert len(window._row_summaries) == rows
+    assert window._row_summaries[0].get() == "s0"
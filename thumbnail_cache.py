@@ -0,0 +1,303 @@
+"""
+thumbnail_cache.py
+==================
+
+Content-addressed thumbnail cache for clipboard-history images and matrix
+image rows.
+
+A thumbnail is generated once in a background thread and written as a small
+PNG under ``<data_dir>/thumbnails/<w>x<h>/``. It is keyed by the history key
+when the item came from the clipboard history, otherwise by a hash of the
+image content. Each size directory is pruned back to
+:data:`MAX_DISK_BYTES`, least recently used files first (a disk hit
+refreshes the file's mtime), at startup and every
+:data:`PRUNE_EVERY_WRITES` new thumbnails. Repeated grid rebuilds and popups then only read a few hundred
+bytes, or hit the in-memory LRU, instead of decoding the full image on the Tk
+thread. Full-size previews are decoded off the Tk thread as well, via
+:meth:`ThumbnailCache.decode_preview`.
+
+Callbacks of :meth:`ThumbnailCache.request` and
+:meth:`ThumbnailCache.decode_preview` are always invoked on the worker
+thread, cache hits included. UI code should marshal them back with
+``widget.after(0, ...)``, as the rest of the app does.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+import memory_accounting
+from history_store import decode_image_payload
+from metrics import record_cache
+
+try:
+    from . import paths  # type: ignore
+except ImportError:
+    import paths  # type: ignore
+
+ThumbCallback = Callable[[Optional[Image.Image]], None]
+
+# サイズごとのディスク上限（超えたら古い順に消す）
+MAX_DISK_BYTES = 32 * 1024 * 1024
+PRUNE_EVERY_WRITES = 256
+
+
+def key_for_item(item: Dict[str, Any]) -> Optional[str]:
+    """Content key for an ``image``/``image_compressed``/``image_file`` input item."""
+    data = item.get("data")
+    if not isinstance(data, str) or not data:
+        return None
+    if item.get("key"):
+        # 履歴から来た項目は履歴キー（内容のハッシュ）をそのまま使い、ペイロードを再ハッシュしない
+        return hashlib.sha1(str(item["key"]).encode("utf-8", "surrogatepass")).hexdigest()
+    if item.get("type") == "image_file":
+        # ファイル参照は中身を読まずに、パスと更新時刻・サイズで識別する
+        try:
+            st = os.stat(data)
+        except OSError:
+            return None
+        return hashlib.sha1(f"{data}:{st.st_mtime_ns}:{st.st_size}".encode("utf-8", "surrogatepass")).hexdigest()
+    # base64 文字列のままハッシュする（デコード不要で十分に一意）
+    return hashlib.sha1(data.encode("ascii", "ignore")).hexdigest()
+
+
+def image_bytes_loader(item: Dict[str, Any]) -> Callable[[], Optional[bytes]]:
+    """Return a loader that decodes an input item's image bytes when called."""
+    if item.get("type") == "image_file":
+        return lambda: _read_file_bytes(str(item.get("data", "")))
+    return lambda: decode_image_payload(item)
+
+
+def _read_file_bytes(path: str) -> Optional[bytes]:
+    try:
+        return Path(path).read_bytes()
+    except Exception as e:
+        print(f"ERROR: ThumbnailCache - cannot read {path}: {e}")
+        return None
+
+
+class ThumbnailCache:
+    """Thread-backed, disk-persisted thumbnail cache keyed by content hash."""
+
+    def __init__(self, size: Tuple[int, int] = (50, 50), root: Optional[Path] = None, max_memory_items: int = 512, workers: int = 2,
+                 max_disk_bytes: int = MAX_DISK_BYTES):
+        self.size = (int(size[0]), int(size[1]))
+        base = Path(root) if root else paths.get_data_dir() / "thumbnails"
+        self.root = base / f"{self.size[0]}x{self.size[1]}"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._writes = 0
+        self._memory: "OrderedDict[str, Image.Image]" = OrderedDict()
+        self._pending: Dict[str, List[ThumbCallback]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="thumbs")
+        memory_accounting.register("thumbnails", self.memory_usage, self.trim_memory)
+        self._executor.submit(self.prune_disk)
+
+    # ------------------------------------------------------------------
+    def get_cached(self, key: Optional[str]) -> Optional[Image.Image]:
+        """Return the thumbnail if it is in memory. Never touches the disk, so it is safe on the Tk thread."""
+        if not key:
+            return None
+        with self._lock:
+            img = self._memory.get(key)
+            if img is not None:
+                self._memory.move_to_end(key)
+                record_cache("thumbnail_memory", True)
+                return img
+        record_cache("thumbnail_memory", False)
+        return None
+
+    def get(self, key: Optional[str]) -> Optional[Image.Image]:
+        """Return a cached thumbnail from memory or disk (never generates).
+
+        May read and decode a file; on the Tk thread use :meth:`get_cached` and :meth:`request`.
+        """
+        img = self.get_cached(key)
+        if img is not None or not key:
+            return img
+        path = self._path(key)
+        if not path.exists():
+            record_cache("thumbnail_disk", False)
+            return None
+        try:
+            with Image.open(path) as im:
+                img = im.copy()
+        except Exception:
+            record_cache("thumbnail_disk", False)
+            return None
+        record_cache("thumbnail_disk", True)
+        try:
+            # 最近使ったものとして残す（prune_disk は mtime の古い順に消す）
+            os.utime(path)
+        except OSError:
+            pass
+        self._remember(key, img)
+        return img
+
+    def request(self, key: Optional[str], loader: Callable[[], Optional[bytes]], callback: ThumbCallback) -> None:
+        """Look up or generate the thumbnail for *key* in the background and pass it to *callback*.
+
+        The callback always runs on the worker thread. Concurrent requests for
+        the same key share a single lookup and decode.
+        """
+        if not key:
+            self._executor.submit(callback, None)
+            return
+        with self._lock:
+            waiters = self._pending.get(key)
+            if waiters is not None:
+                waiters.append(callback)
+                return
+            self._pending[key] = [callback]
+        self._executor.submit(self._generate, key, loader)
+
+    def decode_preview(self, loader: Callable[[], Optional[bytes]], max_size: Tuple[int, int], callback: ThumbCallback) -> None:
+        """Decode a full image and downscale it to *max_size* off the Tk thread."""
+        def _work():
+            img = None
+            try:
+                raw = loader()
+                if raw:
+                    with Image.open(BytesIO(raw)) as im:
+                        im.load()
+                        img = im.copy()
+                    img.thumbnail((max(1, int(max_size[0])), max(1, int(max_size[1]))), Image.LANCZOS)
+            except Exception as e:
+                print(f"ERROR: ThumbnailCache.decode_preview - {e}")
+                img = None
+            callback(img)
+        self._executor.submit(_work)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def memory_usage(self) -> Dict[str, int]:
+        with self._lock:
+            images = list(self._memory.values())
+        return {"bytes": sum(_image_bytes(img) for img in images), "items": len(images)}
+
+    def trim_memory(self, target_bytes: int) -> int:
+        """Drop least recently used thumbnails until the LRU holds at most *target_bytes*; returns the count.
+
+        Dropped thumbnails are still on disk and come back on the next ``get``.
+        """
+        dropped = 0
+        with self._lock:
+            held = sum(_image_bytes(img) for img in self._memory.values())
+            while self._memory and held > target_bytes:
+                _, img = self._memory.popitem(last=False)
+                held -= _image_bytes(img)
+                dropped += 1
+        return dropped
+
+    def prune_disk(self) -> int:
+        """Delete the least recently used thumbnails beyond ``max_disk_bytes``; returns the count."""
+        files = []
+        try:
+            for sub in os.scandir(self.root):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        except OSError as e:
+            print(f"ERROR: ThumbnailCache - cannot scan {self.root}: {e}")
+            return 0
+        total = sum(f[1] for f in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    # ------------------------------------------------------------------
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.png"
+
+    def _remember(self, key: str, img: Image.Image) -> None:
+        with self._lock:
+            self._memory[key] = img
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def _generate(self, key: str, loader: Callable[[], Optional[bytes]]) -> None:
+        img: Optional[Image.Image] = self.get(key)
+        try:
+            raw = loader() if img is None else None
+            if raw:
+                with Image.open(BytesIO(raw)) as im:
+                    # JPEG などは draft で縮小デコードできる
+                    try:
+                        im.draft("RGB", self.size)
+                    except Exception:
+                        pass
+                    im.thumbnail(self.size)
+                    img = im.convert("RGBA") if im.mode not in ("RGB", "RGBA") else im.copy()
+                self._persist(key, img)
+                self._remember(key, img)
+        except Exception as e:
+            print(f"ERROR: ThumbnailCache - failed to build thumbnail {key}: {e}")
+            img = None
+        with self._lock:
+            waiters = self._pending.pop(key, [])
+        for cb in waiters:
+            try:
+                cb(img)
+            except Exception:
+                pass
+
+    def _persist(self, key: str, img: Image.Image) -> None:
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            img.save(tmp, format="PNG")
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"ERROR: ThumbnailCache - failed to persist {key}: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            due = self._writes % PRUNE_EVERY_WRITES == 0
+        if due:
+            self.prune_disk()
+
+
+def _image_bytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+_shared: Dict[Tuple[int, int], ThumbnailCache] = {}
+_shared_lock = threading.Lock()
+
+
+def get_thumbnail_cache(size: Tuple[int, int]) -> ThumbnailCache:
+    """Return the process-wide cache for the given thumbnail size."""
+    key = (int(size[0]), int(size[1]))
+    with _shared_lock:
+        cache = _shared.get(key)
+        if cache is None:
+            cache = ThumbnailCache(size=key)
+            _shared[key] = cache
+        return cache
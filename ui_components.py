@@ -3,7 +3,6 @@ import tkinter as tk
 from tkinter import filedialog
 from typing import Dict, Optional, Callable, Any, Literal, List, TYPE_CHECKING
 from io import BytesIO
-from PIL import Image
 import base64
 import zlib
 from pathlib import Path
@@ -13,13 +12,12 @@ import customtkinter as ctk
 from CTkMessagebox import CTkMessagebox
 from history_dialogs import HistoryEditDialog
 
-from common_models import Prompt, PromptParameters
-from matrix_batch_processor import MatrixBatchProcessorWindow
+from common_models import ImagePolicy, Prompt, PromptParameters, configure_genai
+from history_store import history_label
 import styles
 from constants import API_SERVICE_ID, SUPPORTED_MODELS, model_id_to_label, model_label_to_id
 from i18n import tr, set_locale, available_locales
 import keyring
-import google.generativeai as genai
 from config_manager import save_config
 import keyboard
 
@@ -194,40 +192,7 @@ class ActionSelectorWindow(ctk.CTkToplevel):
         clipboard_label.grid(row=0, column=0, sticky="w", padx=(0,8))
 
         # 履歴の表示用ラベルを整形
-        labels: List[str] = []
-        self._history_label_to_item.clear()
-        for it in getattr(self.agent, 'clipboard_history', [])[:50]:
-            try:
-                if isinstance(it, str):
-                    lbl = it.replace('\n', ' ')[:60] + ("…" if len(it) > 60 else "")
-                    self._history_label_to_item[lbl] = {"type": "text", "data": it}
-                elif isinstance(it, dict) and 'type' in it and 'data' in it:
-                    t = it.get('type')
-                    if t == 'text':
-                        data = it.get('data', '')
-                        lbl = data.replace('\n', ' ')[:60] + ("…" if len(data) > 60 else "")
-                    elif t in ('image', 'image_compressed'):
-                        lbl = tr("history.image")
-                    elif t == 'file':
-                        try:
-                            from pathlib import Path
-                            lbl = f"[" + tr("history.file_name_prefix", name=Path(it.get('data','')).name) + "]"
-                        except Exception:
-                            lbl = tr("history.file")
-                    else:
-                        lbl = tr("history.unknown")
-                    # ラベルの重複を避けるため少しユニーク化
-                    uniq_lbl = lbl
-                    c = 1
-                    while uniq_lbl in self._history_label_to_item:
-                        c += 1
-                        uniq_lbl = f"{lbl} ({c})"
-                    self._history_label_to_item[uniq_lbl] = it
-                else:
-                    continue
-            except Exception:
-                continue
-        labels = list(self._history_label_to_item.keys()) or [tr("history.empty")]
+        labels = self._rebuild_history_labels(self.agent.history_store.entries(50))
 
         # 固定幅コンテナ内に OptionMenu を配置し、リスト長に依存して横幅が変わらないようにする
         om_container = ctk.CTkFrame(header_frame, fg_color="transparent", width=345, height=28)
@@ -243,6 +208,12 @@ class ActionSelectorWindow(ctk.CTkToplevel):
         self.edit_history_button = ctk.CTkButton(header_frame, text=tr("common.edit"), width=60, command=self._on_edit_history, fg_color=styles.DEFAULT_BUTTON_FG_COLOR, text_color=styles.DEFAULT_BUTTON_TEXT_COLOR)
         self.edit_history_button.grid(row=0, column=2, padx=(5,0))
 
+        # 履歴の絞り込み（入力に合わせて全履歴を検索し、候補を入れ替える）
+        self._history_filter_job: Optional[str] = None
+        self.history_search_entry = ctk.CTkEntry(header_frame, placeholder_text=tr("history.search_placeholder"), height=26)
+        self.history_search_entry.grid(row=1, column=1, columnspan=2, sticky="ew", pady=(4, 0))
+        self.history_search_entry.bind("<KeyRelease>", self._on_history_search_key)
+
         # 設定アイコンはアクションボタン行の右端へ移動
 
         self._on_history_changed()  # 初期状態反映
@@ -410,7 +381,7 @@ class ActionSelectorWindow(ctk.CTkToplevel):
             # 選択された履歴があれば、エージェントに一時入力として渡す
             if self._selected_history_item is not None:
                 try:
-                    item = self._selected_history_item
+                    item = self._resolve_history_item(self._selected_history_item)
                     # 画像が圧縮形式ならここで非圧縮の base64 PNG へ変換しておく
                     if isinstance(item, dict) and item.get('type') == 'image_compressed':
                         try:
@@ -682,9 +653,61 @@ class ActionSelectorWindow(ctk.CTkToplevel):
             except Exception:
                 pass
 
+    def _rebuild_history_labels(self, items: List[Dict[str, Any]]) -> List[str]:
+        """履歴メタデータからラベル→項目の対応を作り直し、ラベル一覧を返す。"""
+        self._history_label_to_item.clear()
+        for it in items:
+            try:
+                if not isinstance(it, dict) or 'type' not in it:
+                    continue
+                # ペイロードは読み込まず、メタデータからラベルを作る
+                lbl = history_label(it)
+                # ラベルの重複を避けるため少しユニーク化
+                uniq_lbl = lbl
+                c = 1
+                while uniq_lbl in self._history_label_to_item:
+                    c += 1
+                    uniq_lbl = f"{lbl} ({c})"
+                self._history_label_to_item[uniq_lbl] = it
+            except Exception:
+                continue
+        return list(self._history_label_to_item.keys()) or [tr("history.empty")]
+
+    def _on_history_search_key(self, event):
+        if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        self._cancel_scheduled_close()
+        if self._history_filter_job is not None:
+            try:
+                self.after_cancel(self._history_filter_job)
+            except Exception:
+                pass
+        # 連続入力中は検索しない（軽いデバウンス）
+        self._history_filter_job = self.after(120, self._apply_history_filter)
+
+    def _apply_history_filter(self):
+        self._history_filter_job = None
+        if self._is_destroying:
+            return
+        try:
+            query = self.history_search_entry.get()
+            items = self.agent.history_store.search(query, limit=50)
+            # 候補だけを絞り込む。選択中の項目は利用者がメニューから選び直すまで変えない
+            self.history_menu.configure(values=self._rebuild_history_labels(items))
+        except Exception as e:
+            print(f"ERROR: _apply_history_filter - {e}")
+
+    def _resolve_history_item(self, item: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """履歴メタデータなら実データを読み込む（編集済みの項目はそのまま返す）。"""
+        if isinstance(item, dict) and 'key' in item:
+            loader = getattr(self.agent, 'load_history_item', None)
+            if loader is not None:
+                return loader(item)
+        return item
+
     def _on_edit_history(self):
         """選択中の履歴を編集。テキストはテキスト編集、ファイルはファイル再選択。画像は無効化済み。"""
-        item = self._selected_history_item
+        item = self._resolve_history_item(self._selected_history_item)
         if not isinstance(item, dict) or 'type' not in item:
             return
         t = item.get('type')
@@ -960,13 +983,30 @@ class PromptEditorDialog(BaseDialog):
         self.enable_web_switch = ctk.CTkSwitch(self, text="", variable=self.enable_web_var)
         self.enable_web_switch.grid(row=4, column=1, padx=10, pady=(0, 10), sticky="w")
 
-        ctk.CTkLabel(self, text=tr("prompt.system_prompt"), text_color=styles.HISTORY_ITEM_TEXT_COLOR).grid(row=5, column=0, columnspan=2, padx=10, pady=10, sticky="w")
+        # 画像の送り方（形式・長辺の上限・画質）。「元のまま」は原寸の PNG
+        self._image_policy: Optional[ImagePolicy] = None
+        self._image_formats = [tr("prompt.image_original"), "PNG", "JPEG", "WebP"]
+        ctk.CTkLabel(self, text=tr("prompt.image_policy"), text_color=styles.HISTORY_ITEM_TEXT_COLOR).grid(row=5, column=0, padx=10, pady=(0, 10), sticky="w")
+        image_frame = ctk.CTkFrame(self, fg_color="transparent")
+        image_frame.grid(row=5, column=1, padx=10, pady=(0, 10), sticky="ew")
+        self.image_format_optionmenu = ctk.CTkOptionMenu(image_frame, values=self._image_formats, width=120, fg_color=styles.HISTORY_ITEM_FG_COLOR, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
+        self.image_format_optionmenu.grid(row=0, column=0, padx=(0, 10))
+        self.image_max_edge_entry = ctk.CTkEntry(image_frame, width=110, placeholder_text=tr("prompt.image_max_edge"), fg_color=styles.HISTORY_ITEM_FG_COLOR, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
+        self.image_max_edge_entry.grid(row=0, column=1, padx=(0, 10))
+        self.image_quality_entry = ctk.CTkEntry(image_frame, width=80, placeholder_text=tr("prompt.image_quality"), fg_color=styles.HISTORY_ITEM_FG_COLOR, text_color=styles.HISTORY_ITEM_TEXT_COLOR)
+        self.image_quality_entry.grid(row=0, column=2)
+        # モデルのタイル数が減るなら少し（最大 15%）縮める。新しく作る方針では既定で無効
+        self.image_tile_aware_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(image_frame, text=tr("prompt.image_tile_aware"), variable=self.image_tile_aware_var, text_color=styles.HISTORY_ITEM_TEXT_COLOR).grid(row=1, column=0, columnspan=3, pady=(5, 0), sticky="w")
+        self.image_format_optionmenu.set(self._image_formats[0])
+
+        ctk.CTkLabel(self, text=tr("prompt.system_prompt"), text_color=styles.HISTORY_ITEM_TEXT_COLOR).grid(row=6, column=0, columnspan=2, padx=10, pady=10, sticky="w")
         self.system_prompt_textbox = ctk.CTkTextbox(self, width=480, height=400, fg_color=styles.HISTORY_ITEM_FG_COLOR, text_color=styles.HISTORY_ITEM_TEXT_COLOR, border_width=1, border_color=styles.HIGHLIGHT_BORDER_COLOR)
-        self.system_prompt_textbox.grid(row=6, column=0, columnspan=2, padx=10, pady=10, sticky="nsew")
-        self.grid_rowconfigure(6, weight=1)
+        self.system_prompt_textbox.grid(row=7, column=0, columnspan=2, padx=10, pady=10, sticky="nsew")
+        self.grid_rowconfigure(7, weight=1)
 
         button_frame = ctk.CTkFrame(self, fg_color="transparent")
-        button_frame.grid(row=7, column=0, columnspan=2, pady=10)
+        button_frame.grid(row=8, column=0, columnspan=2, pady=10)
         button_frame.grid_columnconfigure(0, weight=1)
         button_frame.grid_columnconfigure(1, weight=1)
 
@@ -980,6 +1020,7 @@ class PromptEditorDialog(BaseDialog):
             self.parameter_editor.set_parameters(prompt.parameters)
             self.thinking_level_optionmenu.set(prompt.thinking_level)
             self.enable_web_var.set(getattr(prompt, 'enable_web', False))
+            self._set_image_policy(getattr(prompt, 'image_policy', None))
             self.system_prompt_textbox.insert("0.0", prompt.system_prompt)
         else:
             self.parameter_editor.set_parameters(PromptParameters())
@@ -987,6 +1028,38 @@ class PromptEditorDialog(BaseDialog):
             self.thinking_level_optionmenu.set("Balanced")
             self.enable_web_var.set(False)
 
+    def _set_image_policy(self, policy: Optional[ImagePolicy]):
+        self._image_policy = policy
+        if policy is None:
+            return
+        self.image_format_optionmenu.set({"png": "PNG", "jpeg": "JPEG", "webp": "WebP"}[policy.format])
+        if policy.max_edge:
+            self.image_max_edge_entry.insert(0, str(policy.max_edge))
+        if policy.format != "png":
+            self.image_quality_entry.insert(0, str(policy.quality))
+        self.image_tile_aware_var.set(policy.tile_aware)
+
+    def _ignored_image_fields_message(self) -> Optional[str]:
+        """選んだ形式では使われない欄に入力があれば、その旨のメッセージを返す（黙って捨てない）"""
+        label = self.image_format_optionmenu.get()
+        max_edge = self.image_max_edge_entry.get().strip()
+        quality = self.image_quality_entry.get().strip()
+        if label == self._image_formats[0]:
+            if max_edge or quality or self.image_tile_aware_var.get():
+                return tr("prompt.image_ignored_original")
+        elif label == "PNG" and quality:
+            return tr("prompt.image_ignored_quality")
+        return None
+
+    def _get_image_policy(self) -> Optional[ImagePolicy]:
+        label = self.image_format_optionmenu.get()
+        if label == self._image_formats[0]:
+            return None
+        max_edge = self.image_max_edge_entry.get().strip()
+        quality = self.image_quality_entry.get().strip()
+        return ImagePolicy(format=label.lower(), max_edge=int(max_edge) if max_edge else None,
+                           quality=int(quality) if quality else 85, tile_aware=bool(self.image_tile_aware_var.get()))
+
     def on_save(self):
         try:
             name = self.name_entry.get()
@@ -999,6 +1072,15 @@ class PromptEditorDialog(BaseDialog):
             if not name or not system_prompt or not model:
                 CTkMessagebox(title=tr("common.error"), message=tr("prompt.validation_missing"), icon="warning")
                 return
+            ignored = self._ignored_image_fields_message()
+            if ignored:
+                CTkMessagebox(title=tr("common.warning"), message=ignored, icon="warning")
+                return
+            try:
+                image_policy = self._get_image_policy()
+            except ValueError:
+                CTkMessagebox(title=tr("common.error"), message=tr("prompt.image_invalid"), icon="warning")
+                return
 
             self.result = Prompt(
                 name=name,
@@ -1006,7 +1088,8 @@ class PromptEditorDialog(BaseDialog):
                 system_prompt=system_prompt,
                 thinking_level=thinking_level,
                 enable_web=enable_web,
-                parameters=parameters
+                parameters=parameters,
+                image_policy=image_policy,
             )
             self.destroy()
         except Exception as e:
@@ -1167,7 +1250,7 @@ class SettingsWindow(ctk.CTkToplevel):
             try:
                 keyring.set_password(API_SERVICE_ID, "api_key", new_api_key)
                 self.agent.api_key = new_api_key
-                genai.configure(api_key=self.agent.api_key)
+                configure_genai(self.agent.api_key)
                 CTkMessagebox(title=tr("common.success"), message=tr("settings.save_done_message"), icon="info").wait_window()
                 self.api_key_entry.delete(0, ctk.END)
                 self.api_key_entry.insert(0, "*" * (len(new_api_key) - 4) + new_api_key[-4:])
@@ -1296,7 +1379,6 @@ class SettingsWindow(ctk.CTkToplevel):
             if new_max_history_size <= 0:
                 raise ValueError(tr("settings.history.max_invalid"))
             self.agent.config.max_history_size = new_max_history_size
-            self.agent.max_history_size = new_max_history_size
             try:
                 new_max_flow_steps = int(self.max_flow_steps_entry.get())
                 if new_max_flow_steps <= 0:
@@ -1341,10 +1423,7 @@ class SettingsWindow(ctk.CTkToplevel):
             except Exception:
                 pass
             save_config(self.agent.config)
-            if len(self.agent.clipboard_history) > self.agent.max_history_size:
-                self.agent.clipboard_history = self.agent.clipboard_history[-self.agent.max_history_size:]
-            if self.agent._on_history_updated_callback:
-                self.agent._on_history_updated_callback(self.agent.clipboard_history)
+            self.agent.set_max_history_size(new_max_history_size)
             CTkMessagebox(title=tr("settings.save_done_title"), message=tr("settings.save_done_message"), icon="info").wait_window()
         except ValueError as e:
             CTkMessagebox(title=tr("common.error"), message=f"Invalid value: {e}", icon="warning").wait_window()
@@ -1435,25 +1514,27 @@ class ResizableInputDialog(BaseDialog):
         # 履歴から挿入（任意）
         # 履歴選択用のウィジェットと挿入ボタンは独立したフレームに配置し、固定幅にする
         if self._enable_history and self._agent is not None:
-            history_items: list[str] = []
+            history_items: list[dict] = []
             try:
-                # 直近50件の履歴を収集（テキストのみ）
-                for it in getattr(self._agent, 'clipboard_history', [])[:50]:
-                    if isinstance(it, str):
+                # 直近50件の履歴を収集（テキストのみ、本文は挿入時に読み込む）
+                for it in self._agent.history_store.entries(50):
+                    if isinstance(it, dict) and it.get('type') == 'text':
                         history_items.append(it)
-                    elif isinstance(it, dict) and it.get('type') == 'text':
-                        history_items.append(it.get('data', ''))
             except Exception:
                 history_items = []
 
-            # ラベルを整形し、無い場合でもプレースホルダーを用意する
-            def _labelize(s: str) -> str:
-                s1 = s.replace('\n', ' ')
-                return s1[:60] + ('…' if len(s1) > 60 else '')
             if history_items:
-                labels = [_labelize(s) for s in history_items]
-                # 実値をマッピング
-                self._history_map = {lbl: val for lbl, val in zip(labels, history_items)}
+                labels = []
+                self._history_map = {}
+                for it in history_items:
+                    lbl = history_label(it)
+                    uniq_lbl = lbl
+                    c = 1
+                    while uniq_lbl in self._history_map:
+                        c += 1
+                        uniq_lbl = f"{lbl} ({c})"
+                    labels.append(uniq_lbl)
+                    self._history_map[uniq_lbl] = it
                 no_history = False
             else:
                 # 履歴がない場合でもレイアウトを保つためプレースホルダーを設定
@@ -1542,7 +1623,10 @@ class ResizableInputDialog(BaseDialog):
         try:
             if hasattr(self, 'history_menu') and hasattr(self, '_history_map'):
                 lbl = self.history_menu.get()
-                val = self._history_map.get(lbl, '')
+                val = self._history_map.get(lbl)
+                if isinstance(val, dict):
+                    loaded = self._agent.load_history_item(val) if 'key' in val else val
+                    val = (loaded or {}).get('data', '')
                 if val:
                     self.textbox.insert('insert', val)
         except Exception: